@@ -0,0 +1,238 @@
+"""
+Carga por lotes de quejas desde el historial local (services.history_store) a BigQuery.
+
+Cada bloque de quejas se vuelve a armar con core.complaint_rows.build_complaint_rows, la
+misma transformación de save_user_data, a partir de los datos de sesión guardados al registrarla.
+Cada bloque se carga con un load job (NDJSON o Parquet) en lugar de inserciones en
+streaming. Después de cada bloque cargado se guarda un checkpoint; con --reanudar se
+continúa desde el último.
+
+Uso (desde src/):
+    python backfill.py                                   # quejas pendientes (BigQuery no respondió)
+    python backfill.py --todas --tabla quejas_reproceso --reemplazar
+    python backfill.py --reanudar
+    python backfill.py --todas --salida quejas.ndjson    # solo exporta, sin cargar (reescribe el archivo)
+
+Para reprocesar quejas que ya están en la tabla (p. ej. después de corregir una regla de
+limpieza) cárguelas en una tabla auxiliar con el mismo esquema y haga MERGE por PK.
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from config import get_api_config, get_history_config
+from core.complaint_rows import build_complaint_rows
+from services.bigquery_service import GUARDADA, PENDIENTE
+from services.history_store import HistoryStore
+
+logger = logging.getLogger("backfill")
+
+FORMATOS = ("ndjson", "parquet")
+
+def leer_checkpoint(ruta: str) -> Dict[str, Any]:
+    if not os.path.exists(ruta):
+        return {}
+    with open(ruta, encoding="utf-8") as archivo:
+        return json.load(archivo)
+
+def guardar_checkpoint(ruta: str, checkpoint: Dict[str, Any]) -> None:
+    # Escritura atómica: un corte a mitad de escritura no deja un checkpoint corrupto
+    temporal = f"{ruta}.tmp"
+    with open(temporal, "w", encoding="utf-8") as archivo:
+        json.dump(checkpoint, archivo)
+    os.replace(temporal, ruta)
+
+def _fecha(valor: Optional[str]) -> Optional[float]:
+    return datetime.strptime(valor, "%Y-%m-%d").timestamp() if valor else None
+
+def filas_de_bloque(bloque: List[Dict[str, Any]], schema_fields: Optional[List[str]],
+                    desde: Optional[float] = None, hasta: Optional[float] = None) -> Tuple[List[Dict[str, Any]], List[str], int]:
+    """Filas listas para cargar, ids de las quejas incluidas y cuántas se omitieron"""
+    sesiones, ids, omitidas = [], [], 0
+    for queja in bloque:
+        if (desde and queja["fecha"] < desde) or (hasta and queja["fecha"] >= hasta):
+            continue
+        if not queja.get("datos"):
+            # Registrada antes de que el historial guardara los datos de sesión
+            omitidas += 1
+            continue
+        user_data = json.loads(queja["datos"])
+        user_data["queja_actual"] = {"id": queja["id"], "guardada": False}
+        sesiones.append(user_data)
+        ids.append(queja["id"])
+    return build_complaint_rows(sesiones, schema_fields), ids, omitidas
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise SystemExit("El formato parquet necesita pyarrow (pip install pyarrow)")
+    return pyarrow
+
+def _tabla_arrow(filas: List[Dict[str, Any]], schema=None):
+    pyarrow = _pyarrow()
+    tabla = pyarrow.Table.from_pylist(filas, schema=schema)
+    if schema is None:
+        # Una columna vacía en todo el bloque (fecha_atencion) se infiere como null y
+        # no admitiría los valores de los bloques siguientes
+        tabla = tabla.cast(pyarrow.schema([
+            campo.with_type(pyarrow.string()) if pyarrow.types.is_null(campo.type) else campo
+            for campo in tabla.schema
+        ]))
+    return tabla
+
+def serializar(filas: List[Dict[str, Any]], formato: str) -> bytes:
+    if formato == "parquet":
+        buffer = io.BytesIO()
+        _pyarrow().parquet.write_table(_tabla_arrow(filas), buffer)
+        return buffer.getvalue()
+    return "".join(json.dumps(fila, ensure_ascii=False) + "\n" for fila in filas).encode("utf-8")
+
+class ArchivoSalida:
+    """
+    Archivo de --salida, abierto toda la corrida. Una corrida nueva lo trunca; con
+    --reanudar el NDJSON se continúa. El Parquet se escribe con un solo ParquetWriter
+    (un footer para todos los bloques), por eso no se puede reanudar.
+    """
+
+    def __init__(self, ruta: str, formato: str, reanudar: bool):
+        if formato == "parquet" and reanudar:
+            raise SystemExit("Un Parquet no se puede continuar: repita la exportación sin --reanudar")
+        self.formato = formato
+        self._archivo = open(ruta, "ab" if reanudar else "wb")
+        self._writer = None
+
+    def escribir(self, filas: List[Dict[str, Any]]) -> None:
+        if self.formato == "parquet":
+            if self._writer is None:
+                tabla = _tabla_arrow(filas)
+                self._writer = _pyarrow().parquet.ParquetWriter(self._archivo, tabla.schema)
+            else:
+                tabla = _tabla_arrow(filas, self._writer.schema)
+            self._writer.write_table(tabla)
+        else:
+            self._archivo.write(serializar(filas, self.formato))
+        # Lo escrito queda en disco antes de guardar el checkpoint del bloque
+        self._archivo.flush()
+
+    def cerrar(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        self._archivo.close()
+
+def cargar(client, table_ref: str, contenido: bytes, formato: str, reemplazar: bool) -> int:
+    """Carga un bloque con un load job y espera a que termine; devuelve las filas cargadas"""
+    from google.cloud import bigquery
+
+    job_config = bigquery.LoadJobConfig(
+        source_format=bigquery.SourceFormat.PARQUET if formato == "parquet" else bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE if reemplazar else bigquery.WriteDisposition.WRITE_APPEND,
+    )
+    job = client.load_table_from_file(io.BytesIO(contenido), table_ref, job_config=job_config)
+    job.result()
+    return job.output_rows or 0
+
+def ejecutar(args, store: HistoryStore, client=None, table_ref: Optional[str] = None) -> Dict[str, Any]:
+    checkpoint = leer_checkpoint(args.checkpoint) if args.reanudar else {}
+    desde_rowid = checkpoint.get("rowid", 0)
+    estado = None if args.todas else PENDIENTE
+    # Solo las cargas a la tabla en vivo cambian el estado de las quejas pendientes
+    marcar_guardadas = client is not None and not args.tabla and estado == PENDIENTE
+    # Con --reanudar la tabla ya se vació en la corrida anterior
+    reemplazar = args.reemplazar and not checkpoint
+
+    schema_fields = [campo.name for campo in client.get_table(table_ref).schema] if client is not None else None
+    totales = {"leidas": 0, "cargadas": 0, "omitidas": 0, "bloques": 0}
+    inicio = time.perf_counter()
+    tiempo_armado = 0.0
+    salida = ArchivoSalida(args.salida, args.formato, args.reanudar) if client is None else None
+
+    try:
+        for bloque in store.iterar(desde_rowid, estado, args.bloque):
+            antes = time.perf_counter()
+            filas, ids, omitidas = filas_de_bloque(bloque, schema_fields, _fecha(args.desde), _fecha(args.hasta))
+            tiempo_armado += time.perf_counter() - antes
+            totales["leidas"] += len(bloque)
+            totales["omitidas"] += omitidas
+
+            if filas:
+                if salida is not None:
+                    salida.escribir(filas)
+                    totales["cargadas"] += len(filas)
+                else:
+                    contenido = serializar(filas, args.formato)
+                    totales["cargadas"] += cargar(client, table_ref, contenido, args.formato, reemplazar)
+                    reemplazar = False
+                    if marcar_guardadas:
+                        store.marcar(ids, GUARDADA)
+
+            totales["bloques"] += 1
+            guardar_checkpoint(args.checkpoint, {
+                "rowid": bloque[-1]["rowid"], "cargadas": checkpoint.get("cargadas", 0) + totales["cargadas"],
+                "destino": args.salida or table_ref,
+            })
+            duracion = time.perf_counter() - inicio
+            logger.info("Bloque %d: %d filas (%.0f filas/s)", totales["bloques"], len(filas), totales["cargadas"] / max(duracion, 1e-9))
+    finally:
+        if salida is not None:
+            salida.cerrar()
+
+    totales["segundos"] = time.perf_counter() - inicio
+    totales["filas_por_segundo"] = totales["cargadas"] / max(totales["segundos"], 1e-9)
+    totales["armado_filas_por_segundo"] = totales["leidas"] / max(tiempo_armado, 1e-9)
+    return totales
+
+def crear_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=None, help="SQLite del historial (por defecto HISTORY_DB_PATH)")
+    parser.add_argument("--todas", action="store_true", help="todas las quejas, no solo las pendientes")
+    parser.add_argument("--desde", help="fecha de registro mínima, AAAA-MM-DD")
+    parser.add_argument("--hasta", help="fecha de registro máxima (excluida), AAAA-MM-DD")
+    parser.add_argument("--tabla", help="tabla de destino (por defecto BIGQUERY_TABLE_ID)")
+    parser.add_argument("--reemplazar", action="store_true", help="vacía la tabla de destino con el primer bloque")
+    parser.add_argument("--formato", choices=FORMATOS, default="ndjson")
+    parser.add_argument("--bloque", type=int, default=5000, help="quejas por load job")
+    parser.add_argument("--salida", help="escribe las filas en este archivo en lugar de cargarlas")
+    parser.add_argument("--checkpoint", default="backfill_checkpoint.json")
+    parser.add_argument("--reanudar", action="store_true", help="continúa desde el checkpoint")
+    return parser
+
+def main() -> None:
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    args = crear_parser().parse_args()
+    if args.reemplazar and not args.tabla:
+        raise SystemExit("--reemplazar solo se permite con una tabla auxiliar (--tabla)")
+
+    store = HistoryStore(args.db or get_history_config()["path"])
+    client = table_ref = None
+    if not args.salida:
+        from services.bigquery_service import BigQueryService
+
+        config = get_api_config()
+        servicio = BigQueryService(
+            project_id=config["bigquery_project_id"],
+            dataset_id=config["bigquery_dataset_id"],
+            table_id=args.tabla or config["bigquery_table_id"],
+            credentials_path=config["google_credentials_path"],
+        )
+        client = servicio.client
+        table_ref = f"{servicio.project_id}.{servicio.dataset_id}.{servicio.table_id}"
+
+    totales = ejecutar(args, store, client, table_ref)
+    print(
+        f"Quejas leídas: {totales['leidas']} | cargadas: {totales['cargadas']} | omitidas sin datos: {totales['omitidas']}\n"
+        f"Duración: {totales['segundos']:.2f} s | {totales['filas_por_segundo']:.0f} filas/s "
+        f"(armado de filas: {totales['armado_filas_por_segundo']:.0f} filas/s)"
+    )
+
+if __name__ == "__main__":
+    main()
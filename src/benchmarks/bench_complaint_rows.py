@@ -0,0 +1,156 @@
+"""
+Filas por segundo al armar la tabla de quejas con core.complaint_rows.build_complaint_rows
+(un lote de sesiones, patrones compilados una vez y normalización memorizada por lote)
+contra el armado anterior fila por fila (construir_fila + depurar_fila), copiado aquí
+tal cual como referencia. Verifica además que ambas salidas sean idénticas.
+
+Las sesiones sintéticas mezclan las que ya traen medicamentos_normalizados (quejas
+nuevas) con las anteriores al índice de medicamentos, que hay que normalizar al
+reprocesarlas (--legado controla la proporción).
+
+Uso (desde src/):
+    python -m benchmarks.bench_complaint_rows --quejas 100000
+    python -m benchmarks.bench_complaint_rows --legado 1.0
+"""
+import argparse
+import logging
+import random
+import re
+import time
+from typing import Any, Dict, List, Tuple
+
+from core.complaint_rows import build_complaint_rows
+from core.medication_index import formatear, no_entregados, normalizar_medicamento, normalizar_medicamentos
+from loadtest.fake_bigquery import COLUMNAS_QUEJAS
+
+logger = logging.getLogger("benchmarks.bench_complaint_rows")
+
+MEDICAMENTOS = [
+    "LOSARTAN 50 MG TABLETA - 1 CADA 12 HORAS",
+    "METFORMINA 850 MG TAB #60",
+    "ATORVASTATINA 20MG 1 NOCHE",
+    "ACETAMINOFÉN 500 MG 1 CADA 8 HORAS SI HAY DOLOR",
+    "INSULINA GLARGINA 100 UI/ML 10 UI SC NOCHE",
+    "OMEPRAZOL 20 MG CAPSULA EN AYUNAS",
+    "Enalapril 10 mg 1 cada 12 h",
+    "LEVOTIROXINA 50 MCG AYUNAS",
+    "Losartán + Hidroclorotiazida 50/12,5 mg tab",
+    "SALBUTAMOL 100 MCG/DOSIS INHALADOR 2 PUFF",
+]
+CIUDADES = ["Bogotá", "Medellín", "Cali", "contributivo", "Barranquilla", "Ese fue"]
+FARMACIAS = ["Cruz Verde sede norte", "Audifarma", "y la sede donde", "Colsubsidio", "donde no te", "Farmatodo"]
+NO_ENTREGADOS = ["losartan", "ninguno", "todos", "metformina y atorvastatina", "el omeprazol", ""]
+
+def construir_fila(user_data: Dict[str, Any]) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """Armado anterior, fila por fila (referencia)"""
+    fecha_atencion = None
+    if user_data.get("formula_data", {}).get("fecha_atencion"):
+        fecha_parts = user_data["formula_data"]["fecha_atencion"].split('/')
+        if len(fecha_parts) == 3:
+            dia, mes, anio = fecha_parts
+            fecha_atencion = f"{anio}-{mes.zfill(2)}-{dia.zfill(2)}"
+
+    nombre_paciente = user_data.get("formula_data", {}).get("paciente", "No disponible")
+    logger.debug("Nombre del paciente desde la fórmula: %s", nombre_paciente, extra={"event": "bigquery.fila"})
+
+    city = user_data.get("city", "")
+    if city.lower() in ["contributivo", "subsidiado", "ese fue"]:
+        city = "No disponible"
+
+    pharmacy = user_data.get("pharmacy", "")
+    pharmacy = re.sub(r'donde.*te|y la sede donde|donde no te|sede|y\s+debían|debían', '', pharmacy, flags=re.I).strip()
+    if not pharmacy or pharmacy.lower() in ["y", "la", "el", "los", "las", "donde"]:
+        pharmacy = "No disponible"
+
+    logger.debug("Ciudad original: %s, Ciudad limpia: %s", user_data.get('city', ''), city, extra={"event": "bigquery.fila"})
+    logger.debug("Farmacia original: %s, Farmacia limpia: %s", user_data.get('pharmacy', ''), pharmacy, extra={"event": "bigquery.fila"})
+
+    formula_data = user_data.get("formula_data") or {}
+    normalizados = formula_data.get("medicamentos_normalizados")
+    if normalizados is None:
+        normalizados = normalizar_medicamentos(formula_data.get("medicamentos", []))
+    faltantes = no_entregados(user_data.get("missing_meds", ""), normalizados)
+
+    row = {
+        "PK": user_data["queja_actual"]["id"],
+        "tipo_documento": user_data.get("formula_data", {}).get("tipo_documento", "No disponible"),
+        "numero_documento": user_data.get("formula_data", {}).get("numero_documento", "No disponible"),
+        "paciente": nombre_paciente,
+        "fecha_atencion": fecha_atencion,
+        "eps": user_data.get("formula_data", {}).get("eps", "No disponible"),
+        "doctor": user_data.get("formula_data", {}).get("doctor", "No disponible"),
+        "ips": user_data.get("formula_data", {}).get("ips", "No disponible"),
+        "diagnostico": user_data.get("formula_data", {}).get("diagnostico", "No disponible"),
+        "medicamentos": ", ".join(user_data.get("formula_data", {}).get("medicamentos", [])) or "No disponible",
+        "image_url": "",
+        "no_entregado": user_data.get("missing_meds", "No especificado"),
+        "medicamentos_normalizados": "; ".join(formatear(r) for r in normalizados) or "No disponible",
+        "no_entregado_normalizado": "; ".join(formatear(r) for r in faltantes) or "No especificado",
+        "fecha_nacimiento": user_data.get("birth_date", "No disponible"),
+        "telefono": user_data.get("cellphone", user_data.get("user_id", "No disponible")),
+        "regimen": user_data.get("affiliation_regime", "No disponible"),
+        "municipio": city,
+        "direccion": user_data.get("residence_address", "No proporcionada"),
+        "farmacia": pharmacy
+    }
+    return row, faltantes
+
+def depurar_fila(row: Dict[str, Any], schema_fields: List[str]) -> Dict[str, Any]:
+    """Filtro anterior por esquema, fila por fila (referencia)"""
+    filtered_row = {k: v for k, v in row.items() if k in schema_fields}
+    if len(filtered_row) != len(row):
+        removed_fields = set(row.keys()) - set(filtered_row.keys())
+        logger.warning(f"Se filtraron campos que no existen en el esquema: {removed_fields}")
+    for key, value in filtered_row.items():
+        if isinstance(value, str) and (not value.strip() or value.strip() in ["y", "la", "el", "los", "las"]):
+            filtered_row[key] = "No disponible"
+    return filtered_row
+
+def sesiones_sinteticas(cantidad: int, legado: float, rng: random.Random) -> List[Dict[str, Any]]:
+    normalizados = {linea: normalizar_medicamento(linea) for linea in MEDICAMENTOS}
+    sesiones = []
+    for numero in range(cantidad):
+        medicamentos = rng.sample(MEDICAMENTOS, rng.randint(1, 4))
+        formula_data = {
+            "tipo_documento": "CC", "numero_documento": str(10_000_000 + rng.randrange(50_000)),
+            "paciente": f"PACIENTE {numero}", "fecha_atencion": f"{rng.randint(1, 28)}/{rng.randint(1, 12)}/2024",
+            "eps": "SANITAS", "doctor": "DR. PEREZ", "ips": "IPS CENTRAL", "diagnostico": "HIPERTENSION",
+            "medicamentos": medicamentos,
+        }
+        if rng.random() >= legado:
+            formula_data["medicamentos_normalizados"] = [normalizados[linea] for linea in medicamentos]
+        sesiones.append({
+            "user_id": f"u{numero}", "queja_actual": {"id": f"u{numero}_{numero}", "guardada": False},
+            "formula_data": formula_data, "missing_meds": rng.choice(NO_ENTREGADOS),
+            "city": rng.choice(CIUDADES), "pharmacy": rng.choice(FARMACIAS), "birth_date": "1960-05-04",
+            "cellphone": "3001234567", "affiliation_regime": "Contributivo", "residence_address": "Calle 1 # 2-3",
+        })
+    return sesiones
+
+def principal(args) -> None:
+    sesiones = sesiones_sinteticas(args.quejas, args.legado, random.Random(11))
+    schema_fields = list(COLUMNAS_QUEJAS)
+
+    inicio = time.perf_counter()
+    anteriores = [depurar_fila(construir_fila(user_data)[0], schema_fields) for user_data in sesiones]
+    por_fila = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    filas = build_complaint_rows(sesiones, schema_fields)
+    por_lote = time.perf_counter() - inicio
+
+    if filas != anteriores:
+        raise SystemExit("Las filas del lote no coinciden con el armado anterior")
+
+    print(f"{args.quejas} quejas ({args.legado:.0%} sin medicamentos normalizados)")
+    print(f"Fila por fila:        {args.quejas / por_fila:12.0f} filas/s")
+    print(f"build_complaint_rows: {args.quejas / por_lote:12.0f} filas/s ({por_fila / por_lote:.1f}x)")
+
+def crear_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quejas", type=int, default=100000)
+    parser.add_argument("--legado", type=float, default=0.5, help="fracción de sesiones sin medicamentos_normalizados")
+    return parser
+
+if __name__ == "__main__":
+    principal(crear_parser().parse_args())
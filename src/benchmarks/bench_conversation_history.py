@@ -0,0 +1,116 @@
+"""
+Historial de conversación como lista (recortar con [-15:], agregar y reasignar en cada
+turno, como hacía ask_openai) contra core.conversation_history (buffer circular con
+ventana sin copias). Mide tiempo y memoria transitoria por turno, y memoria retenida
+por sesión tras una conversación larga con comandos y plantillas entre turnos.
+
+Uso (desde src/):
+    python -m benchmarks.bench_conversation_history --sesiones 10000 --turnos 40
+"""
+import argparse
+import gc
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+from core.conversation_history import ConversationHistory
+
+SISTEMA = {"role": "system", "content": "Prompt del sistema"}
+
+def turno_lista(data: Dict[str, Any], texto: str, extra: bool) -> List[Dict[str, str]]:
+    """El patrón anterior: IntentHandler agrega, ask_openai recorta, agrega y reasigna"""
+    data["conversation_history"].append({"role": "user", "content": texto})
+    historial = data["conversation_history"][-15:] if data["conversation_history"] else []
+    mensajes = [SISTEMA]
+    mensajes.extend(historial)
+    historial.append({"role": "assistant", "content": "Respuesta del asistente"})
+    data["conversation_history"] = historial
+    if extra:
+        # /help, /start o una plantilla: agregan sin recortar
+        data["conversation_history"].append({"role": "assistant", "content": "Mensaje de ayuda"})
+    return mensajes
+
+def turno_buffer(data: Dict[str, Any], texto: str, extra: bool) -> List[Dict[str, str]]:
+    historial = data["conversation_history"]
+    historial.append({"role": "user", "content": texto})
+    mensajes = [SISTEMA]
+    mensajes.extend(historial.ventana())
+    historial.append({"role": "assistant", "content": "Respuesta del asistente"})
+    if extra:
+        historial.append({"role": "assistant", "content": "Mensaje de ayuda"})
+    return mensajes
+
+def rondas(datos: List[Dict[str, Any]], turno: Callable, turnos: int, extra_cada: int, entre_rondas: Callable = None) -> None:
+    for numero in range(turnos):
+        extra = extra_cada > 0 and numero % extra_cada == 0
+        for data in datos:
+            turno(data, "Mensaje del usuario", extra)
+        if entre_rondas:
+            entre_rondas()
+
+def medir(nombre: str, nuevo: Callable[[], Any], turno: Callable, sesiones: int, turnos: int, extra_cada: int) -> None:
+    datos = [{"conversation_history": nuevo()} for _ in range(sesiones)]
+    inicio = time.perf_counter()
+    rondas(datos, turno, turnos, extra_cada)
+    duracion = time.perf_counter() - inicio
+
+    # Memoria en una segunda pasada: tracemalloc encarece cada asignación y falsea los tiempos
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    datos = [{"conversation_history": nuevo()} for _ in range(sesiones)]
+    picos = []
+
+    def pico() -> None:
+        actual, maximo = tracemalloc.get_traced_memory()
+        picos.append(maximo - actual)
+        tracemalloc.reset_peak()
+
+    rondas(datos, turno, turnos, extra_cada, pico)
+    retenida = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+
+    mensajes = sum(len(data["conversation_history"]) for data in datos) / sesiones
+    print(f"{nombre:<16} {duracion / (sesiones * turnos) * 1e6:6.2f} µs por turno | "
+          f"pico transitorio {sum(picos) / len(picos) / 1024:6.0f} KB por ronda | "
+          f"retenido {retenida / sesiones / 1024:4.1f} KB por sesión ({mensajes:.0f} mensajes)")
+
+def asignaciones(turno: Callable, nuevo: Callable[[], Any], turnos: int, repeticiones: int = 1000) -> float:
+    """
+    Bloques de memoria reservados por turno con el historial ya lleno. El historial anterior
+    se mantiene vivo durante la medición para que su liberación no compense la copia nueva.
+    """
+    data = {"conversation_history": nuevo()}
+    for _ in range(turnos):
+        turno(data, "calentamiento", False)
+    gc.collect()
+    gc.disable()
+    total = 0
+    for _ in range(repeticiones):
+        anterior = data["conversation_history"]
+        antes = sys.getallocatedblocks()
+        mensajes = turno(data, "Mensaje del usuario", False)
+        total += sys.getallocatedblocks() - antes
+        del mensajes, anterior
+    gc.enable()
+    return total / repeticiones
+
+def principal(args) -> None:
+    print(f"{args.sesiones} sesiones, {args.turnos} turnos, un mensaje extra cada {args.extra_cada} turnos")
+    medir("lista", list, turno_lista, args.sesiones, args.turnos, args.extra_cada)
+    medir("buffer circular", ConversationHistory, turno_buffer, args.sesiones, args.turnos, args.extra_cada)
+
+    for nombre, nuevo, turno in (("lista", list, turno_lista), ("buffer circular", ConversationHistory, turno_buffer)):
+        print(f"{nombre:<16} {asignaciones(turno, nuevo, args.turnos):5.1f} bloques reservados por turno "
+              f"(mensajes nuevos y lista del prompt incluidos)")
+
+def crear_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sesiones", type=int, default=10000)
+    parser.add_argument("--turnos", type=int, default=40)
+    parser.add_argument("--extra-cada", type=int, default=3, help="turnos entre mensajes de comandos o plantillas")
+    return parser
+
+if __name__ == "__main__":
+    principal(crear_parser().parse_args())
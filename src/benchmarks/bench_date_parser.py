@@ -0,0 +1,168 @@
+"""
+Fechas de nacimiento con core.date_parser (una expresión compilada, tabla de meses
+precalculada y validación de calendario) contra el DataExtractor.extraer_fecha anterior
+(tres búsquedas y el diccionario de meses armado en cada llamada), copiado aquí como
+referencia.
+
+Primero revisa la exactitud sobre un corpus de mensajes con la fecha esperada (o None
+cuando no hay fecha válida) y lista los que fallan; sale con código 1 si el parser
+nuevo falla alguno. Después mide el costo por mensaje sobre una mezcla en la que la
+mayoría de los mensajes no trae fecha, como en una conversación real.
+
+Uso (desde src/):
+    python -m benchmarks.bench_date_parser
+    python -m benchmarks.bench_date_parser --mensajes 200000 --con-fecha 0.1
+"""
+import argparse
+import random
+import re
+import sys
+import time
+from datetime import date
+from typing import Callable, List, Optional, Tuple
+
+from core.date_parser import parsear_fecha
+
+HOY = date.today()
+ANIO = HOY.year
+
+# (mensaje, fecha esperada como DD/MM/AAAA o None)
+CORPUS: List[Tuple[str, Optional[str]]] = [
+    ("05/03/1980", "05/03/1980"),
+    ("5/3/1980", "05/03/1980"),
+    ("5-3-1980", "05/03/1980"),
+    ("05.03.1980", "05/03/1980"),
+    ("Mi fecha de nacimiento es 12/11/1975", "12/11/1975"),
+    ("nací el 5-3-80", "05/03/1980"),
+    ("07/11/05", "07/11/2005"),
+    ("1980-03-05", "05/03/1980"),
+    ("5 de marzo de 1980", "05/03/1980"),
+    ("nací el 5 de Marzo de 1980", "05/03/1980"),
+    ("5 de marzo del 80", "05/03/1980"),
+    ("5 marzo 1980", "05/03/1980"),
+    ("5 de mar. de 1980", "05/03/1980"),
+    ("15-ago-1970", "15/08/1970"),
+    ("15/ENE/1990", "15/01/1990"),
+    ("3 de sept de 1962", "03/09/1962"),
+    ("3 de sep. 1962", "03/09/1962"),
+    ("3 de setiembre de 1962", "03/09/1962"),
+    ("22 de dic 01", "22/12/2001"),
+    ("primero de mayo de 1975", "01/05/1975"),
+    ("el primero de enero del 90", "01/01/1990"),
+    ("1ro de sept. del 80", "01/09/1980"),
+    ("1° de octubre de 1968", "01/10/1968"),
+    ("2do de febrero de 1999", "02/02/1999"),
+    ("marzo 5, 1980", "05/03/1980"),
+    ("Marzo 5 de 1980", "05/03/1980"),
+    ("mayo 1ro del 80", "01/05/1980"),
+    ("sept 9 2001", "09/09/2001"),
+    ("DICIEMBRE 24 1958", "24/12/1958"),
+    ("29/02/2000", "29/02/2000"),
+    # Fechas que no existen o no pueden ser de nacimiento
+    ("31/02/1990", None),
+    ("29/02/1999", None),
+    ("31 de abril de 1985", None),
+    ("13/13/1980", None),
+    ("00/05/1980", None),
+    ("5 de marzo de 1850", None),
+    (f"5 de marzo de {ANIO + 3}", None),
+    # Sin año no hay fecha de nacimiento (ni se asume el año actual)
+    ("12 de enero", None),
+    ("nací el 5 de marzo", None),
+    ("el 1 de mayo", None),
+    ("marzo 5", None),
+    # Mensajes sin fecha
+    ("3001234567", None),
+    ("tengo 3 hijos y vivo en Medellín", None),
+    ("la mayoría 5 veces", None),
+    ("me entregaron 2 de los 3 medicamentos", None),
+    ("LOSARTAN 50 MG TABLETA #30", None),
+    ("Calle 45 # 12-30", None),
+    ("es la primera vez que me pasa", None),
+    ("la cuota fue de $1.500.000", None),
+    ("Contributivo", None),
+]
+
+MENSAJES_SIN_FECHA = [
+    "Hola, buenas tardes", "Medellín", "Contributivo", "3001234567", "Cruz Verde de la 80",
+    "Sí, acepto", "no me entregaron la metformina", "Calle 45 # 12-30 apto 201",
+    "todos", "1 y 3", "me dijeron que volviera en 8 días",
+]
+
+def extraer_fecha_anterior(texto: str) -> Optional[str]:
+    """El DataExtractor.extraer_fecha anterior (referencia)"""
+    formato_slash = re.search(r"(\d{1,2})[\/\-](\d{1,2})[\/\-](\d{4})", texto)
+    formato_texto = re.search(r"(\d{1,2})\s+de\s+([a-zñáéíóú]+)(?:\s+de\s+)?(\d{4})?", texto, re.I)
+    formato_invertido = re.search(r"([a-zñáéíóú]+)\s+(\d{1,2})(?:,?\s+)?(\d{4})?", texto, re.I)
+
+    if formato_slash:
+        return f"{formato_slash.group(1).zfill(2)}/{formato_slash.group(2).zfill(2)}/{formato_slash.group(3)}"
+
+    meses = {
+        'enero': '01', 'febrero': '02', 'marzo': '03', 'abril': '04',
+        'mayo': '05', 'junio': '06', 'julio': '07', 'agosto': '08',
+        'septiembre': '09', 'octubre': '10', 'noviembre': '11', 'diciembre': '12'
+    }
+    if formato_texto:
+        dia = formato_texto.group(1).zfill(2)
+        mes_texto = formato_texto.group(2).lower()
+        anio = formato_texto.group(3) or str(time.localtime().tm_year)
+        for nombre, numero in meses.items():
+            if nombre in mes_texto:
+                return f"{dia}/{numero}/{anio}"
+
+    if formato_invertido:
+        mes_texto = formato_invertido.group(1).lower()
+        dia = formato_invertido.group(2).zfill(2)
+        anio = formato_invertido.group(3) or str(time.localtime().tm_year)
+        for nombre, numero in meses.items():
+            if nombre in mes_texto:
+                return f"{dia}/{numero}/{anio}"
+    return None
+
+def extraer_fecha_nueva(texto: str) -> Optional[str]:
+    """Lo mismo que DataExtractor.extraer_fecha, con la fecha de hoy fija para el corpus"""
+    fecha = parsear_fecha(texto, hasta=HOY, hoy=HOY)
+    return f"{fecha.day:02d}/{fecha.month:02d}/{fecha.year}" if fecha else None
+
+def exactitud(nombre: str, funcion: Callable[[str], Optional[str]], mostrar: bool) -> int:
+    fallos = [(texto, esperado, funcion(texto)) for texto, esperado in CORPUS if funcion(texto) != esperado]
+    print(f"{nombre:<10} {len(CORPUS) - len(fallos)}/{len(CORPUS)} correctas")
+    if mostrar:
+        for texto, esperado, obtenido in fallos:
+            print(f"    {texto!r}: se esperaba {esperado}, se obtuvo {obtenido}")
+    return len(fallos)
+
+def medir(funcion: Callable[[str], Optional[str]], mensajes: List[str]) -> float:
+    inicio = time.perf_counter()
+    for mensaje in mensajes:
+        funcion(mensaje)
+    return (time.perf_counter() - inicio) / len(mensajes) * 1e6
+
+def principal(args) -> int:
+    exactitud("anterior", extraer_fecha_anterior, args.detalle)
+    fallos = exactitud("nuevo", extraer_fecha_nueva, True)
+
+    rng = random.Random(5)
+    con_fecha = [texto for texto, esperado in CORPUS if esperado]
+    mensajes = [rng.choice(con_fecha) if rng.random() < args.con_fecha else rng.choice(MENSAJES_SIN_FECHA)
+                for _ in range(args.mensajes)]
+    anterior = medir(extraer_fecha_anterior, mensajes)
+    nuevo = medir(extraer_fecha_nueva, mensajes)
+    print(f"{args.mensajes} mensajes, {args.con_fecha:.0%} con fecha")
+    print(f"anterior   {anterior:6.2f} µs por mensaje")
+    print(f"nuevo      {nuevo:6.2f} µs por mensaje ({anterior / nuevo:.1f}x)")
+    solo_fechas = [rng.choice(con_fecha) for _ in range(args.mensajes // 4)]
+    print(f"solo mensajes con fecha: anterior {medir(extraer_fecha_anterior, solo_fechas):.2f} µs | "
+          f"nuevo {medir(extraer_fecha_nueva, solo_fechas):.2f} µs")
+    return 1 if fallos else 0
+
+def crear_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mensajes", type=int, default=100000)
+    parser.add_argument("--con-fecha", type=float, default=0.1, help="fracción de mensajes que traen una fecha")
+    parser.add_argument("--detalle", action="store_true", help="listar también los fallos del extractor anterior")
+    return parser
+
+if __name__ == "__main__":
+    sys.exit(principal(crear_parser().parse_args()))
@@ -0,0 +1,87 @@
+"""
+Mide el lag del event loop mientras se procesa una foto grande, con el trabajo de
+CPU (base64 de la foto y parseo de la respuesta de Vision) ejecutado en el propio
+loop ("antes") y despachado al executor ("después").
+
+Un ticker duerme 5 ms en bucle y registra cuánto tarde despierta: ese retraso es
+el que sufriría la respuesta de texto de cualquier otro usuario.
+
+Uso (desde src/):
+    python -m benchmarks.bench_event_loop_lag --mb 8 --fotos 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+
+from core.executor import run_cpu_bound, shutdown_executors
+from handlers.telegram_handler import codificar_base64
+from services.image_processor import parsear_respuesta_formula
+
+INTERVALO = 0.005
+
+def respuesta_vision(num_medicamentos: int) -> str:
+    datos = {
+        "datos": {
+            "tipo_documento": "CC",
+            "numero_documento": "1020304050",
+            "paciente": "María Fernanda López Gómez",
+            "fecha_atencion": "15/03/2024",
+            "eps": "Sura",
+            "doctor": "Carlos Pérez",
+            "diagnostico": "Hipertensión esencial",
+            "medicamentos": [f"Medicamento {i} 50 mg tableta cada 12 horas por 30 días" for i in range(num_medicamentos)]
+        }
+    }
+    # Las respuestas reales suelen traer texto alrededor del JSON
+    return "Aquí está el resultado:\n```json\n" + json.dumps(datos, ensure_ascii=False, indent=2) + "\n```"
+
+async def ticker(lags: list, detener: asyncio.Event) -> None:
+    while not detener.is_set():
+        inicio = time.perf_counter()
+        await asyncio.sleep(INTERVALO)
+        lags.append(max(0.0, time.perf_counter() - inicio - INTERVALO))
+
+async def procesar_fotos(fotos: list, respuesta: str, usar_executor: bool) -> None:
+    for foto in fotos:
+        if usar_executor:
+            await run_cpu_bound(codificar_base64, foto)
+            await run_cpu_bound(parsear_respuesta_formula, respuesta)
+        else:
+            codificar_base64(foto)
+            parsear_respuesta_formula(respuesta)
+        # Cede el loop entre fotos, como lo haría la llamada de red real
+        await asyncio.sleep(0)
+
+async def medir(fotos: list, respuesta: str, usar_executor: bool) -> list:
+    lags = []
+    detener = asyncio.Event()
+    tarea = asyncio.create_task(ticker(lags, detener))
+    await asyncio.sleep(INTERVALO * 4)
+    await procesar_fotos(fotos, respuesta, usar_executor)
+    detener.set()
+    await tarea
+    return lags
+
+def resumen(nombre: str, lags: list) -> None:
+    ordenados = sorted(lags)
+    p99 = ordenados[min(len(ordenados) - 1, int(len(ordenados) * 0.99))]
+    print(f"{nombre:>8}: lag p50 {statistics.median(ordenados) * 1000:7.2f} ms | "
+          f"p99 {p99 * 1000:7.2f} ms | máx {ordenados[-1] * 1000:7.2f} ms")
+
+async def principal(args) -> None:
+    fotos = [os.urandom(args.mb * 1024 * 1024) for _ in range(args.fotos)]
+    respuesta = respuesta_vision(args.medicamentos)
+
+    resumen("antes", await medir(fotos, respuesta, usar_executor=False))
+    resumen("después", await medir(fotos, respuesta, usar_executor=True))
+    shutdown_executors()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mb", type=int, default=8)
+    parser.add_argument("--fotos", type=int, default=5)
+    parser.add_argument("--medicamentos", type=int, default=40)
+    asyncio.run(principal(parser.parse_args()))
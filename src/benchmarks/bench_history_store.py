@@ -0,0 +1,73 @@
+"""
+Consulta del historial y detección de quejas repetidas con services.history_store
+(SQLite con índices por documento, usuario y ATC) contra recorrer una lista de
+quejas en memoria, como hacían patient_history y quejas_anteriores.
+
+Uso (desde src/):
+    python -m benchmarks.bench_history_store --quejas 100000
+    python -m benchmarks.bench_history_store --db /tmp/historial.db
+"""
+import argparse
+import random
+import time
+
+from services.history_store import HistoryStore
+
+ATC = ["C09CA01", "A10BA02", "C10AA05", "N02BE01", "A10AE04", "A02BC01", "C09AA02", "H03AA01", "C03AA03", "C08CA01"]
+
+def poblar(store: HistoryStore, quejas: int, pacientes: int, rng: random.Random):
+    lista = []
+    ahora = time.time()
+    for numero in range(quejas):
+        documento = str(10_000_000 + rng.randrange(pacientes))
+        codigos = rng.sample(ATC, rng.randint(1, 3))
+        queja = {
+            "id": f"u{numero}_{numero}", "numero_documento": documento, "user_id": f"u{rng.randrange(pacientes)}",
+            "paciente": "PACIENTE", "fecha": ahora - rng.uniform(0, 365 * 86400), "medicamentos": ", ".join(codigos),
+            "farmacia": "Farmacia",
+        }
+        store.registrar(queja, codigos)
+        lista.append(dict(queja, atc=codigos))
+    return lista
+
+def recorrido_lista(lista, documento: str, codigos, desde: float):
+    """Lo que costaría la misma pregunta sobre la lista en memoria"""
+    historial = sorted((q for q in lista if q["numero_documento"] == documento), key=lambda q: -q["fecha"])[:10]
+    repetidas = [q for q in lista if q["numero_documento"] == documento and q["fecha"] >= desde and set(codigos) & set(q["atc"])]
+    return historial, max(repetidas, key=lambda q: q["fecha"], default=None)
+
+def principal(args) -> None:
+    rng = random.Random(7)
+    store = HistoryStore(args.db)
+    inicio = time.perf_counter()
+    lista = poblar(store, args.quejas, args.pacientes, rng)
+    print(f"Carga de {args.quejas} quejas: {time.perf_counter() - inicio:.2f} s")
+
+    consultas = [(str(10_000_000 + rng.randrange(args.pacientes)), rng.sample(ATC, 2)) for _ in range(args.consultas)]
+    desde = time.time() - 30 * 86400
+
+    inicio = time.perf_counter()
+    for documento, codigos in consultas[: max(1, args.consultas // 20)]:
+        recorrido_lista(lista, documento, codigos, desde)
+    lineal = (time.perf_counter() - inicio) / max(1, args.consultas // 20) * 1e6
+
+    inicio = time.perf_counter()
+    for documento, codigos in consultas:
+        store.historial(documento)
+        store.queja_repetida(documento, codigos, dias=30)
+    indexado = (time.perf_counter() - inicio) / args.consultas * 1e6
+
+    print(f"Lista en memoria:    {lineal:10.1f} µs por consulta (historial + repetida)")
+    print(f"SQLite con índices:  {indexado:10.1f} µs por consulta ({lineal / indexado:.0f}x)")
+    store.close()
+
+def crear_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quejas", type=int, default=100000)
+    parser.add_argument("--pacientes", type=int, default=20000)
+    parser.add_argument("--consultas", type=int, default=2000)
+    parser.add_argument("--db", default=":memory:", help="archivo SQLite; por defecto en memoria")
+    return parser
+
+if __name__ == "__main__":
+    principal(crear_parser().parse_args())
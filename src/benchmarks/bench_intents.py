@@ -0,0 +1,120 @@
+"""
+Costo por mensaje de la detección de intenciones: la cadena anterior de re.search
+(reinicio, nueva queja, fórmula perdida, consentimiento y despedida dos veces, cada
+una con su propio lower()) contra una sola llamada a intent_classifier.classify.
+
+También reporta, sobre respuestas etiquetadas al pedido de autorización, cuántas
+quedaban mal enrutadas: "sin problema" contaba como autorización por el "si" dentro
+de "sin", y cualquier pregunta contaba como negativa y descartaba la fórmula pendiente
+(el usuario tenía que reenviar la foto: otra llamada de Vision y más turnos del LLM).
+El conjunto incluye respuestas mixtas con un "no" que no niega ("Sí, no hay problema",
+"no sé, ¿para qué...?"); sale con código 1 si el clasificador enruta mal alguna.
+
+Uso (desde src/):
+    python -m benchmarks.bench_intents --mensajes 200000
+"""
+import argparse
+import re
+import sys
+import time
+
+from core import intent_classifier
+
+MENSAJES = [
+    "Sí, autorizo",
+    "No me entregaron ninguno",
+    "Medellín",
+    "3001234567",
+    "Nací el 15/04/1980",
+    "Soy del régimen contributivo",
+    "Mi dirección: Calle 45 # 23-10, apartamento 301.",
+    "La farmacia: Cruz Verde del centro.",
+    "Muchas gracias por la ayuda",
+    "Quiero hacer otra queja por un medicamento distinto",
+    "se me perdió la fórmula, ¿qué hago?",
+    "Hola, no me entregaron el losartán en la farmacia de la EPS y lo necesito para la presión",
+]
+
+# (respuesta al pedido de autorización, True autoriza / False se niega / None no responde)
+CONSENTIMIENTO = [
+    ("Sí, autorizo", True),
+    ("si", True),
+    ("claro que sí", True),
+    ("ok dale", True),
+    ("Acepto", True),
+    ("De acuerdo", True),
+    ("sin problema", None),
+    ("así es", None),
+    ("No autorizo", False),
+    ("no", False),
+    ("No, gracias", False),
+    ("prefiero que no", False),
+    ("¿Para qué necesitan mis datos?", None),
+    ("¿Quién va a ver la información?", None),
+    ("espera un momento", None),
+    ("no estoy de acuerdo", False),
+    ("Por supuesto", True),
+    ("bueno", True),
+    # Un "no" que no niega
+    ("Sí, no hay problema", True),
+    ("No hay problema, adelante", True),
+    ("dale no hay drama", True),
+    ("no hay lío", True),
+    ("no sé, ¿para qué la necesitan?", None),
+    ("no, ¿para qué la necesitan?", None),
+    ("No me entregaron todo, ¿eso importa?", None),
+    ("no señor", False),
+    ("no, mejor no", False),
+]
+
+def cadena_anterior(text: str, esperando_autorizacion: bool = True):
+    """Las mismas expresiones regulares que se evaluaban por mensaje antes del clasificador"""
+    reinicio = text.lower() == '/reset' or 'empezar de nuevo' in text.lower() or 'reiniciar' in text.lower()
+    nueva_queja = re.search(r"(nueva queja|otra queja|quiero hacer otra|iniciar otra|tramitar otra|otra .*queja|reportar otro|denunciar otro|otro medicamento no entregado|volver a empezar)", text, re.I)
+    perdida = re.search(r"(perd[ií] la f[oó]rmula|no tengo la f[oó]rmula|se me perd[ií]|no la tengo|se me dañó|se me mojó|no la encuentro)", text.lower(), re.I)
+    afirmativo = None
+    if esperando_autorizacion:
+        text_lower = text.lower()
+        afirmativo = bool(re.search(r"(si|sí|claro|ok|dale|autorizo|acepto|por supuesto|listo|adelante)", text_lower))
+    despedida = re.search(r"(gracias|adios|chao|hasta luego|muchas gracias|listo)", text.lower())
+    despedida_final = re.search(r"(gracias|adios|chao|hasta luego|muchas gracias|listo)", text.lower())
+    return reinicio, nueva_queja, perdida, afirmativo, despedida, despedida_final
+
+def medir(funcion, mensajes: int) -> float:
+    inicio = time.perf_counter()
+    for indice in range(mensajes):
+        funcion(MENSAJES[indice % len(MENSAJES)])
+    return (time.perf_counter() - inicio) / mensajes * 1e6
+
+def principal(args) -> int:
+    intent_classifier.get_classifier()
+    # Calentamiento de la caché de expresiones regulares
+    cadena_anterior(MENSAJES[0])
+
+    anterior = medir(cadena_anterior, args.mensajes)
+    nuevo = medir(intent_classifier.classify, args.mensajes)
+    print(f"Cadena de re.search:      {anterior:6.2f} µs/mensaje")
+    print(f"Clasificador compilado:   {nuevo:6.2f} µs/mensaje ({anterior / nuevo:.1f}x)")
+
+    errores_anterior = errores_nuevo = 0
+    for texto, esperado in CONSENTIMIENTO:
+        # Antes todo lo que no era afirmativo se trataba como negativa
+        antes = cadena_anterior(texto)[3]
+        ahora = intent_classifier.respuesta_consentimiento(intent_classifier.classify(texto))
+        errores_anterior += antes != esperado
+        errores_nuevo += ahora != esperado
+        if args.detalle:
+            print(f"  {texto!r:40} esperado={esperado!s:5} antes={antes!s:5} ahora={ahora!s:5}")
+
+    print(f"Respuestas de autorización mal enrutadas: {errores_anterior}/{len(CONSENTIMIENTO)} antes, "
+          f"{errores_nuevo}/{len(CONSENTIMIENTO)} con el clasificador")
+    return 1 if errores_nuevo else 0
+
+def crear_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mensajes", type=int, default=200000)
+    parser.add_argument("--detalle", action="store_true", help="muestra cada respuesta de autorización")
+    return parser
+
+if __name__ == "__main__":
+    sys.exit(principal(crear_parser().parse_args()))
@@ -0,0 +1,151 @@
+"""
+Extracción del JSON de las respuestas de Vision: el parser anterior (regex codiciosa,
+reintento con re.sub de comillas y raspado con patrones) contra core.json_parser.
+
+Mide lecturas recuperadas (paciente y medicamentos correctos; cada fallo obligaba al
+usuario a reenviar la foto, es decir, otra llamada de Vision) y µs por respuesta.
+
+Sin --corpus se usa un corpus sintético con las fallas vistas en producción: texto
+alrededor del JSON, bloques ```json, comas sobrantes, comillas internas, comillas
+tipográficas, salida sobre-escapada, diccionarios con comillas simples y salidas
+truncadas. Con --corpus se leen respuestas grabadas, una por línea en JSONL:
+{"raw": "...", "paciente": "...", "medicamentos": ["..."]}
+
+Uso (desde src/):
+    python -m benchmarks.bench_json_parser --repeticiones 200
+    python -m benchmarks.bench_json_parser --corpus respuestas_vision.jsonl
+"""
+import argparse
+import json
+import random
+import re
+import time
+from collections import Counter
+from typing import Any, Dict, List
+
+from core.json_parser import JSONIrreparableError
+from services.image_processor import parsear_respuesta_formula
+
+PACIENTES = ["MARIA FERNANDA GOMEZ RUIZ", "JOSE LUIS PEREZ", "ANA LUCIA TORRES DE LA HOZ", "CARLOS ANDRES MEJIA"]
+MEDICAMENTOS = [
+    "LOSARTAN 50 MG TABLETA - 1 CADA 12 HORAS", "METFORMINA 850 MG TAB #60", "ATORVASTATINA 20MG 1 NOCHE",
+    "ACETAMINOFEN 500 MG 1 CADA 8 HORAS SI HAY DOLOR", "INSULINA GLARGINA 100 UI/ML 10 UI SC NOCHE",
+    "OMEPRAZOL 20 MG CAPSULA EN AYUNAS", "ENALAPRIL 10 MG 1 CADA 12 H", "LEVOTIROXINA 50 MCG AYUNAS",
+]
+
+def _formula(rng: random.Random) -> Dict[str, Any]:
+    return {"datos": {
+        "tipo_documento": "CC",
+        "numero_documento": str(rng.randint(10_000_000, 1_999_999_999)),
+        "paciente": rng.choice(PACIENTES),
+        "fecha_atencion": f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/2024",
+        "eps": rng.choice(["SURA", "NUEVA EPS", "SANITAS", "SALUD TOTAL"]),
+        "doctor": rng.choice(["JUAN CAMILO RESTREPO", "Dr. \"Pacho\" Díaz", "LAURA MARTINEZ"]),
+        "diagnostico": rng.choice(["HIPERTENSION ESENCIAL (I10)", "DIABETES MELLITUS TIPO 2", "No visible"]),
+        "medicamentos": rng.sample(MEDICAMENTOS, rng.randint(1, 5)),
+    }}
+
+def _truncar(texto: str, rng: random.Random) -> str:
+    # Se corta en algún punto de la lista de medicamentos, como cuando se agotan los tokens
+    inicio = texto.find('"medicamentos"') + 20
+    return texto[:rng.randint(inicio, max(inicio, len(texto) - 3))]
+
+VARIANTES = {
+    "limpia": lambda t, r: t,
+    "con texto alrededor": lambda t, r: f"Claro, aquí está la información extraída:\n{t}\nEspero que sea útil.",
+    "bloque ```json": lambda t, r: f"```json\n{t}\n```",
+    "comas sobrantes": lambda t, r: re.sub(r'"\s*\n(\s*)([\]}])', '",\n\\1\\2', t),
+    "comillas internas": lambda t, r: t.replace('\\"', '"'),
+    "comillas tipográficas": lambda t, r: re.sub(r'"([^"\\]*)"', "“\\1”", t),
+    "sobre-escapada": lambda t, r: json.dumps(t, ensure_ascii=False)[1:-1],
+    "comillas simples": lambda t, r: repr(json.loads(t)),
+    "truncada": _truncar,
+}
+
+def corpus_sintetico(repeticiones: int, semilla: int = 7) -> List[Dict[str, Any]]:
+    rng = random.Random(semilla)
+    corpus = []
+    for _ in range(repeticiones):
+        for nombre, variante in VARIANTES.items():
+            formula = _formula(rng)
+            texto = json.dumps(formula, ensure_ascii=False, indent=2)
+            corpus.append({
+                "tipo": nombre,
+                "raw": variante(texto, rng),
+                "paciente": formula["datos"]["paciente"],
+                "medicamentos": formula["datos"]["medicamentos"],
+            })
+    return corpus
+
+def parser_anterior(response_text: str) -> Dict[str, Any]:
+    """El parser previo a core.json_parser, tal como estaba en ImageProcessor"""
+    json_match = re.search(r'\{[\s\S]*\}', response_text)
+    if not json_match:
+        paciente_match = re.search(r'paciente[:\s]+"([^"]+)"', response_text, re.I)
+        medicamentos_match = re.findall(r'medicamento[s]?[:\s]+([^\n\."]+)', response_text, re.I)
+        return {"datos": {
+            "paciente": paciente_match.group(1) if paciente_match else "No visible",
+            "medicamentos": medicamentos_match if medicamentos_match else ["No se detectaron medicamentos"]
+        }}
+    try:
+        json_data = json.loads(json_match.group(0))
+    except json.JSONDecodeError:
+        cleaned_json = json_match.group(0).replace('\n', '').replace('\r', '')
+        cleaned_json = re.sub(r'(?<=":\s*"[^"]*)"(?=[^"]*")', '\\"', cleaned_json)
+        json_data = json.loads(cleaned_json)
+    if "datos" not in json_data:
+        if any(key in json_data for key in ["tipo_documento", "paciente", "medicamentos"]):
+            json_data = {"datos": json_data}
+        else:
+            raise ValueError("Estructura JSON incorrecta")
+    return json_data
+
+def es_correcta(resultado: Dict[str, Any], caso: Dict[str, Any]) -> bool:
+    datos = resultado.get("datos", {})
+    medicamentos = datos.get("medicamentos") or []
+    if datos.get("paciente") != caso["paciente"] or not medicamentos:
+        return False
+    # En una salida truncada basta con que lo leído sea un prefijo de lo esperado
+    esperados = caso["medicamentos"]
+    return all(any(esperado.startswith(leido) for esperado in esperados) for leido in medicamentos)
+
+def evaluar(parser, corpus: List[Dict[str, Any]]):
+    aciertos, totales = Counter(), Counter()
+    inicio = time.perf_counter()
+    for caso in corpus:
+        totales[caso.get("tipo", "grabada")] += 1
+        try:
+            resultado = parser(caso["raw"])
+        except (ValueError, re.error, JSONIrreparableError):
+            continue
+        if es_correcta(resultado, caso):
+            aciertos[caso.get("tipo", "grabada")] += 1
+    duracion = (time.perf_counter() - inicio) / max(1, len(corpus)) * 1e6
+    return aciertos, totales, duracion
+
+def principal(args) -> None:
+    if args.corpus:
+        with open(args.corpus, encoding="utf-8") as archivo:
+            corpus = [json.loads(linea) for linea in archivo if linea.strip()]
+    else:
+        corpus = corpus_sintetico(args.repeticiones)
+
+    aciertos_antes, totales, us_antes = evaluar(parser_anterior, corpus)
+    aciertos_ahora, _, us_ahora = evaluar(parsear_respuesta_formula, corpus)
+
+    print(f"{'variante':<24}{'anterior':>12}{'nuevo':>12}")
+    for tipo in totales:
+        print(f"{tipo:<24}{aciertos_antes[tipo]:>7}/{totales[tipo]:<4}{aciertos_ahora[tipo]:>7}/{totales[tipo]:<4}")
+    total = sum(totales.values())
+    print(f"{'total':<24}{sum(aciertos_antes.values()):>7}/{total:<4}{sum(aciertos_ahora.values()):>7}/{total:<4}")
+    print(f"µs por respuesta: anterior {us_antes:.1f} | nuevo {us_ahora:.1f}")
+    print(f"Fotos que el usuario tendría que reenviar: {total - sum(aciertos_antes.values())} -> {total - sum(aciertos_ahora.values())}")
+
+def crear_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeticiones", type=int, default=200, help="casos sintéticos por variante")
+    parser.add_argument("--corpus", help="JSONL con respuestas grabadas de Vision")
+    return parser
+
+if __name__ == "__main__":
+    principal(crear_parser().parse_args())
@@ -0,0 +1,72 @@
+"""
+Mensajes/segundo del trabajo local de un turno (extracción de datos, verificación
+de la sesión y actualización del contexto) con distintas configuraciones de logging.
+
+- apagado: solo WARNING y superiores
+- síncrono DEBUG: todos los registros de los hot paths formateados y escritos en el
+  hilo del bot, equivalente al volumen INFO que se emitía antes por turno
+- estructurado DEBUG: cola no bloqueante, JSON, redacción de PII y muestreo por evento
+- producción: nivel INFO con cola (configuración por defecto)
+
+Uso (desde src/):
+    python -m benchmarks.bench_logging --turnos 20000
+"""
+import argparse
+import logging
+import tempfile
+import time
+
+from core.session_manager import get_user_session, user_sessions
+from core.data_extractor import DataExtractor
+from core.structured_logging import configure_logging
+from handlers.intent_handler import IntentHandler
+
+MENSAJES = [
+    "Vivo en Medellín",
+    "Mi celular es 3001234567, gracias",
+    "Nací el 12 de marzo de 1985",
+    "Soy del régimen contributivo",
+    "Mi dirección: Calle 45 # 23-10, apartamento 301.",
+    "La farmacia: Cruz Verde del centro.",
+]
+
+ESCENARIOS = {
+    "apagado": {"level": "WARNING", "format": "text", "async": False, "redact_pii": False, "sampling": {}},
+    "síncrono DEBUG": {"level": "DEBUG", "format": "text", "async": False, "redact_pii": False, "sampling": {}},
+    "estructurado DEBUG": {
+        "level": "DEBUG", "format": "json", "async": True, "redact_pii": True,
+        "sampling": {"sesion.verificacion": 0.01, "contexto.actualizado": 0.1, "extraccion.limpieza": 0.1}
+    },
+    "producción": {"level": "INFO", "format": "text", "async": True, "redact_pii": True, "sampling": {}},
+}
+
+def medir(turnos: int, usuarios: int) -> float:
+    intent_handler = IntentHandler(openai_service=None)
+    user_sessions.clear()
+
+    inicio = time.perf_counter()
+    for turno in range(turnos):
+        user_session = get_user_session(str(turno % usuarios))
+        texto = MENSAJES[turno % len(MENSAJES)]
+        DataExtractor.extraer_datos_de_mensaje_usuario(texto, user_session)
+        intent_handler._verificar_informacion_completa(user_session)
+    return turnos / (time.perf_counter() - inicio)
+
+def principal(args) -> None:
+    resultados = {}
+    for nombre, config in ESCENARIOS.items():
+        with tempfile.TemporaryFile("w", encoding="utf-8") as salida:
+            listener = configure_logging(config, stream=salida)
+            resultados[nombre] = medir(args.turnos, args.usuarios)
+            if listener:
+                listener.stop()
+
+    base = resultados["apagado"]
+    for nombre, throughput in resultados.items():
+        print(f"{nombre:>20}: {throughput:10,.0f} mensajes/s ({throughput / base:.0%} del throughput sin logging)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turnos", type=int, default=20000)
+    parser.add_argument("--usuarios", type=int, default=500)
+    principal(parser.parse_args())
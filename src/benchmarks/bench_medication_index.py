@@ -0,0 +1,110 @@
+"""
+Costo por línea de la normalización de medicamentos con core.medication_index
+(bisección sobre el índice abierto con mmap) contra un recorrido lineal de todas
+las claves, que es lo que haría una búsqueda sin índice ordenado.
+
+Las líneas imitan la salida del OCR: nombres con y sin tildes, concentraciones,
+formas abreviadas y combinaciones; aparte se miden las que tienen errores de
+lectura ("LOSARTAM", "METFORMLNA"), que pasan por la búsqueda aproximada.
+Con --claves se agregan nombres sintéticos al índice para ver cómo escala con un
+catálogo del tamaño del listado completo de registros sanitarios.
+
+Uso (desde src/):
+    python -m benchmarks.bench_medication_index --lineas 50000
+    python -m benchmarks.bench_medication_index --claves 20000
+"""
+import argparse
+import os
+import random
+import string
+import tempfile
+import time
+
+from core import medication_index
+from core.medication_index import normalizar, normalizar_medicamento
+
+LINEAS = [
+    "LOSARTAN 50 MG TABLETA - 1 CADA 12 HORAS",
+    "METFORMINA 850 MG TAB #60",
+    "ATORVASTATINA 20MG 1 NOCHE",
+    "ACETAMINOFÉN 500 MG 1 CADA 8 HORAS SI HAY DOLOR",
+    "INSULINA GLARGINA 100 UI/ML 10 UI SC NOCHE",
+    "OMEPRAZOL 20 MG CAPSULA EN AYUNAS",
+    "Enalapril 10 mg 1 cada 12 h",
+    "LEVOTIROXINA 50 MCG AYUNAS",
+    "Losartán + Hidroclorotiazida 50/12,5 mg tab",
+    "AMOXICILINA + ACIDO CLAVULANICO 875/125 MG",
+    "SALBUTAMOL 100 MCG/DOSIS INHALADOR 2 PUFF",
+    "ESOMEPRAZOL 40 MG",
+]
+
+# Errores de OCR y líneas que no son medicamentos del índice
+APROXIMADAS = [
+    "LOSARTAM 50MG",
+    "METFORMLNA 1000 MG",
+    "ATORVASTATlNA 40 MG",
+    "CREMA HUMECTANTE USO EXTERNO",
+]
+
+def recorrido_lineal(linea: str):
+    """La clave más larga contenida en la línea, revisando todas las claves del índice"""
+    texto = " " + " ".join(normalizar(linea)) + " "
+    mejor = None
+    for clave, atc, principio in _CLAVES:
+        if f" {clave} " in texto and (mejor is None or len(clave) > len(mejor[0])):
+            mejor = (clave, atc, principio)
+    return mejor
+
+def medir(funcion, lineas, repeticiones: int) -> float:
+    inicio = time.perf_counter()
+    for indice in range(repeticiones):
+        funcion(lineas[indice % len(lineas)])
+    return (time.perf_counter() - inicio) / repeticiones * 1e6
+
+def indice_ampliado(claves: int, directorio: str) -> str:
+    """Fuente con nombres sintéticos adicionales, compilada a un índice temporal"""
+    rng = random.Random(7)
+    fuente = os.path.join(directorio, "medicamentos.tsv")
+    with open(medication_index.RUTA_FUENTE, encoding="utf-8") as original, open(fuente, "w", encoding="utf-8") as archivo:
+        archivo.write(original.read())
+        for numero in range(claves):
+            nombre = "".join(rng.choice(string.ascii_uppercase) for _ in range(rng.randint(6, 14)))
+            archivo.write(f"Z{numero:06d}\t{nombre}\t\n")
+    destino = os.path.join(directorio, "medicamentos.idx.tsv")
+    medication_index.construir_indice(fuente, destino)
+    return destino
+
+def principal(args) -> None:
+    global _CLAVES
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta = indice_ampliado(args.claves, directorio) if args.claves else medication_index.RUTA_INDICE
+        inicio = time.perf_counter()
+        medication_index._indice = medication_index.MedicationIndex(ruta)
+        print(f"Apertura del índice: {(time.perf_counter() - inicio) * 1e3:.2f} ms")
+        _CLAVES = medication_index.get_index().con_prefijo("", limite=10**7)
+
+        lineal = medir(recorrido_lineal, LINEAS, max(1, args.lineas // 20))
+        nuevo = medir(normalizar_medicamento, LINEAS, args.lineas)
+        aproximada = medir(normalizar_medicamento, APROXIMADAS, args.lineas)
+        print(f"Recorrido lineal ({len(_CLAVES)} claves): {lineal:9.2f} µs/línea")
+        print(f"Índice ordenado con mmap:     {nuevo:9.2f} µs/línea ({lineal / nuevo:.1f}x)")
+        print(f"Búsqueda aproximada (OCR):    {aproximada:9.2f} µs/línea")
+
+        sin_reconocer = 0
+        for linea in LINEAS + APROXIMADAS:
+            registro = normalizar_medicamento(linea)
+            sin_reconocer += registro["atc"] is None
+            if args.detalle:
+                print(f"  {linea!r:50} -> {medication_index.formatear(registro)} [{registro['confianza']}]")
+        print(f"Líneas sin reconocer: {sin_reconocer}/{len(LINEAS) + len(APROXIMADAS)}")
+        medication_index._indice = None
+
+def crear_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lineas", type=int, default=50000)
+    parser.add_argument("--claves", type=int, default=0, help="nombres sintéticos adicionales en el índice")
+    parser.add_argument("--detalle", action="store_true", help="muestra el registro de cada línea")
+    return parser
+
+if __name__ == "__main__":
+    principal(crear_parser().parse_args())
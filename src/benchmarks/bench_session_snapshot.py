@@ -0,0 +1,108 @@
+"""
+Instantáneas de sesiones (services.session_snapshot): escritura completa, escritura
+incremental con una fracción de sesiones modificadas, compactación y restauración con
+mmap, contra volcar y leer las mismas sesiones como un JSON.
+
+Uso (desde src/):
+    python -m benchmarks.bench_session_snapshot --sesiones 100000
+    python -m benchmarks.bench_session_snapshot --sesiones 100000 --modificadas 0.05 --dir /tmp/sesiones
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from config import get_session_snapshot_config
+from core import session_manager
+from core.conversation_history import ConversationHistory
+from services.session_snapshot import SessionSnapshot
+
+CIUDADES = ["Medellín", "Bogotá", "Cali", "Barranquilla", "Pereira", ""]
+
+def poblar(sesiones: int, rng: random.Random) -> None:
+    """Sesiones a medio llenar: fórmula leída, algunos datos y unos turnos de conversación"""
+    session_manager.user_sessions.clear()
+    for numero in range(sesiones):
+        user_id = str(100000 + numero)
+        data = session_manager.get_user_session(user_id)["data"]
+        data.update(
+            name="Usuario", consented=True, city=rng.choice(CIUDADES), cellphone="3001234567",
+            missing_meds="LOSARTAN 50 MG", formula_data={
+                "paciente": "PACIENTE DE PRUEBA", "numero_documento": str(10_000_000 + numero), "eps": "Sura",
+                "doctor": "DR. PRUEBA", "ips": "IPS Central", "diagnostico": "Hipertensión",
+                "medicamentos": ["LOSARTAN 50 MG TABLETA #30", "METFORMINA 850 MG TABLETA #60"],
+            },
+            conversation_history=ConversationHistory(
+                {"role": "user" if turno % 2 == 0 else "assistant", "content": "Mensaje de la conversación " * 3}
+                for turno in range(rng.randint(4, 15))
+            ),
+        )
+    session_manager.tomar_modificadas()
+
+async def medir(args) -> None:
+    rng = random.Random(11)
+    directorio = args.dir or tempfile.mkdtemp(prefix="sesiones-")
+    shutil.rmtree(directorio, ignore_errors=True)
+    config = dict(get_session_snapshot_config(), compact_after=10**9, max_age=10**9)
+
+    poblar(args.sesiones, rng)
+    instantanea = SessionSnapshot(directorio, config)
+
+    session_manager.marcar_pendientes(session_manager.user_sessions)
+    for user_id in session_manager.user_sessions:
+        session_manager.user_sessions[user_id]["version"] += 1
+    inicio = time.perf_counter()
+    await instantanea.guardar()
+    completa = time.perf_counter() - inicio
+    tamano = sum(os.path.getsize(os.path.join(directorio, nombre)) for nombre in os.listdir(directorio))
+    print(f"Instantánea completa:     {completa * 1000:8.0f} ms | {tamano / 1024 / 1024:.1f} MB "
+          f"({tamano / args.sesiones:.0f} bytes por sesión)")
+
+    cambiadas = rng.sample(list(session_manager.user_sessions), int(args.sesiones * args.modificadas))
+    for user_id in cambiadas:
+        session_manager.get_user_session(user_id)["data"]["pharmacy"] = "Cruz Verde"
+    inicio = time.perf_counter()
+    escritas = await instantanea.guardar()
+    incremental = time.perf_counter() - inicio
+    print(f"Instantánea incremental:  {incremental * 1000:8.0f} ms | {escritas} sesiones modificadas de {args.sesiones}")
+
+    inicio = time.perf_counter()
+    instantanea.compactar()
+    print(f"Compactación:             {(time.perf_counter() - inicio) * 1000:8.0f} ms")
+
+    inicio = time.perf_counter()
+    restauradas = SessionSnapshot(directorio, config).restaurar()
+    restauracion = time.perf_counter() - inicio
+    assert len(restauradas) == args.sesiones
+    assert all(restauradas[user_id]["data"]["pharmacy"] == "Cruz Verde" for user_id in cambiadas)
+    print(f"Restauración (mmap):      {restauracion * 1000:8.0f} ms | {args.sesiones / restauracion:,.0f} sesiones/s")
+
+    # Referencia: todas las sesiones en un solo JSON, reescrito completo en cada instantánea
+    ruta_json = os.path.join(directorio, "sesiones.json")
+    inicio = time.perf_counter()
+    with open(ruta_json, "w", encoding="utf-8") as archivo:
+        json.dump(session_manager.user_sessions, archivo, ensure_ascii=False, default=list)
+    escritura_json = time.perf_counter() - inicio
+    inicio = time.perf_counter()
+    with open(ruta_json, encoding="utf-8") as archivo:
+        json.load(archivo)
+    lectura_json = time.perf_counter() - inicio
+    print(f"JSON completo:            {escritura_json * 1000:8.0f} ms escritura | {lectura_json * 1000:.0f} ms lectura | "
+          f"{os.path.getsize(ruta_json) / 1024 / 1024:.1f} MB")
+
+    if not args.dir:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+def crear_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sesiones", type=int, default=100000)
+    parser.add_argument("--modificadas", type=float, default=0.01, help="fracción de sesiones que cambian entre instantáneas")
+    parser.add_argument("--dir", default=None, help="directorio de la instantánea; por defecto uno temporal")
+    return parser
+
+if __name__ == "__main__":
+    asyncio.run(medir(crear_parser().parse_args()))
@@ -0,0 +1,150 @@
+"""
+Mide el throughput del modo multi-worker con 1..N procesos por el camino de producción:
+el mismo WorkerSupervisor que usa main.py lanza main.ejecutar_worker, cada worker arma
+su TelegramHandler y recibe los updates como dict, igual que de handlers.shard_router.
+
+OpenAI y Telegram son los stand-ins HTTP del harness de carga (loadtest), que corren en
+este proceso con las latencias indicadas; cada worker guarda en un
+loadtest.fake_bigquery propio. Cada usuario sigue el guion de loadtest.run (foto,
+consentimiento, datos y despedida) y manda su siguiente mensaje cuando le llega la
+respuesta del anterior. Como en loadtest.run, la cola de salida casi no limita (1000
+mensajes/s del bot, 20 por chat): con los límites reales de Telegram se mediría la cola
+y no los workers. Al final se cuentan las quejas guardadas en el historial local
+que comparten los workers; sale con código 1 si falta alguna.
+
+Uso (desde src/):
+    python -m benchmarks.bench_sharding --usuarios 200 --concurrencia 50 --workers 1,2,4
+    python -m benchmarks.bench_sharding --chat-latencia 0 --vision-latencia 0   # solo CPU del bot
+"""
+import argparse
+import asyncio
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from config import get_api_config
+from core.sharding import WorkerSupervisor
+from loadtest.fake_bigquery import FakeBigQueryClient
+from loadtest.fake_openai import FakeOpenAIServer
+from loadtest.fake_telegram import FakeTelegramServer
+from loadtest.run import GUION, TOKEN, SimuladorUsuarios, percentil
+from main import ejecutar_worker
+from services.bigquery_service import GUARDADA
+from services.history_store import HistoryStore
+
+class Usuarios(SimuladorUsuarios):
+    """Los usuarios del harness de carga, pero del otro lado del receptor: sus updates van a la cola de un worker"""
+
+    def __init__(self, supervisor: WorkerSupervisor, telegram: FakeTelegramServer):
+        super().__init__(application=None, telegram=telegram)
+        self.supervisor = supervisor
+
+    async def enviar(self, user_id: int, tipo: str, texto: str = None) -> float:
+        """Envía un mensaje y espera la respuesta del bot; devuelve la latencia"""
+        enviados = len(self.telegram.sent[user_id])
+        inicio = time.perf_counter()
+        self.supervisor.dispatch(user_id, self._update(user_id, tipo, texto))
+        while len(self.telegram.sent[user_id]) == enviados:
+            await asyncio.sleep(0.005)
+        return time.perf_counter() - inicio
+
+    async def conversar(self, user_id: int, latencias: List[float]) -> None:
+        for tipo, texto in GUION:
+            latencias.append(await self.enviar(user_id, tipo, texto))
+
+async def medir(num_workers: int, args) -> Dict[str, Any]:
+    directorio = tempfile.mkdtemp(prefix="bench-sharding-")
+    fake_openai = await FakeOpenAIServer(chat_latency=args.chat_latencia, vision_latency=args.vision_latencia).start()
+    fake_telegram = await FakeTelegramServer(token=TOKEN, photo_bytes=args.foto_kb * 1024).start()
+
+    # Los workers (spawn) heredan el ambiente: stand-ins, historial y sesiones en el directorio temporal
+    os.environ.update({
+        "OPENAI_BASE_URL": fake_openai.base_url,
+        "HISTORY_DB_PATH": os.path.join(directorio, "historial.db"),
+        "SESSION_SNAPSHOT_DIR": os.path.join(directorio, "sesiones"),
+        "LOG_LEVEL": "ERROR",
+        "TELEGRAM_GLOBAL_RATE": str(args.telegram_tasa_global),
+        "TELEGRAM_CHAT_RATE": str(args.telegram_tasa_chat),
+    })
+    config = dict(
+        get_api_config(),
+        telegram_token=TOKEN,
+        telegram_base_url=fake_telegram.base_url,
+        telegram_base_file_url=fake_telegram.base_file_url,
+        openai_api_key="sk-loadtest",
+        bigquery_project_id="loadtest",
+    )
+    supervisor = WorkerSupervisor(num_workers, ejecutar_worker, args=(config, FakeBigQueryClient))
+    supervisor.start()
+    usuarios = Usuarios(supervisor, fake_telegram)
+    loop = asyncio.get_running_loop()
+
+    try:
+        # Un mensaje por worker antes de medir: no se cuenta el arranque de spawn ni las importaciones
+        calentamiento, user_id = {}, 1
+        while len(calentamiento) < num_workers:
+            calentamiento.setdefault(supervisor.worker_for(user_id), user_id)
+            user_id += 1
+        await asyncio.gather(*(usuarios.enviar(user_id, "text", "hola") for user_id in calentamiento.values()))
+
+        latencias: List[float] = []
+        semaforo = asyncio.Semaphore(args.concurrencia)
+
+        async def con_limite(user_id: int) -> None:
+            async with semaforo:
+                await usuarios.conversar(user_id, latencias)
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(con_limite(100000 + indice) for indice in range(args.usuarios)))
+        duracion = time.perf_counter() - inicio
+    finally:
+        # stop() espera a los workers, que al salir todavía envían a los stand-ins de este loop
+        await loop.run_in_executor(None, supervisor.stop)
+        await fake_openai.stop()
+        await fake_telegram.stop()
+
+    store = HistoryStore(os.environ["HISTORY_DB_PATH"])
+    guardadas = sum(len(bloque) for bloque in store.iterar(0, GUARDADA, 10000))
+    store.close()
+    shutil.rmtree(directorio, ignore_errors=True)
+    return {
+        "turnos_por_segundo": len(latencias) / duracion,
+        "p50": percentil(latencias, 0.5),
+        "p95": percentil(latencias, 0.95),
+        "guardadas": guardadas,
+    }
+
+async def principal(args) -> int:
+    base = None
+    faltantes = 0
+    for num_workers in [int(valor) for valor in args.workers.split(",")]:
+        if num_workers > os.cpu_count():
+            print(f"Aviso: {num_workers} workers con {os.cpu_count()} núcleos, no se espera escalado lineal")
+        resultado = await medir(num_workers, args)
+        base = base or resultado["turnos_por_segundo"]
+        faltantes += args.usuarios - resultado["guardadas"]
+        print(f"{num_workers} workers: {resultado['turnos_por_segundo']:,.1f} turnos/s "
+              f"(x{resultado['turnos_por_segundo'] / base:.2f}) | p50 {resultado['p50'] * 1000:.0f} ms | "
+              f"p95 {resultado['p95'] * 1000:.0f} ms | quejas {resultado['guardadas']}/{args.usuarios}")
+    return 1 if faltantes else 0
+
+def crear_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--usuarios", type=int, default=200)
+    parser.add_argument("--concurrencia", type=int, default=50, help="usuarios conversando a la vez")
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--chat-latencia", type=float, default=0.05, help="segundos por completion de chat")
+    parser.add_argument("--vision-latencia", type=float, default=0.3, help="segundos por llamada de Vision")
+    parser.add_argument("--foto-kb", type=int, default=300)
+    parser.add_argument("--telegram-tasa-global", type=float, default=1000.0, help="TELEGRAM_GLOBAL_RATE de los workers")
+    parser.add_argument("--telegram-tasa-chat", type=float, default=20.0, help="TELEGRAM_CHAT_RATE de los workers")
+    return parser
+
+if __name__ == "__main__":
+    # main ya configuró el logging en INFO al importarse
+    logging.getLogger().setLevel(logging.WARNING)
+    sys.exit(asyncio.run(principal(crear_parser().parse_args())))
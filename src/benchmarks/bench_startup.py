@@ -0,0 +1,143 @@
+"""
+Tiempo de arranque en frío: importación de main (con un reporte al estilo de
+`python -X importtime`), tiempo hasta que el bot hace polling y hasta que las
+dependencias quedan verificadas.
+
+Cada medición corre en un intérprete nuevo contra los stand-ins de loadtest. En modo
+"diferido" (el de main) el bot empieza a hacer polling enseguida y las verificaciones
+de OpenAI y BigQuery corren en paralelo en segundo plano; en modo "serial"
+se importan los clientes y se verifican una por una antes de arrancar, como antes.
+
+Uso (desde src/):
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --latencia-bigquery 2 --latencia-openai 0.5
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+def _medir_hijo(args) -> None:
+    """Corre dentro del intérprete nuevo e imprime los tiempos en JSON"""
+    import asyncio
+    import logging
+
+    logging.disable(logging.WARNING)
+    importado = time.perf_counter()
+    import main  # noqa: F401
+    import_main = time.perf_counter() - importado
+
+    async def arrancar():
+        from loadtest.fake_bigquery import FakeBigQueryClient
+        from loadtest.fake_openai import FakeOpenAIServer
+        from loadtest.fake_telegram import FakeTelegramServer
+
+        fake_openai = await FakeOpenAIServer(chat_latency=args.latencia_openai, jitter=0).start()
+        fake_telegram = await FakeTelegramServer(token="123456:FAKE").start()
+        os.environ["OPENAI_BASE_URL"] = fake_openai.base_url
+
+        from core.executor import run_blocking
+        from core.readiness import verificar_dependencias
+        from handlers.telegram_handler import TelegramHandler
+        from services.bigquery_service import BigQueryService
+        from services.history_store import HistoryStore
+        from services.image_processor import ImageProcessor
+        from services.llm_gateway import LLMGateway
+        from services.openai_service import OpenAIService
+
+        inicio = time.perf_counter()
+        llm_gateway = LLMGateway(api_key="sk-bench")
+        openai_service = OpenAIService(api_key="sk-bench", gateway=llm_gateway)
+        image_processor = ImageProcessor(api_key="sk-bench", gateway=llm_gateway)
+        bigquery_service = BigQueryService(project_id="bench", dataset_id="bench", table_id="quejas",
+                                           client=FakeBigQueryClient(latency=args.latencia_bigquery),
+                                           history_store=HistoryStore(":memory:"))
+        verificaciones = {
+            "openai": openai_service.verificar_conexion,
+            "bigquery": bigquery_service.verificar_conexion,
+        }
+        if args.modo == "serial":
+            # Como antes: los imports pesados y cada verificación, en orden, antes del polling.
+            # Van al pool de hilos solo porque los stand-ins comparten este event loop
+            import google.cloud.bigquery  # noqa: F401
+            for verificacion in verificaciones.values():
+                await run_blocking(verificacion)
+
+        handler = TelegramHandler("123456:FAKE", openai_service, image_processor, bigquery_service,
+                                  base_url=f"{fake_telegram.url}/bot", base_file_url=f"{fake_telegram.url}/file/bot")
+        application = handler.setup_telegram_bot()
+        await application.initialize()
+        await application.start()
+        await application.updater.start_polling()
+        polling = time.perf_counter() - inicio
+
+        if args.modo == "diferido":
+            await verificar_dependencias(verificaciones, reintento=0)
+        listo = time.perf_counter() - inicio
+
+        await application.updater.stop()
+        await application.stop()
+        await application.shutdown()
+        await fake_openai.stop()
+        await fake_telegram.stop()
+        return polling, listo
+
+    polling, listo = asyncio.run(arrancar())
+    print(json.dumps({"import_main": import_main, "polling": polling, "listo": listo}))
+
+def _ejecutar(argumentos) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, *argumentos], capture_output=True, text=True, check=True,
+                          cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def reporte_importtime(top: int) -> None:
+    """Módulos de primer nivel que más tardan al importar main (tiempo acumulado)"""
+    salida = _ejecutar(["-X", "importtime", "-c", "import main"]).stderr
+    filas = []
+    for linea in salida.splitlines():
+        coincidencia = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)", linea)
+        if coincidencia and len(coincidencia.group(3)) <= 3:
+            filas.append((int(coincidencia.group(2)), coincidencia.group(4)))
+    total = next((acumulado for acumulado, modulo in filas if modulo == "main"), 0)
+    print(f"import main: {total / 1000:.0f} ms")
+    for acumulado, modulo in sorted((f for f in filas if f[1] != "main"), reverse=True)[:top]:
+        print(f"  {modulo:<32} {acumulado / 1000:7.1f} ms")
+    diferidos = _ejecutar(["-X", "importtime", "-c", "import openai, google.cloud.bigquery, requests"]).stderr
+    for modulo in ("openai", "google.cloud.bigquery", "requests"):
+        coincidencia = re.search(rf"\|\s+(\d+) \| {re.escape(modulo)}$", diferidos, re.M)
+        if coincidencia:
+            print(f"  diferido: {modulo:<22} {int(coincidencia.group(1)) / 1000:7.1f} ms")
+
+def principal(args) -> None:
+    reporte_importtime(args.top)
+    print()
+    for modo in ("serial", "diferido"):
+        tiempos = []
+        for _ in range(args.repeticiones):
+            salida = _ejecutar(["-m", "benchmarks.bench_startup", "--hijo", "--modo", modo,
+                                "--latencia-openai", str(args.latencia_openai),
+                                "--latencia-bigquery", str(args.latencia_bigquery)]).stdout
+            tiempos.append(json.loads(salida.strip().splitlines()[-1]))
+        mejor = min(tiempos, key=lambda t: t["polling"])
+        print(f"{modo:<9} import main {mejor['import_main'] * 1000:6.0f} ms | "
+              f"polling en {mejor['polling'] * 1000:6.0f} ms | dependencias listas en {mejor['listo'] * 1000:6.0f} ms "
+              f"(desde el inicio del proceso: {(mejor['import_main'] + mejor['polling']) * 1000:.0f} ms hasta el polling)")
+
+def crear_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latencia-openai", type=float, default=0.3, help="segundos de la verificación de OpenAI")
+    parser.add_argument("--latencia-bigquery", type=float, default=1.0, help="segundos del get_table de BigQuery")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--top", type=int, default=8, help="módulos a listar en el reporte de importtime")
+    parser.add_argument("--modo", choices=("serial", "diferido"), default="diferido")
+    parser.add_argument("--hijo", action="store_true", help=argparse.SUPPRESS)
+    return parser
+
+if __name__ == "__main__":
+    argumentos = crear_parser().parse_args()
+    if argumentos.hijo:
+        _medir_hijo(argumentos)
+    else:
+        principal(argumentos)
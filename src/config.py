@@ -23,14 +23,209 @@ WELCOME_MESSAGE = "¡Hola! 👋 Bienvenido a *No Me Entregaron*. \n\nSoy tu asis
 MENSAJE_CONSENTIMIENTO = "Para leer tu fórmula y ayudarte, necesito tu autorización. ¿Me autorizas a procesar tus datos para tramitar la queja? (Responde sí o no) 📝"
 MENSAJE_FORMULA_MAL_LEIDA = "No pude leer bien la fórmula. 🔍❌ ¿Podrías enviarme una foto más clara por favor? Necesito que la imagen esté bien iluminada y enfocada. 📸✨"
 MENSAJE_FORMULA_PERDIDA = "Entiendo que no tienes la fórmula médica en este momento. 📋❓\n\nEstas son algunas opciones que puedes considerar:\n• Solicitar un duplicado directamente en tu EPS 🏥\n• Consultar tu historial médico en la página web de tu EPS (muchas permiten descargar fórmulas anteriores) 💻\n• Contactar a tu médico tratante para que te genere una nueva fórmula 👨‍⚕️\n\n¿Te gustaría más información sobre alguna de estas alternativas? También puedes escribirme cuando tengas la fórmula y te ayudaré con gusto. 🤝"
+MENSAJE_FORMULA_RECIBIDA = "📋 Recibí tu fórmula, dame un momento mientras la leo... 🔍"
 MENSAJE_SOLICITUD_FORMULA = "Para ayudarte con tu queja, necesito que me envíes una foto clara de tu fórmula médica. 📋📸"
+MENSAJE_REINICIO = "Listo, empecemos de nuevo. 🔄 Envíame una foto clara de la fórmula médica de los medicamentos que no te entregaron. 📋📸"
+MENSAJE_AYUDA = "Te ayudo a radicar una queja cuando tu EPS no te entrega los medicamentos. 💊\n\nPara continuar necesito: {campos_faltantes}.\n\nSi quieres empezar de nuevo escribe /reset. 🔄"
+MENSAJE_CONSENTIMIENTO_NEGADO = "Entiendo, respeto tu decisión. 🙏 Sin tu autorización no puedo procesar la fórmula, así que no guardé ningún dato. Si cambias de opinión, envíame de nuevo la foto y con gusto te ayudo. 📋"
 
 def get_api_config():
     return {
         "telegram_token": os.getenv('TELEGRAM_TOKEN'),
+        "telegram_base_url": os.getenv('TELEGRAM_BASE_URL'),
+        "telegram_base_file_url": os.getenv('TELEGRAM_BASE_FILE_URL'),
         "openai_api_key": os.getenv('OPENAI_API_KEY'),
         "bigquery_project_id": os.getenv('BIGQUERY_PROJECT_ID'),
         "bigquery_dataset_id": os.getenv('BIGQUERY_DATASET_ID', 'solutions2pharma_data'),
         "bigquery_table_id": os.getenv('BIGQUERY_TABLE_ID', 'quejas'),
         "google_credentials_path": os.getenv('GOOGLE_CREDENTIALS_PATH')
-    }
\ No newline at end of file
+    }
+
+def get_worker_config():
+    return {
+        "workers": int(os.getenv('BOT_WORKERS', '1')),
+        "restart_delay": float(os.getenv('BOT_WORKER_RESTART_DELAY', '1.0')),
+        # Updates que un proceso atiende a la vez; los de un mismo usuario van siempre en orden
+        "concurrent_updates": int(os.getenv('BOT_CONCURRENT_UPDATES', '128'))
+    }
+
+def get_executor_config():
+    return {
+        # "thread" o "process"; el pool de procesos evita el GIL a cambio de copiar los datos
+        "kind": os.getenv('CPU_EXECUTOR', 'thread'),
+        "cpu_workers": int(os.getenv('CPU_EXECUTOR_WORKERS', str(min(4, os.cpu_count() or 1)))),
+        "io_workers": int(os.getenv('IO_EXECUTOR_WORKERS', '32'))
+    }
+
+def get_metrics_config():
+    return {
+        "enabled": os.getenv('METRICS_ENABLED', 'false').lower() in ('1', 'true', 'si', 'sí'),
+        "host": os.getenv('METRICS_HOST', '127.0.0.1'),
+        # 0 desactiva el endpoint /metrics; en modo multi-worker cada worker usa puerto + índice + 1
+        "port": int(os.getenv('METRICS_PORT', '0')),
+        "log_interval": float(os.getenv('METRICS_LOG_INTERVAL', '60')),
+        "loop_lag_interval": float(os.getenv('METRICS_LOOP_LAG_INTERVAL', '0.5'))
+    }
+
+def get_llm_config():
+    return {
+        # Un solo pool keep-alive para chat y Vision
+        "max_connections": int(os.getenv('LLM_MAX_CONNECTIONS', '32')),
+        "keepalive_expiry": float(os.getenv('LLM_KEEPALIVE_EXPIRY', '30')),
+        # Llamadas simultáneas en total y por ruta
+        "max_concurrency": int(os.getenv('LLM_MAX_CONCURRENCY', '32')),
+        "chat_concurrency": int(os.getenv('LLM_CHAT_CONCURRENCY', '24')),
+        "vision_concurrency": int(os.getenv('LLM_VISION_CONCURRENCY', '8')),
+        "chat_timeout": float(os.getenv('LLM_CHAT_TIMEOUT', '60')),
+        "vision_timeout": float(os.getenv('LLM_VISION_TIMEOUT', '120')),
+        "max_retries": int(os.getenv('LLM_MAX_RETRIES', '3')),
+        "backoff_base": float(os.getenv('LLM_BACKOFF_BASE', '0.5')),
+        "backoff_max": float(os.getenv('LLM_BACKOFF_MAX', '20')),
+        # Fallos seguidos que abren el circuito y segundos que permanece abierto
+        "breaker_failures": int(os.getenv('LLM_BREAKER_FAILURES', '5')),
+        "breaker_cooldown": float(os.getenv('LLM_BREAKER_COOLDOWN', '30')),
+        # Cobertura: tope del p95 tras el que se duplica una llamada lenta (0 la desactiva)
+        "hedge_chat_after": float(os.getenv('LLM_HEDGE_CHAT_AFTER', '8')),
+        "hedge_vision_after": float(os.getenv('LLM_HEDGE_VISION_AFTER', '30')),
+        "hedge_min": float(os.getenv('LLM_HEDGE_MIN', '1')),
+        # Plazo de un turno de chat: vencido, se responde con una plantilla local
+        "chat_deadline": float(os.getenv('LLM_CHAT_DEADLINE', '25'))
+    }
+
+def _parse_lista(valor):
+    return [parte.strip() for parte in valor.split(",") if parte.strip()]
+
+def _parse_precios(valor):
+    # "o4-mini=1.10/4.40,gpt-4o-mini=0.15/0.60": USD por millón de tokens de entrada/salida
+    precios = {}
+    for parte in _parse_lista(valor):
+        if "=" not in parte or "/" not in parte:
+            continue
+        modelo, costos = parte.split("=", 1)
+        entrada, salida = costos.split("/", 1)
+        try:
+            precios[modelo.strip()] = (float(entrada), float(salida))
+        except ValueError:
+            logger.warning(f"Precio inválido en MODEL_PRICES: {parte}")
+    return precios
+
+def get_model_routing_config():
+    return {
+        "enabled": os.getenv('MODEL_ROUTING', 'true').lower() in ('1', 'true', 'si', 'sí'),
+        # Cada nivel es una lista: el primer modelo y, si falla, los siguientes en orden
+        "tiers": {
+            "rapido": _parse_lista(os.getenv('MODEL_TIER_RAPIDO', 'gpt-4o-mini,o4-mini')),
+            "razonamiento": _parse_lista(os.getenv('MODEL_TIER_RAZONAMIENTO', 'o4-mini')),
+            "vision": _parse_lista(os.getenv('MODEL_TIER_VISION', 'o4-mini')),
+        },
+        # Mensajes más largos que esto van al modelo de razonamiento
+        "max_chars": int(os.getenv('MODEL_ROUTING_MAX_CHARS', '80')),
+        "prices": _parse_precios(os.getenv('MODEL_PRICES', 'o4-mini=1.10/4.40,gpt-4o-mini=0.15/0.60'))
+    }
+
+def get_response_cache_config():
+    return {
+        "enabled": os.getenv('RESPONSE_CACHE', 'true').lower() in ('1', 'true', 'si', 'sí'),
+        "size": int(os.getenv('RESPONSE_CACHE_SIZE', '2000')),
+        "ttl": float(os.getenv('RESPONSE_CACHE_TTL', '86400')),
+        # Similitud de Jaccard (trigramas de caracteres) mínima para reutilizar una respuesta
+        "threshold": float(os.getenv('RESPONSE_CACHE_THRESHOLD', '0.6')),
+        # Mensajes más largos no se tratan como preguntas frecuentes
+        "max_chars": int(os.getenv('RESPONSE_CACHE_MAX_CHARS', '160'))
+    }
+
+def get_outbound_config():
+    return {
+        # Telegram admite unos 30 mensajes por segundo por bot y cerca de 1 por segundo por chat;
+        # tasa + ráfaga quedan por debajo de 30 en cualquier segundo
+        "global_rate": float(os.getenv('TELEGRAM_GLOBAL_RATE', '25')),
+        "global_burst": float(os.getenv('TELEGRAM_GLOBAL_BURST', '5')),
+        "chat_rate": float(os.getenv('TELEGRAM_CHAT_RATE', '1')),
+        "chat_burst": float(os.getenv('TELEGRAM_CHAT_BURST', '3')),
+        "senders": int(os.getenv('TELEGRAM_SENDERS', '8')),
+        "max_retries": int(os.getenv('TELEGRAM_SEND_RETRIES', '5')),
+        # Por encima de esta cantidad de chats se descartan los buckets sin uso reciente
+        "max_chats": int(os.getenv('TELEGRAM_MAX_CHAT_BUCKETS', '10000'))
+    }
+
+def get_startup_config():
+    return {
+        # Las verificaciones de OpenAI y BigQuery corren en segundo plano; el bot no las espera
+        "healthcheck_timeout": float(os.getenv('HEALTHCHECK_TIMEOUT', '10')),
+        # Segundos entre reintentos de una dependencia caída (0 no reintenta)
+        "healthcheck_retry": float(os.getenv('HEALTHCHECK_RETRY_INTERVAL', '30'))
+    }
+
+def get_shutdown_config():
+    return {
+        # Tras SIGTERM/SIGINT: segundos para terminar los mensajes en curso, ya sin recibir nuevos
+        "drain_timeout": float(os.getenv('SHUTDOWN_DRAIN_TIMEOUT', '15')),
+        # Segundos para guardar las quejas completas pendientes y vaciar la cola de salida;
+        # la suma queda por debajo de los 30 s que suelen esperar Docker y Kubernetes
+        "flush_timeout": float(os.getenv('SHUTDOWN_FLUSH_TIMEOUT', '10'))
+    }
+
+def get_session_snapshot_config():
+    return {
+        "enabled": os.getenv('SESSION_SNAPSHOT', 'true').lower() in ('1', 'true', 'si', 'sí'),
+        # En modo multi-worker cada worker escribe en su subdirectorio worker-N
+        "dir": os.getenv('SESSION_SNAPSHOT_DIR', 'sesiones'),
+        # Segundos entre instantáneas: es lo máximo que se pierde si el proceso muere sin parada ordenada
+        "interval": float(os.getenv('SESSION_SNAPSHOT_INTERVAL', '5')),
+        # Deltas acumulados antes de fundirlos con la base
+        "compact_after": int(os.getenv('SESSION_SNAPSHOT_COMPACT_AFTER', '60')),
+        # Las sesiones sin actividad en este tiempo (segundos) no se restauran
+        "max_age": float(os.getenv('SESSION_SNAPSHOT_MAX_AGE', '172800'))
+    }
+
+def get_photo_config():
+    return {
+        # Segundos sin páginas nuevas para dar por completo un álbum (media_group_id)
+        "album_wait": float(os.getenv('ALBUM_WAIT', '1.0')),
+        "album_max_pages": int(os.getenv('ALBUM_MAX_PAGES', '10'))
+    }
+
+def get_conversation_config():
+    return {
+        # Mensajes que conserva el historial de cada sesión; los más viejos se descartan.
+        # Con la ventana de 15 más la respuesta es lo mismo que quedaba tras cada turno
+        "capacity": int(os.getenv('CONVERSATION_HISTORY_SIZE', '16')),
+        # Mensajes recientes que se envían al modelo en cada turno
+        "window": int(os.getenv('CONVERSATION_WINDOW', '15'))
+    }
+
+def get_history_config():
+    return {
+        # SQLite con el historial de quejas guardadas; ':memory:' lo deja solo en el proceso
+        "path": os.getenv('HISTORY_DB_PATH', 'historial_quejas.db'),
+        # Días en los que una queja por el mismo medicamento se considera repetida
+        "repeat_window_days": int(os.getenv('REPEAT_COMPLAINT_DAYS', '30'))
+    }
+
+# Mensajes que se responden con plantillas locales en lugar de una llamada al LLM
+PLANTILLAS_DISPONIBLES = "reinicio,ayuda,formula_perdida,consentimiento_negado,error_imagen,historial"
+
+def get_templates_config():
+    valor = os.getenv('LOCAL_TEMPLATES', PLANTILLAS_DISPONIBLES).strip().lower()
+    if valor in ('', 'none', 'ninguna'):
+        return {"locales": frozenset()}
+    return {"locales": frozenset(p.strip() for p in valor.split(",") if p.strip())}
+
+def _parse_sampling(valor):
+    # Convierte 'evento=0.1,otro=0' en {'evento': 0.1, 'otro': 0.0}
+    tasas = {}
+    for parte in filter(None, (p.strip() for p in valor.split(","))):
+        evento, _, tasa = parte.partition("=")
+        tasas[evento.strip()] = float(tasa or 1)
+    return tasas
+
+def get_logging_config():
+    return {
+        "level": os.getenv('LOG_LEVEL', 'INFO').upper(),
+        # "text" conserva el formato de siempre; "json" emite un objeto por línea
+        "format": os.getenv('LOG_FORMAT', 'text'),
+        "async": os.getenv('LOG_ASYNC', 'true').lower() in ('1', 'true', 'si', 'sí'),
+        "redact_pii": os.getenv('LOG_REDACT_PII', 'true').lower() in ('1', 'true', 'si', 'sí'),
+        # Tasas por evento, p. ej. "contexto.actualizado=0.1,sesion.verificacion=0.01"
+        "sampling": _parse_sampling(os.getenv('LOG_SAMPLING', ''))
+    }
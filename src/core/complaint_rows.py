@@ -0,0 +1,119 @@
+import logging
+import re
+from typing import Any, Dict, Iterable, List, Optional
+
+from core.date_parser import parsear_fecha
+from core.medication_index import cruzar_menciones, formatear, menciones, normalizar_medicamento
+
+logger = logging.getLogger(__name__)
+
+NO_DISPONIBLE = "No disponible"
+
+# Reglas de limpieza, compiladas una sola vez
+_FARMACIA_RUIDO = re.compile(r'donde.*te|y la sede donde|donde no te|sede|y\s+debían|debían', re.I)
+_CIUDADES_INVALIDAS = frozenset(["contributivo", "subsidiado", "ese fue"])
+_FARMACIAS_INVALIDAS = frozenset(["y", "la", "el", "los", "las", "donde"])
+_VALORES_INVALIDOS = frozenset(["y", "la", "el", "los", "las"])
+
+# Columnas de la fila que la tabla no tiene y ya se advirtieron (una vez por proceso, no
+# en cada inserción mientras no se corra la migración del esquema)
+_descartadas_avisadas: set = set()
+
+def formatear_fecha(fecha: Optional[str]) -> Optional[str]:
+    """'5/3/2024', '5 de marzo de 2024' -> '2024-03-05'; None si no es una fecha válida"""
+    # La fórmula es reciente: una fecha de atención sin año es de este año
+    fecha = parsear_fecha(fecha, requiere_anio=False)
+    return fecha.isoformat() if fecha else None
+
+def limpiar_ciudad(city: str) -> str:
+    return NO_DISPONIBLE if city.lower() in _CIUDADES_INVALIDAS else city
+
+def limpiar_farmacia(pharmacy: str) -> str:
+    pharmacy = _FARMACIA_RUIDO.sub('', pharmacy).strip()
+    return NO_DISPONIBLE if not pharmacy or pharmacy.lower() in _FARMACIAS_INVALIDAS else pharmacy
+
+def _normalizados(formula_data: Dict[str, Any], memo: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # Las sesiones anteriores al índice de medicamentos no traen la lista normalizada
+    normalizados = formula_data.get("medicamentos_normalizados")
+    if normalizados is not None:
+        return normalizados
+    resultado = []
+    for linea in formula_data.get("medicamentos", []):
+        if not linea or linea.startswith("No se detectaron"):
+            continue
+        registro = memo.get(linea)
+        if registro is None:
+            registro = memo[linea] = normalizar_medicamento(linea)
+        resultado.append(registro)
+    return resultado
+
+def build_complaint_rows(sessions: Iterable[Dict[str, Any]], schema_fields: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Filas de la tabla de quejas para muchas sesiones a la vez, sin I/O. Recibe los
+    `data` de las sesiones (con queja_actual['id'] asignado). Con schema_fields deja
+    solo esas columnas y reemplaza los valores vacíos por "No disponible", como se
+    insertan en BigQuery. La usan save_user_data y backfill.py.
+    """
+    columnas = frozenset(schema_fields) if schema_fields is not None else None
+    conservadas = descartadas = None
+    # Las líneas de medicamentos y las respuestas ("ninguno", "el losartán") se repiten
+    # mucho entre quejas: se resuelven contra el índice una vez por lote
+    memo: Dict[str, Dict[str, Any]] = {}
+    memo_menciones: Dict[str, Any] = {}
+    memo_fechas: Dict[Optional[str], Optional[str]] = {}
+    filas = []
+
+    for user_data in sessions:
+        formula_data = user_data.get("formula_data") or {}
+        normalizados = _normalizados(formula_data, memo)
+        texto = user_data.get("missing_meds", "")
+        if texto not in memo_menciones:
+            memo_menciones[texto] = menciones(texto)
+        faltantes = cruzar_menciones(memo_menciones[texto], normalizados)
+        fecha = formula_data.get("fecha_atencion")
+        if fecha not in memo_fechas:
+            memo_fechas[fecha] = formatear_fecha(fecha)
+
+        row = {
+            "PK": user_data["queja_actual"]["id"],
+            "tipo_documento": formula_data.get("tipo_documento", NO_DISPONIBLE),
+            "numero_documento": formula_data.get("numero_documento", NO_DISPONIBLE),
+            "paciente": formula_data.get("paciente", NO_DISPONIBLE),
+            "fecha_atencion": memo_fechas[fecha],
+            "eps": formula_data.get("eps", NO_DISPONIBLE),
+            "doctor": formula_data.get("doctor", NO_DISPONIBLE),
+            "ips": formula_data.get("ips", NO_DISPONIBLE),
+            "diagnostico": formula_data.get("diagnostico", NO_DISPONIBLE),
+            "medicamentos": ", ".join(formula_data.get("medicamentos", [])) or NO_DISPONIBLE,
+            "image_url": "",
+            "no_entregado": user_data.get("missing_meds", "No especificado"),
+            "medicamentos_normalizados": "; ".join(formatear(r) for r in normalizados) or NO_DISPONIBLE,
+            "no_entregado_normalizado": "; ".join(formatear(r) for r in faltantes) or "No especificado",
+            "fecha_nacimiento": user_data.get("birth_date", NO_DISPONIBLE),
+            "telefono": user_data.get("cellphone", user_data.get("user_id", NO_DISPONIBLE)),
+            "regimen": user_data.get("affiliation_regime", NO_DISPONIBLE),
+            "municipio": limpiar_ciudad(user_data.get("city", "")),
+            "direccion": user_data.get("residence_address", "No proporcionada"),
+            "farmacia": limpiar_farmacia(user_data.get("pharmacy", "")),
+        }
+
+        if columnas is not None:
+            if conservadas is None:
+                # Todas las filas tienen las mismas claves: el filtro se calcula con la primera
+                conservadas = [campo for campo in row if campo in columnas]
+                descartadas = set(row) - columnas
+            depurada = {}
+            for campo in conservadas:
+                valor = row[campo]
+                if isinstance(valor, str):
+                    limpio = valor.strip()
+                    if not limpio or limpio in _VALORES_INVALIDOS:
+                        valor = NO_DISPONIBLE
+                depurada[campo] = valor
+            row = depurada
+        filas.append(row)
+
+    if descartadas and not descartadas <= _descartadas_avisadas:
+        _descartadas_avisadas.update(descartadas)
+        logger.warning(f"Se filtraron campos que no existen en el esquema: {descartadas}")
+    return filas
@@ -0,0 +1,97 @@
+"""
+Historial de conversación de capacidad fija. Antes era una lista que ask_openai
+recortaba ([-15:]), ampliaba y reasignaba en cada turno, y que los comandos y las
+plantillas seguían ampliando sin límite entre turnos. Aquí es un buffer circular de
+tamaño fijo: agregar es O(1) y sin copias, los mensajes más viejos se sobrescriben y
+la ventana que va al modelo se recorre sobre el mismo buffer.
+"""
+import sys
+from itertools import chain, islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+
+from config import get_conversation_config
+
+Mensaje = Dict[str, Any]
+
+# Un solo objeto por rol en todos los mensajes, también en los que vienen de una instantánea
+ROLES = {rol: sys.intern(rol) for rol in ("system", "user", "assistant")}
+
+_config: Optional[Dict[str, Any]] = None
+
+def get_config() -> Dict[str, Any]:
+    global _config
+    if _config is None:
+        _config = get_conversation_config()
+    return _config
+
+class ConversationHistory:
+    """
+    Buffer circular de mensajes {'role', 'content'} sobre una lista de tamaño fijo;
+    `total` cuenta también los mensajes ya descartados.
+    """
+    __slots__ = ("_mensajes", "_inicio", "_largo", "total")
+
+    def __init__(self, mensajes: Iterable[Mensaje] = (), capacidad: Optional[int] = None):
+        self._mensajes: List[Optional[Mensaje]] = [None] * (capacidad or get_config()["capacity"])
+        self._inicio = 0
+        self._largo = 0
+        self.total = 0
+        for mensaje in mensajes:
+            self.append(mensaje)
+
+    @property
+    def capacidad(self) -> int:
+        return len(self._mensajes)
+
+    def append(self, mensaje: Mensaje) -> None:
+        rol = ROLES.get(mensaje.get("role"))
+        if rol is not None:
+            mensaje["role"] = rol
+        capacidad = len(self._mensajes)
+        if self._largo < capacidad:
+            self._mensajes[(self._inicio + self._largo) % capacidad] = mensaje
+            self._largo += 1
+        else:
+            # Lleno: el mensaje nuevo ocupa el lugar del más viejo
+            self._mensajes[self._inicio] = mensaje
+            self._inicio = (self._inicio + 1) % capacidad
+        self.total += 1
+
+    def _recorrer(self, desde: int = 0) -> Iterator[Mensaje]:
+        # El buffer da la vuelta a lo sumo una vez: dos tramos de la lista, recorridos en C
+        capacidad = len(self._mensajes)
+        inicio = self._inicio + desde
+        fin = self._inicio + self._largo
+        if fin <= capacidad:
+            return islice(self._mensajes, inicio, fin)
+        if inicio >= capacidad:
+            return islice(self._mensajes, inicio - capacidad, fin - capacidad)
+        return chain(islice(self._mensajes, inicio, capacidad), islice(self._mensajes, 0, fin - capacidad))
+
+    def ventana(self, largo: Optional[int] = None) -> Iterator[Mensaje]:
+        """
+        Recorre los últimos `largo` mensajes (por defecto CONVERSATION_WINDOW) sin copiarlos,
+        para armar el prompt; se consume antes del próximo append
+        """
+        return self._recorrer(max(0, self._largo - (largo or get_config()["window"])))
+
+    def a_lista(self) -> List[Mensaje]:
+        return list(self._recorrer())
+
+    def __len__(self) -> int:
+        return self._largo
+
+    def __iter__(self) -> Iterator[Mensaje]:
+        return self._recorrer()
+
+    def __getitem__(self, indice: Union[int, slice]) -> Union[Mensaje, List[Mensaje]]:
+        if isinstance(indice, slice):
+            return self.a_lista()[indice]
+        if indice < 0:
+            indice += self._largo
+        if not 0 <= indice < self._largo:
+            raise IndexError("índice fuera del historial")
+        return self._mensajes[(self._inicio + indice) % len(self._mensajes)]
+
+    def __repr__(self) -> str:
+        return f"ConversationHistory({self._largo}/{len(self._mensajes)} mensajes, {self.total} en total)"
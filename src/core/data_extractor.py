@@ -1,8 +1,9 @@
 import re
-import time
 import logging
+from datetime import date
 from typing import Dict, Any, Optional, List
 from config import ConversationSteps
+from core.date_parser import parsear_fecha
 from core.session_manager import actualizar_datos_contexto
 
 logger = logging.getLogger(__name__)
@@ -51,8 +52,7 @@ class DataExtractor:
             "farmacia": r"(?:farmacia)[:\s]+([A-Za-zÁáÉéÍíÓóÚúÜüÑñ\s0-9]+?)(?:\.|\!|\n|,|en)",
             "direccion": r"(?:dirección)[:\s]+([A-Za-zÁáÉéÍíÓóÚúÜüÑñ\s0-9#\-\.]+?)(?:\.|\!|\n|,)",
             "regimen": r"(?:régimen|afiliación)[:\s]+(Contributivo|Subsidiado)",
-            "medicamentos": r"(?:medicamentos? no entregados?)[:\s]+(.+?)(?:\.|\!|\n|,)",
-            "fecha_nacimiento": r"(?:nacimiento|nació)[:\s]+(\d{1,2}[\/\-]\d{1,2}[\/\-]\d{4})"
+            "medicamentos": r"(?:medicamentos? no entregados?)[:\s]+(.+?)(?:\.|\!|\n|,)"
         }
         
         # Valores de palabras no válidas para ciertos campos
@@ -71,7 +71,7 @@ class DataExtractor:
                 if campo == "ciudad":
                     # Verificar que no sea un régimen u otro valor inválido
                     if any(palabra in valor.lower() for palabra in palabras_invalidas["ciudad"]):
-                        logger.info(f"Ignorando valor inválido para ciudad: {valor}")
+                        logger.debug("Ignorando valor inválido para ciudad: %s", valor, extra={"event": "extraccion.descartada"})
                         continue
                 
                 if campo == "farmacia":
@@ -81,11 +81,11 @@ class DataExtractor:
                         valor = re.sub(patron_invalido, "", valor, flags=re.I).strip()
                     
                     if valor != valor_original:
-                        logger.info(f"Limpiando valor de farmacia: '{valor_original}' -> '{valor}'")
+                        logger.debug("Limpiando valor de farmacia: '%s' -> '%s'", valor_original, valor, extra={"event": "extraccion.limpieza"})
                     
                     # Si después de limpiar queda una palabra muy corta o vacía, ignorar
                     if len(valor) < 3:
-                        logger.info(f"Ignorando valor demasiado corto para farmacia: '{valor}'")
+                        logger.debug("Ignorando valor demasiado corto para farmacia: '%s'", valor, extra={"event": "extraccion.descartada"})
                         continue
                 
                 # Mapeo de campos al formato esperado por actualizar_datos_contexto
@@ -95,8 +95,7 @@ class DataExtractor:
                     "farmacia": "farmacia",
                     "direccion": "direccion",
                     "regimen": "regimen",
-                    "medicamentos": "medicamentos",
-                    "fecha_nacimiento": "fechaNacimiento"
+                    "medicamentos": "medicamentos"
                 }
                 
                 actualizar_datos_contexto(user_session, campo_map[campo], valor)
@@ -114,7 +113,7 @@ class DataExtractor:
         if telefono_directo:
             actualizar_datos_contexto(user_session, "celular", telefono_directo.group(1))
         
-        # Buscar fechas en formato más flexible
+        # Fecha de nacimiento en cualquier formato, validada contra el calendario
         fecha = DataExtractor.extraer_fecha(texto)
         if fecha:
             actualizar_datos_contexto(user_session, "fechaNacimiento", fecha)
@@ -148,7 +147,7 @@ class DataExtractor:
                 if len(valor_limpio) >= 3:
                     actualizar_datos_contexto(user_session, "farmacia", valor_limpio)
                 else:
-                    logger.info(f"Ignorando valor demasiado corto para farmacia: '{valor_limpio}'")
+                    logger.debug("Ignorando valor demasiado corto para farmacia: '%s'", valor_limpio, extra={"event": "extraccion.descartada"})
             elif "nacimiento" in campo or "nací" in campo:
                 fecha_corregida = DataExtractor.extraer_fecha(nuevo_valor)
                 if fecha_corregida:
@@ -205,54 +204,11 @@ class DataExtractor:
     
     @staticmethod
     def extraer_fecha(texto: str) -> Optional[str]:
-        """Extrae una fecha del texto en varios formatos posibles"""
-        
-        # Formato DD/MM/AAAA o DD-MM-AAAA
-        formato_slash = re.search(r"(\d{1,2})[\/\-](\d{1,2})[\/\-](\d{4})", texto)
-        
-        # Formato "DD de Mes de AAAA" o "DD de Mes"
-        formato_texto = re.search(r"(\d{1,2})\s+de\s+([a-zñáéíóú]+)(?:\s+de\s+)?(\d{4})?", texto, re.I)
-        
-        # Formato "Mes DD, AAAA" o "Mes DD"
-        formato_invertido = re.search(r"([a-zñáéíóú]+)\s+(\d{1,2})(?:,?\s+)?(\d{4})?", texto, re.I)
-        
-        if formato_slash:
-            dia = formato_slash.group(1).zfill(2)
-            mes = formato_slash.group(2).zfill(2)
-            anio = formato_slash.group(3)
-            return f"{dia}/{mes}/{anio}"
-        
-        if formato_texto:
-            dia = formato_texto.group(1).zfill(2)
-            mes_texto = formato_texto.group(2).lower()
-            anio = formato_texto.group(3) or str(time.localtime().tm_year)
-            
-            meses = {
-                'enero': '01', 'febrero': '02', 'marzo': '03', 'abril': '04',
-                'mayo': '05', 'junio': '06', 'julio': '07', 'agosto': '08',
-                'septiembre': '09', 'octubre': '10', 'noviembre': '11', 'diciembre': '12'
-            }
-            
-            for nombre, numero in meses.items():
-                if nombre in mes_texto:
-                    return f"{dia}/{numero}/{anio}"
-        
-        if formato_invertido:
-            mes_texto = formato_invertido.group(1).lower()
-            dia = formato_invertido.group(2).zfill(2)
-            anio = formato_invertido.group(3) or str(time.localtime().tm_year)
-            
-            meses = {
-                'enero': '01', 'febrero': '02', 'marzo': '03', 'abril': '04',
-                'mayo': '05', 'junio': '06', 'julio': '07', 'agosto': '08',
-                'septiembre': '09', 'octubre': '10', 'noviembre': '11', 'diciembre': '12'
-            }
-            
-            for nombre, numero in meses.items():
-                if nombre in mes_texto:
-                    return f"{dia}/{numero}/{anio}"
-        
-        return None
+        """Fecha de nacimiento del texto como DD/MM/AAAA; None si no hay una válida, con año y no futura"""
+        fecha = parsear_fecha(texto, hasta=date.today())
+        if fecha is None:
+            return None
+        return f"{fecha.day:02d}/{fecha.month:02d}/{fecha.year}"
     
     @staticmethod
     async def procesar_seleccion_medicamentos(text: str, user_session: Dict[str, Any]) -> Dict[str, Any]:
@@ -0,0 +1,116 @@
+"""
+Fechas en español escritas por los usuarios o leídas de la fórmula: "05/03/1980",
+"5-3-80", "1980-03-05", "5 de marzo de 1980", "1ro de sept. del 80", "marzo 5, 1980".
+Una sola expresión compilada con la tabla de meses y abreviaturas armada al importar;
+cada candidata se valida contra el calendario (no hay 31 de febrero) antes de aceptarla.
+"""
+import os
+import re
+from datetime import date
+from typing import Dict, List, Optional
+
+ANIO_MINIMO = 1900
+
+MESES: Dict[str, int] = {}
+for _numero, _nombres in enumerate((
+    ("enero", "ene"), ("febrero", "feb"), ("marzo", "mar"), ("abril", "abr"),
+    ("mayo", "may"), ("junio", "jun"), ("julio", "jul"), ("agosto", "ago"),
+    ("septiembre", "setiembre", "sept", "sep", "set"), ("octubre", "oct"),
+    ("noviembre", "nov"), ("diciembre", "dic"),
+), start=1):
+    for _nombre in _nombres:
+        MESES[_nombre] = _numero
+
+def _alternativa(palabras) -> str:
+    """
+    Alternativa con los prefijos comunes factorizados ("se(?:p(?:t(?:iembre)?)?|t(?:iembre)?)"):
+    en cada posición el motor descarta todos los meses con una o dos comparaciones
+    """
+    grupos: Dict[str, List[str]] = {}
+    for palabra in palabras:
+        grupos.setdefault(palabra[0], []).append(palabra)
+    partes = []
+    for _, grupo in sorted(grupos.items()):
+        prefijo = os.path.commonprefix(grupo)
+        restos = [palabra[len(prefijo):] for palabra in grupo]
+        resto = [r for r in restos if r]
+        if not resto:
+            partes.append(re.escape(prefijo))
+        else:
+            opcional = "?" if len(resto) < len(restos) else ""
+            partes.append(f"{re.escape(prefijo)}(?:{_alternativa(resto)}){opcional}")
+    return "|".join(partes)
+
+_MES = _alternativa(MESES)
+_ORDINAL = r"(?:ro|er|do|to|vo|no|mo|º|°|ª)?"
+# "5 de", "5-", "5/", "5 ", "mayo, del"
+_SEPARADOR = r"(?:\s*[-/.,]\s*|\s+)(?:del?\s+)?"
+_ANIO = r"\d{4}|\d{2}"
+
+# Toda fecha empieza un token, con un dígito, "primer" o la inicial de un mes: el
+# motor descarta las demás posiciones antes de probar las alternativas
+_INICIO = rf"(?<!\w)(?=[\dp{''.join(sorted({nombre[0] for nombre in MESES}))}])"
+
+_FECHA = re.compile(
+    rf"{_INICIO}(?:"
+    # 1980-03-05
+    rf"(?P<a_iso>\d{{4}})[-/.](?P<m_iso>\d{{1,2}})[-/.](?P<d_iso>\d{{1,2}})(?!\d)"
+    # 05/03/1980, 5-3-80
+    rf"|(?P<d_num>\d{{1,2}})[-/.](?P<m_num>\d{{1,2}})[-/.](?P<a_num>{_ANIO})(?!\d)"
+    # 5 de marzo de 1980, 1ro de sept. del 80, primero de mayo
+    rf"|(?:(?P<d_txt>\d{{1,2}}){_ORDINAL}|(?P<primero>primer[oa]?)){_SEPARADOR}"
+    rf"(?P<m_txt>{_MES})\b\.?(?:{_SEPARADOR}(?P<a_txt>{_ANIO})(?!\d))?"
+    # marzo 5, 1980; mayo 1ro del 80
+    rf"|(?P<m_inv>{_MES})\b\.?{_SEPARADOR}(?P<d_inv>\d{{1,2}})(?!\d){_ORDINAL}(?:{_SEPARADOR}(?P<a_inv>{_ANIO})(?!\d))?"
+    r")"
+)
+
+# Sin un dígito ni "primer" no puede haber fecha: la mayoría de los mensajes salen aquí
+_CANDIDATA = re.compile(r"\d|primer")
+
+def _anio(texto: Optional[str], hoy: date) -> int:
+    if not texto:
+        return hoy.year
+    anio = int(texto)
+    if len(texto) == 2:
+        # "80" es 1980 y "05" es 2005: el siglo más reciente que no quede en el futuro
+        anio += 2000 if 2000 + anio <= hoy.year else 1900
+    return anio
+
+def parsear_fecha(texto: str, hasta: Optional[date] = None, hoy: Optional[date] = None,
+                  requiere_anio: bool = True) -> Optional[date]:
+    """
+    Primera fecha válida del texto. Con `requiere_anio` las fechas sin año ("5 de marzo")
+    se descartan; sin él se toma el año actual, como en la fecha de atención de la
+    fórmula. Con `hasta`, las fechas posteriores se descartan (una fecha de nacimiento
+    no puede estar en el futuro).
+    """
+    if not texto:
+        return None
+    # La expresión está en minúsculas: más rápida que re.I
+    texto = texto.lower()
+    if not _CANDIDATA.search(texto):
+        return None
+    hoy = hoy or date.today()
+    for match in _FECHA.finditer(texto):
+        a_iso, m_iso, d_iso, d_num, m_num, a_num, d_txt, primero, m_txt, a_txt, m_inv, d_inv, a_inv = match.groups()
+        if requiere_anio and not (a_iso or a_num or a_txt or a_inv):
+            continue
+        if a_iso:
+            anio, mes, dia = int(a_iso), int(m_iso), int(d_iso)
+        elif d_num:
+            anio, mes, dia = _anio(a_num, hoy), int(m_num), int(d_num)
+        elif m_txt:
+            anio, mes, dia = _anio(a_txt, hoy), MESES[m_txt], 1 if primero else int(d_txt)
+        else:
+            anio, mes, dia = _anio(a_inv, hoy), MESES[m_inv], int(d_inv)
+        if anio < ANIO_MINIMO:
+            continue
+        try:
+            fecha = date(anio, mes, dia)
+        except ValueError:
+            continue
+        if hasta is not None and fecha > hasta:
+            continue
+        return fecha
+    return None
@@ -0,0 +1,75 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, List, Optional
+
+from config import get_executor_config
+
+logger = logging.getLogger(__name__)
+
+_cpu_executor: Optional[Executor] = None
+_io_executor: Optional[Executor] = None
+
+def get_cpu_executor() -> Executor:
+    """Pool para trabajo CPU (base64, parseo de JSON, procesamiento de imágenes)"""
+    global _cpu_executor
+
+    if _cpu_executor is None:
+        config = get_executor_config()
+        if config["kind"] == "process":
+            _cpu_executor = ProcessPoolExecutor(max_workers=config["cpu_workers"])
+        else:
+            _cpu_executor = ThreadPoolExecutor(max_workers=config["cpu_workers"], thread_name_prefix="cpu")
+        logger.info(f"Executor de CPU creado: {config['kind']} con {config['cpu_workers']} workers")
+
+    return _cpu_executor
+
+def get_io_executor() -> Executor:
+    """Pool de hilos para llamadas de red síncronas (requests, clientes HTTP bloqueantes)"""
+    global _io_executor
+
+    if _io_executor is None:
+        config = get_executor_config()
+        _io_executor = ThreadPoolExecutor(max_workers=config["io_workers"], thread_name_prefix="io")
+
+    return _io_executor
+
+async def run_cpu_bound(func: Callable, *args: Any, **kwargs: Any) -> Any:
+    """
+    Ejecuta una función CPU-bound fuera del event loop. Con el pool de procesos,
+    la función y sus argumentos deben poder serializarse con pickle.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_cpu_executor(), functools.partial(func, *args, **kwargs))
+
+async def run_blocking(func: Callable, *args: Any, **kwargs: Any) -> Any:
+    """Ejecuta una llamada bloqueante de I/O en el pool de hilos"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_io_executor(), functools.partial(func, *args, **kwargs))
+
+async def run_concurrently(*aws: Awaitable) -> List[Any]:
+    """
+    Ejecuta varias corutinas a la vez y devuelve sus resultados en orden. Si una falla,
+    o si se cancela a quien espera, las demás se cancelan y se esperan antes de propagar
+    el error: ninguna queda corriendo suelta.
+    """
+    tareas = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tareas)
+    except BaseException:
+        for tarea in tareas:
+            if not tarea.done():
+                tarea.cancel()
+        await asyncio.gather(*tareas, return_exceptions=True)
+        raise
+
+def shutdown_executors(wait: bool = True) -> None:
+    global _cpu_executor, _io_executor
+
+    for executor in (_cpu_executor, _io_executor):
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    _cpu_executor = None
+    _io_executor = None
@@ -0,0 +1,226 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+# Intenciones reconocidas
+FORMULA_PERDIDA = "formula_perdida"
+CONSENTIMIENTO_SI = "consentimiento_si"
+CONSENTIMIENTO_NO = "consentimiento_no"
+DESPEDIDA = "despedida"
+NUEVA_QUEJA = "nueva_queja"
+REINICIAR = "reiniciar"
+HISTORIAL = "historial"
+# "no sé", "no entiendo": no responde la autorización aunque empiece con "no"
+DUDA = "duda"
+
+# Frases ya normalizadas (minúsculas y sin tildes) con su confianza
+FRASES: Dict[str, List[Tuple[str, float]]] = {
+    FORMULA_PERDIDA: [
+        ("perdi la formula", 1.0), ("no tengo la formula", 1.0), ("se me perdi", 0.9), ("se me perdio", 0.9),
+        ("no la tengo", 0.8), ("se me dano", 0.8), ("se me mojo", 0.8), ("no la encuentro", 0.8),
+        ("perdi mi formula", 1.0), ("no encuentro la formula", 1.0),
+    ],
+    CONSENTIMIENTO_SI: [
+        ("si", 0.9), ("claro", 0.9), ("ok", 0.8), ("okay", 0.8), ("dale", 0.8), ("autorizo", 1.0),
+        ("acepto", 1.0), ("por supuesto", 1.0), ("listo", 0.6), ("adelante", 0.8), ("de acuerdo", 0.9),
+        ("si autorizo", 1.0), ("si acepto", 1.0), ("bueno", 0.5), ("vale", 0.6), ("esta bien", 0.8),
+        ("no hay problema", 0.9), ("no hay lio", 0.9), ("no hay drama", 0.9),
+    ],
+    # El "no" suelto no está aquí: solo niega como respuesta entera o al comienzo (ver classify)
+    CONSENTIMIENTO_NO: [
+        ("no autorizo", 1.0), ("no acepto", 1.0), ("no quiero", 1.0), ("prefiero que no", 1.0),
+        ("para nada", 0.9), ("no gracias", 1.0), ("nunca", 0.8), ("no estoy de acuerdo", 1.0),
+    ],
+    DESPEDIDA: [
+        ("gracias", 0.8), ("muchas gracias", 1.0), ("adios", 1.0), ("chao", 1.0), ("hasta luego", 1.0),
+        ("listo", 0.5), ("eso es todo", 0.9), ("hasta pronto", 1.0),
+    ],
+    NUEVA_QUEJA: [
+        ("nueva queja", 1.0), ("otra queja", 1.0), ("quiero hacer otra", 0.9), ("iniciar otra", 0.9),
+        ("tramitar otra", 0.9), ("reportar otro", 0.8), ("denunciar otro", 0.8),
+        ("otro medicamento no entregado", 1.0), ("volver a empezar", 0.8),
+    ],
+    REINICIAR: [
+        ("reiniciar", 1.0), ("empezar de nuevo", 1.0),
+    ],
+    HISTORIAL: [
+        ("historial de quejas", 1.0), ("mis quejas", 0.9), ("quejas anteriores", 1.0), ("mis reclamos", 0.8),
+        ("reclamos anteriores", 1.0), ("ver mi historial", 0.9), ("quejas que he puesto", 1.0),
+        ("quejas que tengo", 0.9), ("que quejas tengo", 1.0),
+    ],
+    DUDA: [
+        ("no se", 0.8), ("no sabia", 0.8), ("no entiendo", 0.8), ("no estoy seguro", 0.8), ("no estoy segura", 0.8),
+    ],
+}
+
+# Frases que cuentan solo como el mensaje completo: "reset" o "/reset", pero no "quiero
+# reset de mi contraseña"
+SOLAS: Dict[str, List[Tuple[str, float]]] = {
+    REINICIAR: [("reset", 1.0), ("reinicia", 1.0)],
+}
+
+# Secuencias con huecos: todos los tokens en orden, con cualquier cosa entre ellos ("otra ... queja")
+SECUENCIAS: Dict[str, List[Tuple[Tuple[str, ...], float]]] = {
+    NUEVA_QUEJA: [(("otra", "queja"), 0.9), (("otro", "reclamo"), 0.8)],
+}
+
+_SIN_TILDES = str.maketrans("áéíóúüàèìòùÁÉÍÓÚÜÀÈÌÒÙ", "aeiouuaeiouaeiouuaeiou")
+_TOKEN = re.compile(r"[a-z0-9ñ]+")
+
+def normalizar(texto: str) -> List[str]:
+    """Minúsculas, sin tildes y separado en palabras: los límites de palabra quedan implícitos"""
+    texto = texto.lower()
+    if not texto.isascii():
+        texto = texto.translate(_SIN_TILDES)
+    return _TOKEN.findall(texto)
+
+class _Nodo:
+    __slots__ = ("hijos", "fallo", "salidas")
+
+    def __init__(self):
+        self.hijos: Dict[str, "_Nodo"] = {}
+        self.fallo: "_Nodo" = None
+        # (longitud en tokens, intención, confianza)
+        self.salidas: List[Tuple[int, str, float]] = []
+
+class IntentClassifier:
+    """
+    Clasificador de intenciones en una sola pasada: un autómata Aho-Corasick sobre
+    tokens encuentra todas las frases clave a la vez. Cuando una frase corta queda
+    dentro de una más larga de otra intención ("autorizo" dentro de "no autorizo"),
+    gana la más larga.
+    """
+
+    def __init__(self, frases: Dict[str, List[Tuple[str, float]]] = FRASES,
+                 secuencias: Dict[str, List[Tuple[Tuple[str, ...], float]]] = SECUENCIAS,
+                 solas: Dict[str, List[Tuple[str, float]]] = SOLAS):
+        self._raiz = _Nodo()
+        self._solas: Dict[str, List[Tuple[str, float]]] = {}
+        for intencion, lista in solas.items():
+            for frase, confianza in lista:
+                self._solas.setdefault(" ".join(normalizar(frase)), []).append((intencion, confianza))
+        self._secuencias = secuencias
+        self._inicios_secuencias = frozenset(secuencia[0] for lista in secuencias.values() for secuencia, _ in lista)
+
+        for intencion, lista in frases.items():
+            for frase, confianza in lista:
+                tokens = normalizar(frase)
+                nodo = self._raiz
+                for token in tokens:
+                    nodo = nodo.hijos.setdefault(token, _Nodo())
+                nodo.salidas.append((len(tokens), intencion, confianza))
+
+        self._construir_fallos()
+
+    def _construir_fallos(self) -> None:
+        self._raiz.fallo = self._raiz
+        pendientes = []
+        for hijo in self._raiz.hijos.values():
+            hijo.fallo = self._raiz
+            pendientes.append(hijo)
+
+        while pendientes:
+            siguientes = []
+            for nodo in pendientes:
+                for token, hijo in nodo.hijos.items():
+                    fallo = nodo.fallo
+                    while fallo is not self._raiz and token not in fallo.hijos:
+                        fallo = fallo.fallo
+                    hijo.fallo = fallo.hijos.get(token, self._raiz)
+                    if hijo.fallo is hijo:
+                        hijo.fallo = self._raiz
+                    hijo.salidas = hijo.salidas + hijo.fallo.salidas
+                    siguientes.append(hijo)
+            pendientes = siguientes
+
+    def _coincidencias(self, tokens: List[str]) -> List[Tuple[int, int, str, float]]:
+        coincidencias = []
+        raiz = self._raiz
+        nodo = raiz
+        for posicion, token in enumerate(tokens):
+            while nodo is not raiz and token not in nodo.hijos:
+                nodo = nodo.fallo
+            nodo = nodo.hijos.get(token, raiz)
+            if nodo.salidas:
+                for longitud, intencion, confianza in nodo.salidas:
+                    coincidencias.append((posicion - longitud + 1, posicion + 1, intencion, confianza))
+        return coincidencias
+
+    def classify(self, texto: str) -> Dict[str, float]:
+        """Devuelve todas las intenciones detectadas con su confianza (0-1)"""
+        tokens = normalizar(texto)
+        if not tokens:
+            return {}
+
+        coincidencias = self._coincidencias(tokens)
+        intenciones: Dict[str, float] = {}
+
+        if len(coincidencias) > 1:
+            # Las coincidencias más largas se quedan con su tramo de texto
+            coincidencias.sort(key=lambda c: c[0] - c[1])
+            cubiertos: List[Tuple[int, int, str]] = []
+            for inicio, fin, intencion, confianza in coincidencias:
+                if any(c_inicio <= inicio and fin <= c_fin and c_intencion != intencion and (c_fin - c_inicio) > (fin - inicio)
+                       for c_inicio, c_fin, c_intencion in cubiertos):
+                    continue
+                cubiertos.append((inicio, fin, intencion))
+                if confianza > intenciones.get(intencion, 0.0):
+                    intenciones[intencion] = confianza
+        elif coincidencias:
+            _, _, intencion, confianza = coincidencias[0]
+            intenciones[intencion] = confianza
+
+        for intencion, confianza in self._solas.get(" ".join(tokens), ()):
+            intenciones[intencion] = max(confianza, intenciones.get(intencion, 0.0))
+
+        # "no" niega la autorización solo como respuesta entera o primera palabra ("no", "no,
+        # gracias", "no señor"), si ninguna frase lo incluye ("no hay problema", "no sé"), nada
+        # afirmativo lo sigue y no es una pregunta ("no, ¿para qué la necesitan?")
+        if (tokens[0] == "no" and CONSENTIMIENTO_SI not in intenciones and "?" not in texto and "¿" not in texto
+                and not any(inicio == 0 for inicio, _, _, _ in coincidencias)):
+            intenciones[CONSENTIMIENTO_NO] = max(0.9, intenciones.get(CONSENTIMIENTO_NO, 0.0))
+
+        if not self._inicios_secuencias.isdisjoint(tokens):
+            for intencion, secuencias in self._secuencias.items():
+                for secuencia, confianza in secuencias:
+                    if confianza > intenciones.get(intencion, 0.0) and self._contiene_en_orden(tokens, secuencia):
+                        intenciones[intencion] = confianza
+
+        # Un mensaje corto con una sola intención es más confiable que uno largo que la menciona de pasada
+        if intenciones and len(tokens) > 8:
+            intenciones = {intencion: round(confianza * 0.85, 3) for intencion, confianza in intenciones.items()}
+
+        return intenciones
+
+    @staticmethod
+    def _contiene_en_orden(tokens: List[str], secuencia: Tuple[str, ...]) -> bool:
+        restantes = iter(tokens)
+        return all(token in restantes for token in secuencia)
+
+_clasificador = None
+
+def get_classifier() -> IntentClassifier:
+    """Clasificador compartido, construido una sola vez por proceso"""
+    global _clasificador
+    if _clasificador is None:
+        _clasificador = IntentClassifier()
+    return _clasificador
+
+def classify(texto: str) -> Dict[str, float]:
+    return get_classifier().classify(texto)
+
+# Confianza mínima para actuar sobre una intención sin pasar por el LLM
+UMBRAL = 0.5
+UMBRAL_NEGATIVO = 0.8
+
+def detectada(intenciones: Dict[str, float], intencion: str, umbral: float = UMBRAL) -> bool:
+    return intenciones.get(intencion, 0.0) >= umbral
+
+def respuesta_consentimiento(intenciones: Dict[str, float]) -> Optional[bool]:
+    """True si autoriza, False si se niega y None si el mensaje no responde a la autorización"""
+    si = intenciones.get(CONSENTIMIENTO_SI, 0.0)
+    no = intenciones.get(CONSENTIMIENTO_NO, 0.0)
+    if si >= UMBRAL and si > no:
+        return True
+    if no >= UMBRAL_NEGATIVO and no >= si:
+        return False
+    return None
@@ -0,0 +1,253 @@
+import ast
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+_decoder = json.JSONDecoder()
+
+_COMILLAS_TIPOGRAFICAS = str.maketrans({"“": '"', "”": '"', "„": '"', "‘": "'", "’": "'"})
+_CERCA = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$", re.I | re.M)
+# Tramos sin caracteres relevantes que la reparación copia de una vez
+_TRAMO_CADENA = re.compile(r'[^"\\\n\r]+')
+_TRAMO_FUERA = re.compile(r'[^"{}\[\],:]+')
+
+class JSONIrreparableError(ValueError):
+    """El texto no contiene un objeto JSON recuperable"""
+
+_NO_ESPACIO = re.compile(r"[^ \t\r\n]")
+
+def _siguiente_significativo(texto: str, posicion: int) -> str:
+    siguiente = _NO_ESPACIO.search(texto, posicion)
+    return siguiente.group() if siguiente else ""
+
+def _inicio_objeto(texto: str) -> int:
+    """Posición del primer '{' que abre un objeto JSON ('{' seguido de '"' o '}'); -1 si no hay"""
+    inicio = texto.find("{")
+    while inicio != -1:
+        if _siguiente_significativo(texto, inicio + 1) in ('"', "}"):
+            return inicio
+        inicio = texto.find("{", inicio + 1)
+    return -1
+
+def _decodificar_primero(texto: str) -> Optional[Any]:
+    """Decodifica el primer objeto JSON del texto, ignorando lo que haya antes o después"""
+    inicio = _inicio_objeto(texto)
+    if inicio == -1:
+        return None
+    try:
+        valor, _ = _decoder.raw_decode(texto, inicio)
+    except json.JSONDecodeError:
+        return None
+    return valor if isinstance(valor, dict) else None
+
+def reparar_json(texto: str) -> str:
+    """
+    Reparación determinista en una sola pasada, desde el primer '{':
+    - comillas sin escapar dentro de un valor ("Dr. "Pérez"") se escapan
+    - saltos de línea crudos dentro de cadenas se escapan
+    - comas sobrantes antes de '}' o ']' se eliminan
+    - una salida truncada se cierra: cadena abierta, valor pendiente y corchetes
+    """
+    inicio = _inicio_objeto(texto)
+    if inicio == -1:
+        raise JSONIrreparableError("No hay ningún objeto JSON en la respuesta")
+
+    salida: List[str] = []
+    pila: List[str] = []
+    en_cadena = escape = False
+    # Por cada objeto abierto: True si lo siguiente es una clave
+    espera_clave: List[bool] = []
+    # Posición en la salida donde empezó la última clave, para descartarla si quedó sin valor
+    inicio_clave = -1
+
+    posicion = inicio
+    while posicion < len(texto):
+        if not escape:
+            tramo = (_TRAMO_CADENA if en_cadena else _TRAMO_FUERA).match(texto, posicion)
+            if tramo:
+                salida.append(tramo.group())
+                posicion = tramo.end()
+                continue
+
+        caracter = texto[posicion]
+
+        if en_cadena:
+            if escape:
+                escape = False
+                salida.append(caracter)
+            elif caracter == "\\":
+                escape = True
+                salida.append(caracter)
+            elif caracter == '"':
+                siguiente = _siguiente_significativo(texto, posicion + 1)
+                if siguiente in (",", "}", "]", ":", ""):
+                    en_cadena = False
+                    salida.append(caracter)
+                else:
+                    salida.append('\\"')
+            elif caracter == "\n":
+                salida.append("\\n")
+            elif caracter == "\r":
+                pass
+            else:
+                salida.append(caracter)
+        elif caracter == '"':
+            en_cadena = True
+            if espera_clave and espera_clave[-1] and pila[-1] == "}":
+                inicio_clave = len(salida)
+            salida.append(caracter)
+        elif caracter in "{[":
+            pila.append("}" if caracter == "{" else "]")
+            espera_clave.append(caracter == "{")
+            salida.append(caracter)
+        elif caracter in "}]":
+            if not pila:
+                break
+            while salida and salida[-1].strip() in (",", ""):
+                salida.pop()
+            salida.append(pila.pop())
+            espera_clave.pop()
+            if not pila:
+                break
+        elif caracter == ",":
+            if _siguiente_significativo(texto, posicion + 1) not in ("}", "]"):
+                salida.append(caracter)
+            if espera_clave and pila[-1] == "}":
+                espera_clave[-1] = True
+        elif caracter == ":":
+            salida.append(caracter)
+            if espera_clave:
+                espera_clave[-1] = False
+        else:
+            salida.append(caracter)
+        posicion += 1
+
+    if pila:
+        # Salida truncada: una clave sin valor se descarta completa
+        clave_pendiente = bool(espera_clave) and espera_clave[-1] and pila[-1] == "}" and inicio_clave != -1
+        if clave_pendiente and (en_cadena or "".join(salida[inicio_clave:]).rstrip().endswith('"')):
+            del salida[inicio_clave:]
+        elif en_cadena:
+            if escape:
+                salida.pop()
+            salida.append('"')
+        reparado = "".join(salida).rstrip()
+        if reparado.endswith(","):
+            reparado = reparado[:-1]
+        elif reparado.endswith(":"):
+            reparado += " null"
+        elif re.search(r"(?:\btru|\bfals|\bnul|-)$", reparado):
+            reparado = re.sub(r"[A-Za-z-]+$", "null", reparado)
+        return reparado + "".join(reversed(pila))
+
+    return "".join(salida)
+
+def _desescapar(texto: str) -> Optional[str]:
+    """Deshace un nivel de escape: {\\"datos\\": ...} o la respuesta entera como cadena JSON"""
+    candidato = texto.strip()
+    if candidato.startswith('"') and candidato.endswith('"'):
+        try:
+            valor = json.loads(candidato)
+            return valor if isinstance(valor, str) else None
+        except json.JSONDecodeError:
+            pass
+    if '\\"' in candidato:
+        return candidato.replace('\\\\', '\x00').replace('\\"', '"').replace('\\n', '\n').replace('\x00', '\\')
+    return None
+
+def extraer_json(texto: str) -> Dict[str, Any]:
+    """
+    Extrae el primer objeto JSON de una respuesta del modelo. Intenta primero la
+    decodificación directa (rápida, en C) y solo si falla aplica las reparaciones,
+    de la más barata a la más costosa. Lanza JSONIrreparableError si nada funciona.
+    """
+    if not texto:
+        raise JSONIrreparableError("Respuesta vacía")
+
+    valor = _decodificar_primero(texto)
+    if valor is not None:
+        return valor
+
+    limpio = _CERCA.sub("", texto).translate(_COMILLAS_TIPOGRAFICAS)
+    desescapado = _desescapar(limpio)
+    candidatos = [desescapado, limpio] if desescapado else [limpio]
+
+    for candidato in candidatos:
+        valor = _decodificar_primero(candidato)
+        if valor is not None:
+            return valor
+        try:
+            valor = json.loads(reparar_json(candidato))
+            if isinstance(valor, dict):
+                return valor
+        except (json.JSONDecodeError, JSONIrreparableError):
+            pass
+
+    # Último recurso: diccionario al estilo Python con comillas simples
+    inicio, fin = limpio.find("{"), limpio.rfind("}")
+    if inicio != -1 and fin > inicio:
+        try:
+            valor = ast.literal_eval(limpio[inicio:fin + 1])
+            if isinstance(valor, dict):
+                return valor
+        except (ValueError, SyntaxError, MemoryError, RecursionError):
+            pass
+
+    raise JSONIrreparableError("No se pudo recuperar un objeto JSON de la respuesta")
+
+# Esquema de "datos" en la lectura de una fórmula
+NO_VISIBLE = "No visible"
+CAMPOS_TEXTO = ["tipo_documento", "numero_documento", "paciente", "fecha_atencion", "eps", "doctor", "diagnostico"]
+SIN_MEDICAMENTOS = "No se detectaron medicamentos claramente. Por favor, intenta con una foto más clara."
+
+def _como_texto(valor: Any) -> str:
+    if valor is None:
+        return NO_VISIBLE
+    if isinstance(valor, (list, tuple)):
+        return ", ".join(_como_texto(v) for v in valor if v is not None) or NO_VISIBLE
+    if isinstance(valor, dict):
+        return " ".join(_como_texto(v) for v in valor.values() if v) or NO_VISIBLE
+    texto = str(valor).strip()
+    return texto or NO_VISIBLE
+
+def validar_datos(json_data: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    Valida y normaliza el objeto "datos" de una fórmula. Devuelve los datos con
+    los tipos esperados (texto y lista de textos) y la lista de problemas encontrados;
+    sin problemas graves la lista solo contiene avisos de normalización.
+    """
+    problemas: List[str] = []
+    datos = json_data.get("datos", json_data)
+    if not isinstance(datos, dict):
+        raise JSONIrreparableError("'datos' no es un objeto")
+
+    if not any(campo in datos for campo in CAMPOS_TEXTO + ["medicamentos"]):
+        raise JSONIrreparableError("El objeto no tiene ningún campo de la fórmula")
+
+    normalizados: Dict[str, Any] = {}
+    for campo in CAMPOS_TEXTO:
+        if campo not in datos:
+            problemas.append(f"falta {campo}")
+        normalizados[campo] = _como_texto(datos.get(campo))
+
+    # Campos adicionales que el modelo haya agregado (p. ej. "ips") se conservan como texto
+    for campo, valor in datos.items():
+        if campo not in normalizados and campo != "medicamentos":
+            normalizados[campo] = _como_texto(valor)
+
+    medicamentos = datos.get("medicamentos")
+    if isinstance(medicamentos, str):
+        medicamentos = [m for m in re.split(r"\n|;", medicamentos) if m.strip()]
+        problemas.append("medicamentos como texto")
+    elif not isinstance(medicamentos, list):
+        medicamentos = []
+        problemas.append("medicamentos ausentes")
+
+    lista = [_como_texto(m) for m in medicamentos if m]
+    lista = [m for m in lista if m != NO_VISIBLE]
+    normalizados["medicamentos"] = lista if lista and not lista[0].startswith("No se detectaron") else [SIN_MEDICAMENTOS]
+
+    if normalizados["numero_documento"] != NO_VISIBLE:
+        normalizados["numero_documento"] = re.sub(r"[^\dA-Za-z]", "", normalizados["numero_documento"]) or NO_VISIBLE
+
+    return normalizados, problemas
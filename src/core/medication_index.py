@@ -0,0 +1,293 @@
+"""
+Índice local de medicamentos para normalizar las líneas que devuelve el OCR.
+
+data/medicamentos.tsv es la fuente editable (código ATC, principio activo y
+sinónimos o marcas). De ella se genera data/medicamentos.idx.tsv, una línea
+"CLAVE<TAB>ATC<TAB>PRINCIPIO" por nombre, ordenada por bytes; el archivo se abre
+con mmap y se busca por bisección como look(1), sin cargarlo en memoria.
+
+Regenerar el índice después de editar la fuente (desde src/):
+    python -m core.medication_index --construir
+"""
+import argparse
+import mmap
+import os
+import re
+from difflib import SequenceMatcher
+from typing import Any, Dict, List, Optional, Tuple
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+RUTA_FUENTE = os.path.join(DATA_DIR, "medicamentos.tsv")
+RUTA_INDICE = os.path.join(DATA_DIR, "medicamentos.idx.tsv")
+
+# Similitud mínima para aceptar un nombre con errores de OCR ("LOSARTAM", "METFORMLNA")
+SIMILITUD_MINIMA = 0.8
+
+_SIN_TILDES = str.maketrans("ÁÉÍÓÚÜÀÈÌÒÙÑ", "AEIOUUAEIOUN")
+_TOKEN = re.compile(r"[A-Z]+|\d+(?:[.,]\d+)?")
+_CONCENTRACION = re.compile(
+    r"(\d+(?:[.,]\d+)?(?:\s*/\s*\d+(?:[.,]\d+)?)*)\s*"
+    r"(MCG|UG|MG|GR|G|ML|UI|UNIDADES|U|%)\b"
+    r"(?:\s*/\s*(\d+(?:[.,]\d+)?)?\s*(ML|G|DOSIS|H)\b)?"
+)
+_UNIDADES = {"UG": "MCG", "GR": "G", "UNIDADES": "UI", "U": "UI"}
+
+FORMAS = {
+    "TABLETA": "TABLETA", "TABLETAS": "TABLETA", "TAB": "TABLETA", "TABS": "TABLETA",
+    "COMPRIMIDO": "TABLETA", "COMPRIMIDOS": "TABLETA",
+    "CAPSULA": "CAPSULA", "CAPSULAS": "CAPSULA", "CAP": "CAPSULA", "CAPS": "CAPSULA",
+    "JARABE": "JARABE", "SUSPENSION": "SUSPENSION", "SUSP": "SUSPENSION",
+    "SOLUCION": "SOLUCION", "SOL": "SOLUCION", "SLN": "SOLUCION",
+    "AMPOLLA": "AMPOLLA", "AMPOLLAS": "AMPOLLA", "AMP": "AMPOLLA",
+    "INYECTABLE": "INYECTABLE", "INY": "INYECTABLE", "VIAL": "INYECTABLE",
+    "LAPICERO": "LAPICERO", "PLUMA": "LAPICERO", "PEN": "LAPICERO",
+    "CREMA": "CREMA", "UNGUENTO": "UNGUENTO", "GEL": "GEL", "GOTAS": "GOTAS",
+    "INHALADOR": "INHALADOR", "INH": "INHALADOR", "AEROSOL": "INHALADOR",
+    "PARCHE": "PARCHE", "OVULO": "OVULO", "OVULOS": "OVULO", "SOBRE": "SOBRE", "SOBRES": "SOBRE",
+}
+
+# Palabras frecuentes en la fórmula que nunca son un medicamento: no se buscan en el índice
+_NO_MEDICAMENTO = set(FORMAS) | {
+    "MG", "MCG", "UG", "GR", "ML", "UI", "UNIDADES", "DOSIS", "CADA", "HORA", "HORAS", "DIA", "DIAS",
+    "DIARIO", "DIARIA", "NOCHE", "MANANA", "AYUNAS", "TOMAR", "APLICAR", "VIA", "ORAL", "USO", "EXTERNO",
+    "SUBCUTANEA", "SC", "IM", "IV", "PUFF", "POR", "CON", "SIN", "DE", "LA", "EL", "LOS", "LAS", "EN",
+    "SI", "HAY", "DOLOR", "MES", "MESES", "CANTIDAD", "TOTAL", "NO",
+}
+
+# Palabras del texto del usuario que se refieren a todos los medicamentos de la fórmula
+_TODOS = {"NINGUNO", "NINGUNA", "NINGUN", "TODOS", "TODAS", "NADA"}
+
+def normalizar(texto: str) -> List[str]:
+    """Mayúsculas, sin tildes y separado en palabras y números"""
+    texto = texto.upper()
+    if not texto.isascii():
+        texto = texto.translate(_SIN_TILDES)
+    return _TOKEN.findall(texto)
+
+def _clave(texto: str) -> str:
+    return " ".join(normalizar(texto))
+
+def construir_indice(fuente: str = RUTA_FUENTE, destino: str = RUTA_INDICE) -> int:
+    """Genera el índice ordenado a partir de la fuente; devuelve el número de claves"""
+    claves: Dict[str, Tuple[str, str]] = {}
+    with open(fuente, encoding="utf-8") as archivo:
+        for linea in archivo:
+            if not linea.strip() or linea.startswith("#"):
+                continue
+            atc, principio, *resto = linea.rstrip("\n").split("\t")
+            principio = _clave(principio)
+            sinonimos = resto[0].split("|") if resto and resto[0] else []
+            for nombre in [principio] + sinonimos:
+                # Ante un sinónimo repetido gana el primero de la fuente
+                claves.setdefault(_clave(nombre), (atc.strip(), principio))
+
+    lineas = sorted(f"{clave}\t{atc}\t{principio}\n".encode("ascii") for clave, (atc, principio) in claves.items())
+    with open(destino, "wb") as archivo:
+        archivo.writelines(lineas)
+    return len(lineas)
+
+class MedicationIndex:
+    """Búsqueda exacta y por prefijo sobre el índice ordenado, abierto con mmap"""
+
+    def __init__(self, ruta: str = RUTA_INDICE):
+        with open(ruta, "rb") as archivo:
+            self._mapa = mmap.mmap(archivo.fileno(), 0, access=mmap.ACCESS_READ)
+        self._tamano = len(self._mapa)
+
+    def _primera_posicion(self, clave: bytes) -> int:
+        """Inicio de la primera línea cuya clave es >= clave (bisección sobre bytes, como look(1))"""
+        mapa = self._mapa
+        bajo, alto = 0, self._tamano
+        while bajo < alto:
+            medio = (bajo + alto) // 2
+            inicio = mapa.rfind(b"\n", 0, medio) + 1
+            fin = mapa.find(b"\n", inicio)
+            if fin == -1:
+                fin = self._tamano
+            if mapa[inicio:mapa.find(b"\t", inicio, fin)] < clave:
+                bajo = fin + 1
+            else:
+                alto = inicio
+        return bajo
+
+    def _lineas_desde(self, posicion: int):
+        mapa = self._mapa
+        while posicion < self._tamano:
+            fin = mapa.find(b"\n", posicion)
+            if fin == -1:
+                fin = self._tamano
+            clave, atc, principio = mapa[posicion:fin].decode("ascii").split("\t")
+            yield clave, atc, principio
+            posicion = fin + 1
+
+    def buscar(self, clave: str) -> Optional[Tuple[str, str]]:
+        """(ATC, principio activo) de una clave exacta ya normalizada"""
+        for encontrada, atc, principio in self._lineas_desde(self._primera_posicion(clave.encode("ascii"))):
+            return (atc, principio) if encontrada == clave else None
+        return None
+
+    def con_prefijo(self, prefijo: str, limite: int = 50) -> List[Tuple[str, str, str]]:
+        """Claves que empiezan por el prefijo, en orden, con su ATC y principio activo"""
+        resultado = []
+        for linea in self._lineas_desde(self._primera_posicion(prefijo.encode("ascii"))):
+            if not linea[0].startswith(prefijo) or len(resultado) >= limite:
+                break
+            resultado.append(linea)
+        return resultado
+
+    def coincidencias(self, tokens: List[str], todas: bool = False) -> List[Tuple[int, int, str, str]]:
+        """
+        Principios activos nombrados en los tokens como (inicio, fin, ATC, principio).
+        En cada posición gana la clave más larga ("LOSARTAN HIDROCLOROTIAZIDA" sobre
+        "LOSARTAN"); con todas=False se detiene en la primera.
+        """
+        encontradas = []
+        posicion = 0
+        while posicion < len(tokens):
+            token = tokens[posicion]
+            mejor = None
+            if token.isalpha() and token not in _NO_MEDICAMENTO:
+                # Una sola bisección por token: la clave exacta y las que la continúan
+                for clave, atc, principio in self.con_prefijo(token):
+                    palabras = clave.split(" ")
+                    if palabras[0] != token:
+                        continue
+                    fin = posicion + len(palabras)
+                    if tokens[posicion:fin] == palabras and (mejor is None or fin > mejor[1]):
+                        mejor = (posicion, fin, atc, principio)
+            if mejor:
+                encontradas.append(mejor)
+                if not todas:
+                    break
+                posicion = mejor[1]
+            else:
+                posicion += 1
+        return encontradas
+
+    def aproximada(self, tokens: List[str]) -> Optional[Tuple[int, int, str, str, float]]:
+        """Mejor clave con errores de OCR, buscando entre las que comparten las tres primeras letras"""
+        mejor = None
+        for posicion, token in enumerate(tokens):
+            if len(token) < 5 or not token.isalpha() or token in _NO_MEDICAMENTO:
+                continue
+            # Un comparador por número de palabras: SequenceMatcher indexa una sola vez su segunda secuencia
+            comparadores: Dict[int, SequenceMatcher] = {}
+            for clave, atc, principio in self.con_prefijo(token[:3]):
+                palabras = clave.count(" ") + 1
+                comparador = comparadores.get(palabras)
+                if comparador is None:
+                    candidato = " ".join(tokens[posicion:posicion + palabras])
+                    comparador = comparadores[palabras] = SequenceMatcher(None, b=candidato, autojunk=False)
+                comparador.set_seq1(clave)
+                # Cotas baratas antes de la comparación completa
+                umbral = mejor[4] if mejor else SIMILITUD_MINIMA
+                if comparador.real_quick_ratio() < umbral or comparador.quick_ratio() < umbral:
+                    continue
+                similitud = comparador.ratio()
+                if similitud >= umbral and (mejor is None or similitud > mejor[4]):
+                    mejor = (posicion, posicion + palabras, atc, principio, similitud)
+        return mejor
+
+_indice = None
+
+def get_index() -> MedicationIndex:
+    """Índice compartido, abierto una sola vez por proceso"""
+    global _indice
+    if _indice is None:
+        _indice = MedicationIndex()
+    return _indice
+
+def _concentracion(texto: str) -> Optional[str]:
+    encontrada = _CONCENTRACION.search(texto)
+    if not encontrada:
+        return None
+    cantidad, unidad, por_cantidad, por_unidad = encontrada.groups()
+    cantidad = re.sub(r"\s+", "", cantidad).replace(",", ".")
+    concentracion = f"{cantidad} {_UNIDADES.get(unidad, unidad)}"
+    if por_unidad:
+        concentracion += f"/{por_cantidad or ''}{por_unidad}"
+    return concentracion
+
+def normalizar_medicamento(linea: str) -> Dict[str, Any]:
+    """
+    Registro canónico de una línea de la fórmula: principio activo, código ATC,
+    concentración y forma farmacéutica. Sin coincidencia, principio y ATC quedan en None.
+    """
+    texto = linea.upper()
+    if not texto.isascii():
+        texto = texto.translate(_SIN_TILDES)
+    tokens = _TOKEN.findall(texto)
+
+    indice = get_index()
+    registro: Dict[str, Any] = {
+        "texto": linea, "principio_activo": None, "atc": None,
+        "concentracion": _concentracion(texto),
+        "forma": next((FORMAS[token] for token in tokens if token in FORMAS), None),
+        "confianza": 0.0,
+    }
+
+    exactas = indice.coincidencias(tokens)
+    if exactas:
+        _, _, registro["atc"], registro["principio_activo"] = exactas[0]
+        registro["confianza"] = 1.0
+    else:
+        aproximada = indice.aproximada(tokens)
+        if aproximada:
+            _, _, registro["atc"], registro["principio_activo"], similitud = aproximada
+            registro["confianza"] = round(similitud, 3)
+    return registro
+
+def normalizar_medicamentos(lineas: List[str]) -> List[Dict[str, Any]]:
+    return [normalizar_medicamento(linea) for linea in lineas if linea and not linea.startswith("No se detectaron")]
+
+def formatear(registro: Dict[str, Any]) -> str:
+    """'LOSARTAN 50 MG TABLETA (C09CA01)'; el texto original si no se reconoció"""
+    if not registro.get("principio_activo"):
+        return registro.get("texto", "")
+    partes = [registro["principio_activo"], registro.get("concentracion"), registro.get("forma")]
+    return f"{' '.join(p for p in partes if p)} ({registro['atc']})"
+
+def menciones(texto: str) -> Optional[List[Tuple[str, str]]]:
+    """(atc, principio) de los medicamentos nombrados en la respuesta; None si dice ninguno o todos"""
+    tokens = normalizar(texto or "")
+    if _TODOS.intersection(tokens):
+        return None
+    return [(atc, principio) for _, _, atc, principio in get_index().coincidencias(tokens, todas=True)]
+
+def no_entregados(texto: str, registros: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Medicamentos de la fórmula a los que se refiere la respuesta del usuario
+    ("no me entregaron ninguno", "el losartán y la metformina"). Los que el usuario
+    nombra y no están en la fórmula se devuelven solo con su principio activo.
+    """
+    return cruzar_menciones(menciones(texto), registros)
+
+def cruzar_menciones(nombrados: Optional[List[Tuple[str, str]]], registros: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """no_entregados con menciones(texto) ya calculado (None: todos los reconocidos)"""
+    reconocidos = [registro for registro in registros if registro.get("atc")]
+    if nombrados is None:
+        return reconocidos
+
+    por_atc = {registro["atc"]: registro for registro in reconocidos}
+    resultado = []
+    for atc, principio in nombrados:
+        registro = por_atc.get(atc) or {
+            "texto": principio, "principio_activo": principio, "atc": atc,
+            "concentracion": None, "forma": None, "confianza": 1.0,
+        }
+        if registro not in resultado:
+            resultado.append(registro)
+    return resultado
+
+def crear_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--construir", action="store_true", help="regenera el índice desde la fuente")
+    parser.add_argument("lineas", nargs="*", help="líneas de fórmula para normalizar")
+    return parser
+
+if __name__ == "__main__":
+    args = crear_parser().parse_args()
+    if args.construir:
+        print(f"{construir_indice()} claves escritas en {RUTA_INDICE}")
+    for linea in args.lineas:
+        print(normalizar_medicamento(linea))
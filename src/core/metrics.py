@@ -0,0 +1,296 @@
+import asyncio
+import bisect
+import contextlib
+import functools
+import json
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Buckets en segundos: cubren desde una extracción con regex hasta una llamada de Vision lenta
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+class Counter:
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+class Gauge:
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+class Histogram:
+    """Histograma de buckets fijos; los percentiles se estiman interpolando dentro del bucket"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        if self.count == 0:
+            return 0.0
+
+        rank = q * self.count
+        acumulado = 0
+        for index, count in enumerate(self.counts):
+            if acumulado + count >= rank and count:
+                inferior = self.buckets[index - 1] if index > 0 else 0.0
+                # El último bucket es abierto: se reporta su límite inferior
+                if index == len(self.buckets):
+                    return inferior
+                superior = self.buckets[index]
+                return inferior + (superior - inferior) * ((rank - acumulado) / count)
+            acumulado += count
+
+        return self.buckets[-1]
+
+class MetricsRegistry:
+    def __init__(self):
+        self._counters: Dict[str, Dict[LabelKey, Counter]] = {}
+        self._gauges: Dict[str, Dict[LabelKey, Gauge]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+        self._help: Dict[str, str] = {}
+
+    @staticmethod
+    def _key(labels: Dict[str, str]) -> LabelKey:
+        return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+    def counter(self, name: str, help: str = "", **labels) -> Counter:
+        self._help.setdefault(name, help)
+        return self._counters.setdefault(name, {}).setdefault(self._key(labels), Counter())
+
+    def gauge(self, name: str, help: str = "", **labels) -> Gauge:
+        self._help.setdefault(name, help)
+        return self._gauges.setdefault(name, {}).setdefault(self._key(labels), Gauge())
+
+    def histogram(self, name: str, help: str = "", buckets: Tuple[float, ...] = DEFAULT_BUCKETS, **labels) -> Histogram:
+        self._help.setdefault(name, help)
+        series = self._histograms.setdefault(name, {})
+        key = self._key(labels)
+        if key not in series:
+            series[key] = Histogram(buckets)
+        return series[key]
+
+    def counters(self, name: str) -> Dict[LabelKey, Counter]:
+        return self._counters.get(name, {})
+
+    def histograms(self, name: str) -> Dict[LabelKey, Histogram]:
+        return self._histograms.get(name, {})
+
+    def reset(self) -> None:
+        self._counters.clear()
+        self._gauges.clear()
+        self._histograms.clear()
+
+    @staticmethod
+    def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+        pares = list(key) + ([extra] if extra else [])
+        if not pares:
+            return ""
+        return "{" + ",".join(f'{name}="{value}"' for name, value in pares) + "}"
+
+    def render_prometheus(self) -> str:
+        """Exporta todas las métricas en el formato de texto de Prometheus"""
+        lines: List[str] = []
+
+        for tipo, metricas in (("counter", self._counters), ("gauge", self._gauges)):
+            for name, series in metricas.items():
+                if self._help.get(name):
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {tipo}")
+                for key, metrica in series.items():
+                    lines.append(f"{name}{self._format_labels(key)} {metrica.value}")
+
+        for name, series in self._histograms.items():
+            if self._help.get(name):
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, histograma in series.items():
+                acumulado = 0
+                for limite, count in zip(histograma.buckets, histograma.counts):
+                    acumulado += count
+                    lines.append(f"{name}_bucket{self._format_labels(key, ('le', repr(limite)))} {acumulado}")
+                lines.append(f"{name}_bucket{self._format_labels(key, ('le', '+Inf'))} {histograma.count}")
+                lines.append(f"{name}_sum{self._format_labels(key)} {histograma.sum}")
+                lines.append(f"{name}_count{self._format_labels(key)} {histograma.count}")
+
+        return "\n".join(lines) + "\n"
+
+    def summary_line(self) -> str:
+        """Resumen compacto de percentiles por etapa para el log periódico"""
+        partes = []
+        for name, series in self._histograms.items():
+            for key, histograma in series.items():
+                if not histograma.count:
+                    continue
+                etiqueta = ",".join(value for _, value in key) or name
+                partes.append(
+                    f"{etiqueta} n={histograma.count} "
+                    f"p50={histograma.quantile(0.5) * 1000:.0f}ms "
+                    f"p95={histograma.quantile(0.95) * 1000:.0f}ms "
+                    f"p99={histograma.quantile(0.99) * 1000:.0f}ms"
+                )
+        return " | ".join(partes)
+
+registry = MetricsRegistry()
+
+_enabled = False
+_NOOP = contextlib.nullcontext()
+
+STAGE_METRIC = "bot_stage_duration_seconds"
+LOOP_LAG_METRIC = "bot_event_loop_lag_seconds"
+
+def is_enabled() -> bool:
+    return _enabled
+
+def set_enabled(enabled: bool) -> None:
+    global _enabled
+    _enabled = enabled
+
+class _StageTimer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+def stage(name: str):
+    """
+    Mide la duración de una etapa con un reloj monotónico. Con las métricas
+    desactivadas devuelve un contexto vacío compartido y no mide nada.
+    """
+    if not _enabled:
+        return _NOOP
+    return _StageTimer(registry.histogram(STAGE_METRIC, "Duración de cada etapa del procesamiento de un mensaje", stage=name))
+
+def timed(name: str):
+    """Decorador que mide una corrutina completa como una etapa"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with stage(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count(name: str, amount: float = 1.0, help: str = "", **labels) -> None:
+    if _enabled:
+        registry.counter(name, help, **labels).inc(amount)
+
+async def watch_event_loop(interval: float = 0.5) -> None:
+    """Tarea vigía: el retraso con el que despierta es el lag que sufre cualquier handler"""
+    histograma = registry.histogram(LOOP_LAG_METRIC, "Retraso del event loop medido por la tarea vigía")
+    maximo = registry.gauge("bot_event_loop_lag_max_seconds", "Mayor lag del event loop observado")
+
+    while True:
+        inicio = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.perf_counter() - inicio - interval)
+        histograma.observe(lag)
+        if lag > maximo.value:
+            maximo.set(lag)
+
+async def log_periodically(interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        resumen = registry.summary_line()
+        if resumen:
+            logger.info(f"Métricas: {resumen}")
+
+async def _handle_metrics_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await reader.readline()
+        # Descartar los encabezados de la petición
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+
+        partes = request_line.decode("latin-1").split()
+        ruta = partes[1].split("?")[0] if len(partes) >= 2 and partes[0] == "GET" else None
+        if ruta == "/metrics":
+            body = registry.render_prometheus().encode("utf-8")
+            status = "200 OK"
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif ruta == "/ready":
+            # 503 mientras alguna dependencia esté pendiente o caída
+            from core import readiness
+
+            estado = readiness.estado()
+            body = (json.dumps(estado, ensure_ascii=False) + "\n").encode("utf-8")
+            status = "200 OK" if estado["listo"] else "503 Service Unavailable"
+            content_type = "application/json; charset=utf-8"
+        else:
+            body = b"Not Found\n"
+            status = "404 Not Found"
+            content_type = "text/plain"
+
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+    except Exception as e:
+        logger.error(f"Error respondiendo /metrics: {e}")
+    finally:
+        writer.close()
+
+async def start_metrics_server(host: str, port: int) -> asyncio.AbstractServer:
+    server = await asyncio.start_server(_handle_metrics_request, host, port)
+    logger.info(f"Endpoint de métricas disponible en http://{host}:{port}/metrics (estado en /ready)")
+    return server
+
+async def start_metrics(config: Dict, port_offset: int = 0) -> List:
+    """
+    Activa las métricas según la configuración y lanza las tareas de soporte.
+    Devuelve las tareas y el servidor creados para poder detenerlos al salir.
+    """
+    set_enabled(config["enabled"])
+    if not config["enabled"]:
+        return []
+
+    recursos = [asyncio.create_task(watch_event_loop(config["loop_lag_interval"]))]
+
+    if config["log_interval"] > 0:
+        recursos.append(asyncio.create_task(log_periodically(config["log_interval"])))
+
+    if config["port"]:
+        recursos.append(await start_metrics_server(config["host"], config["port"] + port_offset))
+
+    return recursos
+
+async def stop_metrics(recursos: List) -> None:
+    for recurso in recursos:
+        if isinstance(recurso, asyncio.Task):
+            recurso.cancel()
+        else:
+            recurso.close()
+            await recurso.wait_closed()
@@ -0,0 +1,111 @@
+"""
+Elección del modelo por turno. o4-mini es un modelo de razonamiento: tarda incluso para
+responder "gracias" o confirmar un celular. Los turnos simples de recolección de datos
+van a un modelo rápido; la fórmula, el consentimiento, los medicamentos, el resumen
+final y cualquier respuesta que los patrones no pudieron interpretar, al de razonamiento.
+"""
+import re
+from typing import Any, Dict, List, Optional
+
+from config import ConversationSteps, get_model_routing_config
+from core import metrics
+
+RAPIDO = "rapido"
+RAZONAMIENTO = "razonamiento"
+VISION = "vision"
+
+# Pasos en los que el asistente solo confirma un dato suelto y pide el siguiente
+PASOS_SIMPLES = frozenset([
+    ConversationSteps.ESPERANDO_CIUDAD,
+    ConversationSteps.ESPERANDO_CELULAR,
+    ConversationSteps.ESPERANDO_FECHA_NACIMIENTO,
+    ConversationSteps.ESPERANDO_REGIMEN,
+    ConversationSteps.ESPERANDO_DIRECCION,
+    ConversationSteps.ESPERANDO_FARMACIA,
+])
+
+# Preguntas, correcciones y quejas del usuario necesitan interpretación
+_MENSAJE_DIFICIL = re.compile(r"[?¿]|me equivoqu|correg|corrij|no es\b|cambi|por\s?qu[eé]|no entiendo|ayuda", re.I)
+
+_config: Optional[Dict[str, Any]] = None
+
+def get_config() -> Dict[str, Any]:
+    global _config
+    if _config is None:
+        _config = get_model_routing_config()
+    return _config
+
+def configurar(config: Dict[str, Any]) -> None:
+    """Reemplaza la configuración leída del ambiente (harness de carga)"""
+    global _config
+    _config = config
+
+def paso_actual(data: Dict[str, Any]) -> ConversationSteps:
+    """Lo próximo que el asistente tiene que pedir, según los datos ya recopilados"""
+    # Con la foto recibida y el OCR en curso se pide el consentimiento sin esperar la lectura
+    if not data.get("formula_data") and not data.get("awaiting_approval"):
+        return ConversationSteps.ESPERANDO_FORMULA
+    if not data.get("consented"):
+        return ConversationSteps.ESPERANDO_CONSENTIMIENTO
+    if not data.get("missing_meds") or data.get("missing_meds") == "[aún no especificado]":
+        return ConversationSteps.ESPERANDO_MEDICAMENTOS
+    if not data.get("city"):
+        return ConversationSteps.ESPERANDO_CIUDAD
+    if not data.get("cellphone"):
+        return ConversationSteps.ESPERANDO_CELULAR
+    if not data.get("birth_date"):
+        return ConversationSteps.ESPERANDO_FECHA_NACIMIENTO
+    if not data.get("affiliation_regime"):
+        return ConversationSteps.ESPERANDO_REGIMEN
+    if not data.get("residence_address"):
+        return ConversationSteps.ESPERANDO_DIRECCION
+    if not data.get("pharmacy"):
+        return ConversationSteps.ESPERANDO_FARMACIA
+    return ConversationSteps.COMPLETADO
+
+def elegir_nivel(data: Dict[str, Any], mensaje: Optional[str]) -> str:
+    """
+    RAPIDO solo si el usuario respondía a una pregunta simple, los patrones ya capturaron
+    ese dato (el paso avanzó), lo siguiente también es un dato simple y el mensaje es
+    corto y sin preguntas ni correcciones. Si no, RAZONAMIENTO.
+    """
+    config = get_config()
+    if not config["enabled"] or mensaje is None:
+        return RAZONAMIENTO
+    paso = paso_actual(data)
+    preguntado = data.get("paso_preguntado")
+    if paso not in PASOS_SIMPLES or preguntado not in {p.name for p in PASOS_SIMPLES}:
+        return RAZONAMIENTO
+    # Confianza de la extracción: si el dato pedido sigue faltando, el modelo tiene que interpretarlo
+    if preguntado == paso.name:
+        return RAZONAMIENTO
+    if len(mensaje) > config["max_chars"] or _MENSAJE_DIFICIL.search(mensaje):
+        return RAZONAMIENTO
+    return RAPIDO
+
+def modelos(nivel: str) -> List[str]:
+    """Modelos del nivel en orden de preferencia (el primero y sus respaldos)"""
+    niveles = get_config()["tiers"]
+    return niveles.get(nivel) or niveles[RAZONAMIENTO]
+
+def costo(modelo: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Costo en USD según MODEL_PRICES; 0 si el modelo no tiene precio configurado"""
+    entrada, salida = get_config()["prices"].get(modelo, (0.0, 0.0))
+    return (prompt_tokens * entrada + completion_tokens * salida) / 1_000_000
+
+def registrar_uso(nivel: str, modelo: str, segundos: float, usage: Any) -> None:
+    """Latencia, tokens y costo por nivel y modelo, para comparar los niveles"""
+    if not metrics.is_enabled():
+        return
+    registro = metrics.registry
+    registro.histogram("llm_tier_latency_seconds", "Duración de las completions por nivel y modelo",
+                       tier=nivel, model=modelo).observe(segundos)
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    ayuda = "Tokens por nivel, modelo y tipo"
+    registro.counter("llm_tier_tokens_total", ayuda, tier=nivel, model=modelo, kind="prompt").inc(prompt_tokens)
+    registro.counter("llm_tier_tokens_total", ayuda, tier=nivel, model=modelo, kind="completion").inc(completion_tokens)
+    registro.counter("llm_tier_cost_usd_total", "Costo estimado en USD por nivel y modelo",
+                     tier=nivel, model=modelo).inc(costo(modelo, prompt_tokens, completion_tokens))
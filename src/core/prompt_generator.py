@@ -172,7 +172,7 @@ En las próximas 24 horas, tramitaremos tu queja ante la EPS y te enviaré el n
         
         if not user_data.get("has_greeted", False):
             context += "- Saludar al usuario\n"
-        elif not user_data.get("formula_data"):
+        elif not user_data.get("formula_data") and not user_data.get("awaiting_approval"):
             context += "- Solicitar foto de fórmula médica\n"
         elif not user_data.get("consented"):
             context += "- Solicitar consentimiento para procesar datos\n"
@@ -216,5 +216,11 @@ En las próximas 24 horas, tramitaremos tu queja ante la EPS y te enviaré el n
             context += "- Medicamentos recetados:\n"
             for i, med in enumerate(medicamentos):
                 context += f"  {i+1}. {med}\n"
+        
+        # Queja reciente del mismo paciente por alguno de estos medicamentos (historial local)
+        repetida = user_data.get("queja_repetida")
+        if repetida:
+            context += (f"- Queja anterior: el {repetida['fecha']} ya se radicó una queja por {repetida['medicamentos']}. "
+                        "Infórmale al usuario y pregúntale si el medicamento sigue sin entregarse antes de radicar otra.\n")
                 
         return context
\ No newline at end of file
@@ -0,0 +1,71 @@
+"""
+Estado de las dependencias externas (OpenAI, Vision, BigQuery). El bot empieza a recibir
+updates sin esperarlas: main lanza las verificaciones en segundo plano y en paralelo, y
+este módulo guarda el resultado para /ready y la métrica dependency_up.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Dict, Optional
+
+from core.executor import run_blocking
+from core.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# None: verificación pendiente; True/False: resultado de la última
+_estado: Dict[str, Optional[bool]] = {}
+_errores: Dict[str, str] = {}
+
+def esta_listo() -> bool:
+    return bool(_estado) and all(_estado.values())
+
+def estado() -> Dict[str, Any]:
+    return {
+        "listo": esta_listo(),
+        "dependencias": {
+            nombre: "pendiente" if ok is None else "ok" if ok else _errores.get(nombre, "error")
+            for nombre, ok in _estado.items()
+        },
+    }
+
+def _registrar(nombre: str, ok: bool, error: str = "") -> None:
+    _estado[nombre] = ok
+    if error:
+        _errores[nombre] = error
+    else:
+        _errores.pop(nombre, None)
+    registry.gauge("dependency_up", "1 si la última verificación de la dependencia fue exitosa", dependency=nombre).set(1 if ok else 0)
+
+async def _verificar(nombre: str, verificacion: Callable[[], Any], timeout: float, reintento: float) -> None:
+    while True:
+        inicio = time.perf_counter()
+        try:
+            # Las verificaciones son bloqueantes (y crean los clientes): van al pool de I/O
+            await asyncio.wait_for(run_blocking(verificacion), timeout)
+            _registrar(nombre, True)
+            logger.info(f"Dependencia {nombre} verificada en {time.perf_counter() - inicio:.2f} s")
+            return
+        except asyncio.TimeoutError:
+            _registrar(nombre, False, f"sin respuesta en {timeout:.0f} s")
+        except Exception as e:
+            _registrar(nombre, False, str(e) or type(e).__name__)
+        logger.error(f"⚠️ Dependencia {nombre} no disponible: {_errores[nombre]}")
+        if reintento <= 0:
+            return
+        await asyncio.sleep(reintento)
+
+async def verificar_dependencias(verificaciones: Dict[str, Callable[[], Any]], timeout: float = 10.0,
+                                 reintento: float = 30.0) -> bool:
+    """
+    Corre todas las verificaciones a la vez. Las que fallan se reintentan cada `reintento`
+    segundos (0: no se reintentan) hasta que pasan; devuelve si quedaron todas listas.
+    """
+    for nombre in verificaciones:
+        _estado.setdefault(nombre, None)
+    await asyncio.gather(*(
+        _verificar(nombre, verificacion, timeout, reintento) for nombre, verificacion in verificaciones.items()
+    ))
+    if esta_listo():
+        logger.info("✅ Todas las dependencias verificadas")
+    return esta_listo()
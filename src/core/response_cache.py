@@ -0,0 +1,216 @@
+"""
+Caché de respuestas para preguntas libres frecuentes ("¿cuánto se demora?", "¿qué es el
+régimen?"). La clave es la pregunta normalizada más el paso de la conversación; las
+preguntas parecidas se encuentran con MinHash y LSH sobre trigramas de caracteres, sin
+embeddings. Solo se guardan respuestas que no mencionan datos del usuario, salvo su
+primer nombre, que se reemplaza por el de quien pregunta.
+"""
+import hashlib
+import logging
+import random
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from config import get_response_cache_config
+from core.metrics import count, registry
+from core.templates import MARCADORES_NOMBRE
+
+logger = logging.getLogger(__name__)
+
+NOMBRE = "{primer_nombre}"
+
+_PRIMO = (1 << 61) - 1
+_INTERROGATIVAS = re.compile(r"^\s*(qu[eé]|cu[aá]nto|cu[aá]ndo|c[oó]mo|cu[aá]l|d[oó]nde|por\s?qu[eé]|para\s+qu[eé]|qui[eé]n)\b", re.I)
+_NO_ALFANUMERICO = re.compile(r"[^a-z0-9ñ ]+")
+_ESPACIOS = re.compile(r"\s+")
+_VACIAS = frozenset(["que", "los", "las", "del", "por", "para", "con", "una", "unos", "mis", "tus", "sus",
+                     "esta", "este", "eso", "esto", "ese", "esa", "hay", "pero", "muy"])
+# Palabras de los datos que también aparecen en cualquier respuesta del formulario
+_GENERICAS = frozenset(["calle", "carrera", "avenida", "diagonal", "transversal", "farmacia", "sede",
+                        "drogueria", "contributivo", "subsidiado", "regimen"])
+
+def normalizar(texto: str) -> str:
+    """Minúsculas, sin tildes ni signos: '¿Cuánto se DEMORA?' -> 'cuanto se demora'"""
+    texto = unicodedata.normalize("NFKD", texto.lower().replace("ñ", "\0"))
+    texto = "".join(c for c in texto if not unicodedata.combining(c)).replace("\0", "ñ")
+    return _ESPACIOS.sub(" ", _NO_ALFANUMERICO.sub(" ", texto)).strip()
+
+def trigramas(texto: str) -> FrozenSet[str]:
+    relleno = f" {normalizar(texto)} "
+    return frozenset(relleno[i:i + 3] for i in range(len(relleno) - 2))
+
+def raices(texto: str) -> FrozenSet[str]:
+    """Primeras cinco letras de las palabras con contenido: 'demoran' y 'demora' cuentan igual"""
+    return frozenset(palabra[:5] for palabra in normalizar(texto).split() if len(palabra) >= 3 and palabra not in _VACIAS)
+
+def nombre_valido(primer_nombre: str) -> bool:
+    """
+    Si el nombre se puede usar como plantilla: al menos tres letras y no un valor de relleno.
+    Un nombre corto o un marcador ("No" de "No visible") coincide con palabras comunes
+    de cualquier respuesta ("No te preocupes").
+    """
+    return len(primer_nombre) >= 3 and primer_nombre.isalpha() and primer_nombre.lower() not in MARCADORES_NOMBRE
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+class _Entrada:
+    __slots__ = ("estado", "trigramas", "raices", "bandas", "respuesta", "creada", "aciertos")
+
+    def __init__(self, estado: str, grams: FrozenSet[str], palabras: FrozenSet[str], bandas: List[Tuple[int, ...]],
+                 respuesta: str):
+        self.estado = estado
+        self.trigramas = grams
+        self.raices = palabras
+        self.bandas = bandas
+        self.respuesta = respuesta
+        self.creada = time.monotonic()
+        self.aciertos = 0
+
+class SemanticCache:
+    """
+    LRU con TTL. Cada entrada tiene una firma MinHash partida en bandas; dos preguntas
+    son candidatas si coinciden en alguna banda (en el mismo paso), y se acepta la de
+    mayor similitud de Jaccard exacta si supera el umbral. Las palabras con contenido
+    también deben coincidir en su mayoría: "¿qué es la EPS?" no responde "¿qué es la IPS?".
+    """
+
+    def __init__(self, capacidad: int = 2000, ttl: float = 86400.0, umbral: float = 0.6,
+                 max_chars: int = 160, permutaciones: int = 64, bandas: int = 16):
+        self.capacidad = capacidad
+        self.ttl = ttl
+        self.umbral = umbral
+        self.max_chars = max_chars
+        self.filas = permutaciones // bandas
+        # Coeficientes fijos: la misma pregunta da la misma firma en todos los procesos
+        generador = random.Random(61)
+        self._coeficientes = [(generador.randrange(1, _PRIMO), generador.randrange(_PRIMO)) for _ in range(permutaciones)]
+        self._entradas: "OrderedDict[int, _Entrada]" = OrderedDict()
+        self._cubetas: Dict[Tuple[str, int, Tuple[int, ...]], set] = {}
+        self._siguiente = 0
+
+    def es_pregunta(self, mensaje: Optional[str]) -> bool:
+        if not mensaje or len(mensaje) > self.max_chars:
+            return False
+        return "?" in mensaje or "¿" in mensaje or bool(_INTERROGATIVAS.match(mensaje))
+
+    def _bandas(self, grams: Iterable[str]) -> List[Tuple[int, ...]]:
+        valores = [int.from_bytes(hashlib.blake2b(g.encode("utf-8"), digest_size=8).digest(), "big") for g in grams]
+        firma = [min((a * v + b) % _PRIMO for v in valores) for a, b in self._coeficientes]
+        return [tuple(firma[i:i + self.filas]) for i in range(0, len(firma), self.filas)]
+
+    def _quitar(self, clave: int) -> None:
+        entrada = self._entradas.pop(clave)
+        for indice, banda in enumerate(entrada.bandas):
+            cubeta = self._cubetas.get((entrada.estado, indice, banda))
+            if cubeta is not None:
+                cubeta.discard(clave)
+                if not cubeta:
+                    del self._cubetas[(entrada.estado, indice, banda)]
+
+    def buscar(self, pregunta: str, estado: str, primer_nombre: str = "") -> Optional[str]:
+        """Respuesta guardada para una pregunta parecida en el mismo paso, con el nombre de quien pregunta"""
+        if not nombre_valido(primer_nombre):
+            # Solo respuestas que no llevan nombre
+            primer_nombre = ""
+        grams = trigramas(pregunta)
+        palabras = raices(pregunta)
+        bandas = self._bandas(grams)
+        candidatas = set()
+        for indice, banda in enumerate(bandas):
+            candidatas |= self._cubetas.get((estado, indice, banda), set())
+
+        mejor, similitud = None, self.umbral
+        ahora = time.monotonic()
+        for clave in candidatas:
+            entrada = self._entradas[clave]
+            if ahora - entrada.creada > self.ttl:
+                self._quitar(clave)
+                count("response_cache_evictions_total", help="Entradas retiradas de la caché de respuestas", motivo="ttl")
+                continue
+            parecido = jaccard(grams, entrada.trigramas)
+            if (parecido >= similitud and jaccard(palabras, entrada.raices) >= 0.5
+                    and (primer_nombre or NOMBRE not in entrada.respuesta)):
+                mejor, similitud = clave, parecido
+
+        if mejor is None:
+            count("response_cache_lookups_total", help="Consultas a la caché de respuestas", resultado="miss")
+            return None
+        entrada = self._entradas[mejor]
+        entrada.aciertos += 1
+        self._entradas.move_to_end(mejor)
+        count("response_cache_lookups_total", help="Consultas a la caché de respuestas", resultado="hit")
+        registry.histogram("response_cache_similarity", "Similitud de Jaccard de los aciertos de la caché",
+                           buckets=(0.6, 0.7, 0.8, 0.9, 0.95, 1.0)).observe(similitud)
+        return entrada.respuesta.replace(NOMBRE, primer_nombre)
+
+    def guardar(self, pregunta: str, estado: str, respuesta: str, data: Dict[str, Any], primer_nombre: str = "") -> bool:
+        """Guarda la respuesta si no menciona datos del usuario; el primer nombre queda como plantilla"""
+        if menciona_datos(respuesta, data, primer_nombre):
+            return False
+        if primer_nombre:
+            # Solo se reemplaza el nombre que dio el usuario, escrito como nombre propio
+            propio = normalizar(data.get("name") or "").split()[:1] == [normalizar(primer_nombre)]
+            if propio and nombre_valido(primer_nombre):
+                respuesta = re.sub(rf"\b{re.escape(primer_nombre)}\b", NOMBRE, respuesta)
+            # Si la palabra sigue en la respuesta (escrita de otra forma o sin reemplazar) no se comparte
+            if f" {normalizar(primer_nombre)} " in f" {normalizar(respuesta)} ":
+                return False
+
+        grams = trigramas(pregunta)
+        bandas = self._bandas(grams)
+        clave = self._siguiente
+        self._siguiente += 1
+        self._entradas[clave] = _Entrada(estado, grams, raices(pregunta), bandas, respuesta)
+        for indice, banda in enumerate(bandas):
+            self._cubetas.setdefault((estado, indice, banda), set()).add(clave)
+        while len(self._entradas) > self.capacidad:
+            self._quitar(next(iter(self._entradas)))
+            count("response_cache_evictions_total", help="Entradas retiradas de la caché de respuestas", motivo="lru")
+        registry.gauge("response_cache_entries", "Entradas en la caché de respuestas").set(len(self._entradas))
+        return True
+
+    def estadisticas(self, top: int = 10) -> List[Dict[str, Any]]:
+        """Entradas con más aciertos: aciertos totales y por hora desde que se guardaron"""
+        ahora = time.monotonic()
+        filas = [
+            {
+                "estado": entrada.estado,
+                "respuesta": entrada.respuesta[:60],
+                "aciertos": entrada.aciertos,
+                "aciertos_por_hora": entrada.aciertos / max((ahora - entrada.creada) / 3600, 1 / 60),
+            }
+            for entrada in self._entradas.values()
+        ]
+        return sorted(filas, key=lambda fila: fila["aciertos"], reverse=True)[:top]
+
+def _datos(data: Dict[str, Any]) -> Iterable[str]:
+    for campo in ("name", "city", "cellphone", "birth_date", "residence_address", "pharmacy", "eps"):
+        yield data.get(campo) or ""
+    formula = data.get("formula_data") or {}
+    for campo in ("paciente", "numero_documento", "doctor", "ips", "diagnostico", "eps"):
+        yield formula.get(campo) or ""
+    for medicamento in formula.get("medicamentos") or []:
+        # Basta con el nombre del medicamento: la respuesta rara vez repite la línea completa
+        yield (medicamento.split() or [""])[0]
+
+def menciona_datos(respuesta: str, data: Dict[str, Any], primer_nombre: str = "") -> bool:
+    """Si la respuesta menciona algún dato de la sesión (fuera del primer nombre) no se puede compartir"""
+    texto = f" {normalizar(respuesta)} "
+    propio = normalizar(primer_nombre)
+    for valor in _datos(data):
+        for parte in normalizar(str(valor)).split():
+            if len(parte) >= 4 and parte != propio and parte not in _GENERICAS and f" {parte} " in texto:
+                return True
+    return False
+
+def crear_cache() -> Optional[SemanticCache]:
+    """Caché según RESPONSE_CACHE_*; None si está desactivada"""
+    config = get_response_cache_config()
+    if not config["enabled"]:
+        return None
+    return SemanticCache(capacidad=config["size"], ttl=config["ttl"], umbral=config["threshold"],
+                         max_chars=config["max_chars"])
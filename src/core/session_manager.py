@@ -1,16 +1,37 @@
 import time
 import logging
-from typing import Dict, Any
+from typing import Dict, Any, Iterable, Set
+
+from core.conversation_history import ConversationHistory
 
 logger = logging.getLogger(__name__)
 
 user_sessions: Dict[str, Dict[str, Any]] = {}
 
+# Usuarios cuya sesión cambió desde la última instantánea (services.session_snapshot)
+_modificadas: Set[str] = set()
+
+def marcar_modificada(user_id: str) -> None:
+    """Sube la versión de la sesión para que la próxima instantánea la escriba"""
+    sesion = user_sessions.get(user_id)
+    if sesion is not None:
+        sesion["version"] = sesion.get("version", 0) + 1
+        _modificadas.add(user_id)
+
+def marcar_pendientes(user_ids: Iterable[str]) -> None:
+    _modificadas.update(user_ids)
+
+def tomar_modificadas() -> Set[str]:
+    global _modificadas
+    modificadas, _modificadas = _modificadas, set()
+    return modificadas
+
 def get_user_session(user_id: str) -> Dict[str, Any]:
     
     if user_id not in user_sessions:
         user_sessions[user_id] = {
             "session_id": f"telegram-session-{user_id}-{int(time.time())}",
+            "version": 0,
             "data": {
                 "user_id": user_id,
                 "name": "",
@@ -20,7 +41,7 @@ def get_user_session(user_id: str) -> Dict[str, Any]:
                 "formula_data": None,
                 "missing_meds": None,
                 "pending_media": None,
-                "conversation_history": [],
+                "conversation_history": ConversationHistory(),
                 "last_interaction": time.time(),
                 "awaiting_approval": False,
                 "context_variables": {},
@@ -38,13 +59,13 @@ def get_user_session(user_id: str) -> Dict[str, Any]:
                     "id": f"{user_id}_{int(time.time())}",
                     "guardada": False
                 },
-                "quejas_anteriores": [],
-                "patient_history": {}
+                "quejas_anteriores": []
             }
         }
-        logger.info(f"Nueva sesión creada para {user_id}: {user_sessions[user_id]['session_id']}")
+        logger.info("Nueva sesión creada para %s: %s", user_id, user_sessions[user_id]['session_id'], extra={"event": "sesion.creada"})
     else:
         user_sessions[user_id]["data"]["last_interaction"] = time.time()
+    marcar_modificada(user_id)
     
     return user_sessions[user_id]
 
@@ -54,7 +75,6 @@ def reset_session(user_session: Dict[str, Any]) -> None:
     previous_name = user_session["data"]["name"]
     previous_conversation_history = user_session["data"]["conversation_history"]
     previous_quejas = user_session["data"]["quejas_anteriores"] or []
-    previous_patient_history = user_session["data"].get("patient_history", {})
 
     user_session["data"] = {
         "user_id": previous_user_id,
@@ -83,8 +103,7 @@ def reset_session(user_session: Dict[str, Any]) -> None:
             "id": f"{previous_user_id}_{int(time.time())}",
             "guardada": False
         },
-        "quejas_anteriores": previous_quejas,
-        "patient_history": previous_patient_history
+        "quejas_anteriores": previous_quejas
     }
 
 def iniciar_nueva_queja(user_session: Dict[str, Any], user_id: str) -> None:
@@ -109,12 +128,14 @@ def iniciar_nueva_queja(user_session: Dict[str, Any], user_id: str) -> None:
     user_session["data"]["eps"] = ''
     user_session["data"]["formula_data"] = None
     user_session["data"]["missing_meds"] = None
+    user_session["data"]["queja_repetida"] = None
     user_session["data"]["process_completed"] = False
     user_session["data"]["birth_date"] = ''
     user_session["data"]["affiliation_regime"] = ''
     user_session["data"]["residence_address"] = ''
     user_session["data"]["pharmacy"] = ''
     user_session["data"]["cellphone"] = ''
+    user_session["data"]["paso_preguntado"] = None
     user_session["data"]["last_interaction"] = time.time()
     
     # Restauramos el nombre del paciente si teníamos uno
@@ -126,7 +147,7 @@ def actualizar_datos_contexto(user_session: Dict[str, Any], tipo: str, valor: st
     if not valor or not valor.strip():
         return
     
-    logger.info(f"Actualizando {tipo}: {valor}")
+    logger.debug("Actualizando %s: %s", tipo, valor, extra={"event": "contexto.actualizado", "campo": tipo})
     
     data = user_session["data"]
     
@@ -0,0 +1,147 @@
+import asyncio
+import bisect
+import hashlib
+import logging
+import multiprocessing
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class ConsistentHashRing:
+    """Anillo de hash consistente que asigna cada usuario a un worker de forma estable"""
+
+    def __init__(self, num_nodes: int, replicas: int = 128):
+        if num_nodes < 1:
+            raise ValueError("Se necesita al menos un nodo en el anillo")
+
+        self.num_nodes = num_nodes
+        self._ring: List[Tuple[int, int]] = []
+
+        # Cada nodo ocupa varias posiciones virtuales para repartir mejor la carga
+        for node in range(num_nodes):
+            for replica in range(replicas):
+                self._ring.append((self._hash(f"worker-{node}#{replica}"), node))
+
+        self._ring.sort()
+        self._keys = [position for position, _ in self._ring]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        # hash() de Python cambia entre procesos; necesitamos un valor estable
+        return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+    def node_for(self, key: Any) -> int:
+        """Devuelve el índice del worker dueño de la clave"""
+        index = bisect.bisect(self._keys, self._hash(str(key)))
+        if index == len(self._keys):
+            index = 0
+        return self._ring[index][1]
+
+class WorkerSupervisor:
+    """
+    Lanza N procesos worker, reparte los updates por usuario con hash consistente
+    y reinicia los workers que terminen inesperadamente.
+    """
+
+    def __init__(self, num_workers: int, target: Callable, args: Tuple = (), restart_delay: float = 1.0, max_restart_delay: float = 30.0):
+        self.num_workers = num_workers
+        self.target = target
+        self.args = args
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+
+        # spawn evita heredar el event loop y los clientes HTTP del proceso receptor
+        self._ctx = multiprocessing.get_context("spawn")
+        self.ring = ConsistentHashRing(num_workers)
+
+        # Las colas viven en el supervisor: si un worker se cae, sus mensajes pendientes
+        # siguen esperando en la cola hasta que el reemplazo arranque
+        self.queues = [self._ctx.Queue() for _ in range(num_workers)]
+        self._processes: List[Optional[multiprocessing.Process]] = [None] * num_workers
+        self._restarts: Dict[int, int] = {}
+        self._started_at: Dict[int, float] = {}
+        # Workers caídos esperando su backoff: índice -> momento del reinicio (monotonic)
+        self._restart_at: Dict[int, float] = {}
+        self._stopping = False
+
+    def _spawn(self, index: int) -> multiprocessing.Process:
+        # No daemon: un proceso daemon no puede crear hijos y el pool de CPU del worker
+        # (CPU_EXECUTOR=process) los necesita. stop() los espera o los termina
+        process = self._ctx.Process(
+            target=self.target,
+            args=(index, self.queues[index]) + tuple(self.args),
+            name=f"bot-worker-{index}",
+            daemon=False
+        )
+        process.start()
+        self._started_at[index] = time.monotonic()
+        logger.info(f"Worker {index} iniciado (pid {process.pid})")
+        return process
+
+    def start(self) -> None:
+        for index in range(self.num_workers):
+            self._processes[index] = self._spawn(index)
+
+    def worker_for(self, user_id: Any) -> int:
+        return self.ring.node_for(user_id)
+
+    def dispatch(self, user_id: Any, payload: Any) -> int:
+        """Encola el payload en el worker dueño del usuario y devuelve su índice"""
+        index = self.worker_for(user_id)
+        self.queues[index].put(payload)
+        return index
+
+    async def supervise(self, check_interval: float = 1.0) -> None:
+        """
+        Revisa periódicamente los workers y reinicia los que hayan terminado. Cada reinicio
+        tiene su propio momento ("reiniciar en"): el backoff de un worker no demora la
+        revisión ni el reinicio de los demás.
+        """
+        while not self._stopping:
+            ahora = time.monotonic()
+            for index, process in enumerate(self._processes):
+                if self._stopping:
+                    break
+                if process is None:
+                    if index in self._restart_at and ahora >= self._restart_at[index]:
+                        del self._restart_at[index]
+                        self._processes[index] = self._spawn(index)
+                    continue
+                if process.is_alive():
+                    continue
+
+                # Un worker que estuvo estable un buen rato vuelve a empezar el backoff
+                if ahora - self._started_at.get(index, 0) > self.max_restart_delay * 2:
+                    self._restarts[index] = 0
+
+                restarts = self._restarts.get(index, 0)
+                delay = min(self.restart_delay * (2 ** restarts), self.max_restart_delay)
+                logger.warning(f"Worker {index} terminó con código {process.exitcode}. Reiniciando en {delay:.1f}s")
+                self._restarts[index] = restarts + 1
+
+                self._processes[index] = None
+                self._restart_at[index] = ahora + delay
+
+            espera = check_interval
+            if self._restart_at:
+                espera = min(espera, max(min(self._restart_at.values()) - time.monotonic(), 0))
+            await asyncio.sleep(espera)
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Pide a cada worker que termine de procesar su cola y espera a que salga"""
+        self._stopping = True
+
+        for queue in self.queues:
+            queue.put(None)
+
+        for index, process in enumerate(self._processes):
+            if process is None:
+                continue
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning(f"Worker {index} no terminó a tiempo, forzando cierre")
+                process.terminate()
+                process.join(1)
+
+        logger.info("Todos los workers fueron detenidos")
@@ -0,0 +1,142 @@
+import json
+import logging
+import logging.handlers
+import queue
+import re
+import sys
+from typing import Any, Dict, Optional
+
+# Atributos propios de LogRecord; todo lo demás llega por `extra` y se exporta como campo
+_ATRIBUTOS_ESTANDAR = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_PRIMITIVOS = (str, int, float, bool, type(None))
+
+# Campos que nunca deben llegar al log en claro cuando vienen como `extra`
+CAMPOS_PII = {"valor", "cellphone", "telefono", "celular", "residence_address", "direccion",
+              "birth_date", "fecha_nacimiento", "numero_documento", "paciente"}
+
+_PATRONES_PII = [
+    # Correos electrónicos
+    (re.compile(r"[\w.+-]+@[\w-]+\.[\w.]+"), "[correo]"),
+    # Direcciones colombianas: Calle 10 # 20-30, Cra 7 No 45-12, Av. 68 ...
+    (re.compile(r"\b(?:calle|cll?|carrera|cra|kr|kra|avenida|av|diagonal|dg|transversal|tv)\.?\s*\d+[a-z]?\s*(?:#|no\.?|n°)?\s*[\d\w-]*(?:\s*-\s*\d+)?", re.I), "[direccion]"),
+    # Celulares, documentos y cualquier secuencia larga de dígitos
+    (re.compile(r"(?<!\d)(?:\+?57\s?)?\d[\d\s-]{5,}\d(?!\d)"), "[numero]"),
+    # Fechas completas (fechas de nacimiento)
+    (re.compile(r"\b\d{1,2}[/-]\d{1,2}[/-]\d{2,4}\b"), "[fecha]"),
+]
+
+def redactar(texto: str) -> str:
+    for patron, reemplazo in _PATRONES_PII:
+        texto = patron.sub(reemplazo, texto)
+    return texto
+
+class PiiRedactionFilter(logging.Filter):
+    """Enmascara teléfonos, documentos, direcciones, correos y fechas en el mensaje y en los campos extra"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.msg = redactar(record.getMessage())
+        record.args = None
+
+        for campo in CAMPOS_PII & set(vars(record)):
+            setattr(record, campo, "[redactado]")
+
+        return True
+
+class SamplingFilter(logging.Filter):
+    """
+    Deja pasar 1 de cada N registros por evento. El evento es el campo `event`
+    de `extra` o, si no existe, la plantilla del mensaje. WARNING y superiores
+    siempre pasan.
+    """
+
+    def __init__(self, tasas: Dict[str, float]):
+        super().__init__()
+        self._cada = {evento: max(1, round(1 / tasa)) for evento, tasa in tasas.items() if tasa > 0}
+        self._descartar = {evento for evento, tasa in tasas.items() if tasa <= 0}
+        self._contadores: Dict[str, int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+
+        evento = getattr(record, "event", None) or record.msg
+        if evento in self._descartar:
+            return False
+
+        cada = self._cada.get(evento)
+        if cada is None:
+            return True
+
+        contador = self._contadores.get(evento, 0)
+        self._contadores[evento] = contador + 1
+        return contador % cada == 0
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler que no formatea en el hilo que registra el evento: el mensaje se
+    arma en el hilo del QueueListener. Solo los argumentos no primitivos se
+    convierten a texto aquí, para que cambios posteriores no alteren el registro.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.args:
+            if isinstance(record.args, tuple):
+                record.args = tuple(arg if isinstance(arg, _PRIMITIVOS) else repr(arg) for arg in record.args)
+            elif isinstance(record.args, dict):
+                record.args = {clave: valor if isinstance(valor, _PRIMITIVOS) else repr(valor) for clave, valor in record.args.items()}
+        return record
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entrada: Dict[str, Any] = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+
+        for clave, valor in vars(record).items():
+            if clave not in _ATRIBUTOS_ESTANDAR and not clave.startswith("_"):
+                entrada[clave] = valor if isinstance(valor, _PRIMITIVOS) else repr(valor)
+
+        if record.exc_info:
+            entrada["exc"] = self.formatException(record.exc_info)
+
+        return json.dumps(entrada, ensure_ascii=False)
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+def configure_logging(config: Dict[str, Any], stream=None) -> Optional[logging.handlers.QueueListener]:
+    """
+    Reconfigura el logger raíz. En modo asíncrono los registros pasan por una cola
+    y un hilo aparte hace el formateo, la redacción y la escritura. Devuelve el
+    QueueListener para detenerlo al salir (None en modo síncrono).
+    """
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(config["level"])
+
+    salida = logging.StreamHandler(stream or sys.stderr)
+    salida.setFormatter(JsonFormatter() if config["format"] == "json" else logging.Formatter(TEXT_FORMAT))
+    if config["redact_pii"]:
+        salida.addFilter(PiiRedactionFilter())
+
+    muestreo = SamplingFilter(config["sampling"]) if config["sampling"] else None
+
+    if not config["async"]:
+        if muestreo:
+            salida.addFilter(muestreo)
+        root.addHandler(salida)
+        return None
+
+    entrada = LazyQueueHandler(queue.SimpleQueue())
+    if muestreo:
+        # El muestreo se aplica antes de encolar para que lo descartado no cueste nada
+        entrada.addFilter(muestreo)
+    root.addHandler(entrada)
+
+    listener = logging.handlers.QueueListener(entrada.queue, salida, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -0,0 +1,157 @@
+import logging
+import time
+import zlib
+from string import Formatter
+from typing import Any, Dict, List
+
+from config import (
+    MENSAJE_REINICIO, MENSAJE_AYUDA, MENSAJE_FORMULA_PERDIDA, MENSAJE_CONSENTIMIENTO_NEGADO,
+    MENSAJE_FORMULA_MAL_LEIDA, MENSAJE_CONSENTIMIENTO, ConversationSteps, get_templates_config
+)
+from core.json_parser import NO_VISIBLE
+from core.metrics import count
+from core.model_router import paso_actual
+
+logger = logging.getLogger(__name__)
+
+COMPLETIONS_EVITADAS = "llm_completions_avoided_total"
+
+# Variantes por mensaje. Las que usan {primer_nombre} solo se eligen si se conoce el nombre
+PLANTILLAS: Dict[str, List[str]] = {
+    "reinicio": [
+        MENSAJE_REINICIO,
+        "Listo {primer_nombre}, empecemos de nuevo. 🔄 Envíame una foto clara de la fórmula médica de los medicamentos que no te entregaron. 📋📸",
+        "¡Claro! Borré lo que llevábamos y empezamos otra vez. 🔄 Cuando quieras, envíame la foto de tu fórmula médica. 📋📸",
+    ],
+    "ayuda": [
+        MENSAJE_AYUDA,
+        "Hola {primer_nombre} 👋 Estoy aquí para radicar tu queja por medicamentos no entregados. 💊\n\nPara continuar necesito: {campos_faltantes}.\n\nSi quieres empezar de nuevo escribe /reset. 🔄",
+    ],
+    "formula_perdida": [
+        MENSAJE_FORMULA_PERDIDA,
+    ],
+    "consentimiento_negado": [
+        MENSAJE_CONSENTIMIENTO_NEGADO,
+        "Entiendo {primer_nombre}, respeto tu decisión. 🙏 Sin tu autorización no puedo procesar la fórmula, así que no guardé ningún dato. Si cambias de opinión, envíame de nuevo la foto. 📋",
+    ],
+    "error_imagen": [
+        MENSAJE_FORMULA_MAL_LEIDA,
+        "Uy, no logré leer la fórmula. 🔍 ¿Me envías otra foto? Procura que esté bien iluminada, enfocada y que se vea completa. 📸✨",
+    ],
+    "historial": [
+        "Estas son tus quejas registradas: 📋\n\n{quejas}\n\nSi quieres radicar una nueva, envíame una foto clara de la fórmula médica. 📸",
+        "{primer_nombre}, este es tu historial de quejas: 📋\n\n{quejas}\n\n¿Te ayudo con una nueva? Envíame la foto de tu fórmula. 📸",
+    ],
+    "historial_vacio": [
+        "Todavía no tengo quejas registradas a tu nombre. 📋 Si quieres radicar una, envíame una foto clara de tu fórmula médica. 📸",
+    ],
+    # Respaldo cuando el LLM no responde a tiempo (siempre locales, no dependen de LOCAL_TEMPLATES)
+    "demora": [
+        "Disculpa la demora 🙏 Para continuar con tu queja necesito {campos_faltantes}. ¿Me ayudas con eso? 😊",
+        "{primer_nombre}, perdona la espera. 🙏 Sigamos con tu queja: necesito {campos_faltantes}. 📝",
+    ],
+    "demora_consentimiento": [
+        MENSAJE_CONSENTIMIENTO,
+    ],
+    "demora_resumen": [
+        "¡Perfecto! Ya tengo toda la información. En las próximas 24 horas, tramitaremos tu queja ante la EPS y te enviaré el número de radicado por este mismo chat. 📄 ¿Hay algo más en lo que pueda ayudarte? 😊",
+    ],
+}
+
+_RESPALDO_POR_PASO = {
+    ConversationSteps.ESPERANDO_CONSENTIMIENTO: "demora_consentimiento",
+    ConversationSteps.COMPLETADO: "demora_resumen",
+}
+
+# Mensajes que se activan o desactivan junto con otro en LOCAL_TEMPLATES
+_INTERRUPTOR = {"historial_vacio": "historial"}
+
+# Campos pendientes en el mismo orden en que el asistente los pide
+CAMPOS = [
+    ("formula_data", "una foto clara de tu fórmula médica"),
+    ("missing_meds", "los medicamentos que no te entregaron"),
+    ("city", "tu ciudad"),
+    ("cellphone", "tu número de celular"),
+    ("birth_date", "tu fecha de nacimiento"),
+    ("affiliation_regime", "tu régimen de afiliación"),
+    ("residence_address", "tu dirección"),
+    ("pharmacy", "la farmacia donde no te entregaron"),
+]
+
+_SLOTS = {
+    clave: [{campo for _, campo, _, _ in Formatter().parse(variante) if campo} for variante in variantes]
+    for clave, variantes in PLANTILLAS.items()
+}
+
+# Valores de relleno que no son un nombre: una fórmula ilegible deja "No visible"
+MARCADORES_NOMBRE = frozenset(
+    marcador.lower() for marcador in (NO_VISIBLE, "[aún no especificado]", "No disponible", "No proporcionada")
+)
+
+def primer_nombre(data: Dict[str, Any]) -> str:
+    """Primer nombre del usuario; "" si no se conoce (vacío, marcador de relleno o sin letras)"""
+    nombre = (data.get("name") or "").strip()
+    if not nombre or nombre.lower() in MARCADORES_NOMBRE:
+        return ""
+    primero = nombre.split()[0]
+    return primero.capitalize() if primero.isalpha() else ""
+
+def campos_faltantes(data: Dict[str, Any]) -> str:
+    faltantes = [
+        etiqueta for campo, etiqueta in CAMPOS
+        if not data.get(campo) or data.get(campo) == "[aún no especificado]"
+    ]
+    if not faltantes:
+        return "confirmar los datos de tu queja"
+    if len(faltantes) > 3:
+        # Los primeros tres bastan: el asistente los va pidiendo uno a uno
+        return ", ".join(faltantes[:3]) + " y otros datos de contacto"
+    if len(faltantes) > 1:
+        return ", ".join(faltantes[:-1]) + " y " + faltantes[-1]
+    return faltantes[0]
+
+def lista_quejas(quejas: List[Dict[str, Any]]) -> str:
+    """Una línea por queja del historial local: fecha, medicamentos y farmacia"""
+    lineas = []
+    for queja in quejas:
+        linea = f"• {time.strftime('%d/%m/%Y', time.localtime(queja['fecha']))}: {queja.get('medicamentos') or 'medicamentos no especificados'}"
+        if queja.get("farmacia") and queja["farmacia"] != "No disponible":
+            linea += f" ({queja['farmacia']})"
+        lineas.append(linea)
+    return "\n".join(lineas)
+
+def usa_plantilla(clave: str) -> bool:
+    return clave in PLANTILLAS and _INTERRUPTOR.get(clave, clave) in get_templates_config()["locales"]
+
+def render(clave: str, user_session: Dict[str, Any], **extra: str) -> str:
+    """Elige una variante del mensaje y llena sus espacios con los datos de la sesión"""
+    data = user_session["data"]
+    valores = {"primer_nombre": primer_nombre(data), "campos_faltantes": campos_faltantes(data), **extra}
+
+    candidatas = [
+        variante for variante, slots in zip(PLANTILLAS[clave], _SLOTS[clave])
+        if all(valores.get(slot) for slot in slots)
+    ]
+    # La variante depende de la sesión y del turno: estable para pruebas, distinta entre turnos
+    # (`total` sigue creciendo aunque el historial ya esté lleno)
+    semilla = f"{user_session.get('session_id', '')}:{data['conversation_history'].total}"
+    variante = candidatas[zlib.crc32(semilla.encode("utf-8")) % len(candidatas)]
+    return variante.format(**valores)
+
+def respaldo(user_session: Dict[str, Any]) -> str:
+    """Respuesta local para un turno de chat cuyo LLM no respondió a tiempo: pide lo siguiente que falta"""
+    return render(_RESPALDO_POR_PASO.get(paso_actual(user_session["data"]), "demora"), user_session)
+
+async def responder(clave: str, user_session: Dict[str, Any], openai_service, **extra: str) -> str:
+    """
+    Responde un mensaje fijo con su plantilla local o, si está desactivada en
+    LOCAL_TEMPLATES, con el LLM como antes. El historial queda igual en ambos casos.
+    """
+    if not usa_plantilla(clave):
+        return await openai_service.ask_openai(user_session)
+
+    respuesta = render(clave, user_session, **extra)
+    user_session["data"]["conversation_history"].append({"role": "assistant", "content": respuesta})
+    count(COMPLETIONS_EVITADAS, help="Respuestas servidas con plantillas locales en lugar del LLM", mensaje=clave)
+    logger.debug("Respuesta local para %s", clave, extra={"event": "plantilla.respuesta", "mensaje": clave})
+    return respuesta
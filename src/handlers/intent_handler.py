@@ -1,77 +1,168 @@
+import asyncio
 import logging
 import re
-from typing import Dict, Any, Optional
+import time
+from typing import Awaitable, Dict, Any, Optional
 from core.session_manager import actualizar_datos_contexto
 from core.data_extractor import DataExtractor
+from core.executor import run_blocking
+from core.metrics import count, stage
+from core import intent_classifier, templates
+from core.intent_classifier import FORMULA_PERDIDA, DESPEDIDA, HISTORIAL
+from core.json_parser import NO_VISIBLE
+from core.medication_index import normalizar_medicamentos
 
 logger = logging.getLogger(__name__)
 
 class IntentHandler:
-    def __init__(self, openai_service):
+    # Segundos que se conserva una lectura especulativa terminada sin respuesta del usuario
+    OCR_ESPECULATIVO_TTL = 600
+
+    def __init__(self, openai_service, history_store=None):
         """Initialize the intent handler with OpenAI service"""
         self.openai_service = openai_service
+        # Historial local de quejas (services.history_store); sin él se responde con el LLM
+        self.history_store = history_store
+        # OCR lanzado antes del consentimiento, por user_id. Vive solo aquí y no en la sesión:
+        # si el usuario no autoriza, la lectura se cancela o se descarta sin guardarse
+        self._ocr_especulativo: Dict[str, asyncio.Task] = {}
+        self._expiraciones: Dict[str, asyncio.TimerHandle] = {}
+
+    def iniciar_ocr_especulativo(self, user_id: str, lectura: Awaitable[Dict[str, Any]]) -> None:
+        """Lanza el OCR de una fórmula en segundo plano mientras se pide el consentimiento"""
+        self.descartar_ocr_especulativo(user_id)
+        tarea = asyncio.ensure_future(lectura)
+        self._ocr_especulativo[user_id] = tarea
+
+        def al_terminar(tarea: asyncio.Task) -> None:
+            if not tarea.cancelled() and tarea.exception():
+                logger.error(f"Error en el OCR especulativo: {tarea.exception()}")
+            # Una lectura que nadie reclama no se retiene indefinidamente
+            if self._ocr_especulativo.get(user_id) is tarea:
+                self._expiraciones[user_id] = asyncio.get_running_loop().call_later(
+                    self.OCR_ESPECULATIVO_TTL, self.descartar_ocr_especulativo, user_id
+                )
+
+        tarea.add_done_callback(al_terminar)
+
+    def _retirar_ocr(self, user_id: str) -> Optional[asyncio.Task]:
+        expiracion = self._expiraciones.pop(user_id, None)
+        if expiracion:
+            expiracion.cancel()
+        return self._ocr_especulativo.pop(user_id, None)
+
+    def descartar_ocr_especulativo(self, user_id: str) -> None:
+        tarea = self._retirar_ocr(user_id)
+        if tarea and not tarea.done():
+            tarea.cancel()
+
+    def descartar_ocr_pendientes(self) -> None:
+        """Descarta todas las lecturas especulativas; al detener el proceso nadie las reclamará"""
+        for user_id in list(self._ocr_especulativo):
+            self.descartar_ocr_especulativo(user_id)
+
+    async def _obtener_ocr_especulativo(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Espera la lectura especulativa (normalmente ya terminada) y la retira"""
+        tarea = self._retirar_ocr(user_id)
+        if tarea is None:
+            return None
+        try:
+            return await tarea
+        except asyncio.CancelledError:
+            if not tarea.cancelled():
+                raise
+            return None
+        except Exception:
+            return None
     
-    async def procesar_mensaje(self, text: str, user_session: Dict[str, Any]) -> str:
+    async def procesar_mensaje(self, text: str, user_session: Dict[str, Any], intenciones: Optional[Dict[str, float]] = None) -> str:
         """
-        Process user message using AI-driven approach instead of explicit state management
+        Process user message using AI-driven approach instead of explicit state management.
+        `intenciones` es el resultado de intent_classifier.classify si el llamador ya lo calculó.
         """
         try:
+            if intenciones is None:
+                intenciones = intent_classifier.classify(text)
+
             # Add user message to conversation history
             user_message = {"role": "user", "content": text}
             
             # Extract information from user message 
-            DataExtractor.extraer_datos_de_mensaje_usuario(text, user_session)
+            with stage("extraction"):
+                DataExtractor.extraer_datos_de_mensaje_usuario(text, user_session)
             
             # Check if all required information is available to complete the process
             self._verificar_informacion_completa(user_session)
             
             # Special case for formula missing
-            if re.search(r"(perd[ií] la f[oó]rmula|no tengo la f[oó]rmula|se me perd[ií]|no la tengo|se me dañó|se me mojó|no la encuentro)", text.lower(), re.I):
+            if intent_classifier.detectada(intenciones, FORMULA_PERDIDA):
                 # Instead of hardcoded message, let the AI explain the options
                 if not user_session["data"].get("has_greeted", False):
                     user_session["data"]["has_greeted"] = True
                 
                 # Add the message to conversation history and generate response
                 user_session["data"]["conversation_history"].append(user_message)
+                if templates.usa_plantilla("formula_perdida"):
+                    return await templates.responder("formula_perdida", user_session, self.openai_service)
+
                 response = await self.openai_service.ask_openai(user_session)
                 
                 # Extract any information from AI response
-                DataExtractor.extraer_datos_de_respuesta(response, user_session)
+                with stage("extraction"):
+                    DataExtractor.extraer_datos_de_respuesta(response, user_session)
                 
                 return response
             
+            # Consulta del historial: se responde desde el índice local
+            if intent_classifier.detectada(intenciones, HISTORIAL) and not user_session["data"].get("awaiting_approval", False):
+                return await self.consultar_historial_paciente(user_session, user_message)
+            
             # Special case for consent handling
-            if user_session["data"].get("awaiting_approval", False):
-                text_lower = text.lower()
-                affirmative = bool(re.search(r"(si|sí|claro|ok|dale|autorizo|acepto|por supuesto|listo|adelante)", text_lower))
-                
-                if affirmative:
+            # Un mensaje que no responde a la autorización (p. ej. una pregunta) no descarta la fórmula
+            # pendiente: sigue por el flujo general y el asistente vuelve a pedir la autorización
+            consentimiento = intent_classifier.respuesta_consentimiento(intenciones)
+            if user_session["data"].get("awaiting_approval", False) and consentimiento is not None:
+                if consentimiento:
                     user_session["data"]["consented"] = True
                     user_session["data"]["awaiting_approval"] = False
                     
                     # Process pending formula if available
-                    if user_session["data"].get("pending_media"):
-                        formula_result = user_session["data"]["pending_media"]
+                    formula_result = user_session["data"].get("pending_media")
+                    user_session["data"]["pending_media"] = None
+                    ocr_en_curso = user_session["data"]["user_id"] in self._ocr_especulativo
+                    if formula_result is None and ocr_en_curso:
+                        with stage("ocr_wait"):
+                            formula_result = await self._obtener_ocr_especulativo(user_session["data"]["user_id"])
+
+                    if formula_result:
                         await self.actualizar_datos_formula(user_session, formula_result)
-                        user_session["data"]["pending_media"] = None
                         
                         # Add user message to history and generate response
                         user_session["data"]["conversation_history"].append(user_message)
                         
                         # Have the AI generate a formula summary instead of using a template
                         return await self.openai_service.ask_openai(user_session)
+
+                    if ocr_en_curso:
+                        # La lectura falló: el asistente pide reenviar la foto
+                        user_session["data"]["conversation_history"].append(user_message)
+                        user_session["data"]["conversation_history"].append({
+                            "role": "user",
+                            "content": "[Error procesando imagen de fórmula médica]"
+                        })
+                        return await templates.responder("error_imagen", user_session, self.openai_service)
                 else:
                     user_session["data"]["awaiting_approval"] = False
                     user_session["data"]["pending_media"] = None
+                    self.descartar_ocr_especulativo(user_session["data"]["user_id"])
                     
                     # Add user message to history
                     user_session["data"]["conversation_history"].append(user_message)
                     
-                    # Let the AI generate a response for denial of consent
-                    return await self.openai_service.ask_openai(user_session)
+                    return await templates.responder("consentimiento_negado", user_session, self.openai_service)
             
             # Detect if this is a closing message
-            if re.search(r"(gracias|adios|chao|hasta luego|muchas gracias|listo)", text.lower()):
+            if intent_classifier.detectada(intenciones, DESPEDIDA):
                 logger.info("Mensaje de despedida o agradecimiento detectado")
                 # Force process completion if we have enough data
                 if (user_session["data"].get("formula_data") and 
@@ -86,7 +177,8 @@ class IntentHandler:
             response = await self.openai_service.ask_openai(user_session)
             
             # Extract information from AI response
-            DataExtractor.extraer_datos_de_respuesta(response, user_session)
+            with stage("extraction"):
+                DataExtractor.extraer_datos_de_respuesta(response, user_session)
             
             # Check again if all information is available after processing response
             self._verificar_informacion_completa(user_session)
@@ -114,28 +206,32 @@ class IntentHandler:
         """Verifica si se ha completado toda la información necesaria para la queja"""
         data = user_session["data"]
         
-        # Log the current state for debugging
-        logger.info("Verificando información completa:")
-        logger.info(f"- Formula data: {bool(data.get('formula_data'))}")
-        logger.info(f"- Consented: {bool(data.get('consented'))}")
-        logger.info(f"- Missing meds: {bool(data.get('missing_meds') and data.get('missing_meds') != '[aún no especificado]')}")
-        logger.info(f"- City: {bool(data.get('city'))}")
-        logger.info(f"- Cellphone: {bool(data.get('cellphone'))}")
-        logger.info(f"- Birth date: {bool(data.get('birth_date'))}")
-        logger.info(f"- Affiliation regime: {bool(data.get('affiliation_regime'))}")
-        logger.info(f"- Residence address: {bool(data.get('residence_address'))}")
-        logger.info(f"- Pharmacy: {bool(data.get('pharmacy'))}")
+        # Un único registro por turno, muestreable y sin formatear si DEBUG está desactivado
+        logger.debug(
+            "Verificando información completa: formula=%s consentimiento=%s medicamentos=%s ciudad=%s "
+            "celular=%s nacimiento=%s regimen=%s direccion=%s farmacia=%s",
+            bool(data.get('formula_data')),
+            bool(data.get('consented')),
+            bool(data.get('missing_meds') and data.get('missing_meds') != '[aún no especificado]'),
+            bool(data.get('city')),
+            bool(data.get('cellphone')),
+            bool(data.get('birth_date')),
+            bool(data.get('affiliation_regime')),
+            bool(data.get('residence_address')),
+            bool(data.get('pharmacy')),
+            extra={"event": "sesion.verificacion"}
+        )
         
         # Verificar y limpiar datos problemáticos
         if data.get("city") and data.get("city").lower() in ["contributivo", "subsidiado", "ese fue"]:
-            logger.info(f"Limpiando ciudad inválida: {data.get('city')}")
+            logger.debug("Limpiando ciudad inválida: %s", data.get('city'), extra={"event": "sesion.limpieza"})
             data["city"] = ""
         
         if data.get("pharmacy"):
             valor_original = data["pharmacy"]
             valor_limpio = re.sub(r'donde.*te|y la sede donde|donde no te|sede|y\s+debían|debían', '', valor_original, flags=re.I).strip()
             if valor_limpio != valor_original:
-                logger.info(f"Limpiando farmacia: '{valor_original}' -> '{valor_limpio}'")
+                logger.debug("Limpiando farmacia: '%s' -> '%s'", valor_original, valor_limpio, extra={"event": "sesion.limpieza"})
                 data["pharmacy"] = valor_limpio if len(valor_limpio) >= 3 else ""
         
         # Verificar si tenemos todos los datos necesarios
@@ -152,7 +248,7 @@ class IntentHandler:
             # Si la dirección de residencia está vacía, asignarle un valor por defecto
             if not data.get("residence_address"):
                 data["residence_address"] = "No proporcionada"
-                logger.info("Asignando dirección por defecto: 'No proporcionada'")
+                logger.debug("Asignando dirección por defecto: 'No proporcionada'")
             
             # Marcar como completado inmediatamente si tenemos todos los datos necesarios
             data["process_completed"] = True
@@ -163,10 +259,11 @@ class IntentHandler:
         
         user_session["data"]["formula_data"] = formula_result.get("datos", {})
         
-        # Actualizar el nombre del usuario con el de la fórmula
-        if formula_result.get("datos", {}).get("paciente"):
-            user_session["data"]["name"] = formula_result["datos"]["paciente"]
-            logger.info(f"Nombre del paciente actualizado a: {user_session['data']['name']}")
+        # Actualizar el nombre del usuario con el de la fórmula, si se pudo leer
+        paciente = formula_result.get("datos", {}).get("paciente")
+        if paciente and paciente != NO_VISIBLE:
+            user_session["data"]["name"] = paciente
+            logger.debug("Nombre del paciente actualizado a: %s", user_session['data']['name'], extra={"event": "formula.paciente"})
         
         user_session["data"]["eps"] = formula_result.get("datos", {}).get("eps", "")
 
@@ -174,6 +271,10 @@ class IntentHandler:
             user_session["data"]["formula_data"]["diagnostico"] = formula_result["datos"]["diagnostico"]
 
         medicamentos = formula_result.get("datos", {}).get("medicamentos", [])
+        # Principio activo, ATC, concentración y forma de cada línea, para la fila de BigQuery
+        normalizados = normalizar_medicamentos(medicamentos)
+        user_session["data"]["formula_data"]["medicamentos_normalizados"] = normalizados
+        await self._detectar_queja_repetida(user_session, normalizados)
         if medicamentos:
             if "context_variables" not in user_session["data"]:
                 user_session["data"]["context_variables"] = {}
@@ -181,11 +282,8 @@ class IntentHandler:
             # Store the medications in the context variables
             user_session["data"]["context_variables"]["medicamentos_array"] = medicamentos
     
-    async def manejar_imagen_formula(self, formula_result: Dict[str, Any], user_session: Dict[str, Any]) -> str:
-        """Handle prescription image processing results with AI-driven approach"""
-        
-        # Update formula data in user session
-        await self.actualizar_datos_formula(user_session, formula_result)
+    async def solicitar_consentimiento_imagen(self, user_session: Dict[str, Any]) -> str:
+        """Pide el consentimiento al recibir una foto, sin esperar la lectura de la fórmula"""
         
         # If this is first interaction, need to greet first
         if not user_session["data"].get("has_greeted", False):
@@ -197,34 +295,29 @@ class IntentHandler:
                 "role": "assistant",
                 "content": greeting
             })
-            
-            # Add a message indicating that formula was received
-            user_session["data"]["conversation_history"].append({
-                "role": "user", 
-                "content": "[Imagen de fórmula médica]"
-            })
-            
-            # Set awaiting approval to true
-            user_session["data"]["awaiting_approval"] = True
-            user_session["data"]["pending_media"] = formula_result
-            
-            # Let the AI generate a response requesting consent
-            return await self.openai_service.ask_openai(user_session)
         
-        # If we've already greeted, check for consent
+        # Add a message indicating that formula was received
+        user_session["data"]["conversation_history"].append({
+            "role": "user", 
+            "content": "[Imagen de fórmula médica]"
+        })
+        
+        # Set awaiting approval to true
+        user_session["data"]["awaiting_approval"] = True
+        
+        # Let the AI generate a response requesting consent
+        return await self.openai_service.ask_openai(user_session)
+    
+    async def manejar_imagen_formula(self, formula_result: Dict[str, Any], user_session: Dict[str, Any]) -> str:
+        """Handle prescription image processing results with AI-driven approach"""
+        
+        # Sin consentimiento la lectura queda pendiente y no se copia a la sesión
         if not user_session["data"].get("consented", False):
-            user_session["data"]["awaiting_approval"] = True
             user_session["data"]["pending_media"] = formula_result
-            
-            # Add the message to conversation history
-            # Add the message to conversation history
-            user_session["data"]["conversation_history"].append({
-                "role": "user", 
-                "content": "[Imagen de fórmula médica]"
-            })
-            
-            # Let the AI generate a response requesting consent
-            return await self.openai_service.ask_openai(user_session)
+            return await self.solicitar_consentimiento_imagen(user_session)
+        
+        # Update formula data in user session
+        await self.actualizar_datos_formula(user_session, formula_result)
         
         # If we have consent, process the formula immediately
         user_session["data"]["conversation_history"].append({
@@ -235,14 +328,49 @@ class IntentHandler:
         # Let the AI generate a response with formula summary
         return await self.openai_service.ask_openai(user_session)
     
-    async def consultar_historial_paciente(self, user_session: Dict[str, Any]) -> str:
-        """Consulta el historial de quejas del paciente actual usando AI"""
-        
-        # Add a system instruction to generate patient history
-        user_session["data"]["conversation_history"].append({
+    async def _detectar_queja_repetida(self, user_session: Dict[str, Any], normalizados) -> None:
+        """Marca en la sesión si el paciente ya radicó hace poco una queja por alguno de estos medicamentos"""
+        data = user_session["data"]
+        data["queja_repetida"] = None
+        documento = (data.get("formula_data") or {}).get("numero_documento")
+        if self.history_store is None or not documento or documento == "No visible":
+            return
+        try:
+            anterior = await run_blocking(
+                self.history_store.queja_repetida, documento, [registro["atc"] for registro in normalizados]
+            )
+        except Exception as error:
+            logger.warning("No se pudo consultar el historial local: %s", error, extra={"event": "historial.error"})
+            return
+        if anterior:
+            data["queja_repetida"] = {
+                "id": anterior["id"],
+                "fecha": time.strftime("%d/%m/%Y", time.localtime(anterior["fecha"])),
+                "medicamentos": anterior["medicamentos"],
+            }
+            count("repeat_complaints_detected_total", help="Fórmulas con una queja reciente por el mismo medicamento")
+            logger.info("Queja repetida detectada: %s", anterior["id"], extra={"event": "historial.repetida"})
+    
+    async def consultar_historial_paciente(self, user_session: Dict[str, Any], user_message: Optional[Dict[str, str]] = None) -> str:
+        """Responde el historial de quejas del paciente desde el índice local, sin llamar al LLM"""
+        data = user_session["data"]
+        data["conversation_history"].append(user_message or {
             "role": "user", 
             "content": "Por favor, muéstrame mi historial de quejas anteriores."
         })
         
-        # Let the AI generate a response for patient history
-        return await self.openai_service.ask_openai(user_session)
\ No newline at end of file
+        if self.history_store is None or not templates.usa_plantilla("historial"):
+            return await self.openai_service.ask_openai(user_session)
+        
+        # Por documento si ya se leyó la fórmula; si no, por el usuario de Telegram
+        documento = (data.get("formula_data") or {}).get("numero_documento")
+        if documento == "No visible":
+            documento = None
+        try:
+            quejas = await run_blocking(self.history_store.historial, documento, data["user_id"])
+        except Exception as error:
+            logger.warning("No se pudo consultar el historial local: %s", error, extra={"event": "historial.error"})
+            return await self.openai_service.ask_openai(user_session)
+        if not quejas:
+            return await templates.responder("historial_vacio", user_session, self.openai_service)
+        return await templates.responder("historial", user_session, self.openai_service, quejas=templates.lista_quejas(quejas))
\ No newline at end of file
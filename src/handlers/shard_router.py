@@ -0,0 +1,54 @@
+import logging
+from telegram import Update
+from telegram.ext import Application, TypeHandler, ContextTypes
+
+from core.sharding import WorkerSupervisor
+
+logger = logging.getLogger(__name__)
+
+class ShardRouter:
+    """
+    Receptor del modo multi-worker: recibe los updates de Telegram (polling o webhook)
+    y los reenvía sin procesarlos al worker dueño de cada usuario.
+    """
+
+    def __init__(self, telegram_token: str, supervisor: WorkerSupervisor, base_url: str = None, base_file_url: str = None):
+        self.telegram_token = telegram_token
+        self.supervisor = supervisor
+        self.base_url = base_url
+        self.base_file_url = base_file_url
+
+    def setup_telegram_bot(self) -> Application:
+        builder = Application.builder().token(self.telegram_token)
+        if self.base_url:
+            builder = builder.base_url(self.base_url)
+        if self.base_file_url:
+            builder = builder.base_file_url(self.base_file_url)
+
+        application = builder.build()
+
+        async def post_init(application: Application) -> None:
+            await application.bot.delete_webhook(drop_pending_updates=True)
+            logger.info("Webhook eliminado correctamente")
+
+        application.post_init = post_init
+
+        application.add_handler(TypeHandler(Update, self.forward_update))
+
+        async def error_handler(update, context):
+            logger.error(f"Error en el receptor: {context.error}")
+
+        application.add_error_handler(error_handler)
+
+        return application
+
+    async def forward_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        # Los updates sin usuario (p. ej. de canales) se reparten por chat
+        if update.effective_user:
+            routing_key = update.effective_user.id
+        elif update.effective_chat:
+            routing_key = update.effective_chat.id
+        else:
+            routing_key = update.update_id
+
+        self.supervisor.dispatch(routing_key, update.to_dict())
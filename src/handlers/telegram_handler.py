@@ -1,46 +1,95 @@
-import re
+import asyncio
 import time
 import logging
 import base64
-import requests
-from typing import Dict, Any
+from typing import Dict, Any, List, Set
 from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, ContextTypes, filters
+from telegram.ext import Application, CommandHandler, MessageHandler, TypeHandler, ContextTypes, filters
 
-from config import WELCOME_MESSAGE
-from core.session_manager import get_user_session, reset_session, iniciar_nueva_queja
+from config import WELCOME_MESSAGE, MENSAJE_FORMULA_RECIBIDA, get_photo_config, get_worker_config
+from core.session_manager import get_user_session, reset_session, iniciar_nueva_queja, marcar_modificada, user_sessions
+from core.executor import run_blocking, run_cpu_bound, run_concurrently
+from core.metrics import stage, timed
+from core import intent_classifier, templates
+from core.intent_classifier import REINICIAR, NUEVA_QUEJA, DESPEDIDA
 from services.openai_service import OpenAIService
 from services.image_processor import ImageProcessor
 from services.bigquery_service import BigQueryService
+from services.outbound_dispatcher import OutboundDispatcher, ALTA, NORMAL
 from handlers.intent_handler import IntentHandler
+from handlers.update_processor import PerUserUpdateProcessor
 
 logger = logging.getLogger(__name__)
 
+def codificar_base64(contenido: bytes) -> str:
+    return base64.b64encode(contenido).decode('utf-8')
+
+def descargar(url: str):
+    # requests se importa en el hilo del pool, con la primera foto, y no al arrancar
+    import requests
+    return requests.get(url, timeout=30)
+
 class TelegramHandler:
-    def __init__(self, telegram_token: str, openai_service: OpenAIService, image_processor: ImageProcessor, bigquery_service: BigQueryService):
+    def __init__(self, telegram_token: str, openai_service: OpenAIService, image_processor: ImageProcessor, bigquery_service: BigQueryService,
+                 base_url: str = None, base_file_url: str = None, dispatcher: OutboundDispatcher = None):
         self.telegram_token = telegram_token
+        self.base_url = base_url
+        self.base_file_url = base_file_url
         self.openai_service = openai_service
         self.image_processor = image_processor
         self.bigquery_service = bigquery_service
-        self.intent_handler = IntentHandler(openai_service)
+        self.intent_handler = IntentHandler(openai_service, bigquery_service.history_store)
+        # Todas las respuestas salen por la cola con límites de Telegram
+        self.dispatcher = dispatcher or OutboundDispatcher()
+        
+        # Álbumes en formación, por usuario y media_group_id
+        self.photo_config = get_photo_config()
+        self._albumes: Dict[str, Dict[str, Any]] = {}
+        # Tareas de álbum (esperando páginas o procesándose): PTB no las conoce y no las espera al detenerse
+        self._tareas_album: Set[asyncio.Task] = set()
         
-    def setup_telegram_bot(self) -> Application:
-        application = Application.builder().token(self.telegram_token).build()
+    def setup_telegram_bot(self, receive_updates: bool = True) -> Application:
+        builder = Application.builder().token(self.telegram_token)
         
-        # Configurar la eliminación del webhook para que se ejecute durante la inicialización
-        async def post_init(application: Application) -> None:
-            await application.bot.delete_webhook(drop_pending_updates=True)
-            logger.info("Webhook eliminado correctamente")
+        # Permite apuntar a un servidor local de la Bot API o a un stand-in de pruebas
+        if self.base_url:
+            builder = builder.base_url(self.base_url)
+        if self.base_file_url:
+            builder = builder.base_file_url(self.base_file_url)
+        
+        # En modo multi-worker los updates llegan desde el receptor, no desde Telegram
+        if not receive_updates:
+            builder = builder.updater(None)
+
+        # Sin esto PTB espera cada update antes de tomar el siguiente, de cualquier usuario
+        builder = builder.concurrent_updates(PerUserUpdateProcessor(get_worker_config()["concurrent_updates"]))
         
-        application.post_init = post_init
+        application = builder.build()
+        self.dispatcher.bot = application.bot
         
+        if receive_updates:
+            # Configurar la eliminación del webhook para que se ejecute durante la inicialización
+            async def post_init(application: Application) -> None:
+                await application.bot.delete_webhook(drop_pending_updates=True)
+                logger.info("Webhook eliminado correctamente")
+            
+            application.post_init = post_init
+        
+        # Va antes que todo: los mensajes que siguen a un álbum esperan a que se procese
+        application.add_handler(TypeHandler(Update, self.esperar_albumes), group=-1)
+
         application.add_handler(CommandHandler("start", self.start_command))
         application.add_handler(CommandHandler("help", self.help_command))
         application.add_handler(CommandHandler("reset", self.reset_command))
+        application.add_handler(CommandHandler("historial", self.history_command))
 
         application.add_handler(MessageHandler(filters.PHOTO, self.process_photo_message))
         
         application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.process_text_message))
+
+        # El grupo 1 corre cuando terminó el handler del grupo 0: la sesión ya tiene todos los
+        # cambios del mensaje y la próxima instantánea tiene que escribirla
+        application.add_handler(TypeHandler(Update, self.marcar_sesion), group=1)
         
         async def error_handler(update, context):
             logger.error(f"Error en el bot: {context.error}")
@@ -49,22 +98,91 @@ class TelegramHandler:
         
         return application
     
+    async def responder(self, update: Update, texto: str, prioridad: int = NORMAL, **kwargs):
+        """Envía la respuesta por la cola de salida (límites por chat y global, RetryAfter, textos largos)"""
+        return await self.dispatcher.enviar(update.effective_chat.id, texto, prioridad, **kwargs)
+
+    async def marcar_sesion(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        if update.effective_user:
+            marcar_modificada(str(update.effective_user.id))
+
+    async def esperar_albumes(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """
+        Un álbum se procesa en su propia tarea, fuera del orden de PTB: el "sí" que llega justo
+        después no puede adelantarse a procesar_fotos. Los updates del usuario se procesan de
+        a uno (PerUserUpdateProcessor), así que esperar aquí demora solo a ese usuario. Las
+        páginas del álbum que todavía se está armando no esperan: lo cerrarían incompletas.
+        """
+        if not update.effective_user:
+            return
+        prefijo = f"{update.effective_user.id}:"
+        mensaje = update.effective_message
+        propio = f"{prefijo}{mensaje.media_group_id}" if mensaje and mensaje.media_group_id else None
+        tareas = [tarea for tarea in self._tareas_album if tarea.get_name().startswith(prefijo)
+                  and not (tarea.get_name() == propio and propio in self._albumes)]
+        if tareas:
+            await asyncio.wait(tareas)
+
+    def tareas_en_curso(self) -> Set[asyncio.Task]:
+        """Tareas propias que la parada debe esperar además de los updates de PTB"""
+        return set(self._tareas_album)
+
+    async def guardar_pendientes(self, timeout: float) -> int:
+        """
+        Guarda las quejas completas que todavía no llegaron a BigQuery y devuelve cuántas
+        se guardaron. Las que no terminan dentro del plazo quedan pendientes en el
+        historial local, como cuando la inserción falla, para cargarlas con backfill.py.
+        """
+        pendientes = [sesion["data"] for sesion in user_sessions.values()
+                      if sesion["data"].get("process_completed") and not sesion["data"]["queja_actual"].get("guardada", False)]
+        if not pendientes:
+            return 0
+
+        logger.info(f"Guardando {len(pendientes)} quejas completas antes de detener el bot")
+        tareas = {asyncio.create_task(self.bigquery_service.save_user_data(data, True)): data for data in pendientes}
+        terminadas, demoradas = await asyncio.wait(tareas, timeout=timeout)
+        for tarea in demoradas:
+            tarea.cancel()
+        await asyncio.gather(*demoradas, return_exceptions=True)
+        for tarea in demoradas:
+            await self.bigquery_service.registrar_pendiente(tareas[tarea])
+        for data in pendientes:
+            marcar_modificada(data["user_id"])
+        if demoradas:
+            logger.warning(f"{len(demoradas)} quejas no alcanzaron a guardarse; quedan pendientes en el historial local")
+        return sum(1 for tarea in terminadas if tarea.result())
+
+    async def cerrar(self) -> None:
+        """Cierra los pools HTTP de OpenAI y los clientes de BigQuery y del historial local"""
+        gateways = {id(gateway): gateway for gateway in (self.openai_service.gateway, self.image_processor.gateway)}
+        for gateway in gateways.values():
+            await gateway.cerrar()
+        await run_blocking(self.bigquery_service.cerrar)
+
     async def download_telegram_photo(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
         try:
             file_id = update.message.photo[-1].file_id
             photo_file = await context.bot.get_file(file_id)
             
-            response = requests.get(photo_file.file_path)
+            # La descarga y la codificación corren fuera del event loop para no frenar a otros usuarios
+            response = await run_blocking(descargar, photo_file.file_path)
             if response.status_code != 200:
                 raise Exception(f"Error descargando foto: {response.status_code}")
                 
-            base64_image = base64.b64encode(response.content).decode('utf-8')
+            base64_image = await run_cpu_bound(codificar_base64, response.content)
             return base64_image
             
         except Exception as e:
             logger.error(f"Error descargando foto de Telegram: {e}")
             raise
     
+    async def leer_formula(self, updates: List[Update], context: ContextTypes.DEFAULT_TYPE) -> Dict[str, Any]:
+        """Descarga las fotos (una o las páginas de un álbum) y las lee en una sola llamada de Vision"""
+        with stage("download"):
+            paginas = await run_concurrently(*(self.download_telegram_photo(update, context) for update in updates))
+        with stage("ocr"):
+            return await self.image_processor.process_medical_formula(paginas)
+
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         user_id = str(update.effective_user.id)
         user_session = get_user_session(user_id)
@@ -72,7 +190,7 @@ class TelegramHandler:
         user_session["data"]["has_greeted"] = True
         user_session["data"]["is_first_interaction"] = False
         
-        await update.message.reply_text(WELCOME_MESSAGE, parse_mode="Markdown")
+        await self.responder(update, WELCOME_MESSAGE, parse_mode="Markdown")
         
         # Add the greeting to the conversation history
         user_session["data"]["conversation_history"].append({
@@ -90,14 +208,14 @@ class TelegramHandler:
             "content": "/help - Solicitar ayuda sobre el uso del bot"
         })
         
-        # Let the AI generate a help response
-        response = await self.openai_service.ask_openai(user_session)
-        await update.message.reply_text(response)
+        response = await templates.responder("ayuda", user_session, self.openai_service)
+        await self.responder(update, response)
     
     async def reset_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         user_id = str(update.effective_user.id)
         user_session = get_user_session(user_id)
         
+        self.intent_handler.descartar_ocr_especulativo(user_id)
         reset_session(user_session)
         
         # Add reset notification to conversation history
@@ -106,25 +224,79 @@ class TelegramHandler:
             "content": "/reset - Reiniciar la conversación"
         })
         
-        # Let the AI generate a reset confirmation
-        response = await self.openai_service.ask_openai(user_session)
-        await update.message.reply_text(response)
+        response = await templates.responder("reinicio", user_session, self.openai_service)
+        await self.responder(update, response)
+    
+    async def history_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        user_id = str(update.effective_user.id)
+        user_session = get_user_session(user_id)
+        
+        response = await self.intent_handler.consultar_historial_paciente(user_session, {
+            "role": "user",
+            "content": "/historial - Consultar mis quejas anteriores"
+        })
+        await self.responder(update, response)
     
     async def process_photo_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        # Las páginas de un álbum llegan como mensajes separados con el mismo media_group_id
+        if update.message.media_group_id:
+            self._agregar_pagina_album(update, context)
+            return
+        
+        await self.procesar_fotos([update], context)
+    
+    def _agregar_pagina_album(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        clave = f"{update.effective_user.id}:{update.message.media_group_id}"
+        album = self._albumes.get(clave)
+        if album is None:
+            album = self._albumes[clave] = {"updates": []}
+            # El nombre identifica al usuario para esperar_albumes
+            album["tarea"] = asyncio.create_task(self._cerrar_album(clave, context), name=clave)
+            self._tareas_album.add(album["tarea"])
+            album["tarea"].add_done_callback(self._tareas_album.discard)
+        
+        if len(album["updates"]) < self.photo_config["album_max_pages"]:
+            album["updates"].append(update)
+    
+    async def _cerrar_album(self, clave: str, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Espera a que dejen de llegar páginas y procesa el álbum como una sola fórmula"""
+        try:
+            # Cada página nueva reinicia la espera
+            recibidas = 0
+            while len(self._albumes[clave]["updates"]) != recibidas:
+                recibidas = len(self._albumes[clave]["updates"])
+                await asyncio.sleep(self.photo_config["album_wait"])
+            
+            updates = self._albumes.pop(clave)["updates"]
+            logger.info("Álbum de %d páginas recibido", len(updates), extra={"event": "foto.album"})
+            await self.procesar_fotos(updates, context)
+        except Exception as e:
+            self._albumes.pop(clave, None)
+            logger.error(f"Error procesando el álbum: {e}")
+        finally:
+            # Se procesó fuera de PTB: el handler del grupo 1 no vio estos cambios
+            marcar_modificada(clave.split(":")[0])
+    
+    @timed("photo_message")
+    async def procesar_fotos(self, updates: List[Update], context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Procesa una fórmula de una o varias fotos: una lectura de Vision y una respuesta"""
+        update = updates[0]
         user_id = str(update.effective_user.id)
         user_session = get_user_session(user_id)
+        es_album = len(updates) > 1 or bool(update.message.media_group_id)
 
         try:
             current_time = time.time()
 
             # Evitar procesar imágenes duplicadas
-            if (user_session["data"].get("last_processed_time") and 
+            # Las páginas de un álbum llegan juntas a propósito: no son duplicados
+            if (not es_album and user_session["data"].get("last_processed_time") and 
                     (current_time - user_session["data"]["last_processed_time"] < 2.5)):
                 logger.info("Ignorando imagen duplicada")
                 return
 
             last_photo_id = user_session["data"].get("last_photo_id")
-            current_photo_id = update.message.photo[-1].file_unique_id
+            current_photo_id = updates[-1].message.photo[-1].file_unique_id
             
             if (last_photo_id == current_photo_id):
                 logger.info("Ignorando imagen duplicada exacta")
@@ -138,18 +310,34 @@ class TelegramHandler:
                 # Si la queja anterior no se guardó, hacerlo ahora
                 if not user_session["data"]["queja_actual"].get("guardada", False):
                     logger.info("Guardando queja completada antes de iniciar una nueva")
-                    await self.bigquery_service.save_user_data(user_session["data"], True)
+                    with stage("save"):
+                        await self.bigquery_service.save_user_data(user_session["data"], True)
                 
                 iniciar_nueva_queja(user_session, user_id)
 
             try:
-                # Download and process the formula image
-                base64_image = await self.download_telegram_photo(update, context)
-                formula_result = await self.image_processor.process_medical_formula(base64_image)
+                if not user_session["data"].get("consented", False):
+                    # El consentimiento se pide de inmediato y la lectura corre en segundo plano;
+                    # IntentHandler la recoge cuando el usuario autoriza o la descarta si no
+                    self.intent_handler.iniciar_ocr_especulativo(user_id, self.leer_formula(updates, context))
+                    try:
+                        response = await self.intent_handler.solicitar_consentimiento_imagen(user_session)
+                        await self.responder(update, response, ALTA)
+                    except BaseException:
+                        # Sin pedido de consentimiento la lectura no tiene quién la reclame
+                        self.intent_handler.descartar_ocr_especulativo(user_id)
+                        raise
+                    return
+                
+                # Con consentimiento el acuse sale sin esperarlo (esperar=False) y la lectura
+                # empieza enseguida: si Telegram rechaza el acuse, la cola lo registra y el OCR,
+                # ya pagado, no se cancela por un mensaje de cortesía
+                await self.responder(update, MENSAJE_FORMULA_RECIBIDA, ALTA, esperar=False)
+                formula_result = await self.leer_formula(updates, context)
                 
                 # Process the formula using the AI-driven approach
                 response = await self.intent_handler.manejar_imagen_formula(formula_result, user_session)
-                await update.message.reply_text(response)
+                await self.responder(update, response)
                 
             except Exception as e:
                 logger.error(f"Error procesando la imagen: {e}")
@@ -160,14 +348,14 @@ class TelegramHandler:
                     "content": "[Error procesando imagen de fórmula médica]"
                 })
                 
-                # Let the AI generate an error response
-                response = await self.openai_service.ask_openai(user_session)
-                await update.message.reply_text(response)
+                response = await templates.responder("error_imagen", user_session, self.openai_service)
+                await self.responder(update, response)
             
         except Exception as e:
-            logger.error(f"Error general en process_photo_message: {e}")
-            await update.message.reply_text("Lo siento, tuve un problema al procesar tu imagen. ¿Podrías intentar enviarla de nuevo o con mejor iluminación? 📸✨")
+            logger.error(f"Error general en procesar_fotos: {e}")
+            await self.responder(update, "Lo siento, tuve un problema al procesar tu imagen. ¿Podrías intentar enviarla de nuevo o con mejor iluminación? 📸✨")
     
+    @timed("text_message")
     async def process_text_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
        
         text = update.message.text or ''
@@ -190,18 +378,22 @@ class TelegramHandler:
             user_session["data"]["username"] = update.effective_user.username
 
         try:
+            # Una sola clasificación por mensaje, compartida con IntentHandler
+            intenciones = intent_classifier.classify(text)
+
             # Detectar comandos simples en texto
-            if text.lower() == '/reset' or 'empezar de nuevo' in text.lower() or 'reiniciar' in text.lower():
+            if intent_classifier.detectada(intenciones, REINICIAR):
                 await self.reset_command(update, context)
                 return
             
             # Detectar nueva queja
-            es_nueva_queja = re.search(r"(nueva queja|otra queja|quiero hacer otra|iniciar otra|tramitar otra|otra .*queja|reportar otro|denunciar otro|otro medicamento no entregado|volver a empezar)", text, re.I)
+            es_nueva_queja = intent_classifier.detectada(intenciones, NUEVA_QUEJA)
             if es_nueva_queja and user_session["data"].get("formula_data"):
                 # Guardar queja actual si corresponde
                 if not user_session["data"]["queja_actual"].get("guardada", False):
                     logger.info("Iniciando nueva queja - Guardando queja actual primero")
-                    await self.bigquery_service.save_user_data(user_session["data"], True)
+                    with stage("save"):
+                        await self.bigquery_service.save_user_data(user_session["data"], True)
                 
                 # Iniciar nueva queja
                 iniciar_nueva_queja(user_session, user_id)
@@ -214,12 +406,12 @@ class TelegramHandler:
                 
                 # Let the AI generate a response for new complaint request
                 response = await self.openai_service.ask_openai(user_session)
-                await update.message.reply_text(response)
+                await self.responder(update, response)
                 return
             
             # Procesar el mensaje con el enfoque basado en IA
-            response = await self.intent_handler.procesar_mensaje(text, user_session)
-            await update.message.reply_text(response)
+            response = await self.intent_handler.procesar_mensaje(text, user_session, intenciones)
+            await self.responder(update, response)
             
             # Verificar si el proceso está completo para guardar datos
             self.intent_handler._verificar_informacion_completa(user_session)
@@ -233,7 +425,8 @@ class TelegramHandler:
                     if not user_session["data"].get("residence_address"):
                         user_session["data"]["residence_address"] = "No proporcionada"
                     
-                    success = await self.bigquery_service.save_user_data(user_session["data"], True)
+                    with stage("save"):
+                        success = await self.bigquery_service.save_user_data(user_session["data"], True)
                     
                     if success:
                         user_session["data"]["queja_actual"]["guardada"] = True
@@ -244,7 +437,7 @@ class TelegramHandler:
                     logger.info("Proceso completado, pero los datos ya fueron guardados previamente")
             
             # Si es un mensaje de despedida, intentar guardar aunque no se haya detectado como completado
-            es_despedida = re.search(r"(gracias|adios|chao|hasta luego|muchas gracias|listo)", text.lower())
+            es_despedida = intent_classifier.detectada(intenciones, DESPEDIDA)
             if es_despedida and self._tiene_informacion_suficiente(user_session["data"]):
                 if not user_session["data"]["queja_actual"].get("guardada", False):
                     logger.info("Mensaje de despedida detectado - Forzando guardado final")
@@ -257,7 +450,8 @@ class TelegramHandler:
                     if not user_session["data"].get("affiliation_regime"):
                         user_session["data"]["affiliation_regime"] = "No especificado"
                     
-                    success = await self.bigquery_service.save_user_data(user_session["data"], True)
+                    with stage("save"):
+                        success = await self.bigquery_service.save_user_data(user_session["data"], True)
                     if success:
                         user_session["data"]["queja_actual"]["guardada"] = True
                         logger.info("✅ Datos guardados exitosamente en BigQuery por mensaje de despedida")
@@ -268,7 +462,7 @@ class TelegramHandler:
             logger.error(f"Error procesando mensaje: {e}")
             import traceback
             logger.error(traceback.format_exc())
-            await update.message.reply_text("Disculpa, ocurrió un error inesperado. Por favor, intenta nuevamente o escribe /reset para reiniciar la conversación. 🔄")
+            await self.responder(update, "Disculpa, ocurrió un error inesperado. Por favor, intenta nuevamente o escribe /reset para reiniciar la conversación. 🔄")
     
     def _tiene_informacion_suficiente(self, data: Dict[str, Any]) -> bool:
         """Verifica si hay suficiente información para guardar la queja"""
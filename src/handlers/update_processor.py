@@ -0,0 +1,64 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Dict, List, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Procesa a la vez los updates de usuarios distintos y en orden de llegada los de un
+    mismo usuario: una foto lenta no demora las respuestas de los demás, y la sesión de
+    cada usuario la modifica un solo update por vez. Los updates sin usuario ni chat
+    no esperan a nadie.
+    """
+    __slots__ = ("_usuarios",)
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        # Por usuario: [lock, updates que lo esperan o lo tienen]; se borra al quedar en cero
+        self._usuarios: Dict[Any, List] = {}
+
+    @staticmethod
+    def clave(update: object) -> Optional[int]:
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        clave = self.clave(update)
+        if clave is None:
+            await coroutine
+            return
+
+        entrada = self._usuarios.get(clave)
+        if entrada is None:
+            entrada = self._usuarios[clave] = [asyncio.Lock(), 0]
+        entrada[1] += 1
+        try:
+            # asyncio.Lock despierta a los que esperan en orden: los updates del usuario
+            # corren en el orden en que PTB los sacó de la cola
+            try:
+                await entrada[0].acquire()
+            except BaseException:
+                coroutine.close()
+                raise
+            try:
+                await coroutine
+            finally:
+                entrada[0].release()
+        finally:
+            entrada[1] -= 1
+            if entrada[1] == 0:
+                del self._usuarios[clave]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
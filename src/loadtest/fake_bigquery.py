@@ -0,0 +1,76 @@
+import json
+import threading
+import time
+from typing import Any, Dict, List
+
+# Esquema de la tabla en producción; las columnas de BigQueryService.COLUMNAS_NUEVAS
+# aparecen después de migrar_esquema (update_table)
+COLUMNAS_QUEJAS = [
+    "PK", "tipo_documento", "numero_documento", "paciente", "fecha_atencion", "eps", "doctor", "ips",
+    "diagnostico", "medicamentos", "image_url", "no_entregado", "fecha_nacimiento", "telefono",
+    "regimen", "municipio", "direccion", "farmacia"
+]
+
+class FakeSchemaField:
+    def __init__(self, name: str):
+        self.name = name
+
+class FakeTable:
+    def __init__(self, table_ref: str, columnas: List[str]):
+        self.table_ref = table_ref
+        self.schema = [FakeSchemaField(nombre) for nombre in columnas]
+
+class FakeLoadJob:
+    def __init__(self, output_rows: int):
+        self.output_rows = output_rows
+
+    def result(self) -> "FakeLoadJob":
+        return self
+
+class FakeBigQueryClient:
+    """
+    Cliente en memoria con la parte de la API de google.cloud.bigquery.Client que usa
+    BigQueryService. Las llamadas son síncronas, como las reales, y pueden simular latencia.
+    """
+
+    def __init__(self, latency: float = 0.0, columnas: List[str] = COLUMNAS_QUEJAS):
+        self.latency = latency
+        self.columnas = list(columnas)
+        self.rows: List[Dict[str, Any]] = []
+        self.calls = {"get_table": 0, "update_table": 0, "insert_rows_json": 0, "load_table_from_file": 0}
+        self._lock = threading.Lock()
+
+    def _esperar(self) -> None:
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def get_table(self, table_ref: str) -> FakeTable:
+        self._esperar()
+        with self._lock:
+            self.calls["get_table"] += 1
+        return FakeTable(str(table_ref), self.columnas)
+
+    def update_table(self, table: FakeTable, fields: List[str]) -> FakeTable:
+        self._esperar()
+        with self._lock:
+            self.calls["update_table"] += 1
+            self.columnas = [campo.name for campo in table.schema]
+        return FakeTable(table.table_ref, self.columnas)
+
+    def insert_rows_json(self, table: Any, rows: List[Dict[str, Any]]) -> List[Any]:
+        self._esperar()
+        with self._lock:
+            self.calls["insert_rows_json"] += 1
+            self.rows.extend(rows)
+        return []
+
+    def load_table_from_file(self, file_obj: Any, destination: str, job_config: Any = None) -> FakeLoadJob:
+        """Load job con NDJSON (el formato que usa backfill.py por defecto)"""
+        self._esperar()
+        rows = [json.loads(linea) for linea in file_obj.read().decode("utf-8").splitlines() if linea.strip()]
+        with self._lock:
+            self.calls["load_table_from_file"] += 1
+            if job_config is not None and str(getattr(job_config, "write_disposition", "")).endswith("WRITE_TRUNCATE"):
+                self.rows.clear()
+            self.rows.extend(rows)
+        return FakeLoadJob(len(rows))
@@ -0,0 +1,185 @@
+import asyncio
+import json
+import random
+import re
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from loadtest.http_stub import StubHTTPServer, Response, json_response
+
+FORMULA_POR_DEFECTO = {
+    "datos": {
+        "tipo_documento": "CC",
+        "numero_documento": "1020304050",
+        "paciente": "María Fernanda López Gómez",
+        "fecha_atencion": "15/03/2024",
+        "eps": "Sura",
+        "doctor": "Carlos Pérez",
+        "diagnostico": "Hipertensión esencial",
+        "medicamentos": [
+            "Losartán 50 mg tableta, 1 cada 12 horas por 30 días",
+            "Hidroclorotiazida 25 mg tableta, 1 diaria por 30 días",
+            "Atorvastatina 20 mg tableta, 1 en la noche por 30 días"
+        ]
+    }
+}
+
+# Respuesta según la línea "PRÓXIMA INFORMACIÓN A SOLICITAR" del prompt de sistema
+RESPUESTAS_POR_DEFECTO = {
+    "Solicitar foto de fórmula médica": "¡Hola! 👋 Para ayudarte necesito una foto clara de tu fórmula médica. 📋📸",
+    "Solicitar consentimiento para procesar datos": "¡Hola! 👋 Bienvenido a No Me Entregaron. ¿Me autorizas a procesar tus datos para tramitar la queja? (Responde sí o no) 📝",
+    "Preguntar por medicamentos no entregados": "Gracias 😊 Estos son los medicamentos de tu fórmula. ¿Cuáles no te entregaron?",
+    "Preguntar por ciudad": "Entendido. ¿En qué ciudad te entregan los medicamentos?",
+    "Preguntar por número de celular": "Perfecto. ¿Me compartes tu número de celular?",
+    "Preguntar por fecha de nacimiento": "Gracias. ¿Cuál es tu fecha de nacimiento?",
+    "Preguntar por régimen de afiliación": "¿Perteneces al régimen contributivo o subsidiado?",
+    "Preguntar por dirección": "¿Cuál es tu dirección de residencia?",
+    "Preguntar por farmacia": "Por último, ¿en qué farmacia y sede debían entregarte los medicamentos?",
+    "Presentar resumen final": "¡Perfecto! Ya tengo toda la información. En las próximas 24 horas, tramitaremos tu queja ante la EPS y te enviaré el número de radicado por este mismo chat. 📄 ¿Hay algo más en lo que pueda ayudarte? 😊",
+}
+
+RESPUESTA_GENERICA = "Entiendo 😊 ¿Me ayudas con el dato que te pedí para continuar con tu queja?"
+
+_PROXIMO_PASO = re.compile(r"PRÓXIMA INFORMACIÓN A SOLICITAR:\n- ([^\n]+)")
+
+class FakeOpenAIServer(StubHTTPServer):
+    """
+    Stand-in de la API de chat completions (texto y Vision). Las respuestas de chat
+    siguen el paso que el propio prompt de sistema del bot pide a continuación, de
+    modo que una conversación simulada avanza hasta el resumen final.
+    """
+
+    def __init__(self, chat_latency: float = 0.0, vision_latency: float = 0.0, jitter: float = 0.2,
+                 respuestas: Optional[Dict[str, str]] = None, formula: Optional[Dict[str, Any]] = None,
+                 error_rate: float = 0.0, requests_per_minute: int = 0,
+                 model_latency: Optional[Dict[str, float]] = None, reasoning_tokens: Optional[Dict[str, int]] = None,
+                 slow_rate: float = 0.0, slow_latency: float = 10.0, **kwargs):
+        super().__init__(**kwargs)
+        self.chat_latency = chat_latency
+        self.vision_latency = vision_latency
+        self.jitter = jitter
+        # Fracción de completions que responden 429 o 500, para ejercitar los reintentos del gateway
+        self.error_rate = error_rate
+        # Cuota por minuto informada en x-ratelimit-*; con 0 no se limita
+        self.requests_per_minute = requests_per_minute
+        # Latencia de chat por modelo (reemplaza chat_latency) y tokens de razonamiento ocultos
+        # que el modelo cobra como completion_tokens, para comparar los niveles del ruteo
+        self.model_latency = model_latency or {}
+        self.reasoning_tokens = reasoning_tokens or {}
+        self.models = Counter()
+        # Fracción de completions que se quedan colgadas slow_latency segundos (cola larga)
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.slow = 0
+        self._ventana = (0.0, 0)
+        self.errors = Counter()
+        self.respuestas = dict(RESPUESTAS_POR_DEFECTO, **(respuestas or {}))
+        self.formula = formula or FORMULA_POR_DEFECTO
+        self.completions = Counter()
+        self.tokens = Counter()
+
+    @property
+    def base_url(self) -> str:
+        return f"{self.url}/v1"
+
+    async def _esperar(self, latencia: float) -> None:
+        if latencia > 0:
+            await asyncio.sleep(max(0.0, random.uniform(latencia * (1 - self.jitter), latencia * (1 + self.jitter))))
+
+    @staticmethod
+    def _es_vision(messages: List[Dict[str, Any]]) -> bool:
+        for message in messages:
+            content = message.get("content")
+            if isinstance(content, list) and any(parte.get("type") == "image_url" for parte in content):
+                return True
+        return False
+
+    def _respuesta_chat(self, messages: List[Dict[str, Any]]) -> str:
+        system = next((m.get("content") for m in messages if m.get("role") == "system"), "") or ""
+        paso = _PROXIMO_PASO.search(system)
+        if paso:
+            return self.respuestas.get(paso.group(1).strip(), RESPUESTA_GENERICA)
+        return RESPUESTA_GENERICA
+
+    def _encabezados_cuota(self, restantes: int) -> Dict[str, str]:
+        inicio, _ = self._ventana
+        return {
+            "x-ratelimit-limit-requests": str(self.requests_per_minute),
+            "x-ratelimit-remaining-requests": str(restantes),
+            "x-ratelimit-reset-requests": f"{max(0.0, inicio + 60 - time.monotonic()):.3f}s",
+        }
+
+    def _limites(self) -> Optional[Dict[str, str]]:
+        """Encabezados x-ratelimit-* de la ventana de un minuto; None si la cuota se agotó"""
+        if not self.requests_per_minute:
+            return {}
+        inicio, usadas = self._ventana
+        ahora = time.monotonic()
+        if ahora - inicio >= 60:
+            inicio, usadas = ahora, 0
+        if usadas >= self.requests_per_minute:
+            self._ventana = (inicio, usadas)
+            return None
+        self._ventana = (inicio, usadas + 1)
+        return self._encabezados_cuota(self.requests_per_minute - usadas - 1)
+
+    async def handle(self, method: str, path: str, headers: Dict[str, str], body: bytes) -> Response:
+        if method == "GET" and path.rstrip("/").endswith("/models"):
+            # Verificación de conexión al arrancar (core.readiness)
+            await self._esperar(self.chat_latency)
+            return json_response({"object": "list", "data": [{"id": "o4-mini", "object": "model", "owned_by": "loadtest"}]})
+
+        if method != "POST" or not path.rstrip("/").endswith("/chat/completions"):
+            return json_response({"error": {"message": f"Ruta no soportada: {path}"}}, status=404)
+
+        limites = self._limites()
+        if limites is None:
+            self.errors["429"] += 1
+            return json_response({"error": {"message": "Rate limit reached", "type": "requests"}}, status=429,
+                                 headers={"retry-after": "1", **self._encabezados_cuota(0)})
+        if self.error_rate and random.random() < self.error_rate:
+            estado = random.choice((429, 500))
+            self.errors[str(estado)] += 1
+            return json_response({"error": {"message": "Error simulado"}}, status=estado, headers={"retry-after-ms": "50"})
+
+        request = json.loads(body or b"{}")
+        messages = request.get("messages", [])
+        modelo = request.get("model", "o4-mini")
+        self.models[modelo] += 1
+
+        if self.slow_rate and random.random() < self.slow_rate:
+            self.slow += 1
+            await asyncio.sleep(self.slow_latency)
+
+        if self._es_vision(messages):
+            tipo = "vision"
+            await self._esperar(self.vision_latency)
+            contenido = json.dumps(self.formula, ensure_ascii=False)
+        else:
+            tipo = "chat"
+            await self._esperar(self.model_latency.get(modelo, self.chat_latency))
+            contenido = self._respuesta_chat(messages)
+
+        prompt_tokens = sum(len(json.dumps(m.get("content"), ensure_ascii=False)) for m in messages) // 4
+        completion_tokens = len(contenido) // 4 + self.reasoning_tokens.get(modelo, 0)
+        self.completions[tipo] += 1
+        self.tokens[f"{tipo}_prompt"] += prompt_tokens
+        self.tokens[f"{tipo}_completion"] += completion_tokens
+
+        return json_response({
+            "id": f"chatcmpl-fake-{self.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": modelo,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": contenido},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        }, headers=limites)
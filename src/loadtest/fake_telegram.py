@@ -0,0 +1,105 @@
+import asyncio
+import json
+import os
+import time
+from collections import Counter, defaultdict, deque
+from typing import Any, Dict, List
+from urllib.parse import parse_qs
+
+from loadtest.http_stub import StubHTTPServer, Response, json_response
+
+class FakeTelegramServer(StubHTTPServer):
+    """
+    Stand-in de la Bot API: responde getMe/deleteWebhook/getFile, sirve los archivos
+    de las fotos y acepta sendMessage guardando los mensajes enviados por chat. Con
+    `flood_limit` responde 429 (RetryAfter) a los sendMessage que superan ese número por
+    segundo, como el flood control de Telegram.
+    """
+
+    def __init__(self, token: str = "123456:FAKE", photo_bytes: int = 300_000, latency: float = 0.0,
+                 flood_limit: int = 0, **kwargs):
+        super().__init__(**kwargs)
+        self.token = token
+        self.latency = latency
+        self.photo = os.urandom(photo_bytes)
+        self.sent: Dict[int, List[str]] = defaultdict(list)
+        self.methods = Counter()
+        self._message_id = 0
+        self.flood_limit = flood_limit
+        self.flood_errors = 0
+        self._envios_recientes = deque()
+
+    @property
+    def base_url(self) -> str:
+        return f"{self.url}/bot"
+
+    @property
+    def base_file_url(self) -> str:
+        return f"{self.url}/file/bot"
+
+    @staticmethod
+    def _parametros(headers: Dict[str, str], body: bytes) -> Dict[str, Any]:
+        if not body:
+            return {}
+        if headers.get("content-type", "").startswith("application/json"):
+            return json.loads(body)
+        return {clave: valores[-1] for clave, valores in parse_qs(body.decode("utf-8")).items()}
+
+    def _inundado(self) -> bool:
+        if not self.flood_limit:
+            return False
+        ahora = time.monotonic()
+        while self._envios_recientes and ahora - self._envios_recientes[0] > 1:
+            self._envios_recientes.popleft()
+        if len(self._envios_recientes) >= self.flood_limit:
+            return True
+        self._envios_recientes.append(ahora)
+        return False
+
+    def _ok(self, result: Any) -> Response:
+        return json_response({"ok": True, "result": result})
+
+    async def handle(self, method: str, path: str, headers: Dict[str, str], body: bytes) -> Response:
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+
+        if path.startswith(f"/file/bot{self.token}/"):
+            self.methods["download"] += 1
+            return 200, {"Content-Type": "image/jpeg"}, self.photo
+
+        prefijo = f"/bot{self.token}/"
+        if not path.startswith(prefijo):
+            return json_response({"ok": False, "error_code": 404, "description": "Not Found"}, status=404)
+
+        metodo = path[len(prefijo):].split("?")[0]
+        self.methods[metodo] += 1
+        parametros = self._parametros(headers, body)
+
+        if metodo == "getMe":
+            return self._ok({"id": int(self.token.split(":")[0]), "is_bot": True, "first_name": "NoMeEntregaron",
+                             "username": "no_me_entregaron_bot", "can_join_groups": False,
+                             "can_read_all_group_messages": False, "supports_inline_queries": False})
+
+        if metodo == "getFile":
+            file_id = parametros.get("file_id", "")
+            return self._ok({"file_id": file_id, "file_unique_id": f"u-{file_id}",
+                             "file_size": len(self.photo), "file_path": f"photos/{file_id}.jpg"})
+
+        if metodo == "sendMessage":
+            if self._inundado():
+                self.flood_errors += 1
+                return json_response({"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                                      "parameters": {"retry_after": 1}}, status=429)
+            chat_id = int(parametros.get("chat_id", 0))
+            self.sent[chat_id].append(parametros.get("text", ""))
+            self._message_id += 1
+            return self._ok({"message_id": self._message_id, "date": int(time.time()),
+                             "chat": {"id": chat_id, "type": "private"}, "text": parametros.get("text", "")})
+
+        if metodo == "getUpdates":
+            # Long polling sin updates: responde vacío tras una espera corta
+            await asyncio.sleep(min(float(parametros.get("timeout", 0) or 0), 0.5))
+            return self._ok([])
+
+        # deleteWebhook, sendChatAction y el resto: aceptar sin más
+        return self._ok(True)
@@ -0,0 +1,91 @@
+import asyncio
+import json
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+Response = Tuple[int, Dict[str, str], bytes]
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 429: "Too Many Requests", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+def json_response(payload: Any, status: int = 200, headers: Optional[Dict[str, str]] = None) -> Response:
+    cabeceras = {"Content-Type": "application/json"}
+    cabeceras.update(headers or {})
+    return status, cabeceras, json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+class StubHTTPServer:
+    """
+    Servidor HTTP/1.1 mínimo sobre asyncio para los stand-ins locales. Soporta
+    keep-alive y cuerpos con Content-Length, que es lo que envían httpx y requests.
+    Las subclases implementan `handle`.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._conexiones = set()
+        self.requests = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self) -> "StubHTTPServer":
+        self._server = await asyncio.start_server(self._conexion, self.host, self.port, limit=2 ** 24)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self) -> None:
+        if self._server:
+            self._server.close()
+        # Los clientes con keep-alive dejan conexiones abiertas: se cierran explícitamente
+        for tarea in list(self._conexiones):
+            tarea.cancel()
+        await asyncio.gather(*self._conexiones, return_exceptions=True)
+        if self._server:
+            await self._server.wait_closed()
+
+    async def handle(self, method: str, path: str, headers: Dict[str, str], body: bytes) -> Response:
+        raise NotImplementedError
+
+    async def _conexion(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        tarea = asyncio.current_task()
+        self._conexiones.add(tarea)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    linea = await reader.readline()
+                    if linea in (b"\r\n", b"\n", b""):
+                        break
+                    nombre, _, valor = linea.decode("latin-1").partition(":")
+                    headers[nombre.strip().lower()] = valor.strip()
+
+                body = await reader.readexactly(int(headers.get("content-length", 0) or 0))
+                self.requests += 1
+
+                try:
+                    status, response_headers, response_body = await self.handle(method, path, headers, body)
+                except Exception as e:
+                    logger.exception(f"Error en el stub {type(self).__name__}: {e}")
+                    status, response_headers, response_body = json_response({"error": str(e)}, status=500)
+
+                cabecera = f"HTTP/1.1 {status} {_REASONS.get(status, 'OK')}\r\nContent-Length: {len(response_body)}\r\n"
+                cabecera += "".join(f"{nombre}: {valor}\r\n" for nombre, valor in response_headers.items())
+                writer.write(cabecera.encode("latin-1") + b"\r\n" + response_body)
+                await writer.drain()
+
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError, asyncio.CancelledError):
+            pass
+        finally:
+            self._conexiones.discard(tarea)
+            writer.close()
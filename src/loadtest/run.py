@@ -0,0 +1,530 @@
+"""
+Generador de carga de extremo a extremo: levanta los stand-ins locales de OpenAI,
+Telegram y BigQuery, y reproduce miles de usuarios simulados a través del flujo real
+de TelegramHandler (foto, consentimiento, medicamentos, datos y despedida).
+
+Los updates entran por application.update_queue de una Application iniciada con la
+misma configuración que en producción (TelegramHandler.setup_telegram_bot), como los del
+Updater o los del receptor en modo multi-worker: rige el mismo límite de updates
+concurrentes. La latencia de un turno va desde que el update entra en la cola hasta que
+terminan todos sus handlers, así que incluye la espera detrás de otros updates.
+
+Reporta throughput, percentiles de latencia por turno, memoria y completions por
+queja terminada, además de los percentiles por etapa de core.metrics y la latencia,
+los tokens y el costo estimado por nivel de modelo (core.model_router).
+
+Uso (desde src/):
+    python -m loadtest.run --usuarios 2000 --concurrencia 200 --chat-latencia 0.05 --vision-latencia 0.3
+    python -m loadtest.run --usuarios 4000 --procesos 4
+    python -m loadtest.run --usuarios 500 --chat-latencia 2 --sin-ruteo
+    python -m loadtest.run --usuarios 200 --tasa-lentas 0.05 --latencia-lenta 10 --sin-cobertura
+    python -m loadtest.run --usuarios 500 --concurrencia 100 --detener-a 3
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import resource
+import shutil
+import statistics
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from typing import Any, Dict, List
+
+from loadtest.fake_openai import FakeOpenAIServer
+from loadtest.fake_telegram import FakeTelegramServer
+from loadtest.fake_bigquery import FakeBigQueryClient
+
+TOKEN = "123456:FAKE-LOADTEST"
+
+# Conversación de un usuario típico, de la foto de la fórmula a la despedida
+GUION = [
+    ("photo", None),
+    ("text", "Sí, autorizo"),
+    ("text", "No me entregaron ninguno"),
+    ("text", "Medellín"),
+    ("text", "3001234567"),
+    ("text", "15/04/1980"),
+    ("text", "Contributivo"),
+    ("text", "Mi dirección: Calle 45 # 23-10."),
+    ("text", "La farmacia: Cruz Verde."),
+    ("text", "Muchas gracias"),
+]
+
+# Preguntas libres frecuentes, escritas de distintas formas, para la caché de respuestas
+PREGUNTAS = [
+    "¿Cuánto se demora la queja?",
+    "cuanto se demora?",
+    "¿Cuánto tiempo se demoran?",
+    "¿Por qué necesitan mi fórmula?",
+    "por que necesitan mi formula",
+    "¿Qué es el régimen?",
+    "que es el regimen de afiliacion?",
+]
+
+def percentil(valores: List[float], q: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(q * len(ordenados)))]
+
+class SimuladorUsuarios:
+    def __init__(self, application, telegram=None, paginas: int = 1, preguntas: float = 0.0):
+        self.application = application
+        # Fracción de usuarios que hacen una pregunta libre antes de enviar la fórmula
+        self.preguntas = preguntas
+        # Con paginas > 1 la fórmula se envía como álbum y la respuesta sale en segundo plano
+        self.telegram = telegram
+        self.paginas = paginas
+        self._update_id = 0
+        # Latencia de los turnos de texto que no esperan la lectura de la fórmula del propio
+        # usuario: lo que demoran las respuestas mientras otros usuarios mandan fotos
+        self.latencias_texto: List[float] = []
+        # Turnos esperando que la Application termine su update, por update_id
+        self._pendientes: Dict[int, asyncio.Future] = {}
+        # Como el Updater detenido por SIGTERM: los usuarios no envían más mensajes
+        self.detenido = False
+        self.en_turno = 0
+
+    def _update(self, user_id: int, tipo: str, texto: str, media_group_id: str = None) -> Dict[str, Any]:
+        self._update_id += 1
+        message = {
+            "message_id": self._update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Usuario", "username": f"usuario{user_id}"},
+        }
+        if tipo == "photo":
+            message["photo"] = [{
+                "file_id": f"foto-{user_id}-{self._update_id}",
+                "file_unique_id": f"uf-{user_id}-{self._update_id}",
+                "width": 1280,
+                "height": 960
+            }]
+            if media_group_id:
+                message["media_group_id"] = media_group_id
+        else:
+            message["text"] = texto
+        return {"update_id": self._update_id, "message": message}
+
+    async def terminado(self, update, context) -> None:
+        """Handler del último grupo: corre cuando los handlers de producción terminaron el update"""
+        futuro = self._pendientes.pop(update.update_id, None)
+        if futuro is not None and not futuro.done():
+            futuro.set_result(None)
+
+    async def _procesar(self, update) -> None:
+        """Encola el update como el Updater y espera a que la Application lo termine"""
+        futuro = asyncio.get_running_loop().create_future()
+        self._pendientes[update.update_id] = futuro
+        await self.application.update_queue.put(update)
+        await futuro
+
+    async def simular_usuario(self, user_id: int, latencias: List[float], pausa: float) -> None:
+        from telegram import Update
+
+        guion = list(GUION)
+        azar = random.Random(user_id)
+        if azar.random() < self.preguntas:
+            guion.insert(0, ("text", azar.choice(PREGUNTAS)))
+
+        anterior = None
+        for tipo, texto in guion:
+            if self.detenido:
+                return
+            if tipo == "photo" and len(guion) > len(GUION):
+                # El bot ignora una foto que llega menos de 2.5 s después de un mensaje
+                await asyncio.sleep(2.6)
+            inicio = time.perf_counter()
+            self.en_turno += 1
+            try:
+                if tipo == "photo" and self.paginas > 1:
+                    await self._enviar_album(user_id)
+                else:
+                    update = Update.de_json(self._update(user_id, tipo, texto), self.application.bot)
+                    await self._procesar(update)
+            finally:
+                self.en_turno -= 1
+            latencias.append(time.perf_counter() - inicio)
+            if tipo == "text" and anterior != "photo":
+                self.latencias_texto.append(latencias[-1])
+            anterior = tipo
+            if pausa:
+                await asyncio.sleep(pausa)
+
+    async def _enviar_album(self, user_id: int) -> None:
+        """Envía las páginas como álbum y espera la primera respuesta del bot"""
+        from telegram import Update
+
+        enviados = len(self.telegram.sent[user_id])
+        media_group_id = f"album-{user_id}-{self._update_id}"
+        for _ in range(self.paginas):
+            update = Update.de_json(self._update(user_id, "photo", None, media_group_id), self.application.bot)
+            await self.application.update_queue.put(update)
+        while len(self.telegram.sent[user_id]) == enviados:
+            await asyncio.sleep(0.01)
+
+async def ejecutar_carga(opciones: Dict[str, Any], user_ids: List[int]) -> Dict[str, Any]:
+    """Ejecuta la carga para los usuarios dados y devuelve los resultados crudos"""
+    from config import get_model_routing_config
+    from core import model_router
+
+    ruteo = dict(get_model_routing_config(), enabled=not opciones.get("sin_ruteo", False))
+    model_router.configurar(ruteo)
+    razonamiento = set(ruteo["tiers"]["razonamiento"])
+    latencia_rapido = opciones.get("latencia_rapido")
+    if latencia_rapido is None:
+        latencia_rapido = opciones["chat_latencia"] / 4
+
+    fake_openai = await FakeOpenAIServer(
+        chat_latency=opciones["chat_latencia"],
+        vision_latency=opciones["vision_latencia"],
+        error_rate=opciones.get("tasa_errores", 0.0),
+        requests_per_minute=opciones.get("cuota_rpm", 0),
+        # Los modelos rápidos responden antes y no gastan tokens de razonamiento
+        model_latency={modelo: latencia_rapido for modelo in ruteo["tiers"]["rapido"] if modelo not in razonamiento},
+        reasoning_tokens={modelo: opciones.get("tokens_razonamiento", 0) for modelo in razonamiento},
+        slow_rate=opciones.get("tasa_lentas", 0.0),
+        slow_latency=opciones.get("latencia_lenta", 10.0)
+    ).start()
+    fake_telegram = await FakeTelegramServer(
+        token=TOKEN,
+        photo_bytes=opciones["foto_kb"] * 1024,
+        latency=opciones["telegram_latencia"],
+        flood_limit=opciones.get("telegram_limite", 0)
+    ).start()
+    fake_bigquery = FakeBigQueryClient(latency=opciones["bigquery_latencia"])
+
+    # Los clientes de OpenAI leen la URL base del ambiente al crearse
+    os.environ["OPENAI_BASE_URL"] = fake_openai.base_url
+    os.environ.setdefault("OPENAI_API_KEY", "sk-loadtest")
+    if opciones.get("sin_cache"):
+        os.environ["RESPONSE_CACHE"] = "false"
+
+    from config import get_outbound_config
+    from core import metrics
+    from core.session_manager import user_sessions
+    from services.outbound_dispatcher import OutboundDispatcher
+    from services.llm_gateway import LLMGateway
+    from services.openai_service import OpenAIService
+    from services.image_processor import ImageProcessor
+    from services.bigquery_service import BigQueryService
+    from services.history_store import HistoryStore
+    from handlers.telegram_handler import TelegramHandler
+
+    metrics.registry.reset()
+    metrics.set_enabled(True)
+    user_sessions.clear()
+
+    from config import get_llm_config
+
+    llm_config = get_llm_config()
+    if opciones.get("sin_cobertura"):
+        llm_config.update(hedge_chat_after=0, hedge_vision_after=0)
+    if opciones.get("plazo_chat") is not None:
+        llm_config["chat_deadline"] = opciones["plazo_chat"]
+    llm_gateway = LLMGateway(api_key="sk-loadtest", config=llm_config)
+    telegram_handler = TelegramHandler(
+        telegram_token=TOKEN,
+        openai_service=OpenAIService(api_key="sk-loadtest", gateway=llm_gateway),
+        image_processor=ImageProcessor(api_key="sk-loadtest", gateway=llm_gateway),
+        bigquery_service=BigQueryService(project_id="loadtest", dataset_id="loadtest", table_id="quejas", client=fake_bigquery,
+                                         history_store=HistoryStore(":memory:")),
+        base_url=fake_telegram.base_url,
+        base_file_url=fake_telegram.base_file_url,
+        # Los usuarios simulados escriben sin pausa y el stand-in no tiene los límites de Telegram:
+        # por defecto la cola casi no limita; --telegram-tasa-global 25 --telegram-tasa-chat 1 son los reales
+        dispatcher=OutboundDispatcher(config=dict(
+            get_outbound_config(),
+            global_rate=opciones.get("telegram_tasa_global", 1000.0),
+            chat_rate=opciones.get("telegram_tasa_chat", 20.0)
+        ))
+    )
+    from telegram import Update
+    from telegram.ext import TypeHandler
+
+    application = telegram_handler.setup_telegram_bot(receive_updates=False)
+    simulador = SimuladorUsuarios(application, fake_telegram, opciones.get("paginas", 1), opciones.get("preguntas", 0.0))
+    application.add_handler(TypeHandler(Update, simulador.terminado), group=2)
+    await application.initialize()
+    await application.start()
+    latencias: List[float] = []
+    semaforo = asyncio.Semaphore(opciones["concurrencia"])
+
+    async def con_limite(user_id: int) -> None:
+        async with semaforo:
+            await simulador.simular_usuario(user_id, latencias, opciones["pausa"])
+
+    from config import get_shutdown_config, get_session_snapshot_config
+    from main import apagar
+    from services.session_snapshot import SessionSnapshot
+
+    rss_inicial = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    inicio = time.perf_counter()
+    carga = asyncio.ensure_future(asyncio.gather(*(con_limite(user_id) for user_id in user_ids)))
+    parada = None
+    instantanea = None
+    if opciones.get("detener_a") is not None:
+        # La última instantánea de la parada se restaura después, como al arrancar de nuevo
+        directorio_instantanea = tempfile.mkdtemp(prefix="loadtest-sesiones-")
+        instantanea = SessionSnapshot(directorio_instantanea, get_session_snapshot_config())
+        # Simula SIGTERM a mitad de la carga: no entran mensajes nuevos y los turnos en curso
+        # tienen SHUTDOWN_DRAIN_TIMEOUT para terminar, como en main.apagar
+        shutdown_config = get_shutdown_config()
+        await asyncio.wait({carga}, timeout=opciones["detener_a"])
+        simulador.detenido = True
+        inicio_parada = time.perf_counter()
+        await asyncio.wait({carga}, timeout=shutdown_config["drain_timeout"])
+        parada = {
+            "turnos_cortados": simulador.en_turno,
+            "en_curso": sum(1 for sesion in user_sessions.values() if sesion["data"].get("formula_data")
+                            and not sesion["data"]["queja_actual"].get("guardada", False)),
+        }
+        carga.cancel()
+    else:
+        await carga
+    duracion = time.perf_counter() - inicio
+    rss_final = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    await apagar(application, telegram_handler, get_shutdown_config(), instantanea)
+    if parada is not None:
+        parada["segundos"] = time.perf_counter() - inicio_parada
+        inicio_restauracion = time.perf_counter()
+        restauradas = SessionSnapshot(directorio_instantanea, get_session_snapshot_config()).restaurar()
+        parada["restauracion"] = time.perf_counter() - inicio_restauracion
+        parada["restauradas"] = sum(1 for sesion in restauradas.values() if sesion["data"].get("formula_data")
+                                    and not sesion["data"]["queja_actual"].get("guardada", False))
+        shutil.rmtree(directorio_instantanea, ignore_errors=True)
+    await fake_openai.stop()
+    await fake_telegram.stop()
+
+    quejas_guardadas = len(fake_bigquery.rows)
+    etapas = {
+        dict(clave).get("stage"): {
+            "p50": histograma.quantile(0.5),
+            "p95": histograma.quantile(0.95),
+            "p99": histograma.quantile(0.99),
+            "n": histograma.count
+        }
+        for clave, histograma in metrics.registry.histograms(metrics.STAGE_METRIC).items()
+    }
+    niveles = {}
+    for clave, histograma in metrics.registry.histograms("llm_tier_latency_seconds").items():
+        etiquetas = dict(clave)
+        niveles[(etiquetas["tier"], etiquetas["model"])] = {
+            "n": histograma.count, "p50": histograma.quantile(0.5), "p95": histograma.quantile(0.95),
+            "prompt": 0.0, "completion": 0.0, "costo": 0.0,
+        }
+    for clave, contador in metrics.registry.counters("llm_tier_tokens_total").items():
+        etiquetas = dict(clave)
+        niveles[(etiquetas["tier"], etiquetas["model"])][etiquetas["kind"]] += contador.value
+    for clave, contador in metrics.registry.counters("llm_tier_cost_usd_total").items():
+        etiquetas = dict(clave)
+        niveles[(etiquetas["tier"], etiquetas["model"])]["costo"] += contador.value
+
+    return {
+        "usuarios": len(user_ids),
+        "turnos": len(latencias),
+        "duracion": duracion,
+        "latencias": latencias,
+        "latencias_texto": simulador.latencias_texto,
+        "completions": dict(fake_openai.completions),
+        "tokens": dict(fake_openai.tokens),
+        "quejas_guardadas": quejas_guardadas,
+        "mensajes_enviados": sum(len(textos) for textos in fake_telegram.sent.values()),
+        "rss_inicial_kb": rss_inicial,
+        "rss_final_kb": rss_final,
+        "etapas": etapas,
+        "niveles": niveles,
+        "completions_evitadas": sum(
+            contador.value for contador in metrics.registry.counters("llm_completions_avoided_total").values()
+        ),
+        "errores_openai": dict(fake_openai.errors),
+        "reintentos": sum(contador.value for contador in metrics.registry.counters("llm_retries_total").values()),
+        "lentas": fake_openai.slow,
+        "duplicadas": sum(contador.value for contador in metrics.registry.counters("llm_hedged_requests_total").values()),
+        "ganadas_duplicado": sum(contador.value for contador in metrics.registry.counters("llm_hedge_wins_total").values()),
+        "respaldos": sum(contador.value for contador in metrics.registry.counters("llm_chat_deadline_fallbacks_total").values()),
+        "flood": fake_telegram.flood_errors,
+        "envio": (lambda h: {"n": h.count, "p50": h.quantile(0.5), "p95": h.quantile(0.95)})(
+            metrics.registry.histogram("telegram_send_seconds", prioridad="1")),
+        "parada": parada,
+        "cache": Counter({
+            dict(clave)["resultado"]: contador.value
+            for clave, contador in metrics.registry.counters("response_cache_lookups_total").items()
+        }),
+    }
+
+def _ejecutar_shard(opciones: Dict[str, Any], user_ids: List[int]) -> Dict[str, Any]:
+    logging.disable(logging.WARNING)
+    return asyncio.run(ejecutar_carga(opciones, user_ids))
+
+def combinar(resultados: List[Dict[str, Any]]) -> Dict[str, Any]:
+    combinado = {
+        "usuarios": sum(r["usuarios"] for r in resultados),
+        "turnos": sum(r["turnos"] for r in resultados),
+        "duracion": max(r["duracion"] for r in resultados),
+        "latencias": [latencia for r in resultados for latencia in r["latencias"]],
+        "latencias_texto": [latencia for r in resultados for latencia in r["latencias_texto"]],
+        "completions": sum((Counter(r["completions"]) for r in resultados), Counter()),
+        "tokens": sum((Counter(r["tokens"]) for r in resultados), Counter()),
+        "quejas_guardadas": sum(r["quejas_guardadas"] for r in resultados),
+        "mensajes_enviados": sum(r["mensajes_enviados"] for r in resultados),
+        "rss_inicial_kb": sum(r["rss_inicial_kb"] for r in resultados),
+        "rss_final_kb": sum(r["rss_final_kb"] for r in resultados),
+        "etapas": resultados[0]["etapas"] if len(resultados) == 1 else {},
+        "niveles": resultados[0]["niveles"] if len(resultados) == 1 else {},
+        "completions_evitadas": sum(r["completions_evitadas"] for r in resultados),
+        "errores_openai": sum((Counter(r["errores_openai"]) for r in resultados), Counter()),
+        "reintentos": sum(r["reintentos"] for r in resultados),
+        "lentas": sum(r["lentas"] for r in resultados),
+        "duplicadas": sum(r["duplicadas"] for r in resultados),
+        "ganadas_duplicado": sum(r["ganadas_duplicado"] for r in resultados),
+        "respaldos": sum(r["respaldos"] for r in resultados),
+        "cache": sum((r["cache"] for r in resultados), Counter()),
+        "flood": sum(r["flood"] for r in resultados),
+        "envio": resultados[0]["envio"] if len(resultados) == 1 else {},
+        "parada": resultados[0]["parada"] if len(resultados) == 1 else None,
+    }
+    return combinado
+
+def imprimir_reporte(resultado: Dict[str, Any]) -> None:
+    latencias = resultado["latencias"]
+    completions = sum(resultado["completions"].values())
+    quejas = resultado["quejas_guardadas"]
+
+    print(f"Usuarios simulados:       {resultado['usuarios']}")
+    print(f"Turnos procesados:        {resultado['turnos']} en {resultado['duracion']:.2f}s")
+    print(f"Throughput:               {resultado['turnos'] / resultado['duracion']:,.1f} turnos/s | "
+          f"{quejas / resultado['duracion']:,.1f} quejas/s")
+    print(f"Latencia por turno:       p50 {percentil(latencias, 0.5) * 1000:.0f} ms | "
+          f"p95 {percentil(latencias, 0.95) * 1000:.0f} ms | p99 {percentil(latencias, 0.99) * 1000:.0f} ms | "
+          f"media {statistics.mean(latencias) * 1000:.0f} ms")
+    texto = resultado["latencias_texto"]
+    print(f"Turnos de texto:          p50 {percentil(texto, 0.5) * 1000:.0f} ms | p95 {percentil(texto, 0.95) * 1000:.0f} ms | "
+          f"p99 {percentil(texto, 0.99) * 1000:.0f} ms (sin el que espera la lectura de la fórmula propia)")
+    print(f"Memoria (RSS máx.):       {resultado['rss_inicial_kb'] / 1024:.1f} MB -> {resultado['rss_final_kb'] / 1024:.1f} MB")
+    print(f"Completions:              {dict(resultado['completions'])}")
+    print(f"Completions evitadas:     {resultado['completions_evitadas']:.0f} (plantillas locales)")
+    if resultado["errores_openai"]:
+        print(f"Errores de OpenAI:        {dict(resultado['errores_openai'])} | reintentos del gateway: {resultado['reintentos']:.0f}")
+    if resultado["lentas"] or resultado["duplicadas"] or resultado["respaldos"]:
+        print(f"Respuestas lentas:        {resultado['lentas']} | duplicadas {resultado['duplicadas']:.0f} "
+              f"(+{resultado['duplicadas'] / max(completions, 1):.1%} llamadas, ganó el duplicado {resultado['ganadas_duplicado']:.0f}) | "
+              f"respaldos por plazo {resultado['respaldos']:.0f}")
+    if resultado["cache"]:
+        consultas = sum(resultado["cache"].values())
+        print(f"Caché de respuestas:      {resultado['cache']['hit']:.0f} aciertos de {consultas:.0f} preguntas "
+              f"({resultado['cache']['hit'] / consultas:.0%})")
+    print(f"Quejas guardadas:         {quejas} de {resultado['usuarios']}")
+    if quejas:
+        print(f"Completions por queja:    {completions / quejas:.2f}")
+    print(f"Mensajes enviados:        {resultado['mensajes_enviados']}")
+    if resultado["envio"].get("n"):
+        print(f"Cola de salida:           p50 {resultado['envio']['p50'] * 1000:.0f} ms | p95 {resultado['envio']['p95'] * 1000:.0f} ms "
+              f"desde que se encola hasta que Telegram acepta | RetryAfter: {resultado['flood']}")
+    if resultado["parada"]:
+        print(f"Parada ordenada:          {resultado['parada']['segundos']:.2f}s | turnos cortados por el plazo: "
+              f"{resultado['parada']['turnos_cortados']} | quejas a medio llenar: {resultado['parada']['en_curso']}, "
+              f"{resultado['parada']['restauradas']} recuperadas de la instantánea en {resultado['parada']['restauracion'] * 1000:.0f} ms")
+
+    for etapa, valores in sorted(resultado["etapas"].items()):
+        print(f"  etapa {etapa:<16} n={valores['n']:<6} p50 {valores['p50'] * 1000:7.1f} ms | "
+              f"p95 {valores['p95'] * 1000:7.1f} ms | p99 {valores['p99'] * 1000:7.1f} ms")
+
+    if resultado["niveles"]:
+        costo = sum(valores["costo"] for valores in resultado["niveles"].values())
+        print(f"Costo estimado:           US$ {costo:.4f}" + (f" | US$ {costo / quejas:.5f} por queja" if quejas else ""))
+    for (nivel, modelo), valores in sorted(resultado["niveles"].items()):
+        print(f"  nivel {nivel:<12} {modelo:<12} n={valores['n']:<6} p50 {valores['p50'] * 1000:7.1f} ms | "
+              f"p95 {valores['p95'] * 1000:7.1f} ms | tokens/llamada {valores['prompt'] / valores['n']:6.0f} + "
+              f"{valores['completion'] / valores['n']:4.0f} | US$ {valores['costo']:.4f}")
+
+def opciones_desde_args(args) -> Dict[str, Any]:
+    return {
+        "concurrencia": args.concurrencia,
+        "chat_latencia": args.chat_latencia,
+        "vision_latencia": args.vision_latencia,
+        "telegram_latencia": args.telegram_latencia,
+        "bigquery_latencia": args.bigquery_latencia,
+        "foto_kb": args.foto_kb,
+        "pausa": args.pausa,
+        "paginas": args.paginas,
+        "tasa_errores": args.tasa_errores,
+        "cuota_rpm": args.cuota_rpm,
+        "sin_ruteo": args.sin_ruteo,
+        "latencia_rapido": args.latencia_rapido,
+        "tokens_razonamiento": args.tokens_razonamiento,
+        "tasa_lentas": args.tasa_lentas,
+        "latencia_lenta": args.latencia_lenta,
+        "sin_cobertura": args.sin_cobertura,
+        "plazo_chat": args.plazo_chat,
+        "preguntas": args.preguntas,
+        "telegram_limite": args.telegram_limite,
+        "telegram_tasa_chat": args.telegram_tasa_chat,
+        "telegram_tasa_global": args.telegram_tasa_global,
+        "sin_cache": args.sin_cache,
+        "detener_a": args.detener_a,
+    }
+
+def principal(args) -> None:
+    logging.basicConfig(level=logging.WARNING)
+    opciones = opciones_desde_args(args)
+    user_ids = [100000 + indice for indice in range(args.usuarios)]
+
+    if args.procesos <= 1:
+        resultado = asyncio.run(ejecutar_carga(opciones, user_ids))
+    else:
+        # Mismo reparto por hash consistente que el modo multi-worker del bot
+        from core.sharding import ConsistentHashRing
+        anillo = ConsistentHashRing(args.procesos)
+        shards: List[List[int]] = [[] for _ in range(args.procesos)]
+        for user_id in user_ids:
+            shards[anillo.node_for(user_id)].append(user_id)
+
+        with ProcessPoolExecutor(max_workers=args.procesos, mp_context=multiprocessing.get_context("spawn")) as pool:
+            resultado = combinar(list(pool.map(_ejecutar_shard, [opciones] * args.procesos, shards)))
+
+    imprimir_reporte(resultado)
+
+def crear_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--usuarios", type=int, default=1000)
+    parser.add_argument("--concurrencia", type=int, default=100, help="usuarios conversando a la vez")
+    parser.add_argument("--procesos", type=int, default=1, help="procesos con su propio shard de usuarios")
+    parser.add_argument("--chat-latencia", type=float, default=0.05, help="segundos por completion de chat")
+    parser.add_argument("--vision-latencia", type=float, default=0.3, help="segundos por llamada de Vision")
+    parser.add_argument("--telegram-latencia", type=float, default=0.0)
+    parser.add_argument("--bigquery-latencia", type=float, default=0.0)
+    parser.add_argument("--telegram-limite", type=int, default=0,
+                        help="sendMessage por segundo que acepta el stand-in de Telegram antes de responder 429")
+    parser.add_argument("--telegram-tasa-global", type=float, default=1000.0,
+                        help="mensajes por segundo del bot en la cola de salida (TELEGRAM_GLOBAL_RATE)")
+    parser.add_argument("--telegram-tasa-chat", type=float, default=20.0, help="mensajes por segundo por chat (TELEGRAM_CHAT_RATE)")
+    parser.add_argument("--foto-kb", type=int, default=300)
+    parser.add_argument("--paginas", type=int, default=1, help="páginas de la fórmula; con más de una se envía como álbum")
+    parser.add_argument("--pausa", type=float, default=0.0, help="tiempo de escritura entre turnos")
+    parser.add_argument("--tasa-errores", type=float, default=0.0, help="fracción de completions que responden 429 o 500")
+    parser.add_argument("--cuota-rpm", type=int, default=0, help="solicitudes por minuto que acepta el stand-in de OpenAI")
+    parser.add_argument("--sin-ruteo", action="store_true", help="todos los turnos al modelo de razonamiento (referencia)")
+    parser.add_argument("--latencia-rapido", type=float, default=None,
+                        help="segundos por completion del modelo rápido (por defecto, la cuarta parte de --chat-latencia)")
+    parser.add_argument("--tokens-razonamiento", type=int, default=200,
+                        help="tokens de razonamiento ocultos que cobra cada completion del modelo de razonamiento")
+    parser.add_argument("--tasa-lentas", type=float, default=0.0, help="fracción de completions que se quedan colgadas")
+    parser.add_argument("--latencia-lenta", type=float, default=10.0, help="segundos que tarda una completion colgada")
+    parser.add_argument("--sin-cobertura", action="store_true", help="sin duplicar las llamadas lentas (referencia)")
+    parser.add_argument("--preguntas", type=float, default=0.0,
+                        help="fracción de usuarios que hacen una pregunta libre frecuente antes de la fórmula")
+    parser.add_argument("--sin-cache", action="store_true", help="sin la caché de respuestas (referencia)")
+    parser.add_argument("--plazo-chat", type=float, default=None, help="plazo de un turno de chat (LLM_CHAT_DEADLINE)")
+    parser.add_argument("--detener-a", type=float, default=None,
+                        help="segundos tras los que se simula SIGTERM, la parada ordenada de main.apagar y el reinicio")
+    return parser
+
+if __name__ == "__main__":
+    principal(crear_parser().parse_args())
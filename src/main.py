@@ -1,13 +1,28 @@
 import os
+import queue
+import multiprocessing
+import signal
 import logging
 import asyncio
 from dotenv import load_dotenv
+from telegram import Update
 
-from config import get_api_config
+from config import (get_api_config, get_worker_config, get_metrics_config, get_logging_config, get_startup_config,
+                    get_shutdown_config)
+from core.sharding import WorkerSupervisor
+from core.executor import run_blocking, shutdown_executors
+from core.metrics import start_metrics, stop_metrics
+from core.readiness import verificar_dependencias
+from core.session_manager import user_sessions
+from core.structured_logging import configure_logging
+from services.llm_gateway import LLMGateway
 from services.openai_service import OpenAIService
 from services.image_processor import ImageProcessor
 from services.bigquery_service import BigQueryService
+from services.history_store import HistoryStore
+from services.session_snapshot import crear_instantanea
 from handlers.telegram_handler import TelegramHandler
+from handlers.shard_router import ShardRouter
 
 # Configurar logging
 logging.basicConfig(
@@ -17,53 +32,273 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
-async def main():
-    # Cargar variables de entorno
-    load_dotenv()
-    
-    # Obtener configuración
-    config = get_api_config()
-    
-    # Inicializar servicios
-    openai_service = OpenAIService(api_key=config['openai_api_key'])
-    image_processor = ImageProcessor(api_key=config['openai_api_key'])
+def crear_telegram_handler(config, crear_cliente_bigquery=None):
+    # Inicializar servicios; los clientes de OpenAI y BigQuery se crean en su primer uso.
+    # crear_cliente_bigquery reemplaza al cliente real (p. ej. el stand-in de benchmarks.bench_sharding)
+    # Un solo gateway (pool de conexiones, límites y reintentos) para chat y Vision
+    llm_gateway = LLMGateway(api_key=config['openai_api_key'])
+    openai_service = OpenAIService(api_key=config['openai_api_key'], gateway=llm_gateway)
+    image_processor = ImageProcessor(api_key=config['openai_api_key'], gateway=llm_gateway)
     bigquery_service = BigQueryService(
         project_id=config['bigquery_project_id'],
         dataset_id=config['bigquery_dataset_id'],
         table_id=config['bigquery_table_id'],
-        credentials_path=config['google_credentials_path']
+        credentials_path=config['google_credentials_path'],
+        client=crear_cliente_bigquery() if crear_cliente_bigquery else None,
+        history_store=HistoryStore()
     )
-    
+
     # Inicializar el manejador de Telegram
-    telegram_handler = TelegramHandler(
+    return TelegramHandler(
         telegram_token=config['telegram_token'],
         openai_service=openai_service,
         image_processor=image_processor,
-        bigquery_service=bigquery_service
+        bigquery_service=bigquery_service,
+        base_url=config['telegram_base_url'],
+        base_file_url=config['telegram_base_file_url']
     )
-    
-    # Configurar y arrancar el bot de Telegram
-    application = telegram_handler.setup_telegram_bot()
-    
-    logger.info("Bot inicializado y listo para procesar mensajes")
-    
+
+def verificar_en_segundo_plano(telegram_handler) -> asyncio.Task:
+    """Verifica OpenAI y BigQuery en paralelo sin retrasar la recepción de mensajes"""
+    startup_config = get_startup_config()
+    verificaciones = {
+        "openai": telegram_handler.openai_service.verificar_conexion,
+        "bigquery": telegram_handler.bigquery_service.verificar_conexion,
+    }
+    if telegram_handler.image_processor.gateway is not telegram_handler.openai_service.gateway:
+        verificaciones["vision"] = telegram_handler.image_processor.verificar_conexion
+    return asyncio.create_task(verificar_dependencias(
+        verificaciones,
+        timeout=startup_config['healthcheck_timeout'],
+        reintento=startup_config['healthcheck_retry']
+    ))
+
+def instalar_senales(detener: asyncio.Event, senales=(signal.SIGTERM, signal.SIGINT)) -> None:
+    """Las señales activan `detener` y la parada corre en el event loop; una segunda señal fuerza la salida"""
+    loop = asyncio.get_running_loop()
+
+    def al_recibir(senal):
+        logger.info(f"Señal {senal.name} recibida: deteniendo el bot")
+        detener.set()
+        loop.remove_signal_handler(senal)
+
+    for senal in senales:
+        try:
+            loop.add_signal_handler(senal, al_recibir, senal)
+        except (NotImplementedError, RuntimeError):
+            # Windows no admite add_signal_handler: Ctrl+C sigue llegando como KeyboardInterrupt
+            pass
+
+async def restaurar_sesiones(instantanea) -> None:
+    """Recupera las sesiones de la última instantánea antes de recibir mensajes"""
+    if instantanea is None:
+        return
     try:
+        user_sessions.update(await run_blocking(instantanea.restaurar))
+    except Exception as e:
+        logger.error(f"No se pudieron restaurar las sesiones: {e}")
+
+async def apagar(application, telegram_handler, shutdown_config, instantanea=None):
+    """
+    Parada ordenada: deja de recibir updates, termina los que están en curso con un plazo,
+    guarda las quejas completas, vacía la cola de salida, escribe la última instantánea de
+    sesiones y cierra los clientes HTTP
+    """
+    if application.updater is not None and application.updater.running:
+        await application.updater.stop()
+
+    # application.stop() procesa los updates que ya estaban en la cola antes de volver
+    en_curso = set()
+    if application.running:
+        en_curso.add(asyncio.create_task(application.stop()))
+    if telegram_handler is not None:
+        en_curso |= telegram_handler.tareas_en_curso()
+    if en_curso:
+        _, demoradas = await asyncio.wait(en_curso, timeout=shutdown_config['drain_timeout'])
+        if demoradas:
+            logger.warning(
+                f"{len(demoradas)} tareas y {application.update_queue.qsize()} updates sin terminar "
+                f"tras {shutdown_config['drain_timeout']:g} s; se guarda lo que haya"
+            )
+
+    if telegram_handler is not None:
+        telegram_handler.intent_handler.descartar_ocr_pendientes()
+        guardadas, _ = await asyncio.gather(
+            telegram_handler.guardar_pendientes(shutdown_config['flush_timeout']),
+            telegram_handler.dispatcher.cerrar(shutdown_config['flush_timeout'])
+        )
+        if guardadas:
+            logger.info(f"{guardadas} quejas guardadas durante la parada")
+    if instantanea is not None:
+        try:
+            await instantanea.guardar()
+        except Exception as e:
+            logger.error(f"No se pudo escribir la última instantánea de sesiones: {e}")
+
+    try:
+        # Cierra el pool HTTP del bot
+        await application.shutdown()
+    except RuntimeError as e:
+        logger.warning(f"No se pudo cerrar la aplicación de Telegram: {e}")
+    if telegram_handler is not None:
+        await telegram_handler.cerrar()
+
+async def ejecutar_polling(application, telegram_handler=None, instantanea=None):
+    shutdown_config = get_shutdown_config()
+    detener = asyncio.Event()
+    metricas = []
+    verificacion = None
+    instantaneas = None
+    try:
+        instalar_senales(detener)
+        await restaurar_sesiones(instantanea)
+
         # Iniciar el bot
         await application.initialize()
         await application.start()
         await application.updater.start_polling()
+        metricas = await start_metrics(get_metrics_config())
+        if telegram_handler is not None:
+            verificacion = verificar_en_segundo_plano(telegram_handler)
+        if instantanea is not None:
+            instantaneas = asyncio.create_task(instantanea.ejecutar())
         logger.info("Bot iniciado correctamente")
-        
-        # Mantener el bot corriendo indefinidamente
-        while True:
-            await asyncio.sleep(1)
-            
-    except KeyboardInterrupt:
-        logger.info("Deteniendo el bot por interrupción del usuario")
+
+        # Hasta SIGTERM (reinicio o despliegue) o SIGINT (Ctrl+C)
+        await detener.wait()
     finally:
-        # Detener el bot al finalizar
-        await application.stop()
+        if verificacion is not None:
+            verificacion.cancel()
+        if instantaneas is not None:
+            instantaneas.cancel()
+        await apagar(application, telegram_handler, shutdown_config, instantanea)
+        await stop_metrics(metricas)
+        shutdown_executors(wait=False)
         logger.info("Bot detenido")
 
+_SIN_MENSAJES = object()
+
+def leer_cola(cola, timeout: float = 0.5):
+    try:
+        return cola.get(timeout=timeout)
+    except queue.Empty:
+        return _SIN_MENSAJES
+
+async def worker_main(indice, cola, config, crear_cliente_bigquery=None):
+    """Procesa los updates que el receptor asigna a este worker"""
+    shutdown_config = get_shutdown_config()
+    telegram_handler = crear_telegram_handler(config, crear_cliente_bigquery)
+    application = telegram_handler.setup_telegram_bot(receive_updates=False)
+    # Cada worker es dueño de sus usuarios (hash consistente) y guarda solo sus sesiones
+    instantanea = crear_instantanea(indice)
+    await restaurar_sesiones(instantanea)
+
+    await application.initialize()
+    await application.start()
+    metricas = await start_metrics(get_metrics_config(), port_offset=indice + 1)
+    verificacion = verificar_en_segundo_plano(telegram_handler)
+    instantaneas = asyncio.create_task(instantanea.ejecutar()) if instantanea is not None else None
+    logger.info(f"Worker {indice} listo para procesar mensajes")
+
+    # El receptor detiene a los workers con None al final de la cola; SIGTERM llega si no terminan a tiempo
+    detener = asyncio.Event()
+    instalar_senales(detener, (signal.SIGTERM,))
+
+    loop = asyncio.get_running_loop()
+    receptor = multiprocessing.parent_process()
+    try:
+        while not detener.is_set():
+            # La cola es de multiprocessing: leerla en un hilo para no bloquear el loop,
+            # con timeout para no quedar esperando en get() después de SIGTERM
+            payload = await loop.run_in_executor(None, leer_cola, cola)
+            if payload is _SIN_MENSAJES:
+                # Los workers no son daemon: si el receptor murió sin detenerlos, salen solos
+                if receptor is not None and not receptor.is_alive():
+                    logger.warning(f"Worker {indice}: el receptor terminó; se detiene")
+                    break
+                continue
+            if payload is None:
+                break
+
+            update = Update.de_json(payload, application.bot)
+            await application.update_queue.put(update)
+    finally:
+        verificacion.cancel()
+        if instantaneas is not None:
+            instantaneas.cancel()
+        await apagar(application, telegram_handler, shutdown_config, instantanea)
+        await stop_metrics(metricas)
+        shutdown_executors(wait=False)
+        logger.info(f"Worker {indice} detenido")
+
+def ejecutar_worker(indice, cola, config, crear_cliente_bigquery=None):
+    # Punto de entrada de cada proceso worker; el cliente de BigQuery no cruza procesos,
+    # por eso se recibe la fábrica y no el cliente
+    load_dotenv()
+    # Ctrl+C llega a todo el grupo de procesos: el receptor coordina la parada con la cola
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    listener = configure_logging(get_logging_config())
+    try:
+        asyncio.run(worker_main(indice, cola, config, crear_cliente_bigquery))
+    finally:
+        if listener:
+            listener.stop()
+
+async def ejecutar_bot(config, worker_config):
+    if worker_config['workers'] > 1:
+        # Modo multi-worker: este proceso solo recibe y reparte los updates por usuario
+        supervisor = WorkerSupervisor(
+            worker_config['workers'],
+            ejecutar_worker,
+            args=(config,),
+            restart_delay=worker_config['restart_delay']
+        )
+        supervisor.start()
+        supervision = None
+        try:
+            application = ShardRouter(
+                config['telegram_token'],
+                supervisor,
+                base_url=config['telegram_base_url'],
+                base_file_url=config['telegram_base_file_url']
+            ).setup_telegram_bot()
+            supervision = asyncio.create_task(supervisor.supervise())
+
+            logger.info(f"Receptor inicializado con {worker_config['workers']} workers")
+
+            await ejecutar_polling(application)
+        finally:
+            if supervision is not None:
+                supervision.cancel()
+            # Los workers terminan su cola y guardan lo pendiente antes de salir
+            shutdown_config = get_shutdown_config()
+            supervisor.stop(timeout=shutdown_config['drain_timeout'] + shutdown_config['flush_timeout'])
+        return
+
+    telegram_handler = crear_telegram_handler(config)
+
+    # Configurar y arrancar el bot de Telegram
+    application = telegram_handler.setup_telegram_bot()
+
+    logger.info("Bot inicializado y listo para procesar mensajes")
+
+    await ejecutar_polling(application, telegram_handler, crear_instantanea())
+
+async def main():
+    # Cargar variables de entorno
+    load_dotenv()
+
+    # Obtener configuración
+    config = get_api_config()
+    worker_config = get_worker_config()
+
+    # Reemplaza la configuración básica por la de la variable de entorno (cola, JSON, muestreo, PII)
+    listener = configure_logging(get_logging_config())
+    try:
+        await ejecutar_bot(config, worker_config)
+    finally:
+        if listener:
+            listener.stop()
+
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -1,39 +1,79 @@
+import json
 import os
 import time
 import logging
-import re
-from typing import Dict, Any
-from google.cloud import bigquery
-from google.oauth2 import service_account
+import threading
+from typing import Dict, Any, List
+from core.executor import run_blocking
+from core.complaint_rows import build_complaint_rows, limpiar_farmacia
+from core.medication_index import formatear, no_entregados, normalizar_medicamentos
 
 logger = logging.getLogger(__name__)
 
+# Estado de una queja en el historial local
+GUARDADA = "guardada"
+PENDIENTE = "pendiente"
+
+# Campos de la sesión que se usan para armar la fila
+CAMPOS_FILA = [
+    "user_id", "queja_actual", "formula_data", "missing_meds", "city", "pharmacy",
+    "birth_date", "cellphone", "affiliation_regime", "residence_address",
+]
+
+# Columnas agregadas a la tabla de quejas después de su primera versión; migrar_esquema
+# las crea. Mientras no existan, build_complaint_rows las omite de la fila.
+COLUMNAS_NUEVAS = {
+    "medicamentos_normalizados": "STRING",
+    "no_entregado_normalizado": "STRING",
+}
+
 class BigQueryService:
-    def __init__(self, project_id: str = None, dataset_id: str = None, table_id: str = None, credentials_path: str = None):
+    def __init__(self, project_id: str = None, dataset_id: str = None, table_id: str = None, credentials_path: str = None, client=None,
+                 history_store=None):
         
         self.project_id = project_id or os.getenv('BIGQUERY_PROJECT_ID')
         self.dataset_id = dataset_id or os.getenv('BIGQUERY_DATASET_ID', 'solutions2pharma_data')
         self.table_id = table_id or os.getenv('BIGQUERY_TABLE_ID', 'quejas')
-        
+        # Índice local de las quejas guardadas (services.history_store), opcional
+        self.history_store = history_store
+        self.credentials_path = credentials_path
+        # Cliente inyectado (p. ej. el stand-in del harness de carga); si no, se crea en el primer uso
+        self._client = client
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        """
+        Cliente de BigQuery. google.cloud.bigquery tarda en importarse y las credenciales
+        del ambiente pueden requerir red, así que se crea al primer uso y no al arrancar;
+        verificar_conexion, que main lanza en segundo plano, lo crea fuera del event loop.
+        """
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = self._crear_cliente()
+        return self._client
+
+    def _crear_cliente(self):
+        from google.cloud import bigquery
+
         try:
-            if credentials_path and os.path.exists(credentials_path):
+            if self.credentials_path and os.path.exists(self.credentials_path):
                 # Usar credenciales desde archivo para Windows
-                logger.info(f"Usando credenciales desde archivo: {credentials_path}")
-                credentials = service_account.Credentials.from_service_account_file(credentials_path)
-                self.client = bigquery.Client(project=self.project_id, credentials=credentials)
-            else:
-                # Intentar usar credenciales del ambiente
-                logger.info("Usando credenciales del ambiente")
-                self.client = bigquery.Client(project=self.project_id)
-                
-            # Verificar conexión con BigQuery
-            self._verificar_conexion()
+                from google.oauth2 import service_account
+
+                logger.info(f"Usando credenciales desde archivo: {self.credentials_path}")
+                credentials = service_account.Credentials.from_service_account_file(self.credentials_path)
+                return bigquery.Client(project=self.project_id, credentials=credentials)
+            # Intentar usar credenciales del ambiente
+            logger.info("Usando credenciales del ambiente")
+            return bigquery.Client(project=self.project_id)
         except Exception as e:
             logger.error(f"Error al inicializar el cliente BigQuery: {e}")
             raise
-    
-    def _verificar_conexion(self):
-        """Verifica que la conexión a BigQuery esté funcionando y que la tabla exista"""
+
+    def verificar_conexion(self):
+        """Verifica que la conexión a BigQuery esté funcionando y que la tabla exista (bloqueante)"""
         try:
             table_ref = f"{self.project_id}.{self.dataset_id}.{self.table_id}"
             self.client.get_table(table_ref)
@@ -42,6 +82,58 @@ class BigQueryService:
             logger.error(f"⚠️ Error verificando conexión a BigQuery: {e}")
             raise
         
+    def migrar_esquema(self) -> List[str]:
+        """Agrega a la tabla las COLUMNAS_NUEVAS que falten (NULLABLE); devuelve las agregadas (bloqueante)"""
+        from google.cloud import bigquery
+
+        table = self.client.get_table(f"{self.project_id}.{self.dataset_id}.{self.table_id}")
+        existentes = {field.name for field in table.schema}
+        faltantes = [nombre for nombre in COLUMNAS_NUEVAS if nombre not in existentes]
+        if faltantes:
+            table.schema = list(table.schema) + [bigquery.SchemaField(nombre, COLUMNAS_NUEVAS[nombre]) for nombre in faltantes]
+            self.client.update_table(table, ["schema"])
+            logger.info(f"Columnas agregadas a {self.table_id}: {', '.join(faltantes)}")
+        return faltantes
+
+    async def _registrar_historial(self, user_data: Dict[str, Any], estado: str = GUARDADA) -> None:
+        formula_data = user_data.get("formula_data") or {}
+        numero_documento = formula_data.get("numero_documento", "")
+        normalizados = formula_data.get("medicamentos_normalizados")
+        if normalizados is None:
+            normalizados = normalizar_medicamentos(formula_data.get("medicamentos", []))
+        faltantes = no_entregados(user_data.get("missing_meds", ""), normalizados)
+        queja = {
+            "id": user_data["queja_actual"]["id"],
+            "numero_documento": numero_documento if numero_documento not in ("", "No visible", "No disponible") else None,
+            "user_id": str(user_data.get("user_id", "")),
+            "paciente": formula_data.get("paciente", "No disponible"),
+            "fecha": time.time(),
+            "eps": formula_data.get("eps", ""),
+            "diagnostico": formula_data.get("diagnostico", ""),
+            "medicamentos": "; ".join(formatear(r) for r in faltantes) or user_data.get("missing_meds", ""),
+            "farmacia": limpiar_farmacia(user_data.get("pharmacy", "")),
+            "estado": estado,
+            # Datos de la sesión con los que se arma la fila: permiten reprocesarla con backfill.py
+            "datos": json.dumps({campo: user_data.get(campo) for campo in CAMPOS_FILA}, ensure_ascii=False, default=str),
+        }
+        try:
+            await run_blocking(self.history_store.registrar, queja, [r["atc"] for r in faltantes])
+        except Exception as error:
+            # Un fallo del historial local no cambia el resultado del guardado en BigQuery
+            logger.warning("No se pudo registrar la queja en el historial local: %s", error, extra={"event": "historial.error"})
+
+    async def registrar_pendiente(self, user_data: Dict[str, Any]) -> None:
+        """Deja la queja pendiente en el historial local para cargarla después con backfill.py"""
+        if self.history_store is not None:
+            await self._registrar_historial(user_data, PENDIENTE)
+
+    def cerrar(self) -> None:
+        """Cierra el cliente de BigQuery y el historial local (bloqueante)"""
+        if self._client is not None and hasattr(self._client, "close"):
+            self._client.close()
+        if self.history_store is not None:
+            self.history_store.close()
+
     async def save_user_data(self, user_data: Dict[str, Any], force_save: bool = False) -> bool:
         try:
             # Comprobar si tenemos los datos mínimos necesarios
@@ -55,32 +147,7 @@ class BigQueryService:
                 logger.info("Datos incompletos, no se guarda en BigQuery todavía")
                 return False
 
-            logger.info("Preparando datos para BigQuery...")
-
-            # Formatear fecha de atención
-            fecha_atencion = None
-            if user_data.get("formula_data", {}).get("fecha_atencion"):
-                fecha_parts = user_data["formula_data"]["fecha_atencion"].split('/')
-                if len(fecha_parts) == 3:
-                    dia, mes, anio = fecha_parts
-                    fecha_atencion = f"{anio}-{mes.zfill(2)}-{dia.zfill(2)}"
-
-            nombre_paciente = user_data.get("formula_data", {}).get("paciente", "No disponible")
-            logger.info(f"Nombre del paciente desde la fórmula: {nombre_paciente}")
-            
-            # Limpiar los datos antes de guardarlos
-            city = user_data.get("city", "")
-            if city.lower() in ["contributivo", "subsidiado", "ese fue"]:
-                city = "No disponible"
-            
-            pharmacy = user_data.get("pharmacy", "")
-            # Limpiar valores de farmacia
-            pharmacy = re.sub(r'donde.*te|y la sede donde|donde no te|sede|y\s+debían|debían', '', pharmacy, flags=re.I).strip()
-            if not pharmacy or pharmacy.lower() in ["y", "la", "el", "los", "las", "donde"]:
-                pharmacy = "No disponible"
-            
-            logger.info(f"Ciudad original: {user_data.get('city', '')}, Ciudad limpia: {city}")
-            logger.info(f"Farmacia original: {user_data.get('pharmacy', '')}, Farmacia limpia: {pharmacy}")
+            logger.debug("Preparando datos para BigQuery...")
             
             # Crear un ID único para la queja si no existe
             if not user_data.get("queja_actual", {}).get("id"):
@@ -94,60 +161,29 @@ class BigQueryService:
                 logger.info(f"La queja {user_data['queja_actual']['id']} ya fue guardada anteriormente.")
                 return True
             
-            # Preparar fila para inserción con valores depurados
-            row = {
-                "PK": user_data["queja_actual"]["id"],
-                "tipo_documento": user_data.get("formula_data", {}).get("tipo_documento", "No disponible"),
-                "numero_documento": user_data.get("formula_data", {}).get("numero_documento", "No disponible"),
-                "paciente": nombre_paciente,
-                "fecha_atencion": fecha_atencion,
-                "eps": user_data.get("formula_data", {}).get("eps", "No disponible"),
-                "doctor": user_data.get("formula_data", {}).get("doctor", "No disponible"),
-                "ips": user_data.get("formula_data", {}).get("ips", "No disponible"),
-                "diagnostico": user_data.get("formula_data", {}).get("diagnostico", "No disponible"),
-                "medicamentos": ", ".join(user_data.get("formula_data", {}).get("medicamentos", [])) or "No disponible",
-                "image_url": "",
-                "no_entregado": user_data.get("missing_meds", "No especificado"),
-                "fecha_nacimiento": user_data.get("birth_date", "No disponible"),
-                "telefono": user_data.get("cellphone", user_data.get("user_id", "No disponible")),
-                "regimen": user_data.get("affiliation_regime", "No disponible"),
-                # Usar los valores limpios
-                "municipio": city,
-                "direccion": user_data.get("residence_address", "No proporcionada"),
-                "farmacia": pharmacy
-            }
-                
+            nombre_paciente = (user_data.get("formula_data") or {}).get("paciente", "No disponible")
             table_ref = f"{self.project_id}.{self.dataset_id}.{self.table_id}"
 
             try:
-                logger.info(f"Enviando datos a BigQuery con los campos: {list(row.keys())}")
-                
                 # Obtener referencia a la tabla
-                table = self.client.get_table(table_ref)
+                table = await run_blocking(self.client.get_table, table_ref)
                 
                 # Obtener esquema de la tabla
                 schema_fields = [field.name for field in table.schema]
-                logger.info(f"Campos en la tabla: {schema_fields}")
-                
-                # Filtrar campos que no existen en el esquema
-                filtered_row = {k: v for k, v in row.items() if k in schema_fields}
+                logger.debug("Campos en la tabla: %s", schema_fields, extra={"event": "bigquery.esquema"})
                 
-                # Si se filtraron campos, registrar cuáles
-                if len(filtered_row) != len(row):
-                    removed_fields = set(row.keys()) - set(filtered_row.keys())
-                    logger.warning(f"Se filtraron campos que no existen en el esquema: {removed_fields}")
-                
-                # Realizar una última verificación de valores inválidos
-                for key, value in filtered_row.items():
-                    if isinstance(value, str) and (not value.strip() or value.strip() in ["y", "la", "el", "los", "las"]):
-                        filtered_row[key] = "No disponible"
+                # Preparar fila para inserción con valores depurados y solo las columnas del esquema
+                filtered_row = build_complaint_rows([user_data], schema_fields)[0]
                 
                 # Insertar datos filtrados
-                logger.info("Ejecutando inserción en BigQuery...")
-                logger.info(f"Farmacia final: {filtered_row.get('farmacia', 'No disponible')}")
-                logger.info(f"Municipio final: {filtered_row.get('municipio', 'No disponible')}")
+                logger.debug(
+                    "Ejecutando inserción en BigQuery: farmacia=%s municipio=%s",
+                    filtered_row.get('farmacia', 'No disponible'),
+                    filtered_row.get('municipio', 'No disponible'),
+                    extra={"event": "bigquery.fila"}
+                )
                 
-                errors = self.client.insert_rows_json(table, [filtered_row])
+                errors = await run_blocking(self.client.insert_rows_json, table, [filtered_row])
                 
                 if not errors:
                     user_data["queja_actual"]["guardada"] = True
@@ -164,42 +200,49 @@ class BigQueryService:
                         "medicamentos": user_data.get("missing_meds", "")
                     })
                     
-                    # Guardar información en el historial del paciente
-                    paciente_id = user_data.get("formula_data", {}).get("numero_documento", "")
-                    
-                    if paciente_id:
-                        if "patient_history" not in user_data:
-                            user_data["patient_history"] = {}
-                            
-                        if paciente_id not in user_data["patient_history"]:
-                            user_data["patient_history"][paciente_id] = {
-                                "nombre": nombre_paciente,
-                                "quejas": []
-                            }
-                        
-                        # Guardar esta queja en el historial del paciente
-                        user_data["patient_history"][paciente_id]["quejas"].append({
-                            "id": user_data["queja_actual"]["id"],
-                            "fecha": time.strftime("%Y-%m-%d %H:%M:%S"),
-                            "medicamentos": user_data.get("missing_meds", ""),
-                            "eps": user_data.get("formula_data", {}).get("eps", ""),
-                            "diagnostico": user_data.get("formula_data", {}).get("diagnostico", "")
-                        })
-                        
-                        logger.info(f"✅ Historial de paciente actualizado para: {nombre_paciente}")
+                    # Guardar la queja en el historial local (consultas de historial y quejas repetidas)
+                    if self.history_store is not None:
+                        await self._registrar_historial(user_data)
 
                     return True
                 else:
                     logger.error(f"❌ Errores al insertar en BigQuery: {errors}")
-                    return False
                     
             except Exception as error:
                 logger.error(f'❌ Error guardando en BigQuery: {error}')
                 import traceback
                 logger.error(traceback.format_exc())
-                return False
+            
+            # La queja queda pendiente en el historial local para cargarla después con backfill.py
+            if self.history_store is not None:
+                await self._registrar_historial(user_data, PENDIENTE)
+            return False
         except Exception as e:
             logger.error(f'Error general preparando datos para BigQuery: {e}')
             import traceback
             logger.error(traceback.format_exc())
-            return False
\ No newline at end of file
+            return False
+
+if __name__ == "__main__":
+    import argparse
+
+    from dotenv import load_dotenv
+
+    from config import get_api_config
+
+    parser = argparse.ArgumentParser(description="Mantenimiento de la tabla de quejas en BigQuery")
+    parser.add_argument("--migrar", action="store_true", help="agrega las columnas nuevas que le falten a la tabla")
+    parser.add_argument("--tabla", help="tabla (por defecto BIGQUERY_TABLE_ID)")
+    args = parser.parse_args()
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    config = get_api_config()
+    servicio = BigQueryService(
+        project_id=config["bigquery_project_id"],
+        dataset_id=config["bigquery_dataset_id"],
+        table_id=args.tabla or config["bigquery_table_id"],
+        credentials_path=config["google_credentials_path"],
+    )
+    if args.migrar:
+        agregadas = servicio.migrar_esquema()
+        print(f"Columnas agregadas: {', '.join(agregadas)}" if agregadas else "La tabla ya tiene todas las columnas")
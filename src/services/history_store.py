@@ -0,0 +1,141 @@
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from config import get_history_config
+
+logger = logging.getLogger(__name__)
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS quejas (
+    id TEXT PRIMARY KEY,
+    numero_documento TEXT,
+    user_id TEXT,
+    paciente TEXT,
+    fecha REAL NOT NULL,
+    eps TEXT,
+    diagnostico TEXT,
+    medicamentos TEXT,
+    farmacia TEXT,
+    estado TEXT,
+    datos TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_quejas_documento ON quejas (numero_documento, fecha);
+CREATE INDEX IF NOT EXISTS idx_quejas_usuario ON quejas (user_id, fecha);
+
+CREATE TABLE IF NOT EXISTS quejas_medicamentos (
+    queja_id TEXT NOT NULL,
+    numero_documento TEXT NOT NULL,
+    atc TEXT NOT NULL,
+    fecha REAL NOT NULL,
+    PRIMARY KEY (queja_id, atc)
+);
+CREATE INDEX IF NOT EXISTS idx_medicamentos_documento ON quejas_medicamentos (numero_documento, atc, fecha);
+"""
+
+_COLUMNAS = ("id", "numero_documento", "user_id", "paciente", "fecha", "eps", "diagnostico", "medicamentos", "farmacia",
+             "estado", "datos")
+
+# Columnas agregadas después de la primera versión del esquema
+_MIGRACIONES = {"estado": "ALTER TABLE quejas ADD COLUMN estado TEXT", "datos": "ALTER TABLE quejas ADD COLUMN datos TEXT"}
+
+class HistoryStore:
+    """
+    Historial local de las quejas, en SQLite: las guardadas en BigQuery y las que
+    quedaron pendientes porque la inserción falló (backfill.py las carga después). Los índices por
+    (numero_documento, fecha), (user_id, fecha) y (numero_documento, atc, fecha) hacen
+    que consultar el historial y detectar una queja repetida sean búsquedas O(log n)
+    en lugar de recorrer listas en la sesión.
+    Los métodos son bloqueantes: desde el event loop se llaman con run_blocking.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or get_history_config()["path"]
+        self._conexion = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conexion.row_factory = sqlite3.Row
+        # Una sola conexión compartida por los hilos del executor de I/O
+        self._lock = threading.Lock()
+        with self._lock:
+            if self.path != ":memory:":
+                # WAL permite leer mientras otro worker escribe
+                self._conexion.execute("PRAGMA journal_mode=WAL")
+                self._conexion.execute("PRAGMA synchronous=NORMAL")
+            self._conexion.executescript(_ESQUEMA)
+            existentes = {fila["name"] for fila in self._conexion.execute("PRAGMA table_info(quejas)")}
+            for columna, sentencia in _MIGRACIONES.items():
+                if columna not in existentes:
+                    self._conexion.execute(sentencia)
+            self._conexion.execute("CREATE INDEX IF NOT EXISTS idx_quejas_estado ON quejas (estado)")
+
+    def registrar(self, queja: Dict[str, Any], codigos_atc: Iterable[str] = ()) -> None:
+        """Guarda una queja y los códigos ATC de sus medicamentos no entregados"""
+        fila = {columna: queja.get(columna) for columna in _COLUMNAS}
+        fila["fecha"] = fila["fecha"] or time.time()
+        with self._lock, self._conexion:
+            self._conexion.execute("BEGIN")
+            self._conexion.execute(
+                f"INSERT OR REPLACE INTO quejas ({', '.join(_COLUMNAS)}) VALUES ({', '.join('?' * len(_COLUMNAS))})",
+                [fila[columna] for columna in _COLUMNAS]
+            )
+            if fila["numero_documento"]:
+                self._conexion.executemany(
+                    "INSERT OR IGNORE INTO quejas_medicamentos (queja_id, numero_documento, atc, fecha) VALUES (?, ?, ?, ?)",
+                    [(fila["id"], fila["numero_documento"], atc, fila["fecha"]) for atc in set(codigos_atc) if atc]
+                )
+
+    def historial(self, numero_documento: Optional[str] = None, user_id: Optional[str] = None, limite: int = 10) -> List[Dict[str, Any]]:
+        """Quejas más recientes del paciente (por documento) o, si no se conoce, del usuario de Telegram"""
+        if numero_documento:
+            consulta = "SELECT * FROM quejas WHERE numero_documento = ? ORDER BY fecha DESC LIMIT ?"
+            parametros = (numero_documento, limite)
+        elif user_id:
+            consulta = "SELECT * FROM quejas WHERE user_id = ? ORDER BY fecha DESC LIMIT ?"
+            parametros = (str(user_id), limite)
+        else:
+            return []
+        with self._lock:
+            return [dict(fila) for fila in self._conexion.execute(consulta, parametros)]
+
+    def queja_repetida(self, numero_documento: str, codigos_atc: Iterable[str], dias: int = None) -> Optional[Dict[str, Any]]:
+        """La queja más reciente del paciente, dentro de la ventana, por alguno de los mismos medicamentos"""
+        codigos = sorted({atc for atc in codigos_atc if atc})
+        if not numero_documento or not codigos:
+            return None
+        dias = get_history_config()["repeat_window_days"] if dias is None else dias
+        desde = time.time() - dias * 86400
+        consulta = (
+            "SELECT q.*, m.atc FROM quejas_medicamentos m JOIN quejas q ON q.id = m.queja_id "
+            f"WHERE m.numero_documento = ? AND m.atc IN ({', '.join('?' * len(codigos))}) AND m.fecha >= ? "
+            "ORDER BY m.fecha DESC LIMIT 1"
+        )
+        with self._lock:
+            fila = self._conexion.execute(consulta, (numero_documento, *codigos, desde)).fetchone()
+        return dict(fila) if fila else None
+
+    def iterar(self, desde: int = 0, estado: Optional[str] = None, tamano: int = 1000) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Recorre las quejas en bloques por rowid creciente, desde el rowid dado (excluido).
+        Cada fila trae su 'rowid' para que el llamador guarde hasta dónde llegó.
+        """
+        filtro = "AND estado = ?" if estado else ""
+        while True:
+            parametros = (desde, estado, tamano) if estado else (desde, tamano)
+            with self._lock:
+                bloque = [dict(fila) for fila in self._conexion.execute(
+                    f"SELECT rowid, * FROM quejas WHERE rowid > ? {filtro} ORDER BY rowid LIMIT ?", parametros
+                )]
+            if not bloque:
+                return
+            yield bloque
+            desde = bloque[-1]["rowid"]
+
+    def marcar(self, ids: Iterable[str], estado: str) -> None:
+        with self._lock, self._conexion:
+            self._conexion.execute("BEGIN")
+            self._conexion.executemany("UPDATE quejas SET estado = ? WHERE id = ?", [(estado, queja_id) for queja_id in ids])
+
+    def close(self) -> None:
+        with self._lock:
+            self._conexion.close()
@@ -1,23 +1,150 @@
 import os
-import json
 import logging
 import re
-import base64
-from typing import Dict, Any
-from openai import OpenAI
+from typing import Dict, Any, List, Union
+from core import model_router
+from core.executor import run_cpu_bound, run_concurrently
+from core.json_parser import JSONIrreparableError, CAMPOS_TEXTO, NO_VISIBLE, SIN_MEDICAMENTOS, extraer_json, validar_datos
+from core.metrics import count
+from services.llm_gateway import LLMGateway
 
 logger = logging.getLogger(__name__)
 
+ESTRUCTURA_JSON = """{
+  "datos": {
+    "tipo_documento": "tipo de documento (CC, TI, etc.)",
+    "numero_documento": "número del documento",
+    "paciente": "nombre completo del paciente",
+    "fecha_atencion": "fecha de atención",
+    "eps": "eps del paciente",
+    "doctor": "nombre del doctor",
+    "diagnostico": "diagnóstico médico si está visible",
+    "medicamentos": ["medicamento 1 con dosis completa", "medicamento 2 con dosis completa", "etc"]
+  }
+}"""
+
+def parsear_respuesta_formula(response_text: str) -> Dict[str, Any]:
+    """
+    Convierte la respuesta de OpenAI Vision en el diccionario de datos de la fórmula.
+    Tolera texto alrededor del JSON, bloques ```json, salidas truncadas o sobre-escapadas
+    y valida la estructura de "datos". Lanza JSONIrreparableError si no hay nada recuperable.
+    """
+    datos, problemas = validar_datos(extraer_json(response_text))
+    if problemas:
+        logger.debug("Lectura de fórmula normalizada: %s", problemas, extra={"event": "vision.normalizacion"})
+    return {"datos": datos}
+
+def extraer_formula_manual(response_text: str) -> Dict[str, Any]:
+    """Último recurso sin JSON: rescata con patrones lo poco que se pueda de la respuesta"""
+    logger.warning("No se encontró un formato JSON válido en la respuesta. Intentando extraer información manualmente.")
+    
+    # Patrones para extraer información básica
+    paciente_match = re.search(r'paciente[:\s]+"([^"]+)"', response_text, re.I)
+    medicamentos_match = re.findall(r'medicamento[s]?[:\s]+([^\n\."]+)', response_text, re.I)
+    
+    # Crear un JSON básico con la información que podamos extraer
+    datos = {
+        "paciente": paciente_match.group(1) if paciente_match else "No visible",
+        "tipo_documento": "No visible",
+        "numero_documento": "No visible",
+        "fecha_atencion": "No visible",
+        "eps": "No visible",
+        "doctor": "No visible",
+        "diagnostico": "No visible",
+        "medicamentos": medicamentos_match if medicamentos_match else ["No se detectaron medicamentos"]
+    }
+    
+    return {"datos": datos}
+
+def _clave_medicamento(medicamento: str) -> str:
+    return " ".join(str(medicamento).lower().split())
+
+def combinar_formulas(resultados: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Une las lecturas de varias páginas de una misma fórmula: cada campo toma el primer
+    valor visible y los medicamentos se concatenan sin repetir (en el orden de las páginas)
+    """
+    datos: Dict[str, Any] = {}
+    campos = list(dict.fromkeys(
+        CAMPOS_TEXTO + [campo for r in resultados for campo in r.get("datos", {}) if campo != "medicamentos"]
+    ))
+    for campo in campos:
+        valores = [r.get("datos", {}).get(campo) for r in resultados]
+        datos[campo] = next((v for v in valores if v and v != NO_VISIBLE), NO_VISIBLE)
+
+    medicamentos: List[str] = []
+    vistos = set()
+    for resultado in resultados:
+        for medicamento in resultado.get("datos", {}).get("medicamentos", []):
+            # Los avisos de "no se detectaron" de una página no cuentan si otra sí los tiene
+            if str(medicamento).startswith("No se"):
+                continue
+            clave = _clave_medicamento(medicamento)
+            if clave not in vistos:
+                vistos.add(clave)
+                medicamentos.append(medicamento)
+
+    if not medicamentos:
+        medicamentos = [SIN_MEDICAMENTOS]
+    datos["medicamentos"] = medicamentos
+    return {"datos": datos}
+
 class ImageProcessor:
-    def __init__(self, api_key: str = None):
+    def __init__(self, api_key: str = None, gateway: LLMGateway = None):
        
         self.api_key = api_key or os.getenv("OPENAI_API_KEY")
-        self.client = OpenAI(api_key=self.api_key)
+        # Mismo gateway que OpenAIService: un solo pool de conexiones y límites compartidos
+        self.gateway = gateway or LLMGateway(self.api_key)
+
+    def verificar_conexion(self):
+        """Verificación bloqueante de la API de Vision, a través del gateway"""
+        self.gateway.verificar_conexion()
     
-    async def process_medical_formula(self, base64_image: str) -> Dict[str, Any]:
+    # Páginas por llamada de Vision; un álbum más grande se lee en varias llamadas y se combina
+    MAX_PAGINAS_POR_LLAMADA = 5
+
+    async def process_medical_formula(self, base64_image: Union[str, List[str]]) -> Dict[str, Any]:
+        """Lee una fórmula de una o varias imágenes (las páginas de un álbum van en la misma llamada)"""
+        paginas = [base64_image] if isinstance(base64_image, str) else list(base64_image)
+        if len(paginas) <= self.MAX_PAGINAS_POR_LLAMADA:
+            resultado = await self._leer_paginas(paginas)
+            return combinar_formulas([resultado]) if len(paginas) > 1 else resultado
+
+        grupos = [paginas[i:i + self.MAX_PAGINAS_POR_LLAMADA] for i in range(0, len(paginas), self.MAX_PAGINAS_POR_LLAMADA)]
+        return combinar_formulas(await run_concurrently(*(self._leer_paginas(grupo) for grupo in grupos)))
+
+    async def _reparar_respuesta(self, response_text: str) -> Dict[str, Any]:
+        """
+        Una sola llamada de solo texto para convertir la lectura ya hecha al JSON esperado,
+        en lugar de volver a enviar la imagen. Si tampoco sirve, se rescata lo posible con patrones.
+        """
+        prompt = f"""El siguiente texto es la lectura de una fórmula médica, pero no está en el formato pedido. Conviértelo a un objeto JSON con EXACTAMENTE esta estructura, sin inventar datos (usa "No visible" para lo que no aparezca):
+{ESTRUCTURA_JSON}
+
+Responde únicamente con el objeto JSON.
+
+TEXTO:
+{response_text[:8000]}"""
+
+        try:
+            # Convertir texto a JSON no necesita razonamiento: va al nivel rápido
+            response = await self.gateway.completar_nivel(
+                model_router.RAPIDO,
+                "chat",
+                messages=[{"role": "user", "content": prompt}]
+            )
+            resultado = await run_cpu_bound(parsear_respuesta_formula, response.choices[0].message.content)
+            count("vision_json_repairs_total", help="Llamadas de reparación de texto tras una lectura de Vision sin JSON", resultado="ok")
+            return resultado
+        except Exception as e:
+            logger.error(f"La reparación de la lectura falló: {e}")
+            count("vision_json_repairs_total", help="Llamadas de reparación de texto tras una lectura de Vision sin JSON", resultado="error")
+            return await run_cpu_bound(extraer_formula_manual, response_text)
+
+    async def _leer_paginas(self, paginas: List[str]) -> Dict[str, Any]:
         
         try:
-            logger.info("Procesando imagen con OpenAI Vision...")
+            logger.info("Procesando %d imagen(es) con OpenAI Vision...", len(paginas))
             
             prompt = """Analiza esta prescripción médica con extrema precisión y atención al detalle. Extrae la siguiente información:
 
@@ -35,101 +162,43 @@ IMPORTANTE - Extrae ABSOLUTAMENTE TODOS los medicamentos y sus dosis como están
 Si algún campo no se puede leer, indica "No visible".
 
 RESPONDE ÚNICAMENTE CON UN OBJETO JSON CON EXACTAMENTE ESTA ESTRUCTURA:
-{
-  "datos": {
-    "tipo_documento": "tipo de documento (CC, TI, etc.)",
-    "numero_documento": "número del documento",
-    "paciente": "nombre completo del paciente",
-    "fecha_atencion": "fecha de atención",
-    "eps": "eps del paciente",
-    "doctor": "nombre del doctor",
-    "diagnostico": "diagnóstico médico si está visible",
-    "medicamentos": ["medicamento 1 con dosis completa", "medicamento 2 con dosis completa", "etc"]
-  }
-}
+""" + ESTRUCTURA_JSON + """
 
 No incluyas explicaciones, análisis ni texto adicional fuera del JSON. La respuesta debe ser únicamente el objeto JSON."""
 
+            if len(paginas) > 1:
+                prompt += f"\n\nLas {len(paginas)} imágenes son páginas de la MISMA fórmula: combina la información en un solo objeto JSON y lista los medicamentos de todas las páginas sin repetirlos."
+
             # Llamamos a la API de OpenAI 
-            response = self.client.chat.completions.create(
-                model="o4-mini",
+            response = await self.gateway.completar_nivel(
+                model_router.VISION,
+                "vision",
                 messages=[
                     {
                         "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
+                        "content": [{"type": "text", "text": prompt}] + [
                             {
                                 "type": "image_url",
                                 "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}",
+                                    "url": f"data:image/jpeg;base64,{pagina}",
                                     "detail": "high"
                                 }
                             }
+                            for pagina in paginas
                         ]
                     }
                 ]
             )
             
             response_text = response.choices[0].message.content
-            logger.info(f"Respuesta de OpenAI Vision recibida. Longitud: {len(response_text)}")
+            logger.info("Respuesta de OpenAI Vision recibida. Longitud: %d", len(response_text), extra={"event": "vision.respuesta"})
             
-            # Intenta encontrar un JSON válido en la respuesta
-            json_match = re.search(r'\{[\s\S]*\}', response_text)
-            if not json_match:
-                # Si no encuentra JSON, intenta crear un JSON básico con los datos que podamos extraer
-                logger.warning("No se encontró un formato JSON válido en la respuesta. Intentando extraer información manualmente.")
-                
-                # Patrones para extraer información básica
-                paciente_match = re.search(r'paciente[:\s]+"([^"]+)"', response_text, re.I)
-                medicamentos_match = re.findall(r'medicamento[s]?[:\s]+([^\n\."]+)', response_text, re.I)
-                
-                # Crear un JSON básico con la información que podamos extraer
-                datos = {
-                    "paciente": paciente_match.group(1) if paciente_match else "No visible",
-                    "tipo_documento": "No visible",
-                    "numero_documento": "No visible",
-                    "fecha_atencion": "No visible",
-                    "eps": "No visible",
-                    "doctor": "No visible",
-                    "diagnostico": "No visible",
-                    "medicamentos": medicamentos_match if medicamentos_match else ["No se detectaron medicamentos"]
-                }
-                
-                return {"datos": datos}
-            
-            # Si encontramos un JSON, lo analizamos
+            # El parseo y las reparaciones se hacen fuera del event loop
             try:
-                json_data = json.loads(json_match.group(0))
-            except json.JSONDecodeError:
-                # Si el JSON no es válido, intentamos limpiarlo
-                cleaned_json = json_match.group(0).replace('\n', '').replace('\r', '')
-                # Reemplazar dobles comillas dentro de valores
-                cleaned_json = re.sub(r'(?<=":\s*"[^"]*)"(?=[^"]*")', '\\"', cleaned_json)
-                json_data = json.loads(cleaned_json)
-            
-            if "datos" not in json_data:
-                # Si el JSON no tiene la estructura esperada, la creamos
-                if any(key in json_data for key in ["tipo_documento", "paciente", "medicamentos"]):
-                    json_data = {"datos": json_data}
-                else:
-                    raise ValueError("Estructura JSON incorrecta")
-            
-            datos = json_data["datos"]
-            
-            # Asegurarnos de que medicamentos sea una lista
-            if not isinstance(datos.get("medicamentos", []), list):
-                if isinstance(datos.get("medicamentos"), str):
-                    datos["medicamentos"] = [datos["medicamentos"]]
-                else:
-                    datos["medicamentos"] = ["No se detectaron medicamentos"]
-            
-            # Si no hay medicamentos detectados, añadir un mensaje genérico
-            if (len(datos.get("medicamentos", [])) == 0 or
-                    (len(datos.get("medicamentos", [])) == 1 and 
-                    datos["medicamentos"][0] == "No se detectaron medicamentos")):
-                datos["medicamentos"] = ["No se detectaron medicamentos claramente. Por favor, intenta con una foto más clara."]
-            
-            return {"datos": datos}
+                return await run_cpu_bound(parsear_respuesta_formula, response_text)
+            except JSONIrreparableError as e:
+                logger.warning(f"Respuesta de Vision sin JSON recuperable ({e}); se pide reformatear el texto")
+                return await self._reparar_respuesta(response_text)
             
         except Exception as e:
             logger.error(f"Error en process_medical_formula: {e}")
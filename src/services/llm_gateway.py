@@ -0,0 +1,332 @@
+import asyncio
+import logging
+import random
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from config import get_llm_config
+from core import model_router
+from core.executor import run_blocking
+from core.metrics import count
+
+logger = logging.getLogger(__name__)
+
+# Errores HTTP que vale la pena reintentar; el resto de 4xx son del pedido y fallan igual
+_ESTADOS_REINTENTABLES = frozenset([408, 409, 429, 500, 502, 503, 504])
+
+_DURACION = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_SEGUNDOS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+class LLMNoDisponible(Exception):
+    """El circuito está abierto: OpenAI viene fallando y no se intenta la llamada"""
+
+def parsear_duracion(valor: Optional[str]) -> Optional[float]:
+    """'1s', '6m0s', '250ms' (x-ratelimit-reset-*) o segundos sueltos (Retry-After) -> segundos"""
+    if not valor:
+        return None
+    try:
+        return float(valor)
+    except ValueError:
+        partes = _DURACION.findall(valor)
+        return sum(float(numero) * _SEGUNDOS[unidad] for numero, unidad in partes) if partes else None
+
+class CircuitBreaker:
+    """
+    Tras `fallos` errores seguidos deja de intentar durante `enfriamiento` segundos;
+    luego deja pasar una llamada de prueba y, si falla, vuelve a abrirse. Se usa solo
+    desde el event loop, así que no necesita lock.
+    """
+
+    def __init__(self, fallos: int, enfriamiento: float):
+        self.fallos = fallos
+        self.enfriamiento = enfriamiento
+        self._consecutivos = 0
+        self._abierto_hasta = 0.0
+        self._en_prueba = False
+
+    @property
+    def abierto(self) -> bool:
+        return self._abierto_hasta > 0
+
+    def permitir(self) -> bool:
+        if not self.abierto:
+            return True
+        if time.monotonic() < self._abierto_hasta or self._en_prueba:
+            return False
+        self._en_prueba = True
+        return True
+
+    def exito(self) -> None:
+        if self.abierto:
+            logger.info("Circuito de OpenAI cerrado: la llamada de prueba respondió")
+        self._consecutivos = 0
+        self._abierto_hasta = 0.0
+        self._en_prueba = False
+
+    def cancelada(self) -> None:
+        """
+        La llamada de prueba se canceló (plazo del turno, OCR descartado): no dice nada de
+        OpenAI, así que no cuenta como éxito ni como fallo y la próxima llamada vuelve a probar
+        """
+        self._en_prueba = False
+
+    def fallo(self) -> None:
+        self._consecutivos += 1
+        if self._en_prueba or self._consecutivos >= self.fallos:
+            self._abierto_hasta = time.monotonic() + self.enfriamiento
+            self._en_prueba = False
+            count("llm_circuit_open_total", help="Veces que se abrió el circuito de OpenAI")
+            logger.error(f"⚠️ Circuito de OpenAI abierto por {self.enfriamiento:g} s tras {self._consecutivos} fallos seguidos")
+
+class LLMGateway:
+    """
+    Punto único de salida hacia OpenAI para OpenAIService e ImageProcessor: un solo
+    cliente con un pool keep-alive, límites de concurrencia global y por ruta (chat,
+    vision), reintentos con backoff exponencial y jitter, circuit breaker y pausas
+    según los encabezados x-ratelimit-* y Retry-After de las respuestas. Si una llamada
+    supera el p95 de su ruta y modelo, se lanza un duplicado y gana la primera respuesta.
+    """
+
+    def __init__(self, api_key: str = None, config: Dict[str, Any] = None):
+        self.api_key = api_key
+        self.config = config or get_llm_config()
+        self._client = None
+        self._client_lock = threading.Lock()
+        self._async_client = None
+        self._global = asyncio.Semaphore(self.config["max_concurrency"])
+        self._por_ruta = {
+            "chat": asyncio.Semaphore(self.config["chat_concurrency"]),
+            "vision": asyncio.Semaphore(self.config["vision_concurrency"]),
+        }
+        self._timeouts = {"chat": self.config["chat_timeout"], "vision": self.config["vision_timeout"]}
+        self._coberturas = {"chat": self.config["hedge_chat_after"], "vision": self.config["hedge_vision_after"]}
+        # Duraciones recientes de las llamadas exitosas por (ruta, modelo), para el p95
+        self._latencias: Dict[Tuple[str, str], Deque[float]] = {}
+        self.breaker = CircuitBreaker(self.config["breaker_failures"], self.config["breaker_cooldown"])
+        # Instante (monotónico) hasta el que no se envían llamadas nuevas por límite de cuota
+        self._pausa_hasta = 0.0
+        self._en_vuelo = 0
+
+    @property
+    def client(self):
+        """Cliente de OpenAI, creado en el primer uso (importar openai es lento)"""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    import httpx
+                    from openai import OpenAI
+
+                    http_client = httpx.Client(**self._opciones_http())
+                    # Los reintentos los maneja el gateway, no el SDK
+                    self._client = OpenAI(api_key=self.api_key, http_client=http_client, max_retries=0)
+        return self._client
+
+    def _opciones_http(self) -> Dict[str, Any]:
+        import httpx
+
+        return {
+            "limits": httpx.Limits(
+                max_connections=self.config["max_connections"],
+                max_keepalive_connections=self.config["max_connections"],
+                keepalive_expiry=self.config["keepalive_expiry"],
+            ),
+            "timeout": httpx.Timeout(self.config["vision_timeout"], connect=10.0),
+            "follow_redirects": True,
+        }
+
+    def _crear_cliente_async(self):
+        import httpx
+        from openai import AsyncOpenAI
+
+        return AsyncOpenAI(api_key=self.api_key, http_client=httpx.AsyncClient(**self._opciones_http()), max_retries=0)
+
+    async def _cliente_async(self):
+        """
+        Cliente asíncrono para las completions: cancelar una llamada (el duplicado que
+        perdió, un plazo vencido) cierra de verdad su conexión. Se crea en el pool de I/O
+        porque importar openai es lento.
+        """
+        if self._async_client is None:
+            cliente = await run_blocking(self._crear_cliente_async)
+            if self._async_client is None:
+                self._async_client = cliente
+        return self._async_client
+
+    async def cerrar(self) -> None:
+        """Cierra los pools de conexiones de los dos clientes"""
+        if self._async_client is not None:
+            await self._async_client.close()
+            self._async_client = None
+        if self._client is not None:
+            await run_blocking(self._client.close)
+            self._client = None
+
+    def verificar_conexion(self) -> None:
+        """Verificación bloqueante: lista los modelos disponibles"""
+        self.client.models.list()
+
+    def _registrar_limites(self, headers) -> None:
+        restantes = headers.get("x-ratelimit-remaining-requests")
+        tokens = headers.get("x-ratelimit-remaining-tokens")
+        espera = 0.0
+        # Se frena si quedan menos solicitudes que las que ya están en vuelo, o no quedan tokens
+        if restantes is not None and int(restantes) <= self._en_vuelo:
+            espera = max(espera, parsear_duracion(headers.get("x-ratelimit-reset-requests")) or 0.0)
+        if tokens is not None and int(tokens) <= 0:
+            espera = max(espera, parsear_duracion(headers.get("x-ratelimit-reset-tokens")) or 0.0)
+        if espera > 0:
+            self._pausar(espera)
+
+    def _pausar(self, segundos: float) -> None:
+        hasta = time.monotonic() + segundos
+        if hasta > self._pausa_hasta:
+            self._pausa_hasta = hasta
+            logger.warning(f"Cuota de OpenAI agotada: llamadas en pausa {segundos:.1f} s")
+
+    async def _esperar_cuota(self) -> None:
+        espera = self._pausa_hasta - time.monotonic()
+        if espera > 0:
+            count("llm_rate_limit_waits_total", help="Llamadas demoradas por los límites de cuota de OpenAI")
+            await asyncio.sleep(espera)
+
+    def _backoff(self, intento: int, retry_after: Optional[float]) -> float:
+        if retry_after is not None:
+            return retry_after + random.uniform(0, self.config["backoff_base"])
+        # Full jitter: evita que los reintentos de muchos usuarios lleguen juntos
+        return random.uniform(0, min(self.config["backoff_max"], self.config["backoff_base"] * 2 ** intento))
+
+    async def _llamar(self, ruta: str, parametros: Dict[str, Any]):
+        cliente = await self._cliente_async()
+        async with self._global, self._por_ruta[ruta]:
+            self._en_vuelo += 1
+            inicio = time.monotonic()
+            try:
+                respuesta = await cliente.chat.completions.with_raw_response.create(timeout=self._timeouts[ruta], **parametros)
+            finally:
+                self._en_vuelo -= 1
+        clave = (ruta, parametros.get("model", ""))
+        self._latencias.setdefault(clave, deque(maxlen=200)).append(time.monotonic() - inicio)
+        return respuesta
+
+    def presupuesto(self, ruta: str, modelo: str) -> float:
+        """
+        Segundos tras los que se duplica la llamada: el p95 reciente de la ruta y el modelo,
+        entre LLM_HEDGE_MIN y el máximo configurado para la ruta (0 desactiva la cobertura)
+        """
+        maximo = self._coberturas[ruta]
+        muestras = self._latencias.get((ruta, modelo))
+        if maximo <= 0 or not muestras or len(muestras) < 20:
+            return maximo
+        ordenadas = sorted(muestras)
+        return min(maximo, max(self.config["hedge_min"], ordenadas[int(0.95 * (len(ordenadas) - 1))]))
+
+    async def _con_cobertura(self, ruta: str, parametros: Dict[str, Any]):
+        """Una llamada y, si no respondió dentro del presupuesto, un duplicado; gana la primera respuesta"""
+        presupuesto = self.presupuesto(ruta, parametros.get("model", ""))
+        pendientes = {asyncio.ensure_future(self._llamar(ruta, parametros))}
+        try:
+            if presupuesto <= 0:
+                return await next(iter(pendientes))
+            listas, pendientes = await asyncio.wait(pendientes, timeout=presupuesto)
+            if listas:
+                return listas.pop().result()
+            # Con la cuota agotada o el circuito en prueba, un duplicado solo empeora las cosas
+            if self._pausa_hasta > time.monotonic() or self.breaker.abierto:
+                return await next(iter(pendientes))
+            count("llm_hedged_requests_total", help="Llamadas duplicadas por superar el p95 de su ruta", ruta=ruta)
+            duplicado = asyncio.ensure_future(self._llamar(ruta, parametros))
+            pendientes.add(duplicado)
+            error = None
+            while pendientes:
+                listas, pendientes = await asyncio.wait(pendientes, return_when=asyncio.FIRST_COMPLETED)
+                for tarea in listas:
+                    if tarea.exception() is None:
+                        if tarea is duplicado:
+                            count("llm_hedge_wins_total", help="Llamadas duplicadas que respondieron antes que la original", ruta=ruta)
+                        return tarea.result()
+                    error = tarea.exception()
+            raise error
+        finally:
+            # La que perdió (o ambas, si se canceló la espera) se cancela y cierra su conexión
+            for tarea in pendientes:
+                tarea.cancel()
+
+    def _clasificar(self, error: Exception):
+        """(reintentable, estado HTTP, Retry-After en segundos) de un error del SDK"""
+        import openai
+
+        if isinstance(error, openai.APIStatusError):
+            headers = error.response.headers
+            retry_after_ms = parsear_duracion(headers.get("retry-after-ms"))
+            retry_after = retry_after_ms / 1000 if retry_after_ms is not None else parsear_duracion(headers.get("retry-after"))
+            return error.status_code in _ESTADOS_REINTENTABLES, error.status_code, retry_after
+        if isinstance(error, openai.APIConnectionError):
+            # Incluye APITimeoutError
+            return True, None, None
+        return False, None, None
+
+    async def completar(self, ruta: str, **parametros) -> Any:
+        """chat.completions.create por la ruta dada ('chat' o 'vision'); devuelve la respuesta parseada"""
+        intentos = self.config["max_retries"] + 1
+        for intento in range(intentos):
+            if not self.breaker.permitir():
+                count("llm_requests_total", help="Llamadas a OpenAI por ruta y resultado", ruta=ruta, resultado="circuito_abierto")
+                raise LLMNoDisponible("OpenAI no disponible (circuito abierto)")
+
+            # Con el circuito abierto, permitir() dejó pasar esta como la llamada de prueba
+            prueba = self.breaker.abierto
+            try:
+                await self._esperar_cuota()
+                respuesta = await self._con_cobertura(ruta, parametros)
+            except asyncio.CancelledError:
+                if prueba:
+                    self.breaker.cancelada()
+                raise
+            except Exception as e:
+                reintentable, estado, retry_after = self._clasificar(e)
+                if estado is not None and estado < 500:
+                    # OpenAI respondió: el error es del pedido o de la cuota, no de su disponibilidad
+                    self.breaker.exito()
+                else:
+                    self.breaker.fallo()
+                if estado == 429:
+                    # Cuota agotada: se frenan todas las llamadas, no solo esta
+                    self._pausar(retry_after or self._backoff(intento, None))
+                if not reintentable or intento == intentos - 1:
+                    count("llm_requests_total", help="Llamadas a OpenAI por ruta y resultado", ruta=ruta, resultado="error")
+                    raise
+                espera = self._backoff(intento, retry_after)
+                count("llm_retries_total", help="Reintentos de llamadas a OpenAI", ruta=ruta)
+                logger.warning(f"Llamada de {ruta} a OpenAI falló ({e}); reintento {intento + 1} en {espera:.1f} s")
+                await asyncio.sleep(espera)
+                continue
+
+            self._registrar_limites(respuesta.headers)
+            self.breaker.exito()
+            count("llm_requests_total", help="Llamadas a OpenAI por ruta y resultado", ruta=ruta, resultado="ok")
+            return respuesta.parse()
+
+    async def completar_nivel(self, nivel: str, ruta: str, **parametros) -> Any:
+        """
+        completar con los modelos del nivel (core.model_router) en orden: si uno falla se
+        prueba el siguiente. Con el circuito abierto no se cambia de modelo: OpenAI está caído.
+        """
+        modelos = model_router.modelos(nivel)
+        for posicion, modelo in enumerate(modelos):
+            inicio = time.perf_counter()
+            try:
+                respuesta = await self.completar(ruta, model=modelo, **parametros)
+            except LLMNoDisponible:
+                raise
+            except Exception as e:
+                if posicion == len(modelos) - 1:
+                    raise
+                count("llm_model_fallbacks_total", help="Llamadas repetidas con el modelo de respaldo del nivel",
+                      tier=nivel, model=modelo)
+                logger.warning(f"Modelo {modelo} ({nivel}) falló ({e}); se prueba {modelos[posicion + 1]}")
+                continue
+            model_router.registrar_uso(nivel, modelo, time.perf_counter() - inicio, getattr(respuesta, "usage", None))
+            return respuesta
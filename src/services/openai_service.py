@@ -1,16 +1,41 @@
+import asyncio
 import os
 import json
 import logging
-from typing import Dict, Any, List
-from openai import OpenAI
+from typing import Dict, Any, List, Optional
+from config import ConversationSteps
+from core import model_router, templates
+from core.metrics import count, stage
+from core.model_router import paso_actual
+from core.response_cache import SemanticCache, crear_cache
+from services.llm_gateway import LLMGateway
 
 logger = logging.getLogger(__name__)
 
+PROXIMA_INFORMACION = {
+    ConversationSteps.ESPERANDO_FORMULA: "- Solicitar foto de fórmula médica\n",
+    ConversationSteps.ESPERANDO_CONSENTIMIENTO: "- Solicitar consentimiento para procesar datos\n",
+    ConversationSteps.ESPERANDO_MEDICAMENTOS: "- Preguntar por medicamentos no entregados\n",
+    ConversationSteps.ESPERANDO_CIUDAD: "- Preguntar por ciudad\n",
+    ConversationSteps.ESPERANDO_CELULAR: "- Preguntar por número de celular\n",
+    ConversationSteps.ESPERANDO_FECHA_NACIMIENTO: "- Preguntar por fecha de nacimiento\n",
+    ConversationSteps.ESPERANDO_REGIMEN: "- Preguntar por régimen de afiliación\n",
+    ConversationSteps.ESPERANDO_DIRECCION: "- Preguntar por dirección\n",
+    ConversationSteps.ESPERANDO_FARMACIA: "- Preguntar por farmacia\n",
+    ConversationSteps.COMPLETADO: "- Presentar resumen final\n",
+}
+
 class OpenAIService:
-    def __init__(self, api_key: str = None):
-        """Initialize the OpenAI service with API key"""
+    def __init__(self, api_key: str = None, gateway: LLMGateway = None, cache: Optional[SemanticCache] = None):
+        """Initialize the OpenAI service with API key (or the gateway shared with ImageProcessor)"""
         self.api_key = api_key or os.getenv("OPENAI_API_KEY")
-        self.client = OpenAI(api_key=self.api_key)
+        self.gateway = gateway or LLMGateway(self.api_key)
+        # Cache for frequent free-form questions (None when RESPONSE_CACHE is off)
+        self.cache = cache if cache is not None else crear_cache()
+
+    def verificar_conexion(self):
+        """Blocking connectivity check, through the shared gateway"""
+        self.gateway.verificar_conexion()
     
     async def ask_openai(self, user_session: Dict[str, Any], new_message: Dict[str, str] = None) -> str:
         """
@@ -18,32 +43,61 @@ class OpenAIService:
         with minimal handcrafted logic or state management
         """
         try:
-            # Get the most recent messages (limited to prevent token overflow)
-            conversation_history = user_session["data"]["conversation_history"][-15:] if user_session["data"]["conversation_history"] else []
+            # Fixed-size ring buffer: appends are O(1) and the oldest messages drop off
+            conversation_history = user_session["data"]["conversation_history"]
             
             # Add the new message to the conversation history if provided
             if new_message:
                 conversation_history.append(new_message)
             
             # Generate system prompt with session context
-            system_prompt = self._generate_system_prompt(user_session)
+            with stage("prompt_build"):
+                system_prompt = self._generate_system_prompt(user_session)
+                
+                # Format messages for OpenAI API; the window reads the most recent messages
+                # in place (limited to prevent token overflow)
+                formatted_messages = [{"role": "system", "content": system_prompt}]
+                formatted_messages.extend(conversation_history.ventana())
             
-            # Format messages for OpenAI API
-            formatted_messages = [{"role": "system", "content": system_prompt}]
-            formatted_messages.extend(conversation_history)
+            # Pick the model tier for this turn (cheap model for simple data-collection turns)
+            data = user_session["data"]
+            ultimo = conversation_history[-1] if conversation_history else None
+            mensaje = ultimo["content"] if ultimo and ultimo.get("role") == "user" and isinstance(ultimo.get("content"), str) else None
+            nivel = model_router.elegir_nivel(data, mensaje)
             
-            # Call OpenAI API with default settings (no custom temperature)
-            response = self.client.chat.completions.create(
-                model="o4-mini",
-                messages=formatted_messages
-            )
+            # Frequent questions are answered from the cache, keyed on the question and the current step
+            pregunta = self.cache is not None and self.cache.es_pregunta(mensaje)
+            estado = f"{paso_actual(data).name}:{'saludado' if data.get('has_greeted') else 'nuevo'}"
+            nombre = templates.primer_nombre(data)
+            assistant_response = self.cache.buscar(mensaje, estado, nombre) if pregunta else None
             
-            # Extract and return the response content
-            assistant_response = response.choices[0].message.content
+            if assistant_response is None:
+                # Call OpenAI API with default settings (no custom temperature)
+                # El gateway aplica límites de concurrencia, reintentos y circuit breaker
+                # Hard deadline for the turn: past it the user gets a local template instead of waiting
+                with stage("completion"):
+                    try:
+                        response = await asyncio.wait_for(
+                            self.gateway.completar_nivel(nivel, "chat", messages=formatted_messages),
+                            self.gateway.config["chat_deadline"] or None
+                        )
+                    except asyncio.TimeoutError:
+                        response = None
+                
+                # Extract and return the response content
+                if response is None:
+                    count("llm_chat_deadline_fallbacks_total", help="Turnos de chat respondidos con plantilla por vencer el plazo")
+                    logger.warning(f"Turno de chat sin respuesta en {self.gateway.config['chat_deadline']:g} s; se responde con plantilla")
+                    assistant_response = templates.respaldo(user_session)
+                else:
+                    assistant_response = response.choices[0].message.content
+                    if pregunta:
+                        self.cache.guardar(mensaje, estado, assistant_response, data, nombre)
+            # What the assistant just asked for; next turn's routing checks whether it was captured
+            data["paso_preguntado"] = paso_actual(data).name
             
             # Add the assistant's response to conversation history
             conversation_history.append({"role": "assistant", "content": assistant_response})
-            user_session["data"]["conversation_history"] = conversation_history
             
             return assistant_response
             
@@ -141,7 +195,7 @@ En las próximas 24 horas, tramitaremos tu queja ante la EPS y te enviaré el n
         # Add user's name if available
         if user_data.get("name"):
             context += f"- Nombre del paciente: {user_data.get('name')}\n"
-            primer_nombre = user_data.get("name").split()[0] if user_data.get("name") else ""
+            primer_nombre = templates.primer_nombre(user_data)
             if primer_nombre:
                 context += f"- Primer nombre: {primer_nombre}\n"
         
@@ -208,26 +262,8 @@ En las próximas 24 horas, tramitaremos tu queja ante la EPS y te enviaré el n
         # Add next information to request based on what's missing
         context += "\nPRÓXIMA INFORMACIÓN A SOLICITAR:\n"
         
-        if not user_data.get("formula_data"):
-            context += "- Solicitar foto de fórmula médica\n"
-        elif not user_data.get("consented"):
-            context += "- Solicitar consentimiento para procesar datos\n"
-        elif not user_data.get("missing_meds") or user_data.get("missing_meds") == "[aún no especificado]":
-            context += "- Preguntar por medicamentos no entregados\n"
-        elif not user_data.get("city"):
-            context += "- Preguntar por ciudad\n"
-        elif not user_data.get("cellphone"):
-            context += "- Preguntar por número de celular\n"
-        elif not user_data.get("birth_date"):
-            context += "- Preguntar por fecha de nacimiento\n"
-        elif not user_data.get("affiliation_regime"):
-            context += "- Preguntar por régimen de afiliación\n"
-        elif not user_data.get("residence_address"):
-            context += "- Preguntar por dirección\n"
-        elif not user_data.get("pharmacy"):
-            context += "- Preguntar por farmacia\n"
-        else:
-            context += "- Presentar resumen final\n"
+        # El mismo orden que usa el ruteo de modelos (core.model_router.paso_actual)
+        context += PROXIMA_INFORMACION[paso_actual(user_data)]
         
         return context
     
@@ -252,5 +288,11 @@ En las próximas 24 horas, tramitaremos tu queja ante la EPS y te enviaré el n
             context += "- Medicamentos recetados:\n"
             for i, med in enumerate(medicamentos):
                 context += f"  {i+1}. {med}\n"
+        
+        # Queja reciente del mismo paciente por alguno de estos medicamentos (historial local)
+        repetida = user_data.get("queja_repetida")
+        if repetida:
+            context += (f"- Queja anterior: el {repetida['fecha']} ya se radicó una queja por {repetida['medicamentos']}. "
+                        "Infórmale al usuario y pregúntale si el medicamento sigue sin entregarse antes de radicar otra.\n")
                 
         return context
\ No newline at end of file
@@ -0,0 +1,251 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from config import get_outbound_config
+from core.metrics import count, registry
+
+logger = logging.getLogger(__name__)
+
+# Prioridades: menor sale primero. Los acuses y el pedido de consentimiento (el usuario
+# espera ver que el bot reaccionó) pasan antes que el resto; dentro de un mismo chat el
+# orden de llegada se respeta siempre
+ALTA = 0
+NORMAL = 1
+
+LIMITE_TELEGRAM = 4096
+
+def dividir_mensaje(texto: str, limite: int = LIMITE_TELEGRAM) -> List[str]:
+    """Parte un texto largo en trozos de hasta `limite` caracteres, por párrafo, línea o palabra"""
+    partes = []
+    while len(texto) > limite:
+        corte = -1
+        for separador in ("\n\n", "\n", " "):
+            corte = texto.rfind(separador, 0, limite)
+            if corte > limite // 2:
+                break
+        if corte <= 0:
+            corte = limite
+        partes.append(texto[:corte].rstrip())
+        texto = texto[corte:].lstrip()
+    if texto or not partes:
+        partes.append(texto)
+    return partes
+
+def _segundos(retry_after: Any) -> float:
+    # RetryAfter.retry_after es un entero en PTB 20 y un timedelta en versiones posteriores
+    total = getattr(retry_after, "total_seconds", None)
+    return float(total() if total else retry_after)
+
+class TokenBucket:
+    """`tasa` envíos por segundo con ráfagas de hasta `capacidad`; `pausar` lo vacía por un tiempo"""
+
+    def __init__(self, tasa: float, capacidad: float):
+        self.tasa = tasa
+        self.capacidad = capacidad
+        self._tokens = capacidad
+        self._ultimo = time.monotonic()
+        self._pausa_hasta = 0.0
+        self.usado = self._ultimo
+
+    def tomar(self) -> float:
+        """Consume un token y devuelve 0, o devuelve los segundos que faltan para tenerlo"""
+        ahora = time.monotonic()
+        if ahora < self._pausa_hasta:
+            return self._pausa_hasta - ahora
+        self._tokens = min(self.capacidad, self._tokens + (ahora - self._ultimo) * self.tasa)
+        self._ultimo = ahora
+        if self._tokens >= 1:
+            self._tokens -= 1
+            self.usado = ahora
+            return 0.0
+        return (1 - self._tokens) / self.tasa
+
+    def pausar(self, segundos: float) -> None:
+        self._pausa_hasta = max(self._pausa_hasta, time.monotonic() + segundos)
+        self._tokens = 0.0
+
+class _Envio:
+    __slots__ = ("chat_id", "texto", "kwargs", "prioridad", "orden", "futuro", "encolado", "intentos")
+
+    def __init__(self, chat_id: int, texto: str, kwargs: Dict[str, Any], prioridad: int, orden: int,
+                 futuro: Optional[asyncio.Future]):
+        self.chat_id = chat_id
+        self.texto = texto
+        self.kwargs = kwargs
+        self.prioridad = prioridad
+        self.orden = orden
+        self.futuro = futuro
+        self.encolado = time.monotonic()
+        self.intentos = 0
+
+class OutboundDispatcher:
+    """
+    Cola de salida hacia Telegram. Cada chat tiene su fila FIFO y su token bucket, y hay
+    un bucket global para el bot. Los chats con mensajes pendientes esperan en un heap por
+    prioridad y `senders` tareas los atienden. RetryAfter frena los envíos el tiempo que
+    pide Telegram y reintenta; los textos de más de 4096 caracteres se parten.
+    """
+
+    def __init__(self, bot=None, config: Dict[str, Any] = None):
+        self.bot = bot
+        self.config = config or get_outbound_config()
+        self._global = TokenBucket(self.config["global_rate"], self.config["global_burst"])
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._filas: Dict[int, Deque[_Envio]] = {}
+        # (prioridad, orden, chat_id) de los chats listos para enviar su próximo mensaje
+        self._listos: List[Tuple[int, int, int]] = []
+        self._hay_listos: Optional[asyncio.Event] = None
+        self._orden = itertools.count()
+        self._tareas: List[asyncio.Task] = []
+        self._pendientes = 0
+
+    @property
+    def pendientes(self) -> int:
+        return self._pendientes
+
+    def _iniciar(self) -> None:
+        if self._tareas:
+            return
+        self._hay_listos = asyncio.Event()
+        self._tareas = [asyncio.create_task(self._atender()) for _ in range(self.config["senders"])]
+
+    def _profundidad(self, delta: int) -> None:
+        self._pendientes += delta
+        registry.gauge("telegram_outbound_queue_depth", "Mensajes en la cola de salida a Telegram").set(self._pendientes)
+
+    def _listo(self, chat_id: int) -> None:
+        cabeza = self._filas[chat_id][0]
+        heapq.heappush(self._listos, (cabeza.prioridad, cabeza.orden, chat_id))
+        self._hay_listos.set()
+
+    async def enviar(self, chat_id: int, texto: str, prioridad: int = NORMAL, esperar: bool = True, **kwargs) -> Any:
+        """
+        Encola el mensaje (partido si es largo). Con `esperar` devuelve el último Message
+        enviado, o la excepción si Telegram lo rechazó; si no, vuelve apenas lo encola.
+        """
+        self._iniciar()
+        partes = dividir_mensaje(texto)
+        if len(partes) > 1:
+            count("telegram_messages_split_total", help="Mensajes partidos por superar 4096 caracteres")
+        loop = asyncio.get_running_loop()
+        futuros = []
+        fila = self._filas.get(chat_id)
+        nueva = fila is None
+        if nueva:
+            fila = self._filas[chat_id] = deque()
+        for parte in partes:
+            futuro = loop.create_future() if esperar else None
+            fila.append(_Envio(chat_id, parte, kwargs, prioridad, next(self._orden), futuro))
+            futuros.append(futuro)
+        self._profundidad(len(partes))
+        if nueva:
+            self._listo(chat_id)
+        if not esperar:
+            return None
+        resultados = await asyncio.gather(*futuros)
+        return resultados[-1]
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) > self.config["max_chats"]:
+                # Los buckets llenos de chats sin actividad reciente no cambian nada: se descartan
+                limite = time.monotonic() - 60
+                self._buckets = {chat: b for chat, b in self._buckets.items() if b.usado > limite}
+            bucket = self._buckets[chat_id] = TokenBucket(self.config["chat_rate"], self.config["chat_burst"])
+        return bucket
+
+    async def _atender(self) -> None:
+        while True:
+            while not self._listos:
+                self._hay_listos.clear()
+                await self._hay_listos.wait()
+            _, _, chat_id = heapq.heappop(self._listos)
+
+            espera = self._bucket(chat_id).tomar()
+            if espera > 0:
+                # El chat vuelve al heap cuando tenga token; esta tarea sigue con otros chats
+                asyncio.get_running_loop().call_later(espera, self._listo, chat_id)
+                continue
+            while (espera := self._global.tomar()) > 0:
+                await asyncio.sleep(espera)
+
+            envio = self._filas[chat_id][0]
+            terminado = await self._enviar(envio)
+            fila = self._filas[chat_id]
+            if terminado:
+                fila.popleft()
+                self._profundidad(-1)
+            if fila:
+                self._listo(chat_id)
+            else:
+                del self._filas[chat_id]
+
+    async def _enviar(self, envio: _Envio) -> bool:
+        """Un intento; False si hay que reintentarlo más tarde"""
+        from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+
+        envio.intentos += 1
+        try:
+            mensaje = await self.bot.send_message(envio.chat_id, envio.texto, **envio.kwargs)
+        except RetryAfter as e:
+            segundos = _segundos(e.retry_after)
+            count("telegram_retry_after_total", help="Respuestas RetryAfter (flood control) de Telegram")
+            logger.warning(f"Telegram pidió esperar {segundos:g} s (flood control)")
+            # El límite es del bot: se frenan todos los envíos, no solo los de este chat
+            self._global.pausar(segundos)
+            return self._fallo(envio, e)
+        except BadRequest as e:
+            # Subclase de NetworkError, pero permanente ("Can't parse entities", "Chat not found"):
+            # reintentarlo solo retiene la fila del chat
+            return self._rechazar(envio, e)
+        except (TimedOut, NetworkError) as e:
+            count("telegram_send_errors_total", help="Envíos a Telegram fallidos", tipo=type(e).__name__)
+            self._bucket(envio.chat_id).pausar(min(2 ** envio.intentos * 0.5, 10))
+            return self._fallo(envio, e)
+        except Exception as e:
+            return self._rechazar(envio, e)
+        registry.histogram("telegram_send_seconds", "Tiempo desde que se encola un mensaje hasta que Telegram lo acepta",
+                           prioridad=str(envio.prioridad)).observe(time.monotonic() - envio.encolado)
+        self._resolver(envio, mensaje=mensaje)
+        return True
+
+    def _rechazar(self, envio: _Envio, error: Exception) -> bool:
+        """Error permanente: el mensaje falla sin reintentos"""
+        count("telegram_send_errors_total", help="Envíos a Telegram fallidos", tipo=type(error).__name__)
+        logger.error(f"Telegram rechazó un mensaje para el chat {envio.chat_id}: {error}")
+        self._resolver(envio, error=error)
+        return True
+
+    def _fallo(self, envio: _Envio, error: Exception) -> bool:
+        if envio.intentos < self.config["max_retries"]:
+            return False
+        logger.error(f"Mensaje para el chat {envio.chat_id} descartado tras {envio.intentos} intentos: {error}")
+        self._resolver(envio, error=error)
+        return True
+
+    @staticmethod
+    def _resolver(envio: _Envio, mensaje: Any = None, error: Exception = None) -> None:
+        if envio.futuro is None or envio.futuro.done():
+            return
+        if error is not None:
+            envio.futuro.set_exception(error)
+        else:
+            envio.futuro.set_result(mensaje)
+
+    async def cerrar(self, timeout: float = 10.0) -> None:
+        """Espera a que la cola se vacíe (hasta `timeout` segundos) y detiene las tareas"""
+        limite = time.monotonic() + timeout
+        while self._pendientes and time.monotonic() < limite:
+            await asyncio.sleep(0.05)
+        if self._pendientes:
+            logger.warning(f"Se cierra la cola de salida con {self._pendientes} mensajes sin enviar")
+        for tarea in self._tareas:
+            tarea.cancel()
+        await asyncio.gather(*self._tareas, return_exceptions=True)
+        self._tareas = []
@@ -0,0 +1,287 @@
+"""
+Instantáneas de `user_sessions` en disco, para que un reinicio no haga perder las quejas
+a medio llenar (y otra llamada de Vision por la foto reenviada).
+
+El formato es binario y compacto: registros (usuario, sesión en `marshal`) en un archivo
+base y en segmentos delta. Cada instantánea escribe un delta solo con las sesiones cuya
+versión cambió desde la anterior; cada SESSION_SNAPSHOT_COMPACT_AFTER deltas, el hilo de
+escritura los funde con la base y descarta las sesiones más viejas que
+SESSION_SNAPSHOT_MAX_AGE. Todo archivo se escribe aparte y se renombra (atómico): un corte a
+mitad de una escritura deja la instantánea anterior intacta. Al arrancar se lee la base
+y los deltas con mmap y se decodifica una sola vez la versión más reciente de cada sesión.
+"""
+import asyncio
+import gc
+import glob
+import logging
+import marshal
+import mmap
+import os
+import struct
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from config import get_session_snapshot_config
+from core import session_manager
+from core.conversation_history import ConversationHistory
+from core.executor import run_blocking
+from core.metrics import count, registry
+
+logger = logging.getLogger(__name__)
+
+_MAGIA = b"NMES"
+_FORMATO = 1
+# magia, formato, versión de marshal, último delta incluido
+_ENCABEZADO = struct.Struct("<4sBBQ")
+# largo del user_id, largo de la sesión
+_REGISTRO = struct.Struct("<HI")
+
+BASE = "base.snap"
+
+def codificar(user_id: str, sesion: Dict[str, Any]) -> bytes:
+    historial = sesion["data"].get("conversation_history")
+    if isinstance(historial, ConversationHistory):
+        # marshal solo acepta tipos básicos: el historial va como lista (copias superficiales)
+        sesion = dict(sesion, data=dict(sesion["data"], conversation_history=historial.a_lista()))
+    clave = user_id.encode("utf-8")
+    valor = marshal.dumps(sesion)
+    return _REGISTRO.pack(len(clave), len(valor)) + clave + valor
+
+def _registros(vista: memoryview, inicio: int) -> Iterator[Tuple[str, int, int, int]]:
+    """(user_id, inicio del registro, inicio de la sesión, fin) de cada registro; se detiene ante uno truncado"""
+    posicion, total = inicio, len(vista)
+    while posicion + _REGISTRO.size <= total:
+        largo_clave, largo_valor = _REGISTRO.unpack_from(vista, posicion)
+        clave = posicion + _REGISTRO.size
+        fin = clave + largo_clave + largo_valor
+        if fin > total:
+            logger.warning("Instantánea de sesiones truncada; se ignora el resto del archivo")
+            return
+        yield str(vista[clave:clave + largo_clave], "utf-8"), posicion, clave + largo_clave, fin
+        posicion = fin
+
+def _escribir_atomico(ruta: str, partes: List[bytes]) -> int:
+    temporal = f"{ruta}.tmp"
+    with open(temporal, "wb") as archivo:
+        for parte in partes:
+            archivo.write(parte)
+        archivo.flush()
+        os.fsync(archivo.fileno())
+    os.replace(temporal, ruta)
+    return sum(len(parte) for parte in partes)
+
+class _Archivo:
+    """Un archivo de la instantánea abierto con mmap"""
+
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        self._archivo = open(ruta, "rb")
+        self._mapa = None
+        self.vista = memoryview(b"")
+        self.delta = 0
+        tamano = os.fstat(self._archivo.fileno()).st_size
+        if tamano >= _ENCABEZADO.size:
+            self._mapa = mmap.mmap(self._archivo.fileno(), 0, access=mmap.ACCESS_READ)
+            self.vista = memoryview(self._mapa)
+            magia, formato, version_marshal, self.delta = _ENCABEZADO.unpack_from(self.vista)
+            if magia != _MAGIA or formato != _FORMATO or version_marshal != marshal.version:
+                raise ValueError(f"{ruta} no es una instantánea compatible")
+
+    def registros(self) -> Iterator[Tuple[str, int, int, int]]:
+        if len(self.vista) >= _ENCABEZADO.size:
+            yield from _registros(self.vista, _ENCABEZADO.size)
+
+    def cerrar(self) -> None:
+        self.vista.release()
+        if self._mapa is not None:
+            self._mapa.close()
+        self._archivo.close()
+
+class SessionSnapshot:
+    """Escribe y restaura las instantáneas de un directorio (uno por worker)"""
+
+    def __init__(self, directorio: str = None, config: Dict[str, Any] = None):
+        self.config = config or get_session_snapshot_config()
+        self.directorio = directorio or self.config["dir"]
+        os.makedirs(self.directorio, exist_ok=True)
+        # Versión de cada sesión en la última instantánea escrita
+        self._escritas: Dict[str, int] = {}
+        self._delta = 0
+        self._lock = asyncio.Lock()
+
+    def _deltas(self) -> List[Tuple[int, str]]:
+        deltas = []
+        for ruta in glob.glob(os.path.join(self.directorio, "delta-*.snap")):
+            try:
+                deltas.append((int(os.path.basename(ruta)[6:-5]), ruta))
+            except ValueError:
+                continue
+        return sorted(deltas)
+
+    def restaurar(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Sesiones de la última instantánea con actividad dentro de `max_age` (bloqueante).
+        Las ubicaciones se resuelven primero y solo se decodifica la versión final de cada una.
+        """
+        inicio = time.perf_counter()
+        base = os.path.join(self.directorio, BASE)
+        rutas = ([base] if os.path.exists(base) else []) + [ruta for _, ruta in self._deltas()]
+        archivos: List[_Archivo] = []
+        sesiones: Dict[str, Dict[str, Any]] = {}
+        gc_activo = False
+        try:
+            for ruta in rutas:
+                try:
+                    archivos.append(_Archivo(ruta))
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Se ignora la instantánea {ruta}: {e}")
+            incluido = archivos[0].delta if archivos and archivos[0].ruta == base else 0
+
+            ubicaciones: Dict[str, Tuple[_Archivo, int, int]] = {}
+            for archivo in archivos:
+                if archivo.ruta != base and archivo.delta <= incluido:
+                    # Delta ya fundido en la base (la compactación se cortó antes de borrarlo)
+                    continue
+                for user_id, _, desde, hasta in archivo.registros():
+                    ubicaciones[user_id] = (archivo, desde, hasta)
+                self._delta = max(self._delta, archivo.delta)
+
+            limite = time.time() - self.config["max_age"]
+            # Decodificar crea millones de dicts y strings de larga vida: con el GC activo se
+            # recorrerían una y otra vez (la restauración tarda unas tres veces más)
+            gc_activo = gc.isenabled()
+            gc.disable()
+            for user_id, (archivo, desde, hasta) in ubicaciones.items():
+                try:
+                    sesion = marshal.loads(archivo.vista[desde:hasta])
+                except (EOFError, ValueError, TypeError):
+                    logger.warning(f"Sesión de {user_id} ilegible en {archivo.ruta}")
+                    continue
+                if sesion["data"].get("last_interaction", 0) < limite:
+                    continue
+                sesion["data"]["conversation_history"] = ConversationHistory(sesion["data"].get("conversation_history") or ())
+                sesiones[user_id] = sesion
+                self._escritas[user_id] = sesion.get("version", 0)
+        finally:
+            if gc_activo:
+                gc.enable()
+            for archivo in archivos:
+                archivo.cerrar()
+
+        segundos = time.perf_counter() - inicio
+        registry.gauge("session_snapshot_restore_seconds", "Duración de la última restauración de sesiones").set(segundos)
+        if sesiones:
+            logger.info(f"{len(sesiones)} sesiones restauradas en {segundos * 1000:.0f} ms")
+        return sesiones
+
+    def _pendientes(self) -> List[Tuple[str, int, bytes]]:
+        """Codifica en el event loop (ahí no cambian a medias) las sesiones con versión nueva"""
+        pendientes = []
+        for user_id in session_manager.tomar_modificadas():
+            sesion = session_manager.user_sessions.get(user_id)
+            if sesion is None or sesion.get("version", 0) == self._escritas.get(user_id):
+                continue
+            try:
+                pendientes.append((user_id, sesion.get("version", 0), codificar(user_id, sesion)))
+            except ValueError as e:
+                logger.error(f"No se pudo codificar la sesión de {user_id}: {e}")
+        return pendientes
+
+    async def guardar(self) -> int:
+        """Escribe un delta con las sesiones modificadas; devuelve cuántas se escribieron"""
+        async with self._lock:
+            pendientes = self._pendientes()
+            if not pendientes:
+                return 0
+            inicio = time.perf_counter()
+            self._delta += 1
+            ruta = os.path.join(self.directorio, f"delta-{self._delta:08d}.snap")
+            encabezado = _ENCABEZADO.pack(_MAGIA, _FORMATO, marshal.version, self._delta)
+            try:
+                escritos = await run_blocking(_escribir_atomico, ruta, [encabezado] + [registro for _, _, registro in pendientes])
+            except BaseException:
+                # Vuelven a quedar pendientes para la próxima instantánea
+                session_manager.marcar_pendientes(user_id for user_id, _, _ in pendientes)
+                raise
+            for user_id, version, _ in pendientes:
+                self._escritas[user_id] = version
+            if len(self._deltas()) >= self.config["compact_after"]:
+                await run_blocking(self.compactar)
+
+            count("session_snapshot_sessions_total", len(pendientes), help="Sesiones escritas en instantáneas")
+            count("session_snapshot_bytes_total", escritos, help="Bytes escritos en instantáneas de sesiones")
+            registry.histogram("session_snapshot_seconds", "Duración de cada instantánea de sesiones").observe(
+                time.perf_counter() - inicio)
+            return len(pendientes)
+
+    def compactar(self) -> None:
+        """
+        Funde la base y los deltas en una base nueva y borra los deltas (bloqueante). Las
+        sesiones sin actividad dentro de `max_age` no pasan a la base nueva: restaurar ya
+        las descarta, y sin esto la base crecería con cada usuario que alguna vez escribió.
+        """
+        base = os.path.join(self.directorio, BASE)
+        deltas = self._deltas()
+        if not deltas:
+            return
+        ultimo = deltas[-1][0]
+        archivos: List[_Archivo] = []
+        vencidas: List[str] = []
+        gc_activo = False
+        try:
+            for ruta in ([base] if os.path.exists(base) else []) + [ruta for _, ruta in deltas]:
+                archivos.append(_Archivo(ruta))
+            incluido = archivos[0].delta if archivos[0].ruta == base else 0
+            ultimos: Dict[str, Tuple[_Archivo, int, int, int]] = {}
+            for archivo in archivos:
+                if archivo.ruta != base and archivo.delta <= incluido:
+                    continue
+                for user_id, desde, sesion, hasta in archivo.registros():
+                    ultimos[user_id] = (archivo, desde, sesion, hasta)
+
+            limite = time.time() - self.config["max_age"]
+            partes = [_ENCABEZADO.pack(_MAGIA, _FORMATO, marshal.version, ultimo)]
+            # Cada sesión se decodifica solo para leer last_interaction y se libera enseguida:
+            # el GC no tiene nada que recolectar (como en restaurar)
+            gc_activo = gc.isenabled()
+            gc.disable()
+            for user_id, (archivo, desde, sesion, hasta) in ultimos.items():
+                try:
+                    ultima_interaccion = marshal.loads(archivo.vista[sesion:hasta])["data"].get("last_interaction", 0)
+                except (EOFError, ValueError, TypeError, KeyError):
+                    logger.warning(f"Sesión de {user_id} ilegible en {archivo.ruta}; se descarta al compactar")
+                    ultima_interaccion = 0
+                if ultima_interaccion < limite:
+                    vencidas.append(user_id)
+                    continue
+                partes.append(bytes(archivo.vista[desde:hasta]))
+        finally:
+            if gc_activo:
+                gc.enable()
+            for archivo in archivos:
+                archivo.cerrar()
+        _escribir_atomico(base, partes)
+        for _, ruta in deltas:
+            os.remove(ruta)
+        # Corre con el lock de guardar tomado: nadie más modifica _escritas
+        for user_id in vencidas:
+            self._escritas.pop(user_id, None)
+        count("session_snapshot_compactions_total", help="Compactaciones de la instantánea de sesiones")
+        count("session_snapshot_expired_total", len(vencidas), help="Sesiones vencidas descartadas al compactar")
+
+    async def ejecutar(self) -> None:
+        """Escribe una instantánea cada `interval` segundos hasta que se cancele"""
+        while True:
+            await asyncio.sleep(self.config["interval"])
+            try:
+                await self.guardar()
+            except Exception as e:
+                logger.error(f"Error escribiendo la instantánea de sesiones: {e}")
+
+def crear_instantanea(indice: Optional[int] = None) -> Optional[SessionSnapshot]:
+    """Instantánea según SESSION_SNAPSHOT_*; cada worker usa su propio subdirectorio. None si está desactivada"""
+    config = get_session_snapshot_config()
+    if not config["enabled"]:
+        return None
+    directorio = config["dir"] if indice is None else os.path.join(config["dir"], f"worker-{indice}")
+    return SessionSnapshot(directorio, config)
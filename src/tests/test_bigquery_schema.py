@@ -0,0 +1,43 @@
+"""
+Columnas nuevas de la tabla de quejas: sin migrar, la fila las omite; migrar_esquema
+las agrega una sola vez y desde entonces se guardan.
+
+Uso (desde src/):
+    python -m unittest discover -s tests
+"""
+import unittest
+
+from loadtest.fake_bigquery import COLUMNAS_QUEJAS, FakeBigQueryClient
+from services.bigquery_service import COLUMNAS_NUEVAS, BigQueryService
+
+def _sesion(user_id: int) -> dict:
+    return {
+        "user_id": user_id,
+        "formula_data": {"paciente": "Ana Pérez", "medicamentos": ["LOSARTAN 50 MG TABLETA #30"]},
+        "missing_meds": "el losartán",
+        "city": "Medellín",
+        "pharmacy": "Cruz Verde",
+    }
+
+class MigracionDelEsquema(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.client = FakeBigQueryClient()
+        self.servicio = BigQueryService(project_id="p", dataset_id="d", table_id="quejas", client=self.client)
+
+    async def test_sin_migrar_la_fila_omite_las_columnas_nuevas(self):
+        self.assertTrue(await self.servicio.save_user_data(_sesion(1)))
+        self.assertEqual(set(self.client.rows[0]), set(COLUMNAS_QUEJAS))
+
+    async def test_migrar_agrega_las_columnas_una_vez(self):
+        self.assertEqual(self.servicio.migrar_esquema(), list(COLUMNAS_NUEVAS))
+        self.assertEqual(self.servicio.migrar_esquema(), [])
+        self.assertEqual(self.client.calls["update_table"], 1)
+
+        self.assertTrue(await self.servicio.save_user_data(_sesion(2)))
+        fila = self.client.rows[0]
+        self.assertEqual(set(fila), set(COLUMNAS_QUEJAS) | set(COLUMNAS_NUEVAS))
+        self.assertIn("LOSARTAN", fila["no_entregado_normalizado"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,31 @@
+"""
+Fechas sin año: no son una fecha de nacimiento ("nací el 5 de marzo" no es de este
+año), pero la fecha de atención de la fórmula sí se completa con el año actual.
+
+Uso (desde src/):
+    python -m unittest discover -s tests
+"""
+import unittest
+from datetime import date
+
+from core.complaint_rows import formatear_fecha
+from core.data_extractor import DataExtractor
+from core.date_parser import parsear_fecha
+
+class FechasSinAnio(unittest.TestCase):
+
+    def test_nacimiento_sin_anio_se_descarta(self):
+        for texto in ("nací el 5 de marzo", "el 1 de mayo", "12 de enero", "marzo 5", "el primero de junio"):
+            self.assertIsNone(DataExtractor.extraer_fecha(texto), texto)
+        self.assertEqual(DataExtractor.extraer_fecha("nací el 5 de marzo de 1980"), "05/03/1980")
+
+    def test_sigue_buscando_una_fecha_con_anio(self):
+        hoy = date(2024, 6, 1)
+        self.assertEqual(parsear_fecha("el 5 de marzo, o sea el 5/3/1980", hoy=hoy), date(1980, 3, 5))
+
+    def test_atencion_sin_anio_es_de_este_anio(self):
+        self.assertEqual(formatear_fecha("5 de marzo"), f"{date.today().year}-03-05")
+        self.assertEqual(formatear_fecha("5 de marzo de 2024"), "2024-03-05")
+
+if __name__ == "__main__":
+    unittest.main()
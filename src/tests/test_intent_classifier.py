@@ -0,0 +1,33 @@
+"""
+Clasificador de intenciones: un "no" dentro de una respuesta afirmativa o de una duda
+no niega la autorización, y "reset" solo reinicia como mensaje completo.
+
+Uso (desde src/):
+    python -m unittest discover -s tests
+"""
+import unittest
+
+from core.intent_classifier import REINICIAR, classify, detectada, respuesta_consentimiento
+
+class Consentimiento(unittest.TestCase):
+
+    def test_no_que_no_niega(self):
+        for texto in ("Sí, no hay problema", "No hay problema, adelante", "dale no hay drama", "no hay lío"):
+            self.assertIs(respuesta_consentimiento(classify(texto)), True, texto)
+        for texto in ("no sé, ¿para qué la necesitan?", "no, ¿para qué la necesitan?", "no entiendo"):
+            self.assertIsNone(respuesta_consentimiento(classify(texto)), texto)
+
+    def test_negativas(self):
+        for texto in ("no", "No.", "No, gracias", "no señor", "No autorizo", "prefiero que no", "no, mejor no"):
+            self.assertIs(respuesta_consentimiento(classify(texto)), False, texto)
+
+class Reinicio(unittest.TestCase):
+
+    def test_reset_solo_como_mensaje_completo(self):
+        for texto in ("reset", "/reset", "Reinicia", "quiero empezar de nuevo", "reiniciar"):
+            self.assertTrue(detectada(classify(texto), REINICIAR), texto)
+        for texto in ("quiero reset de mi contraseña", "reinicia mi clave del portal"):
+            self.assertFalse(detectada(classify(texto), REINICIAR), texto)
+
+if __name__ == "__main__":
+    unittest.main()
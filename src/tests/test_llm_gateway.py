@@ -0,0 +1,66 @@
+"""
+Circuit breaker de services.llm_gateway: una llamada de prueba cancelada no puede dejar
+el circuito abierto para siempre.
+
+Uso (desde src/):
+    python -m unittest discover -s tests
+"""
+import asyncio
+import time
+import unittest
+
+from config import get_llm_config
+from services.llm_gateway import LLMGateway, LLMNoDisponible
+
+class _Respuesta:
+    headers = {}
+
+    def parse(self):
+        return "respuesta"
+
+class CircuitoTrasCancelacion(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.gateway = LLMGateway(config=dict(get_llm_config(), max_retries=0, breaker_failures=1, breaker_cooldown=60))
+        self.colgada = True
+
+        async def con_cobertura(ruta, parametros):
+            if self.colgada:
+                await asyncio.sleep(3600)
+            return _Respuesta()
+
+        self.gateway._con_cobertura = con_cobertura
+        # Circuito abierto con el enfriamiento ya vencido: la próxima llamada es la de prueba
+        self.gateway.breaker.fallo()
+        self.gateway.breaker._abierto_hasta = time.monotonic() - 1
+
+    async def test_prueba_cancelada_por_plazo_libera_el_circuito(self):
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(self.gateway.completar("chat", model="m", messages=[]), timeout=0.05)
+        self.assertFalse(self.gateway.breaker._en_prueba)
+
+        self.colgada = False
+        self.assertEqual(await self.gateway.completar("chat", model="m", messages=[]), "respuesta")
+        self.assertFalse(self.gateway.breaker.abierto)
+
+    async def test_prueba_cancelada_explicitamente_libera_el_circuito(self):
+        tarea = asyncio.ensure_future(self.gateway.completar("vision", model="m", messages=[]))
+        await asyncio.sleep(0.01)
+        tarea.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await tarea
+
+        self.colgada = False
+        self.assertEqual(await self.gateway.completar("vision", model="m", messages=[]), "respuesta")
+
+    async def test_solo_una_llamada_de_prueba_a_la_vez(self):
+        tarea = asyncio.ensure_future(self.gateway.completar("chat", model="m", messages=[]))
+        await asyncio.sleep(0.01)
+        with self.assertRaises(LLMNoDisponible):
+            await self.gateway.completar("chat", model="m", messages=[])
+        tarea.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await tarea
+
+if __name__ == "__main__":
+    unittest.main()
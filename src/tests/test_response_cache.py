@@ -0,0 +1,49 @@
+"""
+Caché de respuestas: solo el primer nombre que dio el usuario se vuelve plantilla; un
+nombre de relleno ("No" de "No visible") no puede cambiar las respuestas de otros.
+
+Uso (desde src/):
+    python -m unittest discover -s tests
+"""
+import unittest
+
+from core import templates
+from core.json_parser import NO_VISIBLE
+from core.response_cache import SemanticCache
+
+PREGUNTA = "¿Cuánto se demora la queja?"
+ESTADO = "RECOLECTANDO:saludado"
+RESPUESTA = "No te preocupes, tarda unos 15 días hábiles. No dudes en preguntar."
+
+class NombreEnLaCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = SemanticCache()
+
+    def test_formula_ilegible_no_vuelve_plantilla_el_no(self):
+        data = {"name": NO_VISIBLE}
+        # Con el nombre que sale de la sesión ("") y con el "No" que salía antes
+        for nombre in (templates.primer_nombre(data), "No"):
+            cache = SemanticCache()
+            cache.guardar(PREGUNTA, ESTADO, RESPUESTA, data, nombre)
+            self.assertIn(cache.buscar(PREGUNTA, ESTADO, "Juan"), (None, RESPUESTA))
+
+    def test_nombre_corto_no_se_reemplaza(self):
+        data = {"name": "Al Pérez"}
+        self.assertFalse(self.cache.guardar(PREGUNTA, ESTADO, "Al, tarda unos 15 días.", data, "Al"))
+        self.cache.guardar(PREGUNTA, ESTADO, RESPUESTA, data, "Al")
+        self.assertEqual(self.cache.buscar(PREGUNTA, ESTADO, "Juan"), RESPUESTA)
+
+    def test_solo_el_nombre_que_dio_el_usuario(self):
+        # El nombre no es el de la sesión: no se reemplaza y la respuesta no se comparte
+        self.assertFalse(self.cache.guardar(PREGUNTA, ESTADO, "Claro Marta, tarda unos 15 días.", {"name": "Ana"}, "Marta"))
+
+    def test_nombre_propio_se_reemplaza_por_el_de_quien_pregunta(self):
+        data = {"name": "Marta Gómez"}
+        self.assertTrue(self.cache.guardar(PREGUNTA, ESTADO, "Claro Marta, tarda unos 15 días hábiles.", data, "Marta"))
+        self.assertEqual(self.cache.buscar(PREGUNTA, ESTADO, "Juan"), "Claro Juan, tarda unos 15 días hábiles.")
+        # Sin un nombre válido la respuesta con nombre no se usa
+        self.assertIsNone(self.cache.buscar(PREGUNTA, ESTADO, "No"))
+
+if __name__ == "__main__":
+    unittest.main()
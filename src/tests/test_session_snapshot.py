@@ -0,0 +1,55 @@
+"""
+SessionSnapshot.compactar: las sesiones sin actividad dentro de max_age no pasan a la
+base nueva.
+
+Uso (desde src/):
+    python -m unittest discover -s tests
+"""
+import marshal
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from config import get_session_snapshot_config
+from services.session_snapshot import BASE, _ENCABEZADO, _FORMATO, _MAGIA, SessionSnapshot, _escribir_atomico, codificar
+
+def _sesion(hace: float, version: int = 1) -> dict:
+    return {"version": version, "data": {"last_interaction": time.time() - hace, "conversation_history": []}}
+
+class CompactacionDescartaVencidas(unittest.TestCase):
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp(prefix="test-sesiones-")
+        self.addCleanup(shutil.rmtree, self.directorio, ignore_errors=True)
+        self.instantanea = SessionSnapshot(self.directorio, dict(get_session_snapshot_config(), max_age=3600))
+
+    def _delta(self, numero: int, sesiones: dict) -> None:
+        encabezado = _ENCABEZADO.pack(_MAGIA, _FORMATO, marshal.version, numero)
+        _escribir_atomico(os.path.join(self.directorio, f"delta-{numero:08d}.snap"),
+                          [encabezado] + [codificar(user_id, sesion) for user_id, sesion in sesiones.items()])
+
+    def test_la_base_no_guarda_sesiones_vencidas(self):
+        self._delta(1, {"vieja": _sesion(7200), "activa": _sesion(60), "revivida": _sesion(7200)})
+        # La versión más reciente es la que cuenta
+        self._delta(2, {"revivida": _sesion(10, version=2), "activa": _sesion(30, version=2)})
+        self.instantanea._escritas.update({"vieja": 1, "activa": 2, "revivida": 2})
+
+        self.instantanea.compactar()
+
+        self.assertEqual(os.listdir(self.directorio), [BASE])
+        self.assertEqual(sorted(SessionSnapshot(self.directorio, self.instantanea.config).restaurar()), ["activa", "revivida"])
+        self.assertNotIn("vieja", self.instantanea._escritas)
+
+    def test_una_sesion_que_vence_despues_sale_en_la_siguiente_compactacion(self):
+        self._delta(1, {"a": _sesion(60), "b": _sesion(60)})
+        self.instantanea.compactar()
+        self.instantanea.config["max_age"] = 30
+        self._delta(2, {"b": _sesion(5, version=2)})
+        self.instantanea.compactar()
+
+        self.assertEqual(list(SessionSnapshot(self.directorio, dict(self.instantanea.config, max_age=10**9)).restaurar()), ["b"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+"""
+WorkerSupervisor.supervise: el backoff de un worker caído no demora el reinicio de los
+demás.
+
+Uso (desde src/):
+    python -m unittest discover -s tests
+"""
+import asyncio
+import time
+import unittest
+
+from core.sharding import WorkerSupervisor
+
+class _Proceso:
+    def __init__(self, vivo: bool = True):
+        self.vivo = vivo
+        self.exitcode = None if vivo else 1
+
+    def is_alive(self) -> bool:
+        return self.vivo
+
+class ReiniciosIndependientes(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.supervisor = WorkerSupervisor(3, target=None, restart_delay=0.1, max_restart_delay=30.0)
+        self.reinicios = {}
+        inicio = time.monotonic()
+
+        def spawn(index):
+            self.reinicios[index] = time.monotonic() - inicio
+            self.supervisor._started_at[index] = time.monotonic()
+            return _Proceso()
+
+        self.supervisor._spawn = spawn
+        self.supervisor._processes = [_Proceso(vivo=False), _Proceso(vivo=False), _Proceso()]
+        for index in range(3):
+            self.supervisor._started_at[index] = inicio
+
+    async def _supervisar(self, segundos: float) -> None:
+        tarea = asyncio.ensure_future(self.supervisor.supervise(check_interval=0.05))
+        await asyncio.sleep(segundos)
+        self.supervisor._stopping = True
+        await tarea
+
+    async def test_un_backoff_largo_no_demora_a_los_demas(self):
+        # El worker 0 ya se reinició varias veces: le tocan 1.6 s; el 1 se cae por primera vez
+        self.supervisor._restarts[0] = 4
+        await self._supervisar(0.5)
+        self.assertNotIn(0, self.reinicios)
+        self.assertLess(self.reinicios[1], 0.3)
+
+    async def test_cada_worker_con_su_propio_plazo(self):
+        await self._supervisar(0.4)
+        self.assertEqual(sorted(self.reinicios), [0, 1])
+        self.assertLess(max(self.reinicios.values()), 0.2)
+
+if __name__ == "__main__":
+    unittest.main()
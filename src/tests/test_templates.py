@@ -0,0 +1,45 @@
+"""
+Primer nombre de las plantillas: los valores de relleno de una fórmula ilegible
+("No visible") no son un nombre.
+
+Uso (desde src/):
+    python -m unittest discover -s tests
+"""
+import unittest
+
+from core import templates
+from core.json_parser import NO_VISIBLE
+from core.session_manager import get_user_session, user_sessions
+from handlers.intent_handler import IntentHandler
+
+class PrimerNombre(unittest.IsolatedAsyncioTestCase):
+
+    def tearDown(self):
+        user_sessions.clear()
+
+    def test_marcadores_no_son_nombre(self):
+        for nombre in (NO_VISIBLE, "no visible", "[aún no especificado]", "No disponible", "", "123", None):
+            self.assertEqual(templates.primer_nombre({"name": nombre}), "", nombre)
+        self.assertEqual(templates.primer_nombre({"name": "JUAN carlos pérez"}), "Juan")
+
+    def test_plantillas_sin_nombre_desconocido(self):
+        for indice in range(20):
+            sesion = get_user_session(f"usuario-{indice}")
+            sesion["data"]["name"] = NO_VISIBLE
+            for clave in ("reinicio", "ayuda", "consentimiento_negado", "demora"):
+                texto = templates.render(clave, sesion)
+                self.assertNotIn("No,", texto)
+                self.assertFalse(texto.startswith(("No ", "Listo No", "Hola No", "Entiendo No")), texto)
+
+    async def test_formula_ilegible_no_reemplaza_el_nombre(self):
+        handler = IntentHandler(openai_service=None)
+        sesion = get_user_session("usuario-formula")
+        sesion["data"]["name"] = "Ana María"
+        await handler.actualizar_datos_formula(sesion, {"datos": {"paciente": NO_VISIBLE, "medicamentos": []}})
+        self.assertEqual(sesion["data"]["name"], "Ana María")
+
+        await handler.actualizar_datos_formula(sesion, {"datos": {"paciente": "Luisa Gómez", "medicamentos": []}})
+        self.assertEqual(sesion["data"]["name"], "Luisa Gómez")
+
+if __name__ == "__main__":
+    unittest.main()